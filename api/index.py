@@ -1,9 +1,16 @@
 import sys
 import os
+import time
+
+_started = time.perf_counter()
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+if os.getenv("STARTUP_PROFILE", "0") == "1":
+    from backend import startup
+    startup.profile_imports(started=_started)
+
 from backend.main import app
 
 app = app
@@ -0,0 +1,359 @@
+"""Near-duplicate index of scored questionnaire answers for /score-response.
+
+Questionnaire answers are short and repeat across users ("not really", "kinda
+tired", "I guess I'm fine"), but rarely character for character, so the exact
+result cache misses most of them. The index keeps every answer the model scored,
+per question and category, as a hashed character n-gram vector in one NumPy
+matrix, and compares a new answer with all of them in a single matrix-vector
+product. When its ``ANSWER_INDEX_NEIGHBORS`` nearest answers all reach
+``ANSWER_INDEX_SIMILARITY`` (cosine) and were given the same score, that score
+and the nearest answer's reasoning are reused instead of a model call.
+
+Character n-grams barely register a "not" or a swapped adjective ("sleeping
+well" / "not sleeping well" / "sleeping terribly" are all close), so each
+neighbour must also agree word for word: the same negations, and every other
+word present in both answers, allowing only fillers ("honestly", "I guess") and
+typos (a close spelling that is not the word with a negating prefix, as in
+"happy" / "unhappy"). Anything else goes to the model.
+
+suicidal_ideation answers are never looked up or stored; they always get the full
+model analysis. A sample of hits (``ANSWER_INDEX_AUDIT``) is scored by the model
+anyway and the two scores are compared. A question whose audited agreement drops
+below ``ANSWER_INDEX_MIN_AGREEMENT`` stops reusing scores.
+
+Memory is bounded per question (the least recently used answer is evicted) and
+by the number of questions kept. With ``ANSWER_INDEX_PATH`` set, the index is
+loaded from a .npz file on first use and saved back every ``ANSWER_INDEX_SAVE_EVERY``
+new answers, so it survives restarts. NumPy (in requirements.txt) is imported on first use;
+if it is missing, the index says so once at startup and stays off, and every
+answer goes to the model.
+
+Configuration (environment variables):
+    ANSWER_INDEX                 "0" disables the index (default "1")
+    ANSWER_INDEX_SIMILARITY      cosine similarity each neighbour needs (default 0.85)
+    ANSWER_INDEX_NEIGHBORS       nearest answers that must pass it and agree on the score (default 2)
+    ANSWER_INDEX_AUDIT           fraction of hits still scored by the model, for comparison (default 0.05)
+    ANSWER_INDEX_MIN_AGREEMENT   audited agreement below which a question stops reusing scores (default 0.9)
+    ANSWER_INDEX_GROUP_SIZE      answers kept per question and category (default 512)
+    ANSWER_INDEX_MAX_GROUPS      questions kept, least recently used evicted (default 64)
+    ANSWER_INDEX_PATH            .npz file the index is loaded from and saved to (disabled if unset)
+    ANSWER_INDEX_SAVE_EVERY      new answers between saves (default 20)
+"""
+import importlib.util
+import difflib
+import itertools
+import json
+import os
+import random
+import re
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import FrozenSet, List, Optional
+
+from . import telemetry
+from .cache import normalize_text
+
+np = None
+_numpy_checked = False
+
+# Hashed feature space: character 3- and 4-grams of the padded answer plus its words.
+DIM = 256
+NGRAMS = (3, 4)
+FORMAT = 2
+# Audits a question needs before its agreement rate can switch reuse off.
+MIN_AUDITS = 10
+# A new answer this close to a stored one with the same score only refreshes it.
+DUPLICATE = 0.999
+
+# Words that flip what an answer says; two answers must use the same ones.
+NEGATIONS = frozenset({"not", "no", "nope", "nah", "never", "nothing", "none", "nobody", "nowhere", "neither",
+                       "nor", "without", "hardly", "barely", "scarcely", "cannot"})
+# Contractions lose their apostrophe in normalization: "don't" -> "dont", "can't" -> "cant".
+_NEGATED_AUXILIARIES = frozenset({"do", "does", "did", "is", "are", "was", "were", "have", "has", "had", "ca",
+                                  "could", "would", "should", "wo", "must", "need", "ai"})
+# Words an answer can add or drop without changing its score.
+FILLERS = frozenset({"honestly", "tbh", "um", "umm", "uh", "hmm", "i", "think", "guess", "lately"})
+NEGATING_PREFIXES = ("un", "in", "im", "dis", "non")
+# Spelling similarity (difflib ratio) at which two words of 4+ letters count as a typo of each other.
+TYPO_RATIO = 0.8
+
+
+def numpy_available() -> bool:
+    """Import NumPy on first use; False when it is not installed."""
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy as np
+        except ImportError:
+            print("NumPy is not installed, the answer index is off")
+        _numpy_checked = True
+    return np is not None
+
+
+def _normalized(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", "", normalize_text(text, casefold=True)).split())
+
+
+def features(text: str) -> List[str]:
+    text = _normalized(text)
+    padded = f" {text} "
+    return [padded[i:i + n] for n in NGRAMS for i in range(len(padded) - n + 1)] + text.split()
+
+
+def vectorize(text: str):
+    """Unit-length signed feature-hashing vector of ``text`` (float32, ``DIM`` wide)."""
+    hashes = np.fromiter((zlib.crc32(f.encode()) for f in features(text)), dtype=np.int64)
+    signs = np.where(hashes & 0x80000000, 1.0, -1.0)
+    vector = np.bincount(hashes % DIM, weights=signs, minlength=DIM).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def is_negation(word: str) -> bool:
+    return word in NEGATIONS or (word.endswith("nt") and word[:-2] in _NEGATED_AUXILIARIES)
+
+
+def content_words(text: str) -> FrozenSet[str]:
+    """The words of ``text`` that carry its meaning (fillers dropped), for ``words_agree``."""
+    return frozenset(word for word in _normalized(text).split() if word not in FILLERS)
+
+
+def _typo(word: str, other: str) -> bool:
+    if min(len(word), len(other)) < 4 or is_negation(word) or is_negation(other):
+        return False
+    longer, shorter = (word, other) if len(word) >= len(other) else (other, word)
+    if any(longer == prefix + shorter for prefix in NEGATING_PREFIXES):
+        return False
+    return difflib.SequenceMatcher(None, word, other).ratio() >= TYPO_RATIO
+
+
+def words_agree(first: FrozenSet[str], second: FrozenSet[str]) -> bool:
+    """True when two answers say the same thing word for word, up to fillers and typos."""
+    if {w for w in first if is_negation(w)} != {w for w in second if is_negation(w)}:
+        return False
+    only_first, only_second = first - second, second - first
+    return (all(any(_typo(word, other) for other in only_second) for word in only_first)
+            and all(any(_typo(word, other) for other in only_first) for word in only_second))
+
+
+@dataclass
+class Match:
+    score: int
+    reasoning: str
+    similarity: float
+    audit: bool = False
+
+
+class _Group:
+    """Answers to one question: a row per answer in ``vectors``, with its score and reasoning in ``entries``."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.vectors = np.zeros((min(16, capacity), DIM), dtype=np.float32)
+        self.entries: List[dict] = []
+        self.used: List[int] = []
+        self.audits = 0
+        self.disagreements = 0
+
+    def similarities(self, vector):
+        return self.vectors[:len(self.entries)] @ vector
+
+    def insert(self, vector, entry: dict, used: int) -> bool:
+        """Store an answer; True when the least recently used one was evicted to make room."""
+        if len(self.entries) < self.capacity:
+            if len(self.entries) == len(self.vectors):
+                grown = np.zeros((min(2 * len(self.vectors), self.capacity), DIM), dtype=np.float32)
+                grown[:len(self.vectors)] = self.vectors
+                self.vectors = grown
+            self.vectors[len(self.entries)] = vector
+            self.entries.append(entry)
+            self.used.append(used)
+            return False
+        oldest = min(range(len(self.used)), key=self.used.__getitem__)
+        self.vectors[oldest] = vector
+        self.entries[oldest] = entry
+        self.used[oldest] = used
+        return True
+
+    def trusted(self, min_agreement: float) -> bool:
+        return self.audits < MIN_AUDITS or 1 - self.disagreements / self.audits >= min_agreement
+
+
+class AnswerIndex:
+    def __init__(self):
+        self.switched_on = os.getenv("ANSWER_INDEX", "1") != "0"
+        if self.switched_on and importlib.util.find_spec("numpy") is None:
+            # Checked without importing NumPy, which would slow the cold start down.
+            print("NumPy is not installed, the answer index is off: every /score-response answer goes to the model")
+            self.switched_on = False
+        self.similarity = float(os.getenv("ANSWER_INDEX_SIMILARITY", "0.85"))
+        self.neighbors = max(1, int(os.getenv("ANSWER_INDEX_NEIGHBORS", "2")))
+        self.audit_rate = float(os.getenv("ANSWER_INDEX_AUDIT", "0.05"))
+        self.min_agreement = float(os.getenv("ANSWER_INDEX_MIN_AGREEMENT", "0.9"))
+        self.group_size = int(os.getenv("ANSWER_INDEX_GROUP_SIZE", "512"))
+        self.max_groups = int(os.getenv("ANSWER_INDEX_MAX_GROUPS", "64"))
+        self.path = os.getenv("ANSWER_INDEX_PATH") or None
+        self.save_every = int(os.getenv("ANSWER_INDEX_SAVE_EVERY", "20"))
+        self.groups: "OrderedDict[str, _Group]" = OrderedDict()
+        self.counters = {"lookups": 0, "hits": 0, "misses": 0, "distrusted": 0, "audits": 0,
+                         "disagreements": 0, "added": 0, "evictions": 0, "word_mismatches": 0}
+        self._clock = itertools.count()
+        self._loaded = False
+        self._unsaved = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.switched_on and numpy_available()
+
+    @staticmethod
+    def group_key(question: str, category: str, prompt: str) -> str:
+        """Answers are only comparable under the same question, category and scoring prompt version."""
+        return json.dumps([normalize_text(question, casefold=True), category, prompt], ensure_ascii=False)
+
+    def lookup(self, key: str, answer: str) -> Optional[Match]:
+        """The score to reuse for ``answer``, or None when it has to go to the model."""
+        if not self.enabled:
+            return None
+        self._load()
+        self.counters["lookups"] += 1
+        group = self.groups.get(key)
+        if group is None or len(group.entries) < self.neighbors:
+            self.counters["misses"] += 1
+            return None
+        if not group.trusted(self.min_agreement):
+            self.counters["distrusted"] += 1
+            return None
+        self.groups.move_to_end(key)
+        similarities = group.similarities(vectorize(answer))
+        if len(similarities) > self.neighbors:
+            nearest = np.argpartition(-similarities, self.neighbors - 1)[:self.neighbors]
+        else:
+            nearest = np.arange(len(similarities))
+        scores = {group.entries[i]["score"] for i in nearest}
+        if similarities[nearest].min() < self.similarity or len(scores) > 1:
+            self.counters["misses"] += 1
+            return None
+        words = content_words(answer)
+        if not all(words_agree(words, frozenset(group.entries[i]["words"])) for i in nearest):
+            self.counters["misses"] += 1
+            self.counters["word_mismatches"] += 1
+            return None
+        self.counters["hits"] += 1
+        now = next(self._clock)
+        for i in nearest:
+            group.used[i] = now
+        best = int(nearest[np.argmax(similarities[nearest])])
+        return Match(score=group.entries[best]["score"], reasoning=group.entries[best]["reasoning"],
+                     similarity=float(similarities[best]), audit=random.random() < self.audit_rate)
+
+    def add(self, key: str, answer: str, score: int, reasoning: str, audited: Optional[Match] = None):
+        """Store the model's score for ``answer``; ``audited`` is the reused score it was checked against, if any."""
+        if not self.enabled:
+            return
+        self._load()
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = _Group(self.group_size)
+            if len(self.groups) > self.max_groups:
+                _, dropped = self.groups.popitem(last=False)
+                self.counters["evictions"] += len(dropped.entries)
+        self.groups.move_to_end(key)
+        if audited is not None:
+            self.counters["audits"] += 1
+            group.audits += 1
+            if audited.score != score:
+                self.counters["disagreements"] += 1
+                group.disagreements += 1
+        vector = vectorize(answer)
+        if group.entries:
+            similarities = group.similarities(vector)
+            closest = int(np.argmax(similarities))
+            if similarities[closest] >= DUPLICATE and group.entries[closest]["score"] == score:
+                group.used[closest] = next(self._clock)
+                return
+        entry = {"score": score, "reasoning": reasoning, "words": sorted(content_words(answer))}
+        if group.insert(vector, entry, next(self._clock)):
+            self.counters["evictions"] += 1
+        self.counters["added"] += 1
+        self._unsaved += 1
+        if self.path and self._unsaved >= self.save_every:
+            self.save()
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                if (meta.get("format"), meta.get("dim"), tuple(meta.get("ngrams", ()))) != (FORMAT, DIM, NGRAMS):
+                    print(f"Answer index {self.path} was built with other settings, starting empty")
+                    return
+                saved_groups = meta["groups"]
+                for i, saved in enumerate(saved_groups):
+                    if i < len(saved_groups) - self.max_groups:
+                        continue
+                    group = _Group(self.group_size)
+                    for vector, entry in zip(data[f"g{i}"][-self.group_size:], saved["entries"][-self.group_size:]):
+                        group.insert(vector, entry, next(self._clock))
+                    group.audits, group.disagreements = saved["audits"], saved["disagreements"]
+                    self.groups[saved["key"]] = group
+            print(f"Answer index: loaded {sum(len(g.entries) for g in self.groups.values())} answers "
+                  f"for {len(self.groups)} questions")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Answer index load error: {e}")
+
+    def save(self):
+        """Write the index to ``ANSWER_INDEX_PATH``, replacing the file only once the new one is complete."""
+        if not self.path or not self.enabled:
+            return
+        groups = list(self.groups.items())
+        meta = {"format": FORMAT, "dim": DIM, "ngrams": list(NGRAMS),
+                "groups": [{"key": key, "entries": group.entries, "audits": group.audits,
+                            "disagreements": group.disagreements} for key, group in groups]}
+        arrays = {f"g{i}": group.vectors[:len(group.entries)] for i, (_, group) in enumerate(groups)}
+        partial = self.path + ".tmp"
+        try:
+            with open(partial, "wb") as f:
+                np.savez(f, meta=np.array(json.dumps(meta, ensure_ascii=False)), **arrays)
+            os.replace(partial, self.path)
+            self._unsaved = 0
+        except OSError as e:
+            print(f"Answer index save error: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.counters["lookups"]
+        audits = self.counters["audits"]
+        return dict(
+            self.counters,
+            enabled=self.enabled,
+            hit_rate=round(self.counters["hits"] / lookups, 3) if lookups else None,
+            disagreement_rate=round(self.counters["disagreements"] / audits, 3) if audits else None,
+            questions=len(self.groups),
+            answers=sum(len(group.entries) for group in self.groups.values()),
+            bytes=sum(group.vectors.nbytes for group in self.groups.values()),
+            distrusted_questions=sum(1 for group in self.groups.values() if not group.trusted(self.min_agreement)),
+        )
+
+
+answer_index = AnswerIndex()
+
+
+@telemetry.registry.collector
+def answer_index_metrics():
+    counters = answer_index.counters
+    lookups = telemetry.Counter("psy_answer_index_lookups_total",
+                                "Near-duplicate answer lookups by outcome (distrusted: reuse off after failed audits)",
+                                ("outcome",))
+    for outcome, key in (("hit", "hits"), ("miss", "misses"), ("distrusted", "distrusted")):
+        lookups.inc(counters[key], outcome=outcome)
+    audits = telemetry.Counter("psy_answer_index_audits_total", "Reused scores checked against the model",
+                               ("outcome",))
+    audits.inc(counters["audits"] - counters["disagreements"], outcome="agree")
+    audits.inc(counters["disagreements"], outcome="disagree")
+    size = telemetry.Gauge("psy_answer_index_answers", "Answers held by the near-duplicate index")
+    size.set(sum(len(group.entries) for group in answer_index.groups.values()))
+    return [lookups, audits, size]
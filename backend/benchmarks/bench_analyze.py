@@ -0,0 +1,80 @@
+"""Wall-time benchmark for /analyze against the local fake provider.
+
+    python -m backend.benchmarks.bench_analyze [--requests 20]
+
+Each /analyze issues three 70B trait calls, three 8B refine calls and one 70B
+classify call. With blocking clients the wall time is the sum of all seven; with
+the async gateway the gathered stages overlap and the wall time approaches the
+critical path (slowest trait call + slowest refine call + classify).
+
+The load runs twice: with the personality label table off, where every request
+waits for its classify call, and on, where the label is looked up (see
+``backend/labels.py``) and classify only runs in the background on a miss, which
+takes it off the critical path.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+
+from .fake_provider import DEFAULT_LATENCY, FakeProvider
+
+TEXT = ("I love spending quiet evenings reading about new ideas, but I also enjoy "
+        "planning trips with close friends and trying things I have never done before.")
+
+
+async def run(concurrency: int, labels: bool):
+    from backend.main import app, personality_labels
+    from backend.llm import gateway
+
+    personality_labels.enabled = labels
+    personality_labels.labels.clear()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+        async def one():
+            started = time.perf_counter()
+            response = await client.post("/api/analyze", json={"text": TEXT})
+            response.raise_for_status()
+            return time.perf_counter() - started
+
+        single = await one()
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(one() for _ in range(concurrency)))
+        total = time.perf_counter() - started
+    await gateway.aclose()
+    return single, latencies, total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20, help="concurrent /analyze requests in the load phase")
+    args = parser.parse_args()
+
+    big, small = DEFAULT_LATENCY["llama-3.3-70b-versatile"], DEFAULT_LATENCY["llama-3.1-8b-instant"]
+    with FakeProvider() as base_url:
+        os.environ["GROQ_BASE_URL"] = base_url
+        os.environ["MISTRAL_BASE_URL"] = base_url
+        os.environ.setdefault("CACHE_ENABLED", "0")
+        os.environ.setdefault("LLM_LOG_TOKENS", "0")
+        runs = {labels: asyncio.run(run(args.requests, labels)) for labels in (False, True)}
+
+    print(f"sum of upstream calls   : {4 * big + 3 * small:.2f}s")
+    print(f"critical path (max)     : {2 * big + small:.2f}s, {big + small:.2f}s with the label table")
+    for labels, (single, latencies, total) in runs.items():
+        print(f"\nlabel table {'on' if labels else 'off'}")
+        print(f"single /analyze         : {single:.2f}s")
+        print(f"{args.requests} concurrent /analyze : {total:.2f}s total, "
+              f"p50 {statistics.median(latencies):.2f}s, max {max(latencies):.2f}s")
+
+    from backend.tokens import token_ledger
+    print("\ntokens per call site     used / reserved")
+    for site, entry in token_ledger.stats().items():
+        print(f"  {site:22} {entry['avg_completion_tokens']:>6.0f} / {entry['avg_reserved_tokens']:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Near-duplicate answer reuse for /score-response against the fake provider.
+
+    python -m backend.benchmarks.bench_answer_index [--requests 2000] [--similarity 0.85] [--neighbors 2]
+
+Questionnaire traffic is simulated as short answers drawn from a skewed set of
+common phrasings, varied the way people type them: case, punctuation, fillers
+("honestly", "tbh") and the odd dropped letter. The stub scores an answer from
+its frequency words (``fake_provider.answer_score``), so the true score of every
+answer is known, and a typo can change it the way a real model's score changes
+with wording.
+
+The same answer stream goes through /score-response twice, with the exact
+result cache on both times: once with the answer index off and once with it on.
+Each run reports the scoring calls sent upstream and the mean latency. The run
+with the index also reports its hit rate, the audited disagreement rate, and how
+many reused scores differ from the true score. Last come the cost of a lookup
+against a full question, and of saving and loading the index.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import httpx
+
+from .fake_provider import FakeProvider, answer_score, create_app
+
+QUESTIONS = [("Over the last two weeks, how often have you felt down or hopeless?", "mood"),
+             ("How often have you had little interest or pleasure in doing things?", "anhedonia"),
+             ("How have you been sleeping?", "sleep"),
+             ("How often do you feel tired or have little energy?", "energy")]
+PHRASES = ["not really", "no", "never", "I'm fine", "I guess I'm fine", "nope, doing okay", "not at all",
+           "sometimes", "kinda tired", "a bit", "occasionally", "kind of, now and then", "a little I guess",
+           "most days", "often", "a lot lately", "usually yes",
+           "every day", "all the time", "constantly", "always"]
+PREFIXES = ["", "", "", "honestly ", "um ", "well, ", "hmm "]
+SUFFIXES = ["", "", "", " tbh", " lately", " I think", " I guess"]
+ENDINGS = ["", "", ".", "!", "...", " :("]
+
+
+def answer(rng: random.Random) -> str:
+    # Zipf-like: the first phrasings are by far the most common.
+    text = PHRASES[min(int(rng.paretovariate(1.2)) - 1, len(PHRASES) - 1) if rng.random() < 0.6
+                   else rng.randrange(len(PHRASES))]
+    text = rng.choice(PREFIXES) + text + rng.choice(SUFFIXES) + rng.choice(ENDINGS)
+    if rng.random() < 0.3:
+        text = text.capitalize()
+    if rng.random() < 0.05 and len(text) > 4:
+        drop = rng.randrange(len(text))
+        text = text[:drop] + text[drop + 1:]
+    return text
+
+
+async def run(stream: list, index_on: bool, app) -> dict:
+    from backend import main
+    from backend.cache import MemoryBackend
+    from backend.llm import gateway
+
+    main.result_cache.memory = MemoryBackend(main.result_cache.memory.max_entries, main.result_cache.memory.max_bytes)
+    os.environ["ANSWER_INDEX"] = "1" if index_on else "0"
+    main.answer_index.__init__()
+    before = len(app.state.calls)
+    latencies, wrong_reused = [], 0
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+        for question, category, text in stream:
+            calls = len(app.state.calls)
+            started = time.perf_counter()
+            response = await client.post("/api/score-response", json={"question": question, "category": category,
+                                                                       "response": text})
+            latencies.append(time.perf_counter() - started)
+            if len(app.state.calls) == calls and response.json()["score"] != answer_score(text):
+                wrong_reused += 1
+    await gateway.aclose()
+    upstream = sum(1 for call in app.state.calls[before:] if call["site"] == "score_response")
+    return {"upstream": upstream, "mean": statistics.mean(latencies), "wrong_reused": wrong_reused,
+            "stats": main.answer_index.stats()}
+
+
+def lookup_cost(rng: random.Random, size: int = 512, repeat: int = 2000) -> dict:
+    from backend.answer_index import AnswerIndex, vectorize
+
+    os.environ["ANSWER_INDEX"] = "1"
+    index = AnswerIndex()
+    index.group_size = size
+    key = index.group_key(*QUESTIONS[0], "bench")
+    for i in range(size):
+        index.add(key, f"{answer(rng)} {i}", i % 4, "reasoning")
+    queries = [answer(rng) for _ in range(repeat)]
+    started = time.perf_counter()
+    for text in queries:
+        vectorize(text)
+    vectorized = (time.perf_counter() - started) / repeat
+    started = time.perf_counter()
+    for text in queries:
+        index.lookup(key, text)
+    looked_up = (time.perf_counter() - started) / repeat
+
+    with tempfile.TemporaryDirectory() as folder:
+        index.path = os.path.join(folder, "answers.npz")
+        started = time.perf_counter()
+        index.save()
+        saved = time.perf_counter() - started
+        reloaded = AnswerIndex()
+        reloaded.path = index.path
+        started = time.perf_counter()
+        reloaded._load()
+        loaded = time.perf_counter() - started
+        file_bytes = os.path.getsize(index.path)
+    return {"size": size, "vectorize": vectorized, "lookup": looked_up, "save": saved, "load": loaded,
+            "file_bytes": file_bytes, "answers": sum(len(g.entries) for g in reloaded.groups.values())}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--similarity", default="0.85", help="ANSWER_INDEX_SIMILARITY")
+    parser.add_argument("--neighbors", default="2", help="ANSWER_INDEX_NEIGHBORS")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stream = [(*rng.choice(QUESTIONS), answer(rng)) for _ in range(args.requests)]
+    distinct = len({(question, " ".join(text.casefold().split())) for question, _, text in stream})
+    os.environ.update(ANSWER_INDEX_SIMILARITY=args.similarity, ANSWER_INDEX_NEIGHBORS=args.neighbors,
+                      LLM_LOG_TOKENS="0")
+    os.environ.pop("ANSWER_INDEX_PATH", None)
+    app = create_app(latency={"llama-3.3-70b-versatile": 0.02})
+    with FakeProvider(app) as base_url:
+        os.environ["GROQ_BASE_URL"] = base_url
+        os.environ["MISTRAL_BASE_URL"] = base_url
+        results = {"exact cache": asyncio.run(run(stream, False, app)),
+                   "+ answer index": asyncio.run(run(stream, True, app))}
+
+    print(f"{args.requests} answers to {len(QUESTIONS)} questions, {distinct} distinct after normalization\n")
+    print(f"{'':16}{'upstream calls':>15}{'mean ms':>9}")
+    for name, result in results.items():
+        print(f"{name:16}{result['upstream']:>15}{result['mean'] * 1000:>9.1f}")
+    stats = results["+ answer index"]["stats"]
+    reused = stats["hits"] - stats["audits"]
+    print(f"\nindex lookups {stats['lookups']}, hit rate {stats['hit_rate']:.1%}, reused {reused}, "
+          f"audited {stats['audits']} (disagreed {stats['disagreements']}), "
+          f"questions with reuse off {stats['distrusted_questions']}")
+    wrong = results["+ answer index"]["wrong_reused"]
+    print(f"reused scores that differ from the true score: {wrong} of {reused} "
+          f"({wrong / reused if reused else 0:.1%})")
+
+    cost = lookup_cost(rng)
+    print(f"\nwith {cost['size']} answers to one question: vectorize {cost['vectorize'] * 1e6:.1f}us, "
+          f"lookup (vectorize + search) {cost['lookup'] * 1e6:.1f}us")
+    print(f"save {cost['save'] * 1000:.1f}ms, load {cost['load'] * 1000:.1f}ms, {cost['answers']} answers in "
+          f"{cost['file_bytes'] / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
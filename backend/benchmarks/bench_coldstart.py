@@ -0,0 +1,112 @@
+"""Cold start of the serverless entry point (api/index.py), each run in a fresh interpreter.
+
+    python -m backend.benchmarks.bench_coldstart [--runs 5] [--budget-ms 800] [--top 15]
+
+Each run starts a new Python process, the way a new serverless instance does, and
+times three things:
+
+- the process until it is running;
+- importing ``api.index``;
+- the first request, a /score-response against the fake provider, which also
+  opens the provider connection.
+
+It lists the modules that should load only with their route (Pillow, the export
+parser) if the import pulled them in anyway. Last comes the slowest packages,
+from ``-X importtime`` in one more fresh process, grouped by top-level package.
+
+Exits with status 1 when the median of import plus first request is over
+``--budget-ms``, so it can run as a check.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from .fake_provider import FakeProvider, create_app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Modules the backend defers until a route needs them.
+DEFERRED = ("PIL", "backend.chat_export", "opentelemetry.sdk")
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import api.index
+imported = time.perf_counter()
+deferred = [name for name in %r if name in sys.modules]
+import asyncio, httpx
+
+async def first_request():
+    transport = httpx.ASGITransport(app=api.index.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post("/api/score-response", json={
+            "question": "How often have you felt down?", "category": "mood", "response": "Most days, honestly."})
+        response.raise_for_status()
+
+began = time.perf_counter()
+asyncio.run(first_request())
+print(json.dumps({"import": imported - started, "first_request": time.perf_counter() - began,
+                  "deferred_loaded": deferred, "modules": len(sys.modules)}))
+"""
+
+
+def run_once(env: dict) -> dict:
+    launched = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", CHILD % (DEFERRED,)], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    row = json.loads(result.stdout.strip().splitlines()[-1])
+    row["process"] = time.perf_counter() - launched - row["import"] - row["first_request"]
+    return row
+
+
+def import_profile(env: dict, top: int) -> list:
+    """(package, ms) of the slowest top-level packages: self time from -X importtime, summed per package."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import api.index"], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    packages = defaultdict(int)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        packages[name.strip().split(".")[0]] += int(self_us)
+    return sorted(((name, us / 1000) for name, us in packages.items()), key=lambda item: -item[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=800.0, help="median import + first request")
+    parser.add_argument("--top", type=int, default=15, help="packages listed in the import profile")
+    args = parser.parse_args()
+
+    app = create_app(latency={"llama-3.3-70b-versatile": 0.0})
+    with FakeProvider(app) as base_url:
+        env = dict(os.environ, GROQ_BASE_URL=base_url, MISTRAL_BASE_URL=base_url, LLM_LOG_TOKENS="0")
+        for name in ("STARTUP_PROFILE", "PYTHONDONTWRITEBYTECODE"):
+            env.pop(name, None)
+        run_once(env)  # writes .pyc files, as a deployed bundle already has them
+        rows = [run_once(env) for _ in range(args.runs)]
+        profile = import_profile(env, args.top)
+
+    print(f"{'run':>4}{'process ms':>12}{'import ms':>11}{'first request ms':>18}{'modules':>9}")
+    for i, row in enumerate(rows, 1):
+        print(f"{i:>4}{row['process'] * 1000:>12.0f}{row['import'] * 1000:>11.0f}"
+              f"{row['first_request'] * 1000:>18.0f}{row['modules']:>9}")
+    cold = statistics.median(row["import"] + row["first_request"] for row in rows) * 1000
+    loaded = sorted({name for row in rows for name in row["deferred_loaded"]})
+    print(f"\ndeferred modules loaded by the import: {', '.join(loaded) or 'none'}")
+    print("\nslowest packages to import (self time summed per top-level package):")
+    for name, ms in profile:
+        print(f"  {name:24}{ms:>8.1f}ms")
+    verdict = "within" if cold <= args.budget_ms else "OVER"
+    print(f"\nmedian import + first request: {cold:.0f}ms, {verdict} the {args.budget_ms:.0f}ms budget")
+    if cold > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
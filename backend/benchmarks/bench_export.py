@@ -0,0 +1,140 @@
+"""Parse throughput and memory for WhatsApp chat exports, and the export path end to end.
+
+    python -m backend.benchmarks.bench_export [--lines 10000 100000 500000] [--export chat.zip]
+
+Generates synthetic exports in the Android (day-first, 24h) and iOS (month-first,
+12h, bracketed) formats with multi-line messages, media placeholders, deleted
+messages and system notices, zips one of them, and reports lines per second and
+the peak Python heap (tracemalloc) while ``chat_export.read_stats`` streams them.
+Peak memory should stay flat as the export grows. ``--export`` adds a real export.
+
+Then one export is posted to /analyze-whatsapp/export against the fake provider
+to show the upstream calls it costs: a single text call, no vision call.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from datetime import datetime, timedelta
+
+import httpx
+
+from backend import chat_export
+
+from .fake_provider import FakeProvider
+
+WORDS = ("hey how are you doing today i was thinking about that thing we talked about yesterday "
+         "sounds good to me haha see you later maybe tomorrow really love that idea okay sure").split()
+ANDROID_NOTICES = ("Messages and calls are end-to-end encrypted. No one outside of this chat, not even WhatsApp, "
+                   "can read or listen to them. Tap to learn more.",)
+
+
+def synthetic_export(path: str, lines: int, style: str = "android", seed: int = 0):
+    rng = random.Random(seed)
+    now = datetime(2023, 1, 1, 8, 0)
+    author = "Alice"
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        if style == "android":
+            f.write(f"{now:%d/%m/%Y}, {now:%H:%M} - {ANDROID_NOTICES[0]}\n")
+        while written < lines:
+            now += timedelta(seconds=rng.choice((20, 90, 300, 1800, 4 * 3600, 12 * 3600)) * rng.random())
+            if rng.random() < 0.55:
+                author = "Bob" if author == "Alice" else "Alice"
+            roll = rng.random()
+            if roll < 0.05:
+                text = "<Media omitted>" if style == "android" else "‎image omitted"
+            elif roll < 0.06:
+                text = "This message was deleted"
+            else:
+                text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 18)))
+                if rng.random() < 0.08:
+                    text += "\n" + " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 10)))
+            if style == "android":
+                f.write(f"{now:%d/%m/%Y}, {now:%H:%M} - {author}: {text}\n")
+            else:
+                clock = now.strftime("%I:%M:%S").lstrip("0")
+                f.write(f"[{now.month}/{now.day}/{now:%y}, {clock} {now:%p}] {author}: {text}\n")
+            written += 1 + text.count("\n")
+
+
+def measure(path: str, max_bytes: int) -> dict:
+    started = time.perf_counter()
+    with open(path, "rb") as f:
+        stats = chat_export.read_stats(f, max_bytes)
+    elapsed = time.perf_counter() - started
+    # Tracing slows parsing several times over, so memory is measured on a second pass.
+    tracemalloc.start()
+    with open(path, "rb") as f:
+        chat_export.read_stats(f, max_bytes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    with open(path, "rb") as f:
+        lines = sum(1 for _ in f) if not zipfile.is_zipfile(path) else None
+    return {"messages": stats.messages, "lines": lines, "seconds": elapsed, "peak": peak,
+            "size": os.path.getsize(path), "summary": stats.summary(stats.default_user())}
+
+
+async def end_to_end(path: str) -> dict:
+    from backend.main import app
+    from backend.llm import gateway
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+        with open(path, "rb") as f:
+            started = time.perf_counter()
+            response = await client.post("/api/analyze-whatsapp/export?user=Alice", content=f.read())
+        response.raise_for_status()
+        elapsed = time.perf_counter() - started
+    report = gateway.stats()
+    await gateway.aclose()
+    return {"seconds": elapsed, "tokens": report["tokens"], "response": response.json()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, nargs="*", default=[10000, 100000, 500000])
+    parser.add_argument("--export", help="a real .txt or .zip export to include")
+    args = parser.parse_args()
+
+    max_bytes = 1 << 31
+    with tempfile.TemporaryDirectory() as folder:
+        samples = []
+        for count in args.lines:
+            for style in ("android", "ios"):
+                path = os.path.join(folder, f"{style}-{count}.txt")
+                synthetic_export(path, count, style)
+                samples.append((f"{style} {count}", path))
+        zipped = os.path.join(folder, "export.zip")
+        with zipfile.ZipFile(zipped, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.write(samples[-1][1], "_chat.txt")
+        samples.append(("ios zip", zipped))
+        if args.export:
+            samples.append((os.path.basename(args.export), args.export))
+
+        print(f"{'export':20}{'MB':>8}{'messages':>10}{'lines/s':>11}{'peak heap':>11}")
+        for name, path in samples:
+            row = measure(path, max_bytes)
+            rate = f"{row['lines'] / row['seconds']:>11,.0f}" if row["lines"] else f"{'-':>11}"
+            print(f"{name[:19]:20}{row['size'] / 1e6:>8.1f}{row['messages']:>10}{rate}{row['peak'] / 1e6:>9.1f}MB")
+        summary = row["summary"]
+        print(f"\nstats for the last export: {summary['sessions']} conversations, user started "
+              f"{summary['user_initiation_share']:.0%}, user reply median {summary['user']['median_reply_minutes']} min")
+
+        with FakeProvider() as base_url:
+            os.environ["GROQ_BASE_URL"] = base_url
+            os.environ["MISTRAL_BASE_URL"] = base_url
+            os.environ.setdefault("CACHE_ENABLED", "0")
+            os.environ.setdefault("LLM_LOG_TOKENS", "0")
+            result = asyncio.run(end_to_end(samples[0][1]))
+    print(f"\n/analyze-whatsapp/export ({args.lines[0]} lines): {result['seconds']:.2f}s, upstream calls:")
+    for site, entry in result["tokens"].items():
+        print(f"  {site:32}{entry['calls']:>3} call(s), {entry['avg_prompt_tokens']:.0f} prompt tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Upload size, parse time and vision-call latency for /analyze-whatsapp, before and after preprocessing.
+
+    python -m backend.benchmarks.bench_images [--images DIR] [--count 5]
+
+Uses the screenshots in ``--images`` (PNG, JPEG or WebP), or generates phone-sized
+synthetic chat screenshots when no folder is given. For each image it compares
+
+- the legacy path: base64 inside a JSON body, sent to the vision model as-is;
+- the new path: a raw binary upload to /analyze-whatsapp/upload, cropped,
+  downscaled and re-encoded before the vision call.
+
+The fake provider charges vision calls extra latency per megabyte of image, so
+end-to-end times reflect payload size. Needs Pillow.
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import statistics
+import time
+
+import httpx
+from PIL import Image, ImageDraw
+
+from .fake_provider import FakeProvider
+
+EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def synthetic_screenshot(seed: int, size=(1080, 2400)) -> bytes:
+    """A WhatsApp-like PNG: status bar, header, patterned wallpaper, bubbles with text lines and an input bar."""
+    rng = random.Random(seed)
+    width, height = size
+    image = Image.new("RGB", size, (236, 229, 221))
+    draw = ImageDraw.Draw(image)
+    for _ in range(6000):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.ellipse((x, y, x + rng.randint(2, 9), y + rng.randint(2, 9)), fill=(220 + rng.randint(-12, 12),) * 3)
+    draw.rectangle((0, 0, width, 90), fill=(7, 94, 84))
+    draw.rectangle((0, 90, width, 260), fill=(7, 94, 84))
+    y = 300
+    while y < height - 360:
+        mine = rng.random() < 0.5
+        lines = rng.randint(1, 4)
+        bubble_width = rng.randint(360, 820)
+        left = width - bubble_width - 40 if mine else 40
+        bottom = y + 40 + lines * 52
+        draw.rounded_rectangle((left, y, left + bubble_width, bottom), radius=24,
+                               fill=(220, 248, 198) if mine else (255, 255, 255))
+        for line in range(lines):
+            x = left + 28
+            while x < left + bubble_width - 80:
+                word = rng.randint(30, 120)
+                draw.rectangle((x, y + 28 + line * 52, x + word, y + 58 + line * 52), fill=(40, 40, 40))
+                x += word + 18
+        y = bottom + rng.randint(20, 60)
+    draw.rectangle((0, height - 150, width, height), fill=(240, 240, 240))
+    draw.rounded_rectangle((30, height - 130, width - 160, height - 30), radius=50, fill=(255, 255, 255))
+    # Light sensor-style noise stands in for antialiasing and wallpaper detail, which is what makes
+    # real PNG screenshots weigh in at megabytes.
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    image = Image.blend(image, noise, 0.06)
+    out = io.BytesIO()
+    image.save(out, "PNG")
+    return out.getvalue()
+
+
+def load_images(folder: str, count: int) -> list:
+    if folder:
+        names = sorted(n for n in os.listdir(folder) if n.lower().endswith(EXTENSIONS))
+        return [(name, open(os.path.join(folder, name), "rb").read()) for name in names]
+    return [(f"synthetic-{i}.png", synthetic_screenshot(i)) for i in range(count)]
+
+
+def timed(fn, *args, repeat: int = 5):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(*args)
+    return result, (time.perf_counter() - started) / repeat
+
+
+async def end_to_end(client: httpx.AsyncClient, data: bytes, mime: str):
+    os.environ["IMAGE_PREPROCESS"] = "0"
+    body = json.dumps({"image": base64.b64encode(data).decode()})
+    started = time.perf_counter()
+    response = await client.post("/api/analyze-whatsapp", content=body, headers={"content-type": "application/json"})
+    response.raise_for_status()
+    legacy = time.perf_counter() - started
+
+    os.environ["IMAGE_PREPROCESS"] = "1"
+    started = time.perf_counter()
+    response = await client.post("/api/analyze-whatsapp/upload", content=data, headers={"content-type": mime})
+    response.raise_for_status()
+    return legacy, time.perf_counter() - started
+
+
+async def run(samples: list) -> list:
+    from backend.main import app
+    from backend.llm import gateway
+    from backend import images
+
+    rows = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+        for name, data in samples:
+            body = json.dumps({"image": base64.b64encode(data).decode()})
+            _, parse_json = timed(lambda: images.decode_base64(json.loads(body)["image"]))
+            prepared, preprocess = timed(images.prepare, data, dict(images.settings(), preprocess=True), repeat=3)
+            legacy, new = await end_to_end(client, data, images.detect_format(data) or "application/octet-stream")
+            rows.append({"name": name, "original": len(data), "json_body": len(body), "sent": len(prepared.data),
+                         "size": f"{prepared.width}x{prepared.height}", "parse_json": parse_json,
+                         "preprocess": preprocess, "legacy": legacy, "new": new})
+    await gateway.aclose()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", help="folder of sample screenshots (synthetic ones if omitted)")
+    parser.add_argument("--count", type=int, default=5, help="synthetic screenshots to generate")
+    args = parser.parse_args()
+
+    samples = load_images(args.images, args.count)
+    with FakeProvider() as base_url:
+        os.environ["GROQ_BASE_URL"] = base_url
+        os.environ["MISTRAL_BASE_URL"] = base_url
+        os.environ.setdefault("CACHE_ENABLED", "0")
+        os.environ.setdefault("LLM_LOG_TOKENS", "0")
+        rows = asyncio.run(run(samples))
+
+    kb = 1024
+    print(f"{'image':20}{'upload KB':>10}{'JSON KB':>9}{'to model KB':>12}{'model input':>13}"
+          f"{'JSON parse':>11}{'preprocess':>11}{'legacy':>8}{'new':>8}")
+    for row in rows:
+        print(f"{row['name'][:19]:20}{row['original'] / kb:>10.0f}{row['json_body'] / kb:>9.0f}"
+              f"{row['sent'] / kb:>12.0f}{row['size']:>13}{row['parse_json'] * 1000:>9.1f}ms"
+              f"{row['preprocess'] * 1000:>9.1f}ms{row['legacy']:>7.2f}s{row['new']:>7.2f}s")
+    print(f"\nupload bytes vs. JSON body : {sum(r['original'] for r in rows) / sum(r['json_body'] for r in rows):.0%}")
+    print(f"image bytes to vision model: {sum(r['sent'] for r in rows) / sum(r['original'] for r in rows):.0%} of the original")
+    print(f"end-to-end p50             : {statistics.median(r['legacy'] for r in rows):.2f}s legacy, "
+          f"{statistics.median(r['new'] for r in rows):.2f}s preprocessed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""End-to-end run of the batch job runner (``backend.jobs``) against the fake provider.
+
+    python -m backend.benchmarks.bench_jobs [--rows 200] [--concurrency 16] [--rpm 600]
+
+1. Runs half of a synthetic corpus, then tears the last output line the way a
+   crash mid-write would, and resumes: every row ends up with exactly one result
+   and no row is sent upstream twice.
+2. Reruns the finished job: nothing left to do, no upstream calls.
+3. Runs the corpus with a client-side rate limit on the 70B model and reports the
+   request rate actually reached.
+4. Runs it through the provider batch API: one fused call per row, collected
+   once the stub marks the batch complete.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+from .fake_provider import FakeProvider, create_app
+
+SENTENCES = [
+    "I love exploring new ideas with my friends on the weekend.",
+    "Honestly I prefer a quiet evening with a good book and some tea.",
+    "My team relies on me to keep our projects organized and on schedule.",
+    "Sometimes I worry that I have taken on more than I can handle.",
+    "We should definitely plan a trip somewhere we have never been before.",
+    "I think careful analysis matters more than quick decisions.",
+    "Meeting new people energizes me and I rarely turn down an invitation.",
+    "Small routines help me stay calm when work gets stressful.",
+]
+
+
+def write_corpus(path: str, rows: int, seed: int = 0):
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for i in range(rows):
+            if i % 50 == 49:
+                f.write(json.dumps({"id": f"s{i}", "text": "too short"}) + "\n")
+                continue
+            text = " ".join(rng.choice(SENTENCES) for _ in range(rng.randint(2, 8)))
+            f.write(json.dumps({"id": f"s{i}", "text": text}) + "\n")
+        f.write("not json\n")
+
+
+def summarize(path: str) -> dict:
+    last = {}
+    lines = 0
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            last[str(entry["id"])] = entry
+            lines += 1
+    return {"lines": lines, "results": sum("result" in e for e in last.values()),
+            "errors": sum("error" in e for e in last.values())}
+
+
+async def scenario(app, folder: str, rows: int, concurrency: int, rpm: int):
+    from backend import jobs
+    from backend.llm import gateway
+
+    corpus = os.path.join(folder, "corpus.jsonl")
+    write_corpus(corpus, rows)
+
+    def calls() -> int:
+        return len(app.state.calls)
+
+    print(f"== crash and resume ({rows} rows, concurrency {concurrency}) ==")
+    output = os.path.join(folder, "online.jsonl")
+    before = calls()
+    started = time.perf_counter()
+    await jobs.run_job(corpus, output, concurrency=concurrency, limit=rows // 2)
+    first = calls() - before
+    with open(output, "a") as f:
+        f.write('{"id": "s999", "resu')  # torn write
+    before = calls()
+    await jobs.run_job(corpus, output, concurrency=concurrency)
+    second = calls() - before
+    elapsed = time.perf_counter() - started
+    report = summarize(output)
+    print(f"upstream calls: {first} in the first run, {second} after resuming; "
+          f"{report['results']} results, {report['errors']} errors, {report['lines']} lines, {elapsed:.1f}s")
+
+    print("\n== rerun a finished job ==")
+    before = calls()
+    await jobs.run_job(corpus, output, concurrency=concurrency)
+    print(f"upstream calls: {calls() - before}")
+
+    print(f"\n== rate limited: llama-3.3-70b-versatile at {rpm} requests/min ==")
+    gateway.set_rate_limit("llama-3.3-70b-versatile", requests_per_minute=rpm)
+    output = os.path.join(folder, "limited.jsonl")
+    before = len(app.state.calls)
+    started = time.perf_counter()
+    await jobs.run_job(corpus, output, concurrency=concurrency, limit=rows // 4)
+    elapsed = time.perf_counter() - started
+    big = sum(1 for call in app.state.calls[before:] if call["model"] == "llama-3.3-70b-versatile")
+    allowed = rpm / 6 + rpm * elapsed / 60  # a 10 second burst plus the refill
+    print(f"{big} calls to the 70B in {elapsed:.1f}s; the limit allows at most {allowed:.0f} "
+          f"({rpm} per minute after a {rpm // 6}-call burst)")
+    gateway.rate_limits.clear()
+    gateway._buckets.clear()
+
+    print("\n== provider batch API ==")
+    output = os.path.join(folder, "batch.jsonl")
+    before = calls()
+    await jobs.run_job(corpus, output, batch=True, batch_size=max(rows // 3, 1), poll=0.2)
+    models = Counter(call["model"] for call in app.state.calls[before:] if call.get("batch"))
+    report = summarize(output)
+    print(f"batched calls: {dict(models)}; {report['results']} results, {report['errors']} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rpm", type=int, default=600)
+    args = parser.parse_args()
+
+    app = create_app(latency={"llama-3.3-70b-versatile": 0.05, "llama-3.1-8b-instant": 0.02}, jitter=0.02)
+    with FakeProvider(app) as base_url, tempfile.TemporaryDirectory() as folder:
+        os.environ["GROQ_BASE_URL"] = base_url
+        os.environ["MISTRAL_BASE_URL"] = base_url
+        os.environ.setdefault("CACHE_ENABLED", "0")
+        os.environ.setdefault("LLM_LOG_TOKENS", "0")
+        asyncio.run(scenario(app, folder, args.rows, args.concurrency, args.rpm))
+
+
+if __name__ == "__main__":
+    main()
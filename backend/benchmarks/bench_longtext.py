@@ -0,0 +1,116 @@
+"""Long-text /analyze against the fake provider: chunk counts, calls, wall time and memory.
+
+    python -m backend.benchmarks.bench_longtext [--words 300 2000 10000 40000] [--error-rate 0.1]
+
+Texts above 300 words are split into sentence-aware chunks and each chunk gets the
+three trait calls. Refine and classify then run once per text, not once per chunk.
+For each size this reports:
+
+- the number of chunks and upstream calls;
+- the most 70B calls in flight at once: at most ANALYZE_CHUNK_CONCURRENCY chunks
+  times three trait calls, whatever the length of the text;
+- wall time;
+- the peak Python heap while the request runs.
+
+Injected 500s are mostly absorbed by the gateway's retries. A chunk that still
+fails is left out and counted, and the text does not fail. The stub returns the
+same scores for every chunk, so dispersion is zero here; on real text it shows how
+much the parts disagree.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import tracemalloc
+
+import httpx
+
+from .fake_provider import FakeProvider, create_app
+
+SENTENCES = [
+    "I love exploring new ideas with my friends on the weekend.",
+    "Honestly I prefer a quiet evening with a good book and some tea.",
+    "My team relies on me to keep our projects organized and on schedule, even when the plan changes at the last minute.",
+    "Sometimes I worry that I have taken on more than I can handle!",
+    "Would we ever plan a trip somewhere we have never been before?",
+    "I think careful analysis matters more than quick decisions.",
+]
+
+
+def essay(words: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    parts, count = [], 0
+    while count < words:
+        sentence = rng.choice(SENTENCES)
+        parts.append(sentence + ("\n\n" if rng.random() < 0.1 else " "))
+        count += len(sentence.split())
+    return "".join(parts).strip()
+
+
+def peak_in_flight(calls: list, model: str) -> int:
+    edges = sorted([(c["start"], 1) for c in calls if c["model"] == model] +
+                   [(c["end"], -1) for c in calls if c["model"] == model])
+    peak = current = 0
+    for _, step in edges:
+        current += step
+        peak = max(peak, current)
+    return peak
+
+
+async def run(app, sizes: list) -> list:
+    from backend.main import app as backend
+    from backend.llm import gateway
+
+    rows = []
+    transport = httpx.ASGITransport(app=backend)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=600) as client:
+        for words in sizes:
+            text = essay(words)
+            before = len(app.state.calls)
+            tracemalloc.start()
+            started = time.perf_counter()
+            response = await client.post("/api/analyze", json={"text": text})
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            response.raise_for_status()
+            body = response.json()
+            calls = app.state.calls[before:]
+            rows.append({"words": len(text.split()), "chunks": body.get("chunks", {"count": 1, "failed": 0}),
+                         "calls": len(calls), "in_flight": peak_in_flight(calls, "llama-3.3-70b-versatile"),
+                         "seconds": elapsed, "peak": peak, "body": body})
+    await gateway.aclose()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", type=int, nargs="*", default=[300, 2000, 10000, 40000])
+    parser.add_argument("--error-rate", type=float, default=0.1,
+                        help="fraction of upstream calls answered with a 500 (each call is retried)")
+    args = parser.parse_args()
+
+    app = create_app(latency={"llama-3.3-70b-versatile": 0.05, "llama-3.1-8b-instant": 0.02},
+                     jitter=0.02, faults={"error_rate": args.error_rate})
+    with FakeProvider(app) as base_url:
+        os.environ["GROQ_BASE_URL"] = base_url
+        os.environ["MISTRAL_BASE_URL"] = base_url
+        os.environ.setdefault("CACHE_ENABLED", "0")
+        os.environ.setdefault("LLM_LOG_TOKENS", "0")
+        rows = asyncio.run(run(app, args.words))
+
+    print(f"{'words':>7}{'chunks':>8}{'failed':>8}{'calls':>7}{'70B in flight':>15}{'seconds':>9}{'peak heap':>11}")
+    for row in rows:
+        chunks = row["chunks"]
+        print(f"{row['words']:>7}{chunks['count']:>8}{chunks['failed']:>8}{row['calls']:>7}{row['in_flight']:>15}"
+              f"{row['seconds']:>9.2f}{row['peak'] / 1e6:>9.1f}MB")
+    last = rows[-1]["body"]
+    print(f"\nlargest text: ocean {last['ocean']}, mbti {last['mbti']['type']}, "
+          f"confidence level {last['confidence_level']}")
+    if "chunks" in last:
+        print(f"dispersion: {last['chunks']['dispersion']['ocean']}")
+
+
+if __name__ == "__main__":
+    main()
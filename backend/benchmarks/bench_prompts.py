@@ -0,0 +1,117 @@
+"""Prompt-prefix caching against the fake provider: static prefix first vs. user content first.
+
+    python -m backend.benchmarks.bench_prompts [--requests 50] [--prefill 0.2]
+
+The stub caches prompt prefixes in blocks, like the providers do. It charges
+``--prefill`` seconds for every 1000 prompt tokens outside the cached prefix. Each
+prompt is sent with a different user text per request, in three setups:
+
+- registry: the layout in ``prompts.py``, with the static prefix first and the
+  user content last;
+- interleaved: the old layout, with the instructions after the per-request
+  content, as the score_response prompt had them;
+- uncached: the registry layout against a stub without a prefix cache.
+
+For each prompt and setup this reports the share of prompt tokens served from the
+cache and the mean call latency. It also reports the cost of building the
+messages from the prebuilt prefixes.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from backend import prompts
+
+from .fake_provider import FakeProvider, create_app
+
+ANSWERS = ["I haven't enjoyed much lately, even things I used to love.", "Work is busy but I'm coping fine.",
+           "I sleep maybe four hours and wake up exhausted.", "Honestly pretty good this week!",
+           "Whatever, nothing really matters anyway.", "I keep to myself more than I used to."]
+
+CASES = {
+    "score_response": lambda i: dict(variant="full", question="How often have you felt down or hopeless?",
+                                     category="mood", response=f"{ANSWERS[i % len(ANSWERS)]} ({i})"),
+    "analyze.ocean": lambda i: dict(text=f"Entry {i}: {' '.join(ANSWERS[j % len(ANSWERS)] for j in range(i, i + 4))}"),
+    "analyze_depression": lambda i: dict(score=i % 30, level="Moderate", responses=" ".join(ANSWERS[i % 3:])),
+}
+
+
+def interleaved(prompt: prompts.Prompt, variant=None, **values) -> list:
+    """The pre-registry layout: a short system message, the examples, then user content before the instructions."""
+    system, *examples = prompt.prefixes[variant]
+    head, _, instructions = system["content"].partition("\n\n")
+    return [{"role": "system", "content": head}, *examples,
+            {"role": "user", "content": prompt.user.format(**values) + "\n\n" + instructions}]
+
+
+def layout_messages(layout: str, name: str, i: int) -> list:
+    values = CASES[name](i)
+    prompt = prompts.get(name)
+    if layout == "interleaved":
+        return interleaved(prompt, **values)
+    return prompt.messages(values.pop("variant", None), **values)
+
+
+async def run(app, layouts: list, requests: int) -> dict:
+    from backend.llm import gateway
+
+    results = {}
+    for layout in layouts:
+        for name in CASES:
+            app.state.prefixes.clear()
+            before = len(app.state.calls)
+            latencies = []
+            for i in range(requests):
+                started = time.perf_counter()
+                await gateway.chat("llama-3.3-70b-versatile", layout_messages(layout, name, i), max_tokens=300,
+                                   site=name, prompt=prompts.get(name).id)
+                latencies.append(time.perf_counter() - started)
+            calls = app.state.calls[before:]
+            cached = sum(c["cached_tokens"] for c in calls) / max(1, sum(c["prompt_tokens"] for c in calls))
+            results[(layout, name)] = (cached, statistics.mean(latencies), calls[-1]["prompt_tokens"])
+    await gateway.aclose()
+    return results
+
+
+def render_cost(repeat: int = 20000) -> dict:
+    costs = {}
+    for name, values in CASES.items():
+        values = values(0)
+        variant = values.pop("variant", None)
+        prompt = prompts.get(name)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            prompt.messages(variant, **values)
+        costs[name] = (time.perf_counter() - started) / repeat
+    return costs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--prefill", type=float, default=0.2, help="stub seconds per 1000 uncached prompt tokens")
+    args = parser.parse_args()
+
+    latency = {"llama-3.3-70b-versatile": 0.02}
+    results = {}
+    for prefix_cache, layouts in ((True, ["registry", "interleaved"]), (False, ["uncached"])):
+        app = create_app(latency=latency, prefix_cache=prefix_cache, prefill_per_1k=args.prefill)
+        with FakeProvider(app) as base_url:
+            os.environ["GROQ_BASE_URL"] = base_url
+            os.environ.setdefault("LLM_LOG_TOKENS", "0")
+            results.update(asyncio.run(run(app, layouts, args.requests)))
+
+    print(f"{'prompt':20}{'layout':13}{'prompt tokens':>14}{'cached':>8}{'mean ms':>9}")
+    for name in CASES:
+        for layout in ("registry", "interleaved", "uncached"):
+            cached, mean, tokens = results[(layout, name)]
+            print(f"{name:20}{layout:13}{tokens:>14}{cached:>8.0%}{mean * 1000:>9.1f}")
+    print("\nbuilding messages from the prebuilt prefix:")
+    for name, seconds in render_cost().items():
+        print(f"  {name:20}{seconds * 1e6:>6.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Priority scheduling under overload, against a rate-limited fake provider.
+
+    python -m backend.benchmarks.bench_scheduler [--duration 15] [--analyze-clients 16] [--rpm 240]
+                                                 [--deadlines interactive=10,analyze=6]
+
+The stub enforces ``--rpm`` requests per minute on the 70B model the way a
+provider does, answering 429 once its bucket is empty; the gateway's own bucket
+is set to the same limit. Three kinds of clients share the backend for
+``--duration`` seconds:
+
+- ``--analyze-clients`` closed-loop /analyze clients, enough to saturate the 70B limit;
+- two questionnaire clients posting /score-response answers with a short think time;
+- one client posting suicidal_ideation answers, the crisis class.
+
+A client that gets a 503 waits for its Retry-After before the next request. The
+load runs twice, with ``LLM_SCHEDULER=fifo`` (arrival order, no deadlines, as
+before the scheduler) and with priority scheduling. Each run reports latency and
+503s per class, the stub's 429s and what the scheduler shed.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import statistics
+import time
+
+import httpx
+
+from .fake_provider import FakeProvider, create_app
+
+MODEL = "llama-3.3-70b-versatile"
+TEXT = ("Entry {n}: I love spending quiet evenings reading about new ideas, but I also enjoy "
+        "planning trips with close friends and trying things I have never done before.")
+ANSWERS = ["Most days, honestly.", "Not really, I'm fine.", "I sleep badly and wake up tired.",
+           "Sometimes, when work piles up."]
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else float("nan")
+
+
+async def client_loop(client, name: str, request, think: float, until: float, results: dict):
+    counter = itertools.count()
+    while time.monotonic() < until:
+        path, body = request(next(counter))
+        started = time.perf_counter()
+        response = await client.post(path, json=body)
+        entry = results.setdefault(name, {"ok": [], "rejected": 0, "errors": 0, "retry_after": []})
+        if response.status_code == 503:
+            entry["rejected"] += 1
+            retry_after = float(response.headers.get("retry-after", 1))
+            entry["retry_after"].append(retry_after)
+            await asyncio.sleep(min(retry_after, max(until - time.monotonic(), 0)))
+            continue
+        if response.status_code != 200:
+            entry["errors"] += 1
+        else:
+            entry["ok"].append(time.perf_counter() - started)
+        await asyncio.sleep(think)
+
+
+async def scenario(duration: float, analyze_clients: int) -> tuple:
+    from backend.main import app
+    from backend.llm import gateway
+
+    def analyze(n):
+        return "/api/analyze", {"text": TEXT.format(n=n)}
+
+    def answer(category):
+        def request(n):
+            return "/api/score-response", {"question": "How often have you felt down?", "category": category,
+                                           "response": f"{ANSWERS[n % len(ANSWERS)]} ({category} {n})"}
+        return request
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=300) as client:
+        until = time.monotonic() + duration
+        clients = [client_loop(client, "analyze", analyze, 0.0, until, results) for _ in range(analyze_clients)]
+        clients += [client_loop(client, "interactive", answer("mood"), 0.5, until, results) for _ in range(2)]
+        clients.append(client_loop(client, "crisis", answer("suicidal_ideation"), 1.0, until, results))
+        await asyncio.gather(*clients)
+    shed = {model: queue.stats()["shed"] for model, queue in gateway._queues.items()}
+    gateway._buckets.clear()
+    await gateway.aclose()
+    return results, shed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--analyze-clients", type=int, default=16)
+    parser.add_argument("--rpm", type=int, default=240, help="70B requests per minute, at the stub and the gateway")
+    parser.add_argument("--deadlines", default="interactive=10,analyze=6", help="LLM_DEADLINES for the priority run")
+    args = parser.parse_args()
+
+    os.environ.setdefault("CACHE_ENABLED", "0")
+    os.environ.setdefault("LLM_LOG_TOKENS", "0")
+    os.environ["LLM_RATE_LIMITS"] = f"{MODEL}={args.rpm}"
+    os.environ["LLM_DEADLINES"] = args.deadlines
+    runs = {}
+    for mode in ("fifo", "priority"):
+        app = create_app(latency={MODEL: 0.25, "llama-3.1-8b-instant": 0.1}, rate_limits={MODEL: args.rpm})
+        with FakeProvider(app) as base_url:
+            os.environ["GROQ_BASE_URL"] = base_url
+            os.environ["MISTRAL_BASE_URL"] = base_url
+            os.environ["LLM_SCHEDULER"] = mode
+            results, shed = asyncio.run(scenario(args.duration, args.analyze_clients))
+            runs[mode] = (results, shed, app.state.rate_limited)
+
+    print(f"{args.analyze_clients} /analyze clients, 2 questionnaire clients, 1 crisis client; "
+          f"{MODEL} limited to {args.rpm} rpm\n")
+    print(f"{'mode':10}{'class':13}{'ok':>6}{'503':>6}{'errors':>8}{'p50 s':>8}{'p95 s':>8}{'retry-after':>13}")
+    for mode, (results, shed, rate_limited) in runs.items():
+        for name in ("crisis", "interactive", "analyze"):
+            entry = results.get(name, {"ok": [], "rejected": 0, "errors": 0, "retry_after": []})
+            ok = entry["ok"]
+            retry = f"{statistics.mean(entry['retry_after']):.1f}s" if entry["retry_after"] else "-"
+            print(f"{mode:10}{name:13}{len(ok):>6}{entry['rejected']:>6}{entry['errors']:>8}"
+                  f"{statistics.median(ok) if ok else float('nan'):>8.2f}{percentile(ok, 0.95):>8.2f}{retry:>13}")
+        shed_total = {reason: sum(s[reason] for s in shed.values()) for reason in ("deadline", "full", "expired")}
+        print(f"{'':10}stub 429s: {rate_limited}, shed by the scheduler: "
+              + ", ".join(f"{reason} {count}" for reason, count in shed_total.items()) + "\n")
+
+
+if __name__ == "__main__":
+    main()
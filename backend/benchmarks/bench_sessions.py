@@ -0,0 +1,148 @@
+"""Time from the last answer to the questionnaire result, against the fake provider.
+
+    python -m backend.benchmarks.bench_sessions [--users 20] [--think 1.0] [--closing 3.0] [--summary-latency 2.5]
+
+Each simulated user answers the ten questions of chatbot.js, ``--think`` seconds
+apart, then waits ``--closing`` seconds (the chat's closing messages) and asks
+for the result. Users lean towards one severity, so their totals cover every
+band. The stub takes 0.3s to score an answer and ``--summary-latency`` seconds to
+write the summary, which is much longer than a score.
+
+Three flows are timed from the moment the result is asked for:
+
+- batch at end: the old chat; only the crisis answer is scored on the way, then
+  /score-responses scores the rest and writes the summary;
+- session: every answer is scored in a session as it is given, and the summary is
+  written at finish (``SESSION_SPECULATE=0``);
+- session + speculation: the summary starts once every answer is in and the band
+  can no longer change.
+
+Each run reports the wait's p50 and p95, the summaries generated upstream and,
+for the sessions, where the summary stood at finish.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+import httpx
+
+from .fake_provider import FakeProvider, answer_score, create_app
+
+QUESTIONS = [("How have you been feeling lately?", "mood"),
+             ("Do you still enjoy the things you used to?", "anhedonia"),
+             ("How have you been sleeping?", "sleep"),
+             ("How is your energy?", "energy"),
+             ("How is your appetite?", "appetite"),
+             ("How do you feel about yourself?", "self_worth"),
+             ("Can you focus on things?", "concentration"),
+             ("Have you felt slowed down or restless?", "psychomotor"),
+             ("How do you feel about the future?", "hopelessness"),
+             ("Have you had thoughts of hurting yourself?", "suicidal_ideation")]
+ANSWERS = [["not really", "never", "I'm fine", "not at all"],
+           ["sometimes", "a bit", "occasionally", "a little I guess"],
+           ["most days", "often", "a lot lately", "usually yes"],
+           ["every day", "all the time", "constantly", "always"]]
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else float("nan")
+
+
+def user_answers(rng: random.Random) -> list:
+    lean = rng.randrange(4)
+    return [rng.choice(ANSWERS[min(max(lean + rng.choice((-1, 0, 0, 1)), 0), 3)]) for _ in QUESTIONS]
+
+
+def item(i: int, text: str) -> dict:
+    question, category = QUESTIONS[i]
+    return {"question": question, "category": category, "response": text}
+
+
+async def user(client, flow: str, answers: list, think: float, closing: float, waits: list):
+    session_id = None
+    if flow != "batch":
+        session_id = (await client.post("/api/sessions", json={"questions": len(QUESTIONS)})).json()["session_id"]
+    scoring = []
+    for i, text in enumerate(answers):
+        await asyncio.sleep(think)
+        body = item(i, text)
+        if session_id is not None:
+            body.update(session_id=session_id, index=i)
+            scoring.append(asyncio.ensure_future(client.post("/api/score-response", json=body)))
+        if QUESTIONS[i][1] == "suicidal_ideation":
+            # The chat waits for the crisis answer's score before going on.
+            await (scoring[-1] if scoring else client.post("/api/score-response", json=body))
+    await asyncio.sleep(closing)
+
+    started = time.perf_counter()
+    if session_id is not None:
+        await asyncio.gather(*scoring)
+        response = await client.post(f"/api/sessions/{session_id}/finish")
+    else:
+        response = await client.post("/api/score-responses", json={
+            "items": [item(i, text) for i, text in enumerate(answers)], "include_summary": True})
+    waits.append(time.perf_counter() - started)
+    result = response.json()
+    assert result["total_score"] == sum(answer_score(text) for text in answers), result
+
+
+async def run(flow: str, users: list, think: float, closing: float, app) -> dict:
+    from backend.main import app as api, session_store
+    from backend.llm import gateway
+
+    session_store.speculate = flow == "speculation"
+    before = len(app.state.calls)
+    counters = dict(session_store.counters)
+    waits = []
+    transport = httpx.ASGITransport(app=api)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+        await asyncio.gather(*(user(client, flow, answers, think * random.uniform(0.5, 1.5), closing, waits)
+                               for answers in users))
+    await gateway.aclose()
+    summaries = sum(1 for call in app.state.calls[before:] if call["site"] == "analyze_depression")
+    outcomes = {key: session_store.counters[key] - counters[key]
+                for key in ("speculation_ready", "speculation_in_flight", "summarized_at_finish", "discarded")}
+    return {"waits": waits, "summaries": summaries, "outcomes": outcomes}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds between answers")
+    parser.add_argument("--closing", type=float, default=3.0, help="seconds of closing messages before the result")
+    parser.add_argument("--summary-latency", type=float, default=2.5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    os.environ.update(CACHE_ENABLED="0", ANSWER_INDEX="0", LLM_LOG_TOKENS="0")
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    users = [user_answers(rng) for _ in range(args.users)]
+    app = create_app(latency={"llama-3.3-70b-versatile": 0.3, "analyze_depression": args.summary_latency})
+    results = {}
+    with FakeProvider(app) as base_url:
+        os.environ["GROQ_BASE_URL"] = base_url
+        os.environ["MISTRAL_BASE_URL"] = base_url
+        for flow, name in (("batch", "batch at end"), ("session", "session"),
+                           ("speculation", "session + speculation")):
+            results[name] = asyncio.run(run(flow, users, args.think, args.closing, app))
+
+    totals = [sum(answer_score(text) for text in answers) for answers in users]
+    print(f"{args.users} users, totals {min(totals)}-{max(totals)}, {args.closing:.1f}s closing messages, "
+          f"summary takes {args.summary_latency:.1f}s\n")
+    print(f"{'':24}{'p50 s':>8}{'p95 s':>8}{'summaries':>11}  at finish")
+    for name, result in results.items():
+        outcomes = result["outcomes"]
+        at_finish = "-" if name == "batch at end" else (
+            f"ready {outcomes['speculation_ready']}, in flight {outcomes['speculation_in_flight']}, "
+            f"started {outcomes['summarized_at_finish']}, discarded {outcomes['discarded']}")
+        print(f"{name:24}{statistics.median(result['waits']):>8.2f}{percentile(result['waits'], 0.95):>8.2f}"
+              f"{result['summaries']:>11}  {at_finish}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Upstream request rate of several worker processes under one quota, with and without shared state.
+
+    python -m backend.benchmarks.bench_shared_state [--workers 1,2,4,8] [--rpm 600] [--duration 12] [--clients 8]
+
+The stub enforces ``--rpm`` on the 70B model the way a provider does (a bucket
+holding ten seconds' worth, then 429 with Retry-After), and every worker has the
+same quota in ``LLM_RATE_LIMITS``. Each worker is a separate process running the
+app with ``--clients`` closed-loop clients. The clients post distinct answers to
+/score-response, so every request is an upstream call and the workers ask for far
+more than the quota. Each worker count runs twice:
+
+- per-worker: every worker spends the whole quota itself; the excess comes back
+  as 429s, and each worker holds off only after its own;
+- shared: ``SHARED_STATE`` points every worker at the stand-in Redis server
+  (``resp_server.py``), so they draw on one set of buckets.
+
+Each run reports the requests the stub received per second (attempts, including
+those refused with 429) and accepted per second. Both rates are measured over the
+second half of the run, once the initial burst is spent, and are set against the
+quota. The run also counts the 429s and the client responses: scored, failed
+(the fallback score after the retries ran out or the model's breaker opened) and
+shed with 503. For the shared runs it gives the coordination cost per upstream
+call. ``rtt`` is the median time of a reservation (both buckets, one round trip)
+made by one worker once the load is over. ``in load`` is the mean as the requests
+saw it, which adds the wait for their worker's event loop and, with fewer cores
+than processes, for a core. The stand-in server runs in a process of its own.
+
+Last, every worker posts the same ``--repeats`` answers at the same moment with
+the result cache on. Per-worker caches each pay for every answer; with the shared
+cache and its single-flight locks, each answer is scored once.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+from .fake_provider import FakeProvider, create_app
+from .resp_server import RespServer
+
+MODEL = "llama-3.3-70b-versatile"
+QUESTION = {"question": "How have you been feeling lately?", "category": "mood"}
+ANSWERS = ["not really", "sometimes", "most days", "every day"]
+
+
+def outcome(reply: httpx.Response) -> str:
+    if reply.status_code == 503:
+        return "shed"
+    if reply.status_code != 200 or reply.json().get("reasoning") == "Error in scoring":
+        # The score a failed call falls back to, after its retries (or with the model's breaker open).
+        return "failed"
+    return "scored"
+
+
+async def drive(index: int, start_at: float, duration: float, clients: int, repeats: int) -> dict:
+    from backend.main import app
+    from backend.llm import gateway
+    from backend.shared import shared_state
+
+    statuses = Counter()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+        # The first request imports what the routes need and opens the connections; keep that out of the timings.
+        await client.post("/api/score-response", json=dict(QUESTION, response=f"warming up worker {index}"))
+        ops, seconds = (shared_state.counters["ops"], shared_state.seconds) if shared_state is not None else (0, 0.0)
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+        if repeats:
+            replies = await asyncio.gather(*(client.post("/api/score-response", json=dict(
+                QUESTION, response=f"{ANSWERS[i % len(ANSWERS)]}, answer {i}")) for i in range(repeats)))
+            statuses.update(outcome(reply) for reply in replies)
+        else:
+            async def loop(number: int):
+                sent = 0
+                while time.time() < start_at + duration:
+                    reply = await client.post("/api/score-response", json=dict(
+                        QUESTION, response=f"{ANSWERS[sent % len(ANSWERS)]}, worker {index} client {number} #{sent}"))
+                    statuses[outcome(reply)] += 1
+                    sent += 1
+                    if reply.status_code == 503:
+                        # Shed by the scheduler: back off as the Retry-After says, like the chat does.
+                        pause = float(reply.headers.get("retry-after", "1"))
+                        await asyncio.sleep(max(0.0, min(pause, start_at + duration - time.time())))
+
+            await asyncio.gather(*(loop(number) for number in range(clients)))
+    await gateway.aclose()
+    stats = None
+    if shared_state is not None:
+        stats = dict(shared_state.stats(), ops=shared_state.counters["ops"] - ops,
+                     seconds=shared_state.seconds - seconds, round_trips=[])
+        if index == 0:
+            # Once the other workers are done, so that the cores are free.
+            await asyncio.sleep(1.0)
+            stats["round_trips"] = await round_trips(shared_state)
+        await shared_state.close()
+    return {"statuses": statuses, "shared": stats}
+
+
+async def round_trips(state, count: int = 300) -> list:
+    """Times of a reservation (request and token bucket) with nothing else running."""
+    times = []
+    for _ in range(count):
+        started = time.perf_counter()
+        await state.take([("probe/requests", 1000.0, 1e6, 1, None), ("probe/tokens", 1e5, 1e8, 300, None)])
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def worker(index: int, start_at: float, duration: float, clients: int, repeats: int, results):
+    # Thousands of scoring errors and 429 retries otherwise bury the table.
+    sys.stdout = open(os.devnull, "w")
+    results.put(asyncio.run(drive(index, start_at, duration, clients, repeats)))
+
+
+def run(workers: int, shared_url: str, args, run_id: str, repeats: int = 0) -> dict:
+    app = create_app(latency={MODEL: args.latency}, rate_limits={MODEL: args.rpm})
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    with FakeProvider(app) as base_url:
+        # Spawned workers read their configuration from the environment they inherit.
+        os.environ.update(GROQ_BASE_URL=base_url, MISTRAL_BASE_URL=base_url, LLM_RATE_LIMITS=f"{MODEL}={args.rpm}",
+                          CACHE_ENABLED="1" if repeats else "0", ANSWER_INDEX="0", LLM_LOG_TOKENS="0",
+                          SHARED_STATE=shared_url, SHARED_STATE_PREFIX=f"{run_id}:")
+        # Workers import the app first (a second or two), then all start at the same moment.
+        start_at = time.time() + 3 + 0.5 * workers
+        processes = [context.Process(target=worker, args=(i, start_at, args.duration, args.clients, repeats, results))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        # The stub stamps calls with perf_counter; workers agree on wall-clock time.
+        origin = start_at - time.time() + time.perf_counter()
+
+    window = (origin + args.duration / 2, origin + args.duration)
+    accepted = [call["start"] for call in app.state.calls if call.get("site") == "score_response"]
+
+    def in_window(stamps: list) -> int:
+        return sum(1 for stamp in stamps if window[0] <= stamp < window[1])
+
+    seconds = window[1] - window[0]
+    statuses = sum((outcome["statuses"] for outcome in outcomes), Counter())
+    shared = [outcome["shared"] for outcome in outcomes if outcome["shared"]]
+    ops = sum(stats["ops"] for stats in shared)
+    mean_ms = sum(stats["seconds"] for stats in shared) / ops * 1000 if ops else None
+    probes = sorted(time for stats in shared for time in stats["round_trips"])
+    return {
+        "attempts": (in_window(accepted) + in_window(app.state.refused)) / seconds,
+        "accepted": in_window(accepted) / seconds,
+        "upstream": sum(1 for stamp in accepted if stamp >= origin),
+        "refused": app.state.rate_limited,
+        "statuses": statuses,
+        "mean_ms": mean_ms,
+        "round_trip_ms": probes[len(probes) // 2] * 1000 if probes else None,
+        "errors": sum(stats["errors"] for stats in shared),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4,8", help="worker counts to run")
+    parser.add_argument("--rpm", type=int, default=600, help="requests per minute for the model, stub and workers")
+    parser.add_argument("--duration", type=float, default=12.0, help="seconds of load per run")
+    parser.add_argument("--clients", type=int, default=8, help="closed-loop clients per worker")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub seconds per call")
+    parser.add_argument("--repeats", type=int, default=40, help="answers every worker posts in the cache run")
+    args = parser.parse_args()
+    counts = [int(count) for count in args.workers.split(",")]
+    quota = args.rpm / 60
+
+    with RespServer(process=True) as url:
+        print(f"quota {quota:.1f} requests/s, {args.clients} clients per worker, {args.duration:.0f}s per run; "
+              f"rates over the last {args.duration / 2:.0f}s; CPU cores: {os.cpu_count()}\n")
+        print(f"{'workers':>7}  {'state':10}{'attempts/s':>11}{'accepted/s':>11}{'429s':>7}{'scored':>8}"
+              f"{'failed':>8}{'shed':>6}{'rtt ms':>8}{'in load ms':>12}")
+        for workers in counts:
+            for mode, shared_url in (("per-worker", ""), ("shared", url)):
+                result = run(workers, shared_url, args, f"{mode}-{workers}")
+                statuses = result["statuses"]
+                rtt = f"{result['round_trip_ms']:.3f}" if result["round_trip_ms"] is not None else "-"
+                in_load = f"{result['mean_ms']:.2f}" if result["mean_ms"] is not None else "-"
+                print(f"{workers:>7}  {mode:10}{result['attempts']:>11.1f}{result['accepted']:>11.1f}"
+                      f"{result['refused']:>7}{statuses['scored']:>8}{statuses['failed']:>8}{statuses['shed']:>6}"
+                      f"{rtt:>8}{in_load:>12}"
+                      + (f"  ({result['errors']} store errors)" if result["errors"] else ""))
+
+        workers = max(counts)
+        print(f"\n{workers} workers each posting the same {args.repeats} answers at once, result cache on:")
+        for mode, shared_url in (("per-worker", ""), ("shared", url)):
+            result = run(workers, shared_url, args, f"repeat-{mode}", repeats=args.repeats)
+            print(f"  {mode:10} {result['upstream']:>4} upstream calls, {result['statuses']['scored']} of "
+                  f"{workers * args.repeats} answers scored")
+
+
+if __name__ == "__main__":
+    main()
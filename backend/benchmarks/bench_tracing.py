@@ -0,0 +1,95 @@
+"""Tracing overhead and a sample latency breakdown, against the fake provider.
+
+    python -m backend.benchmarks.bench_tracing [--requests 200]
+
+Runs the same /analyze load with spans on and off against a near-instant stub,
+so the difference is the tracing cost itself. Then prints the slowest request's
+trace: total time per span name, and each LLM call with its model, tokens,
+queueing and retries. Last comes the /metrics line count. A scrape renders every
+histogram, so its cost grows with the label sets, not with traffic.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+
+from .fake_provider import FakeProvider, create_app
+
+TEXTS = [f"Sample {i}: I love spending quiet evenings reading about new ideas, but I also enjoy trips with friends."
+         for i in range(1000)]
+
+
+async def load(client, requests: int, concurrency: int) -> list:
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with limit:
+            started = time.perf_counter()
+            response = await client.post("/api/analyze", json={"text": TEXTS[i % len(TEXTS)]})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies
+
+
+async def run(requests: int, concurrency: int):
+    from backend import telemetry
+    from backend.main import app
+    from backend.llm import gateway
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+        await load(client, 20, concurrency)  # warm up the connection pool
+        results = {}
+        for enabled in (False, True, False, True):
+            telemetry.tracer.enabled = enabled
+            started = time.perf_counter()
+            latencies = await load(client, requests, concurrency)
+            results.setdefault(enabled, []).append((time.perf_counter() - started, statistics.median(latencies)))
+        traces = (await client.get("/api/traces", params={"limit": 100, "name": "/api/analyze"})).json()
+        started = time.perf_counter()
+        scrape = (await client.get("/metrics")).text
+        scrape_seconds = time.perf_counter() - started
+    await gateway.aclose()
+    return results, traces, scrape, scrape_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app(latency={"llama-3.3-70b-versatile": 0.001, "llama-3.1-8b-instant": 0.001})
+    with FakeProvider(app) as base_url:
+        os.environ["GROQ_BASE_URL"] = base_url
+        os.environ["MISTRAL_BASE_URL"] = base_url
+        os.environ.setdefault("CACHE_ENABLED", "0")
+        os.environ.setdefault("LLM_LOG_TOKENS", "0")
+        results, traces, scrape, scrape_seconds = asyncio.run(run(args.requests, args.concurrency))
+
+    for enabled, label in ((False, "tracing off"), (True, "tracing on ")):
+        runs = results[enabled]
+        print(f"{label}: {statistics.mean(r[0] for r in runs):.2f}s for {args.requests} requests, "
+              f"median {statistics.mean(r[1] for r in runs) * 1000:.1f}ms per request")
+
+    slowest = max(traces, key=lambda trace: trace["duration"])
+    print(f"\nslowest traced /analyze: {slowest['duration'] * 1000:.0f}ms; time per span name:")
+    for name, seconds in slowest["breakdown"].items():
+        print(f"  {name:10}{seconds * 1000:>8.0f}ms")
+    for child in slowest["root"].get("children", []):
+        attributes = child.get("attributes", {})
+        if child["name"] == "llm.chat":
+            print(f"  +{child['start'] * 1000:>5.0f}ms {child['duration'] * 1000:>5.0f}ms {attributes.get('site', ''):18}"
+                  f"{attributes.get('prompt_tokens')}+{attributes.get('completion_tokens')} tokens, "
+                  f"queued {attributes.get('queued', 0) * 1000:.1f}ms, retries {attributes.get('retries', 0)}")
+    print(f"\n/metrics: {len(scrape.splitlines())} lines rendered in {scrape_seconds * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Fit the local lexical scorer's mapping against recorded LLM lexical scores.
+
+    python -m backend.benchmarks.calibrate_lexical [--records labels.jsonl ...] [--write]
+    python -m backend.benchmarks.calibrate_lexical --record corpus.txt --records labels.jsonl   # needs GROQ_API_KEY
+
+Training pairs come from the fused-vs-split fixtures (the split lexical responses)
+and from JSONL files with one ``{"text": ..., "lexical": {...}}`` object per line.
+``--record`` runs the LLM ``analyze_lexical`` over a corpus (one text per line) and
+appends its scores to the first ``--records`` file.
+
+Each trait gets a ridge regression over all local features. The report compares
+the built-in and fitted mappings against the LLM scores (mean absolute error,
+exact and within-one agreement, cross-validated when there are enough samples)
+and times the local scorer. ``--write`` saves the fitted mapping where
+``backend.lexical`` loads it from.
+
+Requires numpy (``pip install numpy``); the backend itself does not.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+from backend import lexical
+from backend.jsonparse import find_last_json
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "fused_vs_split.json")
+DEFAULT_OUT = os.path.join(os.path.dirname(lexical.__file__), "lexical_calibration.json")
+# Counts are only used for confidence; the mapping works on rates and averages.
+EXCLUDED = {"word_count", "sentence_count"}
+
+
+def load_pairs(fixtures: str, records: list) -> list:
+    pairs = []
+    if fixtures and os.path.exists(fixtures):
+        with open(fixtures) as f:
+            for entry in json.load(f)["corpus"]:
+                recorded = (entry.get("split") or {}).get("lexical")
+                found = find_last_json(recorded["content"]) if recorded else None
+                if found:
+                    pairs.append((entry["text"], json.loads(found)))
+    for path in records:
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            pairs.extend((row["text"], row["lexical"]) for row in map(json.loads, filter(str.strip, f)))
+    return pairs
+
+
+async def record(corpus: str, out: str):
+    from backend import main
+
+    with open(corpus) as f:
+        texts = [line.strip() for line in f if line.strip()]
+    with open(out, "a") as f:
+        for text in texts:
+            analysis = await main.analyze_lexical(text)
+            f.write(json.dumps({"text": text, "lexical": analysis.scores}) + "\n")
+    await main.gateway.aclose()
+    print(f"Recorded {len(texts)} LLM lexical scores to {out}")
+
+
+def fit_trait(x: np.ndarray, y: np.ndarray, alpha: float):
+    """Ridge on standardized features, returned as (intercept, raw-feature weights)."""
+    mean, std = x.mean(axis=0), x.std(axis=0)
+    std[std == 0] = 1.0
+    z = (x - mean) / std
+    coef = np.linalg.solve(z.T @ z + alpha * np.eye(z.shape[1]), z.T @ (y - y.mean()))
+    weights = coef / std
+    return float(y.mean() - weights @ mean), weights
+
+
+def fit(features: list, labels: list, names: list, alpha: float) -> dict:
+    x = np.array([[f[name] for name in names] for f in features])
+    mapping = {}
+    for trait in lexical.TRAITS:
+        intercept, weights = fit_trait(x, np.array([label[trait] for label in labels], dtype=float), alpha)
+        mapping[trait] = {"intercept": round(intercept, 4),
+                          "weights": {name: round(float(w), 4) for name, w in zip(names, weights)}}
+    return mapping
+
+
+def evaluate(features: list, labels: list, mappings: list) -> dict:
+    """``mappings[i]`` scores ``features[i]``, so cross-validated folds can pass per-sample mappings."""
+    report = {}
+    for trait in lexical.TRAITS:
+        predicted = np.array([lexical.score("", f, m)[trait] for f, m in zip(features, mappings)])
+        actual = np.array([label[trait] for label in labels])
+        diff = np.abs(predicted - actual)
+        report[trait] = {"mae": round(float(diff.mean()), 3), "exact": round(float((diff == 0).mean()), 3),
+                         "within_1": round(float((diff <= 1).mean()), 3)}
+    return report
+
+
+def cross_validate(features: list, labels: list, names: list, alpha: float, folds: int = 5) -> dict:
+    order = np.random.default_rng(0).permutation(len(features))
+    mappings = [None] * len(features)
+    for fold in range(folds):
+        held_out = set(order[fold::folds].tolist())
+        train = [i for i in range(len(features)) if i not in held_out]
+        mapping = fit([features[i] for i in train], [labels[i] for i in train], names, alpha)
+        for i in held_out:
+            mappings[i] = mapping
+    return evaluate(features, labels, mappings)
+
+
+def print_report(title: str, report: dict):
+    print(f"\n{title}")
+    print(f"  {'trait':22}{'mae':>8}{'exact':>8}{'within 1':>10}")
+    for trait, row in report.items():
+        print(f"  {trait:22}{row['mae']:>8.2f}{row['exact']:>8.2f}{row['within_1']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", default=FIXTURES, help="fused_vs_split fixture file ('' to skip)")
+    parser.add_argument("--records", nargs="*", default=[], help="JSONL files of {text, lexical} pairs")
+    parser.add_argument("--record", metavar="CORPUS", help="label a corpus with the LLM into the first --records file")
+    parser.add_argument("--alpha", type=float, default=1.0, help="ridge regularization strength")
+    parser.add_argument("--write", action="store_true", help="save the fitted mapping")
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    args = parser.parse_args()
+
+    if args.record:
+        if not args.records:
+            parser.error("--record needs a --records file to append to")
+        asyncio.run(record(args.record, args.records[0]))
+
+    pairs = load_pairs(args.fixtures, args.records)
+    if len(pairs) < 2:
+        parser.error("need at least two recorded samples to calibrate")
+    texts, labels = [text for text, _ in pairs], [label for _, label in pairs]
+
+    started = time.perf_counter()
+    features = [lexical.extract_features(text) for text in texts]
+    for text, f in zip(texts, features):
+        lexical.score(text, f)
+    per_text = (time.perf_counter() - started) / len(texts)
+    names = sorted(set(features[0]) - EXCLUDED)
+
+    print(f"{len(pairs)} samples, local scorer {per_text * 1e6:.0f} µs per text "
+          f"(avg {np.mean([f['word_count'] for f in features]):.0f} words)")
+    print_report("built-in mapping vs. LLM", evaluate(features, labels, [lexical.DEFAULT_MAPPING] * len(features)))
+    mapping = fit(features, labels, names, args.alpha)
+    print_report("fitted mapping vs. LLM (in-sample)", evaluate(features, labels, [mapping] * len(features)))
+    if len(pairs) >= 10:
+        print_report("fitted mapping vs. LLM (5-fold cross-validated)",
+                     cross_validate(features, labels, names, args.alpha))
+    else:
+        print("\n(fewer than 10 samples: in-sample fit only, record more with --record before trusting it)")
+
+    if args.write:
+        with open(args.out, "w") as f:
+            json.dump({"samples": len(pairs), "alpha": args.alpha, "mapping": mapping}, f, indent=2)
+        print(f"\nWrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+"""Local stand-in for the Groq/Mistral chat-completion APIs.
+
+Serves OpenAI-shaped ``/v1/chat/completions`` responses with content the backend
+parsers accept, after a configurable per-model delay, and the ``/v1/files`` +
+``/v1/batches`` batch API. Used by the benchmarks so they can run without API
+keys or network access.
+
+Content is canned unless fixtures are given. Fixtures are recordings of real
+calls: JSONL written by the gateway with ``LLM_RECORD=path``, or the
+fused_vs_split fixture file. A request whose model and messages were recorded
+gets that exact response back. Any other request gets a recorded response from
+the same call site, told apart by its prompt, so the parsers see real model
+output either way.
+
+Delays follow a distribution:
+
+- ``fixed``: the per-model latency plus uniform jitter;
+- ``lognormal``: median at the per-model latency, p95 at ``tail`` times that;
+- ``recorded``: the recorded latency of the replayed response, or of a random
+  recording from the same call site.
+
+With ``prefix_cache`` on, the stub behaves like a provider that caches prompt
+prefixes. It remembers every prompt it has seen in blocks of ``PREFIX_BLOCK``
+characters. For each request it reports how much of the prompt matched earlier
+ones, as ``usage.prompt_tokens_details.cached_tokens``. It charges
+``prefill_per_1k`` seconds only for every 1000 prompt tokens that were not
+cached.
+
+Run it standalone for load tests against a separately started backend:
+
+    python -m backend.benchmarks.fake_provider --port 8001 [--fixtures calls.jsonl] [--distribution recorded]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+DEFAULT_LATENCY = {
+    "llama-3.3-70b-versatile": 0.30,
+    "llama-3.1-8b-instant": 0.10,
+    "pixtral-12b-2409": 0.40,
+}
+
+# Prefix cache granularity in characters (about 64 tokens), like the block size of provider prompt caches.
+PREFIX_BLOCK = 256
+
+
+def prompt_text(messages: list) -> str:
+    """The text of every message, so markers are found in the static prefix as well as the user message."""
+    return "\n".join(m["content"] for m in messages if isinstance(m["content"], str))
+
+
+def prompt_site(messages: list) -> str:
+    """The gateway call site (``site=``) a request came from, recognised from its prompt."""
+    if isinstance(messages[-1]["content"], list):
+        return "analyze_whatsapp.extract"
+    system = messages[0]["content"] if messages[0]["role"] == "system" else ""
+    if "writing assistant" in system:
+        return "refine"
+    if "repair malformed JSON" in system:
+        return "reask"
+    prompt = prompt_text(messages)
+    for marker, site in (("then label the personality", "analyze.fused"),
+                         ("OCEAN personality traits", "analyze.ocean"),
+                         ("MBTI dimensions", "analyze.mbti"),
+                         ("lexical features", "analyze.lexical"),
+                         ("personality type label", "analyze.classify"),
+                         ("communication style based on their WhatsApp", "analyze_whatsapp.semantic"),
+                         ("WhatsApp messages", "analyze_whatsapp.behavior"),
+                         ("=== RESPONSES ===", "score_responses.packed"),
+                         ("User Response:", "score_response"),
+                         ("depression assessment", "analyze_depression")):
+        if marker in prompt:
+            return site
+    return "unknown"
+
+
+# fused_vs_split fixture keys -> call sites.
+_SPLIT_SITES = {"ocean": "analyze.ocean", "mbti": "analyze.mbti", "lexical": "analyze.lexical",
+                "refine_ocean": "refine", "refine_mbti": "refine", "refine_lexical": "refine",
+                "classify": "analyze.classify"}
+
+
+class Fixtures:
+    """Recorded responses, looked up by request key and otherwise by call site."""
+
+    def __init__(self, entries: list = ()):
+        self.exact = {}
+        self.by_site = defaultdict(list)
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry: dict):
+        if entry.get("key"):
+            self.exact[entry["key"]] = entry
+        self.by_site[entry["site"]].append(entry)
+
+    @classmethod
+    def load(cls, *paths: str) -> "Fixtures":
+        fixtures = cls()
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                if path.endswith(".jsonl"):
+                    for line in filter(str.strip, f):
+                        fixtures.add(json.loads(line))
+                    continue
+                for item in json.load(f)["corpus"]:
+                    for kind, recorded in item["split"].items():
+                        fixtures.add(dict(recorded, site=_SPLIT_SITES[kind]))
+                    if item.get("fused"):
+                        fixtures.add(dict(item["fused"], site="analyze.fused"))
+        return fixtures
+
+    def pick(self, key: str, site: str, rng: random.Random) -> Optional[dict]:
+        entry = self.exact.get(key)
+        if entry is None and self.by_site.get(site):
+            entry = rng.choice(self.by_site[site])
+        return entry
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.by_site.values())
+
+
+# Keywords that set the canned score of a questionnaire answer, highest first; anything else scores 0.
+ANSWER_LEVELS = ((3, ("every day", "all the time", "constantly", "always", "can't")),
+                 (2, ("most days", "often", "a lot", "usually")),
+                 (1, ("sometimes", "kinda", "kind of", "a bit", "a little", "occasionally")))
+
+
+def answer_score(answer: str) -> int:
+    """A deterministic stand-in for the model's 0-3 score, so similar answers can get different scores."""
+    answer = answer.lower()
+    for score, words in ANSWER_LEVELS:
+        if any(word in answer for word in words):
+            return score
+    return 0
+
+
+def canned_reply(messages: list) -> str:
+    prompt = messages[-1]["content"]
+    if isinstance(prompt, list):
+        return json.dumps({"messages": [{"side": "user", "text": "hey, how are you?"},
+                                        {"side": "other", "text": "great thanks"},
+                                        {"side": "other", "text": "see you at 6"},
+                                        {"side": "user", "text": "sounds good"}]})
+    system = messages[0]["content"] if messages[0]["role"] == "system" else ""
+    quoted = re.search(r'Text: "(.*?)"\n', prompt, re.DOTALL)
+    subject = f'Reasoning about "{quoted.group(1)[:60]}". ' if quoted else ""
+    if "writing assistant" in system:
+        return prompt.split("\n\n", 1)[-1]
+    text = prompt_text(messages)
+    if "then label the personality" in text:
+        return json.dumps({
+            "reasoning": {"ocean": subject + "Curious and open to new experiences.",
+                          "mbti": subject + "Reflective, prefers ideas to details.",
+                          "lexical": subject + "Casual tone with moderate emotional colour."},
+            "ocean": {"openness": 4, "conscientiousness": 3, "extraversion": 2, "agreeableness": 4,
+                      "neuroticism": 2, "confidence": 0.8},
+            "mbti": {"ei": 3, "sn": 2, "tf": 1, "jp": -1, "type": "INFJ", "confidence": 0.7},
+            "lexical": {"formality": 2, "emotional_intensity": 3, "complexity": 3, "certainty": 3,
+                        "social_orientation": 4, "confidence": 0.8},
+            "personality_type": {"type": "Creative Thinker", "description": "Imaginative and analytical"}})
+    if "OCEAN personality traits" in text:
+        return (subject + "The writer is curious and open to new experiences.\n"
+                '{"openness": 4, "conscientiousness": 3, "extraversion": 2, "agreeableness": 4, "neuroticism": 2, "confidence": 0.8}')
+    if "MBTI dimensions" in text:
+        return (subject + "The writer reflects inwardly and prefers ideas to details.\n"
+                '{"ei": 3, "sn": 2, "tf": 1, "jp": -1, "type": "INFJ", "confidence": 0.7}')
+    if "lexical features" in text:
+        return (subject + "The tone is casual with moderate emotional colour.\n"
+                '{"formality": 2, "emotional_intensity": 3, "complexity": 3, "certainty": 3, "social_orientation": 4, "confidence": 0.8}')
+    if "personality type label" in text:
+        return '{"type": "Creative Thinker", "description": "Imaginative and analytical"}'
+    if "WhatsApp messages" in text:
+        return json.dumps({"response_engagement": 3, "emotional_expressiveness": 4, "conversation_initiation": 2,
+                           "social_reciprocity": 4, "attachment_style": 3, "communication_clarity": 4,
+                           "empathy_display": 4, "boundary_management": 3, "confidence": 0.8,
+                           "behavioral_summary": "Warm and responsive communicator"})
+    if "=== RESPONSES ===" in text:
+        items = re.findall(r'^Item (\d+)\n.*?User Response: "(.*?)"$', prompt, re.MULTILINE | re.DOTALL)
+        return json.dumps({"results": [{"id": int(i), "score": answer_score(answer),
+                                        "reasoning": f"Frequency suggests level {answer_score(answer)}."}
+                                       for i, answer in items]})
+    if "User Response:" in text:
+        answer = re.search(r'User Response: "(.*?)"', prompt, re.DOTALL)
+        score = answer_score(answer.group(1) if answer else "")
+        return (f'Step 1: frequency cues.\n{{"score": {score}, "reasoning": "Frequency suggests level {score}.", '
+                '"crisis": false}')
+    if "depression assessment" in text:
+        return json.dumps({"reasoning": "Mild symptoms.", "detailed_analysis": "Some low mood.",
+                           "message": "Thanks for checking in.", "recommendations": ["Sleep well", "Go outside"]})
+    return "{}"
+
+
+async def stream_reply(model: str, content: str, delay: float = 0.005):
+    for token in re.findall(r"\S+\s*", content):
+        chunk = {"object": "chat.completion.chunk", "model": model,
+                 "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(delay)
+    yield "data: [DONE]\n\n"
+
+
+def image_megabytes(messages: list) -> float:
+    """Size of the images attached to a request, from their base64 data URLs."""
+    total = 0
+    for message in messages:
+        if isinstance(message["content"], list):
+            for part in message["content"]:
+                if part.get("type") == "image_url":
+                    url = part["image_url"]
+                    total += len(url if isinstance(url, str) else url.get("url", "")) * 3 / 4
+    return total / (1024 * 1024)
+
+
+def create_app(latency: dict = None, jitter: float = 0.0, faults: dict = None,
+               image_latency_per_mb: float = 0.25, batch_latency: float = 0.5, fixtures: Fixtures = None,
+               distribution: str = "fixed", tail: float = 3.0, latency_scale: float = 1.0,
+               seed: Optional[int] = None, prefix_cache: bool = False, prefill_per_1k: float = 0.0,
+               rate_limits: dict = None) -> FastAPI:
+    """``latency`` maps models, or call sites such as ``analyze_depression``, to seconds; a site's
+    entry wins over its model's. ``jitter`` adds up to that many seconds of random delay so
+    completions interleave.
+    Vision calls take ``image_latency_per_mb`` extra seconds per megabyte of attached image.
+    Batches report ``in_progress`` for ``batch_latency`` seconds after submission.
+    ``distribution`` is ``fixed``, ``lognormal`` or ``recorded`` (see the module docstring);
+    every delay is multiplied by ``latency_scale``, so slow recordings can be replayed faster.
+    ``prefill_per_1k`` adds that many seconds per 1000 prompt tokens, counting only the tokens
+    outside a cached prefix when ``prefix_cache`` is on. ``app.state.prefixes`` holds the cache.
+    ``rate_limits`` maps models to requests per minute, enforced like a provider: a bucket
+    refilling at that rate and holding ten seconds' worth, with 429 and Retry-After once it is
+    empty. ``app.state.rate_limited`` counts those 429s and ``app.state.refused`` holds their times
+    (``time.perf_counter``).
+
+    ``faults`` injects failures and can be changed at runtime through ``app.state.faults``:
+        error_rate        fraction of calls answered with a 500
+        rate_limit_rate   fraction answered with a 429 carrying ``retry_after`` seconds
+        slow_rate         fraction delayed by an extra ``slow_latency`` seconds
+        down_models       models that always answer 503
+    """
+    latency = dict(DEFAULT_LATENCY, **(latency or {}))
+    if distribution not in ("fixed", "lognormal", "recorded"):
+        raise ValueError(f"distribution must be 'fixed', 'lognormal' or 'recorded', got {distribution!r}")
+    rng = random.Random(seed)
+    # Lognormal with the median at the model's latency and p95 at ``tail`` times it.
+    sigma = math.log(max(tail, 1.0)) / 1.645
+
+    def delay_for(model: str, site: str, recorded: Optional[dict]) -> float:
+        base = latency.get(site, latency.get(model, 0.2))
+        if distribution == "recorded" and fixtures is not None:
+            if recorded is None and fixtures.by_site.get(site):
+                recorded = rng.choice(fixtures.by_site[site])
+            if recorded is not None and recorded.get("latency") is not None:
+                return recorded["latency"] * latency_scale
+        if distribution == "lognormal":
+            return base * math.exp(rng.gauss(0, sigma)) * latency_scale
+        return (base + rng.uniform(0, jitter)) * latency_scale
+
+    app = FastAPI()
+    app.state.calls = []
+    app.state.files = {}
+    app.state.batches = {}
+    app.state.prefixes = set()
+    app.state.rate_limited = 0
+    app.state.refused = []
+    allowance = {}
+
+    def limited(model: str) -> Optional[float]:
+        """Seconds until the model's bucket holds a request again, or None after taking one from it."""
+        rpm = (rate_limits or {}).get(model)
+        if not rpm:
+            return None
+        rate = rpm / 60
+        capacity = max(rate * 10, 1.0)
+        now = time.monotonic()
+        tokens, updated = allowance.get(model, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        if tokens < 1:
+            allowance[model] = (tokens, now)
+            return (1 - tokens) / rate
+        allowance[model] = (tokens - 1, now)
+        return None
+    app.state.faults = dict({"error_rate": 0.0, "rate_limit_rate": 0.0, "retry_after": 0.1,
+                             "slow_rate": 0.0, "slow_latency": 1.0, "down_models": ()}, **(faults or {}))
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        started = time.perf_counter()
+        faults = app.state.faults
+        if body["model"] in faults["down_models"]:
+            return JSONResponse({"error": {"message": "model unavailable"}}, status_code=503)
+        roll = random.random()
+        if roll < faults["error_rate"]:
+            return JSONResponse({"error": {"message": "injected failure"}}, status_code=500)
+        if roll < faults["error_rate"] + faults["rate_limit_rate"]:
+            return JSONResponse({"error": {"message": "rate limited"}}, status_code=429,
+                                headers={"retry-after": str(faults["retry_after"])})
+        retry_after = limited(body["model"])
+        if retry_after is not None:
+            app.state.rate_limited += 1
+            app.state.refused.append(started)
+            return JSONResponse({"error": {"message": "rate limit exceeded"}}, status_code=429,
+                                headers={"retry-after": f"{retry_after:.2f}"})
+        site = prompt_site(body["messages"])
+        recorded = None
+        if fixtures:
+            # Imported here: importing the backend reads its configuration, which benchmarks set after this module.
+            from backend.llm import request_key
+            recorded = fixtures.pick(request_key(body["model"], body["messages"]), site, rng)
+        delay = delay_for(body["model"], site, recorded)
+        prompt_tokens = len(json.dumps(body["messages"])) // 4
+        cached_tokens = cached_prefix(app.state.prefixes, body["model"], body["messages"]) // 4 if prefix_cache else 0
+        delay += prefill_per_1k * (prompt_tokens - cached_tokens) / 1000 * latency_scale
+        delay += image_latency_per_mb * image_megabytes(body["messages"])
+        if random.random() < faults["slow_rate"]:
+            delay += faults["slow_latency"]
+        await asyncio.sleep(delay)
+        content = recorded["content"] if recorded is not None else canned_reply(body["messages"])
+        app.state.calls.append({"model": body["model"], "site": site, "start": started, "end": time.perf_counter(),
+                                "replayed": recorded is not None, "prompt_tokens": prompt_tokens,
+                                "cached_tokens": cached_tokens})
+        if body.get("stream"):
+            return StreamingResponse(stream_reply(body["model"], content), media_type="text/event-stream")
+        # Roughly four characters per token; replies longer than max_tokens are cut off like a real provider.
+        finish_reason = "stop"
+        if len(content) > 4 * body.get("max_tokens", 4096):
+            content, finish_reason = content[:4 * body["max_tokens"]], "length"
+        return {
+            "id": "fake",
+            "object": "chat.completion",
+            "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": finish_reason}],
+            "usage": dict({"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4},
+                          **({"prompt_tokens_details": {"cached_tokens": cached_tokens}} if prefix_cache else {})),
+        }
+
+    @app.post("/v1/files")
+    async def upload_file(request: Request):
+        form = await request.form()
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        app.state.files[file_id] = (await form["file"].read()).decode()
+        return {"id": file_id, "object": "file", "purpose": form.get("purpose")}
+
+    @app.get("/v1/files/{file_id}/content")
+    async def file_content(file_id: str):
+        if file_id not in app.state.files:
+            return JSONResponse({"error": {"message": "no such file"}}, status_code=404)
+        return PlainTextResponse(app.state.files[file_id])
+
+    @app.post("/v1/batches")
+    async def create_batch(request: Request):
+        body = await request.json()
+        if body["input_file_id"] not in app.state.files:
+            return JSONResponse({"error": {"message": "no such file"}}, status_code=400)
+        batch_id = f"batch-{uuid.uuid4().hex[:12]}"
+        app.state.batches[batch_id] = {"id": batch_id, "status": "in_progress", "input_file_id": body["input_file_id"],
+                                       "created": time.monotonic(), "output_file_id": None}
+        return _batch_view(app.state.batches[batch_id])
+
+    @app.get("/v1/batches/{batch_id}")
+    async def get_batch(batch_id: str):
+        batch = app.state.batches.get(batch_id)
+        if batch is None:
+            return JSONResponse({"error": {"message": "no such batch"}}, status_code=404)
+        if batch["status"] == "in_progress" and time.monotonic() - batch["created"] >= batch_latency:
+            lines = []
+            for line in filter(str.strip, app.state.files[batch["input_file_id"]].splitlines()):
+                request = json.loads(line)
+                content = canned_reply(request["body"]["messages"])
+                app.state.calls.append({"model": request["body"]["model"], "batch": True})
+                lines.append(json.dumps({"custom_id": request["custom_id"], "response": {"status_code": 200, "body": {
+                    "model": request["body"]["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": len(json.dumps(request["body"]["messages"])) // 4,
+                              "completion_tokens": len(content) // 4}}}}))
+            batch["output_file_id"] = f"file-{uuid.uuid4().hex[:12]}"
+            app.state.files[batch["output_file_id"]] = "\n".join(lines) + "\n"
+            batch["status"] = "completed"
+        return _batch_view(batch)
+
+    return app
+
+
+def cached_prefix(seen: set, model: str, messages: list) -> int:
+    """Characters at the start of the prompt already seen in earlier prompts, in whole blocks; adds this one to ``seen``."""
+    serialized = model + "\0" + "\0".join(f"{m['role']}:{json.dumps(m['content'], sort_keys=True)}" for m in messages)
+    digest, matched, missed = hashlib.sha256(), 0, False
+    for start in range(0, len(serialized) - PREFIX_BLOCK + 1, PREFIX_BLOCK):
+        digest.update(serialized[start:start + PREFIX_BLOCK].encode())
+        key = digest.copy().digest()
+        if not missed and key in seen:
+            matched = start + PREFIX_BLOCK
+        else:
+            missed = True
+            seen.add(key)
+    return matched
+
+
+def _batch_view(batch: dict) -> dict:
+    return {"id": batch["id"], "object": "batch", "status": batch["status"], "output_file_id": batch["output_file_id"]}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeProvider:
+    """Runs the fake app on a background thread: ``with FakeProvider() as base_url: ...``."""
+
+    def __init__(self, app: FastAPI = None, **kwargs):
+        self.app = app or create_app(**kwargs)
+        self.port = _free_port()
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self.base_url
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the fake provider on its own")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--fixtures", nargs="*", default=[], help="recorded calls (.jsonl) or fused_vs_split.json")
+    parser.add_argument("--distribution", choices=("fixed", "lognormal", "recorded"), default="fixed")
+    parser.add_argument("--latency", action="append", metavar="MODEL=SECONDS",
+                        help="per-model or per-call-site (median) latency")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--tail", type=float, default=3.0, help="lognormal p95 / median")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for every delay")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", action="append", metavar="MODEL=N", help="per-model requests per minute")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--prefix-cache", action="store_true", help="simulate provider prompt-prefix caching")
+    parser.add_argument("--prefill", type=float, default=0.0, help="seconds per 1000 uncached prompt tokens")
+    args = parser.parse_args()
+
+    latency = {}
+    for spec in args.latency or []:
+        model, _, seconds = spec.partition("=")
+        latency[model] = float(seconds)
+    rate_limits = {}
+    for spec in args.rpm or []:
+        model, _, rpm = spec.partition("=")
+        rate_limits[model] = int(rpm)
+    fixtures = Fixtures.load(*args.fixtures) if args.fixtures else None
+    app = create_app(latency=latency, jitter=args.jitter, fixtures=fixtures, distribution=args.distribution,
+                     tail=args.tail, latency_scale=args.scale, seed=args.seed, prefix_cache=args.prefix_cache,
+                     prefill_per_1k=args.prefill, rate_limits=rate_limits,
+                     faults={"error_rate": args.error_rate, "rate_limit_rate": args.rate_limit_rate,
+                             "slow_rate": args.slow_rate})
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Exercise the gateway's retry, hedging, breaker and fallback paths against a faulty stub.
+
+    python -m backend.benchmarks.fault_injection [--calls 100]
+
+Each scenario uses a fresh gateway against the fake provider with injected
+500s, 429s with Retry-After, slow tail responses or a model that is down.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from backend.llm import LLMGateway, UpstreamError
+from backend.resilience import CircuitOpenError, RetryPolicy
+
+from .fake_provider import FakeProvider
+
+MODEL = "llama-3.3-70b-versatile"
+MESSAGES = [{"role": "user", "content": "personality type label"}]
+
+
+async def run_calls(gateway: LLMGateway, calls: int, parallel: int = 8, **kwargs):
+    """``parallel`` stays below the gateway's concurrency limit so latencies measure upstream, not queueing."""
+    limit = asyncio.Semaphore(parallel)
+
+    async def one():
+        async with limit:
+            started = time.perf_counter()
+            try:
+                completion = await gateway.chat(MODEL, MESSAGES, max_tokens=50, **kwargs)
+                return True, time.perf_counter() - started, completion.model
+            except (UpstreamError, CircuitOpenError):
+                return False, time.perf_counter() - started, None
+
+    results = await asyncio.gather(*(one() for _ in range(calls)))
+    await gateway.aclose()
+    return results
+
+
+async def warm_then_run(gateway: LLMGateway, calls: int):
+    """Fill the latency window first so the hedging threshold reflects the model's p95."""
+    for _ in range(gateway.hedge_min_samples):
+        await gateway.chat(MODEL, MESSAGES, max_tokens=50)
+    gateway.counters["hedges"] = 0
+    return await run_calls(gateway, calls)
+
+
+def summarize(label: str, results: list, gateway: LLMGateway):
+    latencies = sorted(latency for _, latency, _ in results)
+    ok = sum(success for success, _, _ in results)
+    p99 = latencies[min(int(0.99 * len(latencies)), len(latencies) - 1)]
+    print(f"  {label:28} success {ok / len(results):6.1%}  p50 {statistics.median(latencies):.3f}s  "
+          f"p99 {p99:.3f}s  {gateway.counters}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=100)
+    args = parser.parse_args()
+    fast = {MODEL: 0.05, "llama-3.1-8b-instant": 0.02}
+
+    with FakeProvider(latency=fast, faults={"error_rate": 0.15, "rate_limit_rate": 0.15}) as base_url:
+        os.environ["GROQ_BASE_URL"] = base_url
+        print("30% of calls fail with 500 or 429 (Retry-After 0.1s):")
+        for attempts in (1, 4):
+            gateway = LLMGateway(retry=RetryPolicy(max_attempts=attempts, base_delay=0.05))
+            gateway.breaker(MODEL).threshold = 10 ** 6
+            summarize(f"max_attempts={attempts}", asyncio.run(run_calls(gateway, args.calls)), gateway)
+
+    with FakeProvider(latency=fast, faults={"slow_rate": 0.05, "slow_latency": 1.0}) as base_url:
+        os.environ["GROQ_BASE_URL"] = base_url
+        print("5% of calls take an extra second:")
+        for hedge in (False, True):
+            gateway = LLMGateway(hedge=hedge)
+            gateway.hedge_min_samples = 20
+            summarize(f"hedge={hedge}", asyncio.run(warm_then_run(gateway, args.calls)), gateway)
+
+    with FakeProvider(latency=fast, faults={"down_models": (MODEL,)}) as base_url:
+        os.environ["GROQ_BASE_URL"] = base_url
+        print(f"{MODEL} answers 503:")
+        gateway = LLMGateway(retry=RetryPolicy(max_attempts=2, base_delay=0.01))
+        summarize("no fallback", asyncio.run(run_calls(gateway, 20)), gateway)
+        print(f"  breaker: {gateway.stats()['breakers']}")
+        gateway = LLMGateway(retry=RetryPolicy(max_attempts=2, base_delay=0.01))
+        results = asyncio.run(run_calls(gateway, 20, fallbacks=("llama-3.1-8b-instant",)))
+        summarize("fallback to 8B", results, gateway)
+        print(f"  served by: {sorted(set(model for _, _, model in results if model))}")
+
+
+if __name__ == "__main__":
+    main()
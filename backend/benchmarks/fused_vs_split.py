@@ -0,0 +1,185 @@
+"""Side-by-side benchmark and agreement report for fused vs. split /analyze.
+
+    python -m backend.benchmarks.fused_vs_split [--fixtures PATH] [--speed 1.0] [--json report.json]
+    python -m backend.benchmarks.fused_vs_split --record      # needs GROQ_API_KEY
+
+Replays recorded model responses (content, latency, usage) for a fixed corpus
+through both pipelines, so the comparison is deterministic and free. Each call
+sleeps for its recorded latency divided by ``--speed``. ``--record`` runs the
+corpus against the live API and rewrites the fixture file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from backend import main
+from backend.llm import Completion
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "fused_vs_split.json")
+TRAITS = ("ocean", "mbti", "lexical")
+
+
+def call_kind(messages: list, entry: dict = None) -> str:
+    prompt = messages[-1]["content"]
+    if "then label the personality" in prompt:
+        return "fused"
+    if "OCEAN personality traits" in prompt:
+        return "ocean"
+    if "MBTI dimensions" in prompt:
+        return "mbti"
+    if "lexical features" in prompt:
+        return "lexical"
+    if "personality type label" in prompt:
+        return "classify"
+    if messages[0]["content"].startswith("You are a writing assistant"):
+        for trait in TRAITS:
+            recorded = entry["split"][trait]["content"] if entry else ""
+            thinking = recorded[:recorded.rfind("{")].strip()
+            if thinking and thinking in prompt:
+                return f"refine_{trait}"
+        return "refine"
+    raise ValueError("Unrecognised prompt")
+
+
+class ReplayGateway:
+    """Serves the current corpus entry's recorded responses and tallies usage."""
+
+    def __init__(self, speed: float):
+        self.speed = speed
+        self.entry = None
+        self.calls = []
+
+    async def chat(self, model, messages, **kwargs):
+        kind = call_kind(messages, self.entry)
+        mode = "fused" if kind == "fused" else "split"
+        recorded = self.entry[mode] if kind == "fused" else self.entry["split"][kind]
+        await asyncio.sleep(recorded["latency"] / self.speed)
+        prompt_chars = sum(len(m["content"]) if isinstance(m["content"], str) else 0 for m in messages)
+        self.calls.append({"kind": kind, "prompt_tokens": prompt_chars // 4,
+                           "completion_tokens": recorded["usage"].get("completion_tokens", 0),
+                           "reserved_tokens": kwargs.get("max_tokens", 0)})
+        return Completion(content=recorded["content"], model=model, usage=recorded["usage"],
+                          latency=recorded["latency"])
+
+
+class RecordingGateway:
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.entry = None
+
+    async def chat(self, model, messages, **kwargs):
+        completion = await self.gateway.chat(model, messages, **kwargs)
+        kind = call_kind(messages, self.entry)
+        record = {"content": completion.content, "latency": round(completion.latency, 3), "usage": completion.usage}
+        if kind == "fused":
+            self.entry["fused"] = record
+        else:
+            self.entry["split"][kind] = record
+        return completion
+
+
+async def run_mode(gateway: ReplayGateway, corpus: list, run) -> dict:
+    results, latencies, calls = [], [], []
+    for entry in corpus:
+        gateway.entry, gateway.calls = entry, []
+        started = time.perf_counter()
+        results.append(await run(entry["text"]))
+        latencies.append((time.perf_counter() - started) * gateway.speed)
+        calls.append(gateway.calls)
+    flat = [call for request in calls for call in request]
+    return {
+        "results": results,
+        "summary": {
+            "calls_per_request": len(flat) / len(corpus),
+            "prompt_tokens_per_request": sum(c["prompt_tokens"] for c in flat) / len(corpus),
+            "completion_tokens_per_request": sum(c["completion_tokens"] for c in flat) / len(corpus),
+            "reserved_tokens_per_request": sum(c["reserved_tokens"] for c in flat) / len(corpus),
+            "latency_p50": statistics.median(latencies),
+            "latency_max": max(latencies),
+        },
+    }
+
+
+def agreement(split: list, fused: list) -> dict:
+    def mean_abs(trait, keys):
+        diffs = [abs(s[trait][k] - f[trait][k]) for s, f in zip(split, fused) for k in keys]
+        return statistics.mean(diffs), sum(d <= 1 for d in diffs) / len(diffs)
+
+    ocean_mad, ocean_within = mean_abs("ocean", ("openness", "conscientiousness", "extraversion",
+                                                 "agreeableness", "neuroticism"))
+    mbti_mad, _ = mean_abs("mbti", ("ei", "sn", "tf", "jp"))
+    lexical_mad, lexical_within = mean_abs("lexical", ("formality", "emotional_intensity", "complexity",
+                                                       "certainty", "social_orientation"))
+    letters = [a == b for s, f in zip(split, fused) for a, b in zip(s["mbti"]["type"], f["mbti"]["type"])]
+    hybrid = [abs(main.calculate_hybrid_score(s["ocean"], s["mbti"], s["lexical"])
+                  - main.calculate_hybrid_score(f["ocean"], f["mbti"], f["lexical"])) for s, f in zip(split, fused)]
+    return {
+        "ocean_mean_abs_diff": round(ocean_mad, 3),
+        "ocean_within_1": round(ocean_within, 3),
+        "mbti_axis_mean_abs_diff": round(mbti_mad, 3),
+        "mbti_type_match": round(statistics.mean(s["mbti"]["type"] == f["mbti"]["type"]
+                                                 for s, f in zip(split, fused)), 3),
+        "mbti_letter_match": round(sum(letters) / len(letters), 3),
+        "lexical_mean_abs_diff": round(lexical_mad, 3),
+        "lexical_within_1": round(lexical_within, 3),
+        "hybrid_score_mean_abs_diff": round(statistics.mean(hybrid), 3),
+    }
+
+
+async def record(corpus: list):
+    recorder = RecordingGateway(main.gateway)
+    main.gateway = recorder
+    for entry in corpus:
+        recorder.entry = entry
+        entry["split"], entry["fused"] = {}, None
+        await main.run_split_analysis(entry["text"])
+        await main.run_fused_analysis(entry["text"])
+    await recorder.gateway.aclose()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", default=FIXTURES)
+    parser.add_argument("--speed", type=float, default=1.0, help="replay latencies this many times faster")
+    parser.add_argument("--json", help="write the full report to this path")
+    parser.add_argument("--record", action="store_true", help="re-record the fixtures from the live API")
+    args = parser.parse_args()
+
+    with open(args.fixtures) as f:
+        fixtures = json.load(f)
+
+    if args.record:
+        asyncio.run(record(fixtures["corpus"]))
+        fixtures["source"] = "recorded"
+        with open(args.fixtures, "w") as f:
+            json.dump(fixtures, f, indent=2)
+        return
+
+    replay = ReplayGateway(args.speed)
+    main.gateway = replay
+    split = asyncio.run(run_mode(replay, fixtures["corpus"], main.run_split_analysis))
+    fused = asyncio.run(run_mode(replay, fixtures["corpus"], main.run_fused_analysis))
+    report = {
+        "corpus_size": len(fixtures["corpus"]),
+        "fixture_source": fixtures.get("source", "unknown"),
+        "split": split["summary"],
+        "fused": fused["summary"],
+        "agreement": agreement(split["results"], fused["results"]),
+    }
+
+    print(f"{'':32}{'split':>10}{'fused':>10}")
+    for key in split["summary"]:
+        print(f"{key:32}{split['summary'][key]:>10.2f}{fused['summary'][key]:>10.2f}")
+    print("\nagreement (fused vs. split):")
+    for key, value in report["agreement"].items():
+        print(f"  {key:30}{value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,290 @@
+"""Load test for the main endpoints, with a JSON report to compare between commits.
+
+    python -m backend.benchmarks.loadtest [--concurrency 1 8 32] [--duration 10] [--json report.json]
+    python -m backend.benchmarks.loadtest --fixtures calls.jsonl --distribution recorded --scale 0.2
+    python -m backend.benchmarks.loadtest --compare baseline.json        # exit status 1 on a regression
+    python -m backend.benchmarks.loadtest --record calls.jsonl           # live APIs, needs GROQ/MISTRAL keys
+
+Runs the fake provider and the backend (uvicorn, one worker) as their own
+processes, so neither shares an interpreter with the load generator. The endpoints
+are /analyze, /score-response, /analyze-depression and /analyze-whatsapp. For each
+endpoint and concurrency level, that many closed-loop clients send requests for
+``--duration`` seconds. The report gives:
+
+- throughput;
+- p50/p95/p99 latency;
+- errors by status;
+- the backend's resident memory after the level and at its peak (from /proc,
+  Linux only).
+
+The provider serves canned content with fixed latencies by default. With
+``--fixtures`` it replays recorded responses, matched exactly or by call site.
+``--distribution`` and ``--error-rate`` shape its delays and failures. The
+backend runs with the result cache off so every request reaches the provider.
+
+``--json`` writes the report with the commit it was measured on. ``--compare``
+reads an earlier report and flags an endpoint and level whose throughput dropped
+or whose p95 rose by more than ``--threshold``, or whose error count grew.
+
+``--record`` starts the backend against the live providers with ``LLM_RECORD``
+set and sends each sample request once. The calls it makes become a fixture file
+of real responses.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "fused_vs_split.json")
+ENDPOINTS = ("analyze", "score_response", "depression", "whatsapp")
+# A 1x1 PNG, used for /analyze-whatsapp when Pillow is not installed to draw a screenshot.
+TINY_PNG = ("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4//8/AAX+Av4N70a4AAAAAElFTkSuQmCC")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def sample_requests() -> dict:
+    """(path, JSON body) pairs per endpoint; clients cycle through them."""
+    with open(FIXTURES, encoding="utf-8") as f:
+        texts = [item["text"] for item in json.load(f)["corpus"]]
+    try:
+        from .bench_images import synthetic_screenshot
+        screenshots = [base64.b64encode(synthetic_screenshot(seed, size=(540, 1200))).decode() for seed in range(3)]
+    except ImportError:
+        screenshots = [TINY_PNG]
+    answers = ["Most days I just don't feel like doing anything I used to enjoy.",
+               "Sleep has been fine, maybe a bit restless before deadlines.",
+               "I get tired easily and coffee doesn't really help anymore."]
+    return {
+        "analyze": [("/api/analyze", {"text": text}) for text in texts],
+        "score_response": [("/api/score-response", {
+            "question": "Over the last two weeks, how often have you been bothered by this?",
+            "response": answer, "category": category})
+            for answer, category in zip(answers, ("interest", "sleep", "energy"))],
+        "depression": [("/api/analyze-depression", {"total_score": score, "responses": answers * 3})
+                       for score in (4, 12, 22)],
+        "whatsapp": [("/api/analyze-whatsapp", {"image": image}) for image in screenshots],
+    }
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def memory_mb(pid: int) -> dict:
+    """Resident and peak resident memory of ``pid`` in MB, where /proc is available."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return {"rss_mb": round(int(fields["VmRSS"].split()[0]) / 1024, 1),
+                "peak_rss_mb": round(int(fields["VmHWM"].split()[0]) / 1024, 1)}
+    except (OSError, KeyError, ValueError):
+        return {"rss_mb": None, "peak_rss_mb": None}
+
+
+def start(command: list, env: dict, ready_url: str, timeout: float = 30.0) -> subprocess.Popen:
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(command)} exited: {process.stderr.read().decode()[-2000:]}")
+        try:
+            if httpx.get(ready_url, timeout=1.0).status_code < 500:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{' '.join(command)} did not start within {timeout}s")
+
+
+async def run_level(client: httpx.AsyncClient, requests: list, concurrency: int, duration: float) -> dict:
+    latencies, statuses = [], Counter()
+    deadline = time.perf_counter() + duration
+
+    async def worker(offset: int):
+        index = offset
+        while time.perf_counter() < deadline:
+            path, body = requests[index % len(requests)]
+            index += concurrency
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    ordered = sorted(latencies)
+    errors = {status: count for status, count in statuses.items() if status != "200"}
+    return {
+        "requests": len(ordered),
+        "errors": sum(errors.values()),
+        "error_statuses": errors,
+        "throughput": round(len(ordered) / elapsed, 2),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 1) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 1),
+    }
+
+
+async def load(base_url: str, pid: int, endpoints: list, levels: list, duration: float) -> dict:
+    samples = sample_requests()
+    results = {}
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        for endpoint in endpoints:
+            await run_level(client, samples[endpoint][:1], 1, 0.0)  # warm-up request
+            results[endpoint] = {}
+            for concurrency in levels:
+                row = await run_level(client, samples[endpoint], concurrency, duration)
+                row.update(memory_mb(pid))
+                results[endpoint][str(concurrency)] = row
+                print(f"{endpoint:15}{concurrency:>5}{row['requests']:>9}{row['errors']:>7}{row['throughput']:>9.1f}"
+                      f"{row['p50_ms']:>9.0f}{row['p95_ms']:>9.0f}{row['p99_ms']:>9.0f}"
+                      f"{row['rss_mb'] if row['rss_mb'] is not None else '-':>9}")
+    return results
+
+
+async def record(base_url: str, endpoints: list):
+    samples = sample_requests()
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        for endpoint in endpoints:
+            for path, body in samples[endpoint]:
+                response = await client.post(path, json=body)
+                print(f"{path}: {response.status_code}")
+
+
+def commit() -> Optional[str]:
+    try:
+        head = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return head + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[str]:
+    """Regressions of ``report`` against ``baseline``, one line each."""
+    regressions = []
+    print(f"\nagainst {baseline.get('commit') or 'baseline'} ({baseline.get('created', '?')}):")
+    for endpoint, levels in report["results"].items():
+        for level, row in levels.items():
+            old = baseline.get("results", {}).get(endpoint, {}).get(level)
+            if old is None:
+                continue
+            throughput = (row["throughput"] - old["throughput"]) / old["throughput"] if old["throughput"] else 0.0
+            p95 = (row["p95_ms"] - old["p95_ms"]) / old["p95_ms"] if old["p95_ms"] else 0.0
+            problems = []
+            if throughput < -threshold:
+                problems.append(f"throughput {throughput:+.0%}")
+            if p95 > threshold:
+                problems.append(f"p95 {p95:+.0%}")
+            if row["errors"] > old["errors"]:
+                problems.append(f"errors {old['errors']} -> {row['errors']}")
+            print(f"  {endpoint:15}{level:>5}  throughput {throughput:+6.0%}  p95 {p95:+6.0%}"
+                  f"{'  REGRESSION: ' + ', '.join(problems) if problems else ''}")
+            if problems:
+                regressions.append(f"{endpoint} x{level}: {', '.join(problems)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--endpoints", nargs="*", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per endpoint and concurrency level")
+    parser.add_argument("--fixtures", nargs="*", default=[], help="recorded calls (.jsonl) or fused_vs_split.json")
+    parser.add_argument("--distribution", choices=("fixed", "lognormal", "recorded"), default="fixed")
+    parser.add_argument("--tail", type=float, default=3.0, help="lognormal p95 / median")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for every provider delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of provider calls answered with 500")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the report here")
+    parser.add_argument("--compare", help="an earlier --json report to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.15, help="relative change that counts as a regression")
+    parser.add_argument("--record", metavar="FILE", help="record live provider responses to this JSONL file")
+    args = parser.parse_args()
+
+    env = dict(os.environ, CACHE_ENABLED="0", LLM_LOG_TOKENS="0", PYTHONUNBUFFERED="1")
+    processes = []
+    try:
+        if not args.record:
+            provider_port = _free_port()
+            command = [sys.executable, "-m", "backend.benchmarks.fake_provider", "--port", str(provider_port),
+                       "--distribution", args.distribution, "--tail", str(args.tail), "--scale", str(args.scale),
+                       "--error-rate", str(args.error_rate), "--seed", str(args.seed)]
+            if args.fixtures:
+                command += ["--fixtures", *args.fixtures]
+            processes.append(start(command, env, f"http://127.0.0.1:{provider_port}/docs"))
+            env["GROQ_BASE_URL"] = env["MISTRAL_BASE_URL"] = f"http://127.0.0.1:{provider_port}/v1"
+        else:
+            env["LLM_RECORD"] = os.path.abspath(args.record)
+        port = _free_port()
+        backend = start([sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port),
+                         "--log-level", "warning"], env, f"http://127.0.0.1:{port}/cache-stats")
+        processes.append(backend)
+        base_url = f"http://127.0.0.1:{port}"
+
+        if args.record:
+            asyncio.run(record(base_url, args.endpoints))
+            print(f"recorded calls appended to {args.record}")
+            return
+
+        print(f"{'endpoint':15}{'conc':>5}{'requests':>9}{'errors':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+              f"{'p99 ms':>9}{'RSS MB':>9}")
+        results = asyncio.run(load(base_url, backend.pid, args.endpoints, args.concurrency, args.duration))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    report = {
+        "version": 1,
+        "commit": commit(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("json", "compare", "record")},
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nreport written to {args.json}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s)")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
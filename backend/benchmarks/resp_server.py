@@ -0,0 +1,291 @@
+"""Local stand-in for a Redis server, for trying ``SHARED_STATE`` without one.
+
+Speaks RESP2 over TCP and implements the commands ``backend/shared.py`` sends,
+plus a few for inspection: PING, AUTH, SELECT, GET, MGET, SET (EX/PX/NX/XX), DEL,
+EXISTS, TIME, DBSIZE, FLUSHALL, SCRIPT LOAD/EXISTS/FLUSH, EVALSHA and EVAL. It has
+no Lua interpreter. EVAL and EVALSHA run the Python equivalent of the scripts in
+``shared.SCRIPTS``, found by their SHA1, and answer NOSCRIPT for any other
+script or one that was not loaded. One event loop serves every client, so
+commands and scripts run one at a time, as in Redis. Nothing is written to disk.
+
+    python -m backend.benchmarks.resp_server [--port 6390]
+
+Or from Python: ``with RespServer() as url: ...`` serves it on a background thread,
+and ``RespServer(process=True)`` in a child process, so that it does not wait for
+the GIL behind a busy parent (the benchmarks' stub provider).
+"""
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from backend.shared import SCRIPTS, SHAS, RespError, apply_take
+
+from .fake_provider import _free_port
+
+SCRIPT_NAMES = {sha: name for name, sha in SHAS.items()}
+
+
+class Ok(str):
+    """A simple-string reply."""
+
+
+def encode_reply(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, Ok):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, RespError):
+        return b"-%s\r\n" % str(value).encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(encode_reply(item) for item in value)
+    data = str(value).encode()
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def parse_commands(buffer: bytes) -> Tuple[List[list], bytes]:
+    """The complete commands at the start of ``buffer`` and what is left after them."""
+    commands, pos = [], 0
+    while pos < len(buffer):
+        end = buffer.find(b"\r\n", pos)
+        if end < 0:
+            break
+        if buffer[pos:pos + 1] != b"*":
+            raise ValueError(f"expected a command array, got {buffer[pos:pos + 20]!r}")
+        args, at = [], end + 2
+        for _ in range(int(buffer[pos + 1:end])):
+            end = buffer.find(b"\r\n", at)
+            if end < 0:
+                break
+            start = end + 2
+            stop = start + int(buffer[at + 1:end])
+            if len(buffer) < stop + 2:
+                break
+            args.append(buffer[start:stop].decode())
+            at = stop + 2
+        else:
+            commands.append(args)
+            pos = at
+            continue
+        break
+    return commands, buffer[pos:]
+
+
+class Store:
+    def __init__(self):
+        # key -> (value, expires at in monotonic seconds or None)
+        self.values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self.loaded = set()
+        self.commands = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self.values[key]
+            return None
+        return entry[0]
+
+    def set(self, key: str, value: str, options: list):
+        expires, only = None, None
+        i = 0
+        while i < len(options):
+            option = options[i].upper()
+            if option in ("NX", "XX"):
+                only = option
+                i += 1
+            elif option in ("EX", "PX"):
+                expires = time.monotonic() + float(options[i + 1]) / (1 if option == "EX" else 1000)
+                i += 2
+            else:
+                return RespError("ERR syntax error")
+        exists = self.get(key) is not None or key in self.buckets
+        if (only == "NX" and exists) or (only == "XX" and not exists):
+            return None
+        self.buckets.pop(key, None)
+        self.values[key] = (value, expires)
+        return Ok("OK")
+
+    def delete(self, *keys: str) -> int:
+        removed = 0
+        for key in keys:
+            if self.get(key) is not None or key in self.buckets:
+                removed += 1
+            self.values.pop(key, None)
+            self.buckets.pop(key, None)
+        return removed
+
+    def evaluate(self, name: str, keys: list, args: list):
+        if name == "take":
+            ceiling = float(args[3]) if len(args) > 3 and args[3] != "" else None
+            return repr(apply_take(self.buckets, keys[0], float(args[0]), float(args[1]), float(args[2]), ceiling,
+                                   time.monotonic()))
+        if name == "get_or_lock":
+            value = self.get(keys[0])
+            if value is not None:
+                return [1, value]
+            return [2] if self.set(keys[1], args[0], ["NX", "PX", args[1]]) is not None else [0]
+        if name == "release":
+            if args[0] != "":
+                self.set(keys[0], args[0], ["PX", args[1]])
+            if self.get(keys[1]) == args[2]:
+                self.delete(keys[1])
+            return 1
+        return RespError(f"ERR unknown script {name}")
+
+    def execute(self, command: list):
+        self.commands += 1
+        name, args = command[0].upper(), command[1:]
+        if name == "PING":
+            return Ok("PONG") if not args else args[0]
+        if name in ("AUTH", "SELECT"):
+            return Ok("OK")
+        if name == "GET":
+            return self.get(args[0])
+        if name == "MGET":
+            return [self.get(key) for key in args]
+        if name == "SET":
+            return self.set(args[0], args[1], args[2:])
+        if name == "DEL":
+            return self.delete(*args)
+        if name == "EXISTS":
+            return sum(1 for key in args if self.get(key) is not None or key in self.buckets)
+        if name == "TIME":
+            now = time.time()
+            return [str(int(now)), str(int(now % 1 * 1e6))]
+        if name == "DBSIZE":
+            return len(self.values) + len(self.buckets)
+        if name == "FLUSHALL":
+            self.values.clear()
+            self.buckets.clear()
+            return Ok("OK")
+        if name == "SCRIPT":
+            return self.script(args[0].upper(), args[1:])
+        if name in ("EVALSHA", "EVAL"):
+            if name == "EVAL":
+                sha = next((sha for script, sha in SHAS.items() if SCRIPTS[script] == args[0]), None)
+                self.loaded.add(sha)
+            else:
+                sha = args[0].lower()
+            if sha not in SCRIPT_NAMES or sha not in self.loaded:
+                return RespError("NOSCRIPT No matching script. Please use EVAL.")
+            count = int(args[1])
+            return self.evaluate(SCRIPT_NAMES[sha], args[2:2 + count], args[2 + count:])
+        return RespError(f"ERR unknown command '{command[0]}'")
+
+    def script(self, action: str, args: list):
+        if action == "LOAD":
+            sha = next((sha for script, sha in SHAS.items() if SCRIPTS[script] == args[0]), None)
+            if sha is None:
+                return RespError("ERR the stand-in server only runs the scripts in backend/shared.py")
+            self.loaded.add(sha)
+            return sha
+        if action == "EXISTS":
+            return [1 if sha.lower() in self.loaded else 0 for sha in args]
+        if action == "FLUSH":
+            self.loaded.clear()
+            return Ok("OK")
+        return RespError(f"ERR unknown SCRIPT subcommand '{action}'")
+
+
+class RespServer:
+    """Serves a ``Store`` on a background thread or in a child process: ``with RespServer() as url: ...``."""
+
+    def __init__(self, port: Optional[int] = None, process: bool = False):
+        self.port = port or _free_port()
+        self.process = multiprocessing.get_context("spawn").Process(target=serve, args=(self.port,), daemon=True) \
+            if process else None
+        self.store = Store()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self._ready = threading.Event()
+        self._stopped: Optional[asyncio.Future] = None
+        self._clients = set()
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients.add(writer)
+        pending = b""
+        try:
+            while True:
+                data = await reader.read(1 << 16)
+                if not data:
+                    break
+                # A pipeline arrives in one read and its replies leave in one write.
+                commands, pending = parse_commands(pending + data)
+                writer.write(b"".join(encode_reply(self.store.execute(command)) for command in commands))
+                if writer.transport.get_write_buffer_size() > 1 << 16:
+                    await writer.drain()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    async def serve(self):
+        self._stopped = asyncio.get_running_loop().create_future()
+        server = await asyncio.start_server(self.handle, "127.0.0.1", self.port)
+        self._ready.set()
+        async with server:
+            await self._stopped
+            for writer in list(self._clients):
+                writer.close()
+            while self._clients:
+                await asyncio.sleep(0.01)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.serve())
+        self.loop.close()
+
+    def __enter__(self):
+        if self.process is None:
+            self.thread.start()
+            self._ready.wait()
+            return self.url
+        self.process.start()
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return self.url
+            except OSError:
+                if not self.process.is_alive():
+                    raise RuntimeError("the stand-in Redis server exited on start")
+                time.sleep(0.05)
+
+    def __exit__(self, *exc):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            return
+        self.loop.call_soon_threadsafe(self._stopped.set_result, None)
+        self.thread.join()
+
+
+def serve(port: int):
+    try:
+        asyncio.run(RespServer(port).serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the stand-in Redis server on its own")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    print(f"Serving SHARED_STATE=redis://127.0.0.1:{args.port}/0")
+    serve(args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Concurrency stress check: every /analyze response must carry its own reasoning.
+
+    python -m backend.benchmarks.stress_thinking [--requests 300]
+
+Fires overlapping /analyze calls with distinct texts against the fake provider,
+whose reasoning echoes the analyzed text, and exits non-zero if any response's
+``thinking`` belongs to a different request.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+from .fake_provider import FakeProvider
+
+
+async def run(count: int):
+    from backend.main import app
+    from backend.llm import gateway
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=300) as client:
+        async def one(index: int):
+            marker = f"sample-{index:05d}"
+            text = f"{marker} I like long walks and quiet evenings with a good book."
+            response = await client.post("/api/analyze", json={"text": text})
+            response.raise_for_status()
+            thinking = response.json()["thinking"]
+            return [key for key, value in thinking.items() if marker not in value]
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(count)))
+        elapsed = time.perf_counter() - started
+    await gateway.aclose()
+    return results, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    fast = {"llama-3.3-70b-versatile": 0.02, "llama-3.1-8b-instant": 0.01}
+    with FakeProvider(latency=fast, jitter=0.05) as base_url:
+        os.environ["GROQ_BASE_URL"] = base_url
+        os.environ.setdefault("LLM_DEFAULT_CONCURRENCY", "64")
+        os.environ.setdefault("LLM_LOG_TOKENS", "0")
+        results, elapsed = asyncio.run(run(args.requests))
+
+    mismatched = [(i, keys) for i, keys in enumerate(results) if keys]
+    print(f"{args.requests} overlapping /analyze calls in {elapsed:.2f}s, {len(mismatched)} with foreign thinking")
+    for index, keys in mismatched[:10]:
+        print(f"  request {index}: {', '.join(keys)}")
+    sys.exit(1 if mismatched else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""Content-addressed result cache for the analysis endpoints.
+
+Entries are keyed on a hash of the normalized input plus everything that changes
+the model's answer (model, prompt version, temperature, mode). Lookups go
+through an in-process LRU with TTL and byte-size limits, then an optional SQLite
+file that survives restarts, then the store the workers share when
+``SHARED_STATE`` is set (``shared.py``). Concurrent identical requests are
+de-duplicated so only one of them pays for the upstream call: within a worker by
+sharing its task, across workers by a lock in the shared store that the others
+wait on, polling for the result every ``CACHE_LOCK_POLL`` seconds.
+
+Configuration (environment variables):
+    CACHE_ENABLED       "0" disables caching (default "1")
+    CACHE_TTL           entry lifetime in seconds (default 3600)
+    CACHE_MAX_ENTRIES   in-process entry limit (default 2048)
+    CACHE_MAX_BYTES     in-process size limit in bytes (default 32 MB)
+    CACHE_PATH          SQLite file for the persistent tier (disabled if unset)
+    CACHE_LOCK_TTL      seconds another worker waits on a shared lock whose holder went away (default 60)
+    CACHE_LOCK_POLL     seconds between looks for the result of another worker's call (default 0.05)
+"""
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from . import telemetry
+from .shared import SharedState, SharedStateError, shared_state
+
+
+def normalize_text(text: str, casefold: bool = False) -> str:
+    text = " ".join(unicodedata.normalize("NFC", text).split())
+    return text.casefold() if casefold else text
+
+
+def cache_key(namespace: str, **fields) -> str:
+    payload = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return f"{namespace}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+class Uncached(Exception):
+    """Raised by a compute function to hand ``value`` to its callers without caching it."""
+
+    def __init__(self, value: Any):
+        super().__init__("result not cached")
+        self.value = value
+
+
+class MemoryBackend:
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, size, expires_at = entry
+        if expires_at < time.time():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, size: int, ttl: float):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, size, time.time() + ttl)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteBackend:
+    """Persistent tier; values are stored as JSON text."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+        self._conn.commit()
+
+    def get(self, key: str):
+        row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, encoded: str, ttl: float):
+        self._conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, encoded, time.time() + ttl))
+        self._conn.commit()
+
+    def clear(self):
+        self._conn.execute("DELETE FROM cache")
+        self._conn.commit()
+
+
+class ResultCache:
+    def __init__(self, ttl: float = 3600, max_entries: int = 2048, max_bytes: int = 32 * 1024 * 1024,
+                 path: Optional[str] = None, enabled: bool = True, state: Optional[SharedState] = None,
+                 lock_ttl: float = 60, lock_poll: float = 0.05):
+        self.ttl = ttl
+        self.enabled = enabled
+        self.memory = MemoryBackend(max_entries, max_bytes)
+        self.disk = SqliteBackend(path) if path else None
+        self.state = state
+        self.lock_ttl = lock_ttl
+        self.lock_poll = lock_poll
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.state_hits = 0
+        self.state_waits = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        return cls(
+            ttl=float(os.getenv("CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "2048")),
+            max_bytes=int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+            path=os.getenv("CACHE_PATH") or None,
+            enabled=os.getenv("CACHE_ENABLED", "1") != "0",
+            state=shared_state,
+            lock_ttl=float(os.getenv("CACHE_LOCK_TTL", "60")),
+            lock_poll=float(os.getenv("CACHE_LOCK_POLL", "0.05")),
+        )
+
+    def get(self, key: str) -> Any:
+        """Return the cached value for ``key`` or ``None``, without computing anything."""
+        if not self.enabled:
+            return None
+        value = self.memory.get(key)
+        if value is None:
+            value = self._disk_get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self._store(key, value, persist=False)
+                return value
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        if self.enabled:
+            encoded = self._store(key, value)
+            if self.state is not None:
+                asyncio.ensure_future(self._share(key, encoded))
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for ``key`` or run ``compute`` once, sharing it with concurrent callers.
+
+        ``compute`` may raise ``Uncached`` to return a value that should not be stored.
+        """
+        if not self.enabled:
+            try:
+                return await compute()
+            except Uncached as e:
+                return e.value
+
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is not asyncio.get_running_loop():
+            # Left behind by an event loop that has since closed (a serverless invocation that ended mid-call).
+            task = None
+        if task is not None:
+            self.shared += 1
+        else:
+            value = self._disk_get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self._store(key, value, persist=False)
+                return value
+            self.misses += 1
+            task = asyncio.ensure_future(self._compute_and_store(key, compute))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so one caller disconnecting does not cancel the call the others are waiting on.
+        return await asyncio.shield(task)
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        token = None
+        if self.state is not None:
+            value, token = await self._claim(key)
+            if value is not None:
+                return value
+        encoded = None
+        try:
+            value = await compute()
+            encoded = self._store(key, value)
+        except Uncached as e:
+            value = e.value
+        finally:
+            if token is not None:
+                # Stores the result and releases the lock in one step; on failure only releases it.
+                await self._share(key, encoded, token)
+        return value
+
+    async def _claim(self, key: str) -> Tuple[Any, Optional[str]]:
+        """Another worker's result for ``key``, or else the token of the lock to compute it here (None when the
+        store is unreachable)."""
+        token = secrets.token_hex(8)
+        waited = False
+        while True:
+            try:
+                encoded, locked = await self.state.get_or_lock("cache:" + key, token, self.lock_ttl)
+            except SharedStateError:
+                return None, None
+            if encoded is not None:
+                self.state_hits += 1
+                value = json.loads(encoded)
+                self._store(key, value)
+                return value, None
+            if locked:
+                return None, token
+            if not waited:
+                waited = True
+                self.state_waits += 1
+            await asyncio.sleep(self.lock_poll)
+
+    async def _share(self, key: str, encoded: Optional[str], token: Optional[str] = None):
+        try:
+            await self.state.put("cache:" + key, encoded, self.ttl, token)
+        except SharedStateError:
+            pass
+
+    def _disk_get(self, key: str):
+        if self.disk is None:
+            return None
+        try:
+            return self.disk.get(key)
+        except sqlite3.Error as e:
+            print(f"Cache read error: {e}")
+            return None
+
+    def _store(self, key: str, value: Any, persist: bool = True) -> str:
+        encoded = json.dumps(value)
+        self.memory.set(key, value, len(encoded), self.ttl)
+        if persist and self.disk is not None:
+            try:
+                self.disk.set(key, encoded, self.ttl)
+            except sqlite3.Error as e:
+                print(f"Cache write error: {e}")
+        return encoded
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "shared_inflight": self.shared,
+            "shared_state_hits": self.state_hits,
+            "shared_state_waits": self.state_waits,
+            "evictions": self.memory.evictions,
+            "expirations": self.memory.expirations,
+            "entries": len(self.memory),
+            "bytes": self.memory.bytes,
+            "max_entries": self.memory.max_entries,
+            "max_bytes": self.memory.max_bytes,
+            "persistent": self.disk is not None,
+        }
+
+
+result_cache = ResultCache.from_env()
+
+
+@telemetry.registry.collector
+def cache_metrics():
+    stats = result_cache.stats()
+    lookups = telemetry.Counter("psy_cache_lookups_total", "Result cache lookups by outcome", ("outcome",))
+    for outcome, key in (("hit", "hits"), ("disk_hit", "disk_hits"), ("miss", "misses"), ("shared", "shared_inflight"),
+                         ("shared_state_hit", "shared_state_hits"), ("shared_state_wait", "shared_state_waits")):
+        lookups.inc(stats[key], outcome=outcome)
+    removed = telemetry.Counter("psy_cache_removals_total", "Entries evicted (LRU) or expired", ("reason",))
+    removed.inc(stats["evictions"], reason="eviction")
+    removed.inc(stats["expirations"], reason="expiration")
+    size = telemetry.Gauge("psy_cache_size", "In-memory cache entries and bytes", ("unit",))
+    size.set(stats["entries"], unit="entries")
+    size.set(stats["bytes"], unit="bytes")
+    return [lookups, removed, size]
@@ -0,0 +1,373 @@
+"""Parser for WhatsApp's "Export chat" files, an alternative to screenshot OCR.
+
+Exports are plain text (or a .zip holding ``_chat.txt`` plus media) with one
+header line per message, in one of two families:
+
+    Android   31/12/2020, 21:41 - Alice: message        12/31/20, 9:41 PM - Alice: message
+    iOS       [31/12/2020, 21:41:05] Alice: message     [12/31/20, 9:41:05 PM] Alice: message
+
+Lines without a header continue the previous message. Media shows up as
+placeholders (``<Media omitted>``, ``image omitted``, ``<attached: ...>``).
+System notices have a header but no author and are skipped. The date order (day or month first) is not
+marked in the file, so it is inferred from the first messages.
+
+``parse`` yields messages one at a time and ``ConversationStats`` counts them
+as they stream past, keeping only per-participant totals, fixed-size gap
+histograms and a token-bounded excerpt of the most recent messages, so memory
+stays flat however long the export is.
+"""
+import math
+import re
+import zipfile
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .tokens import estimate_tokens
+
+_TIME = r"(\d{1,2}[:.]\d{2}(?:[:.]\d{2})?)(?:\s?([AaPp])\.?\s?[Mm]\.?)?"
+_DATE = r"(\d{1,4})[./-](\d{1,2})[./-](\d{1,4})"
+_ANDROID = re.compile(rf"^{_DATE},? {_TIME} - (.*)$")
+_IOS = re.compile(rf"^\[{_DATE},? {_TIME}\] (.*)$")
+_DIRECTION_MARKS = "\u200e\u200f\u202a\u202b\u202c\u2066\u2067\u2068\u2069\ufeff"
+
+MEDIA_PLACEHOLDERS = re.compile(
+    r"^(<media omitted>|(image|video|audio|sticker|gif|document|contact card) omitted|<attached: .*>"
+    r"|.* \(file attached\)|null|location: https?://\S+)$",
+    re.IGNORECASE,
+)
+DELETED = {"this message was deleted", "you deleted this message"}
+_EDITED = re.compile(r"\s*<this message was edited>$", re.IGNORECASE)
+
+# Longest physical line read at once; anything longer is split, so one line can't exhaust memory.
+MAX_LINE = 64 * 1024
+# Messages held back while the date order is still ambiguous.
+ORDER_WINDOW = 2000
+# _header's result for a system notice: a header with no author, neither a message nor a continuation.
+NOTICE = object()
+
+
+class ExportError(ValueError):
+    """The upload is not a WhatsApp chat export we can read."""
+
+
+@dataclass
+class ExportMessage:
+    timestamp: datetime
+    author: str
+    text: str
+    kind: str = "text"  # "text", "media" or "deleted"
+
+
+def _clean(line: str) -> str:
+    line = line.rstrip("\r\n").replace("\u202f", " ").replace("\xa0", " ")
+    return line.lstrip(_DIRECTION_MARKS)
+
+
+def _header(line: str):
+    """(date fields, author, text) of a message's first line, NOTICE for a system notice, else None."""
+    match = _IOS.match(line) or _ANDROID.match(line)
+    if not match:
+        return None
+    first, second, third, clock, meridiem, rest = match.groups()
+    author, separator, text = rest.partition(": ")
+    if not separator:
+        return NOTICE  # Encryption banner, "X added Y", subject changes
+    return (first, second, third, clock, meridiem), author.lstrip(_DIRECTION_MARKS).strip(), text
+
+
+def _timestamp(fields, dayfirst: bool) -> datetime:
+    first, second, third, clock, meridiem = fields
+    if len(first) == 4:
+        year, month, day = int(first), int(second), int(third)
+    else:
+        day, month = (int(first), int(second)) if dayfirst else (int(second), int(first))
+        year = int(third) + (2000 if len(third) <= 2 else 0)
+    parts = [int(p) for p in re.split(r"[:.]", clock)]
+    hour = parts[0]
+    if meridiem:
+        hour = hour % 12 + (12 if meridiem.lower() == "p" else 0)
+    return datetime(year, month, day, hour, parts[1], parts[2] if len(parts) > 2 else 0)
+
+
+def _evidence(fields) -> Optional[bool]:
+    """True if this date can only be day-first, False if only month-first, None if it fits both."""
+    first, second = fields[:2]
+    if len(first) == 4 or int(first) > 12:
+        return True
+    if int(second) > 12:
+        return False
+    return None
+
+
+def _likely_order(pending: List[tuple]) -> bool:
+    """Every date seen fits both orders: take the one that keeps timestamps in sequence, day-first on a tie."""
+    def disorder(dayfirst: bool) -> int:
+        times = []
+        for fields, _, _ in pending:
+            try:
+                times.append(_timestamp(fields, dayfirst))
+            except ValueError:
+                return len(pending)
+        return sum(b < a for a, b in zip(times, times[1:]))
+    return disorder(True) <= disorder(False)
+
+
+def _message(fields, author: str, lines: List[str], dayfirst: bool) -> Optional[ExportMessage]:
+    try:
+        timestamp = _timestamp(fields, dayfirst)
+    except ValueError:
+        return None
+    text = _EDITED.sub("", "\n".join(lines)).strip()
+    if MEDIA_PLACEHOLDERS.match(text.lstrip(_DIRECTION_MARKS)):
+        return ExportMessage(timestamp, author, "", "media")
+    if text.lstrip(_DIRECTION_MARKS).lower() in DELETED:
+        return ExportMessage(timestamp, author, "", "deleted")
+    return ExportMessage(timestamp, author, text)
+
+
+def parse(lines: Iterable[str], dayfirst: Optional[bool] = None) -> Iterator[ExportMessage]:
+    """Messages in file order. ``dayfirst=None`` infers the date order from the export itself."""
+    pending: List[tuple] = []  # (fields, author, lines) not yet emitted
+    current = None
+    for raw in lines:
+        line = _clean(raw)
+        header = _header(line)
+        if header is None:
+            if current is not None:
+                current[2].append(line)
+            continue
+        if header is NOTICE:
+            # Ends the message before it; the lines after it, up to the next header, belong to neither.
+            if current is not None:
+                pending.append(current)
+            current = None
+            continue
+        if current is not None:
+            pending.append(current)
+        current = (header[0], header[1], [header[2]])
+        if dayfirst is None:
+            dayfirst = _evidence(header[0])
+            if dayfirst is None and len(pending) >= ORDER_WINDOW:
+                dayfirst = _likely_order(pending)
+        if dayfirst is not None:
+            for fields, author, body in pending:
+                message = _message(fields, author, body, dayfirst)
+                if message:
+                    yield message
+            pending.clear()
+    if current is not None:
+        pending.append(current)
+    if pending and dayfirst is None:
+        dayfirst = _likely_order(pending)
+    for fields, author, body in pending:
+        message = _message(fields, author, body, dayfirst)
+        if message:
+            yield message
+
+
+def open_export(file: IO[bytes], max_bytes: int) -> Iterator[str]:
+    """Text lines of a .txt export or of the chat file inside a .zip export, read lazily."""
+    file.seek(0)
+    if file.read(4) == b"PK\x03\x04":
+        file.seek(0)
+        try:
+            archive = zipfile.ZipFile(file)
+        except zipfile.BadZipFile as e:
+            raise ExportError(f"Could not open zip: {e}")
+        chats = [info for info in archive.infolist() if info.filename.lower().endswith(".txt")]
+        if not chats:
+            raise ExportError("The zip does not contain a chat .txt file")
+        info = max(chats, key=lambda info: ("chat" in info.filename.lower(), info.file_size))
+        if info.file_size > max_bytes:
+            raise ExportError(f"Chat file is larger than {max_bytes} bytes")
+        stream = archive.open(info)
+    else:
+        file.seek(0)
+        stream = file
+    for line in iter(lambda: stream.readline(MAX_LINE), b""):
+        yield line.decode("utf-8", errors="replace")
+
+
+class GapHistogram:
+    """Time gaps in log-spaced buckets (about 12% wide), for quantiles without keeping every value."""
+
+    RATIO = 1.25
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds: float):
+        index = int(math.log(max(seconds, 1.0), self.RATIO))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        target, seen = q * self.count, 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                return self.RATIO ** (index + 0.5)
+        return None
+
+
+class Participant:
+    def __init__(self):
+        self.messages = 0
+        self.words = 0
+        self.media = 0
+        self.deleted = 0
+        self.questions = 0
+        self.turns = 0
+        self.initiations = 0
+        self.reply_gaps = GapHistogram()
+
+
+def _minutes(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds / 60, 1)
+
+
+class ConversationStats:
+    """Streaming counts over an export: turn-taking, who starts conversations and how fast each side replies.
+
+    A new conversation (session) starts after ``session_gap`` of silence; its first
+    message is an initiation. A turn is a run of consecutive messages by one author,
+    and a reply gap is the time between the end of someone else's turn and the
+    start of the next one, within a session.
+    """
+
+    def __init__(self, session_gap: timedelta = timedelta(hours=6), excerpt_tokens: int = 3000):
+        self.session_gap = session_gap
+        self.excerpt_tokens = excerpt_tokens
+        self.participants: Dict[str, Participant] = {}
+        self.sessions = 0
+        self.first: Optional[datetime] = None
+        self.last: Optional[datetime] = None
+        self.last_author: Optional[str] = None
+        self.excerpt: deque = deque()
+        self.excerpt_size = 0
+
+    def add(self, message: ExportMessage):
+        person = self.participants.setdefault(message.author, Participant())
+        person.messages += 1
+        if message.kind == "media":
+            person.media += 1
+        elif message.kind == "deleted":
+            person.deleted += 1
+        else:
+            person.words += len(message.text.split())
+            person.questions += "?" in message.text
+
+        gap = (message.timestamp - self.last).total_seconds() if self.last else None
+        if gap is None or gap >= self.session_gap.total_seconds():
+            self.sessions += 1
+            person.initiations += 1
+            person.turns += 1
+        elif message.author != self.last_author:
+            person.turns += 1
+            person.reply_gaps.add(max(gap, 0.0))
+        self.first = self.first or message.timestamp
+        self.last = message.timestamp
+        self.last_author = message.author
+
+        if message.kind != "deleted":
+            text = message.text if message.kind == "text" else "[media]"
+            size = estimate_tokens(text) + 2
+            self.excerpt.append((message.author, text, size))
+            self.excerpt_size += size
+            while self.excerpt_size > self.excerpt_tokens and len(self.excerpt) > 1:
+                self.excerpt_size -= self.excerpt.popleft()[2]
+
+    @property
+    def messages(self) -> int:
+        return sum(p.messages for p in self.participants.values())
+
+    def default_user(self) -> Optional[str]:
+        """The most active participant, when the client does not say who they are."""
+        if not self.participants:
+            return None
+        return max(self.participants, key=lambda name: self.participants[name].messages)
+
+    def transcript(self, user: str) -> List[Tuple[str, str]]:
+        """The excerpt as ordered ("user" or "other", text) pairs from ``user``'s side."""
+        return [("user" if author == user else "other", text) for author, text, _ in self.excerpt]
+
+    def summary(self, user: str) -> dict:
+        """Numbers from ``user``'s side, with everyone else pooled as "other"."""
+        me = self.participants.get(user) or Participant()
+        others = [p for name, p in self.participants.items() if name != user]
+
+        def side(people: List[Participant]) -> dict:
+            messages = sum(p.messages for p in people)
+            turns = sum(p.turns for p in people)
+            gaps = GapHistogram()
+            for p in people:
+                for index, count in p.reply_gaps.buckets.items():
+                    gaps.buckets[index] = gaps.buckets.get(index, 0) + count
+                gaps.count += p.reply_gaps.count
+                gaps.total += p.reply_gaps.total
+            texts = messages - sum(p.media + p.deleted for p in people)
+            return {
+                "messages": messages,
+                "turns": turns,
+                "initiations": sum(p.initiations for p in people),
+                "words_per_message": round(sum(p.words for p in people) / texts, 1) if texts else 0.0,
+                "messages_per_turn": round(messages / turns, 2) if turns else 0.0,
+                "question_rate": round(sum(p.questions for p in people) / texts, 3) if texts else 0.0,
+                "media": sum(p.media for p in people),
+                "median_reply_minutes": _minutes(gaps.quantile(0.5)),
+                "p90_reply_minutes": _minutes(gaps.quantile(0.9)),
+                "replies": gaps.count,
+            }
+
+        user_side, other_side = side([me]), side(others)
+        total_messages = user_side["messages"] + other_side["messages"]
+        return {
+            "user": user_side,
+            "other": other_side,
+            "participants": len(self.participants),
+            "sessions": self.sessions,
+            "span_days": round((self.last - self.first).total_seconds() / 86400, 1) if self.first else 0.0,
+            "user_message_share": round(user_side["messages"] / total_messages, 3) if total_messages else 0.0,
+            "user_initiation_share": round(user_side["initiations"] / self.sessions, 3) if self.sessions else 0.0,
+        }
+
+
+def describe(summary: dict) -> str:
+    """The summary as prompt lines."""
+    user, other = summary["user"], summary["other"]
+
+    def reply(side: dict) -> str:
+        if side["median_reply_minutes"] is None:
+            return "no replies measured"
+        return f"median {side['median_reply_minutes']} min, 90th percentile {side['p90_reply_minutes']} min"
+
+    return "\n".join([
+        f"- Messages: user {user['messages']}, other {other['messages']} "
+        f"({summary['user_message_share']:.0%} from the user) over {summary['span_days']} days",
+        f"- Conversations started: user {user['initiations']} of {summary['sessions']} "
+        f"({summary['user_initiation_share']:.0%}), other {other['initiations']}",
+        f"- Turns: user {user['turns']} ({user['messages_per_turn']} messages per turn), "
+        f"other {other['turns']} ({other['messages_per_turn']} messages per turn)",
+        f"- Words per message: user {user['words_per_message']}, other {other['words_per_message']}",
+        f"- Reply time: user {reply(user)}; other {reply(other)}",
+        f"- Share of messages with a question: user {user['question_rate']:.0%}, other {other['question_rate']:.0%}",
+        f"- Media shared: user {user['media']}, other {other['media']}",
+    ])
+
+
+def read_stats(file: IO[bytes], max_bytes: int, session_gap: timedelta = timedelta(hours=6),
+               excerpt_tokens: int = 3000) -> ConversationStats:
+    """Parse a whole export in one pass; blocking, meant for an executor."""
+    stats = ConversationStats(session_gap, excerpt_tokens)
+    for message in parse(open_export(file, max_bytes)):
+        stats.add(message)
+    if not stats.participants:
+        raise ExportError("No messages found; is this a WhatsApp chat export?")
+    return stats
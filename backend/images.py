@@ -0,0 +1,154 @@
+"""Screenshot preprocessing for /analyze-whatsapp.
+
+Uploads are decoded once, their real format is detected from the file header,
+and (when Pillow is installed) the image is oriented, cropped to the chat area,
+downscaled to the resolution the vision model works at and re-encoded as a
+compact JPEG or WebP. Without Pillow the original bytes are passed through with
+their detected MIME type. Pillow is imported with the first screenshot rather
+than at startup, since it is the slowest import in the backend and most
+requests never touch an image.
+
+Configuration (environment variables):
+    IMAGE_PREPROCESS     "0" sends uploads to the vision model unchanged (default "1")
+    IMAGE_MAX_SIDE       longest side in pixels after downscaling (default 1024)
+    IMAGE_FORMAT         "jpeg" or "webp" (default "jpeg")
+    IMAGE_QUALITY        encoder quality 1-95 (default 80)
+    IMAGE_CROP_TOP       fraction of a phone screenshot's height removed at the top, the status bar (default 0.04)
+    IMAGE_CROP_BOTTOM    fraction removed at the bottom, the message input bar (default 0.07)
+    IMAGE_MAX_BYTES      largest accepted upload in bytes (default 15 MB)
+"""
+import base64
+import binascii
+import io
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+Image = ImageOps = None
+_pillow_checked = False
+
+# Taller than this (height / width) is treated as a full phone screenshot with system bars to crop.
+PHONE_ASPECT = 1.6
+
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+class ImageError(ValueError):
+    """The upload is not an image we can send to the vision model."""
+
+
+def detect_format(data: bytes) -> Optional[str]:
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    for signature, mime in _SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    return None
+
+
+def decode_base64(image: str) -> bytes:
+    """Accepts bare base64 or a data URL, with or without line breaks."""
+    payload = "".join(image.split(",", 1)[-1].split())
+    try:
+        return base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
+        raise ImageError("Image is not valid base64")
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime: str
+    original_bytes: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{base64.b64encode(self.data).decode()}"
+
+
+def pillow_available() -> bool:
+    """Import Pillow on first use; False when it is not installed."""
+    global Image, ImageOps, _pillow_checked
+    if not _pillow_checked:
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:
+            pass
+        _pillow_checked = True
+    return Image is not None
+
+
+def settings() -> dict:
+    """Everything that changes the processed image, for cache keys."""
+    return {
+        "preprocess": os.getenv("IMAGE_PREPROCESS", "1") != "0" and pillow_available(),
+        "max_side": int(os.getenv("IMAGE_MAX_SIDE", "1024")),
+        "format": os.getenv("IMAGE_FORMAT", "jpeg").lower(),
+        "quality": int(os.getenv("IMAGE_QUALITY", "80")),
+        "crop_top": float(os.getenv("IMAGE_CROP_TOP", "0.04")),
+        "crop_bottom": float(os.getenv("IMAGE_CROP_BOTTOM", "0.07")),
+    }
+
+
+def max_upload_bytes() -> int:
+    return int(os.getenv("IMAGE_MAX_BYTES", str(15 * 1024 * 1024)))
+
+
+def prepare(data: bytes, config: Optional[dict] = None) -> PreparedImage:
+    if len(data) > max_upload_bytes():
+        raise ImageError(f"Image is larger than {max_upload_bytes()} bytes")
+    mime = detect_format(data)
+    if mime is None:
+        raise ImageError("Unsupported image format")
+    config = config or settings()
+    if not config["preprocess"] or not pillow_available():
+        return PreparedImage(data=data, mime=mime, original_bytes=len(data))
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        # JPEG can decode straight to a reduced size (DCT scaling), skipping most of the decode work.
+        image.draft("RGB", (config["max_side"], config["max_side"]))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except Exception as e:
+        raise ImageError(f"Could not decode image: {e}")
+
+    width, height = image.size
+    if height / width >= PHONE_ASPECT:
+        image = image.crop((0, int(height * config["crop_top"]), width, height - int(height * config["crop_bottom"])))
+    factor = max(image.size) / config["max_side"]
+    if factor > 1:
+        if factor >= 2:
+            # A cheap integer box reduction first, so Lanczos only runs on an image close to the target size.
+            image = image.reduce(int(factor))
+        scale = config["max_side"] / max(image.size)
+        image = image.resize((max(1, round(image.size[0] * scale)), max(1, round(image.size[1] * scale))), Image.LANCZOS)
+    if image.mode not in ("RGB", "L"):
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image.convert("RGBA"), mask=image.convert("RGBA").getchannel("A"))
+        image = background
+
+    out = io.BytesIO()
+    if config["format"] == "webp":
+        image.save(out, "WEBP", quality=config["quality"], method=4)
+        encoded_mime = "image/webp"
+    else:
+        image.save(out, "JPEG", quality=config["quality"], optimize=True)
+        encoded_mime = "image/jpeg"
+    encoded = out.getvalue()
+
+    # A small, already-compressed upload can come out larger; keep whichever is smaller if nothing was resized.
+    if len(encoded) >= len(data) and image.size == (width, height) and mime in ("image/jpeg", "image/webp", "image/png"):
+        return PreparedImage(data=data, mime=mime, original_bytes=len(data), width=width, height=height)
+    return PreparedImage(data=encoded, mime=encoded_mime, original_bytes=len(data),
+                         width=image.size[0], height=image.size[1])
@@ -0,0 +1,324 @@
+"""Offline batch analysis: the /analyze pipeline over a JSONL corpus.
+
+    python -m backend.jobs corpus.jsonl results.jsonl [--concurrency 8] [--mode split|fused] [--rpm MODEL=N]
+    python -m backend.jobs corpus.jsonl results.jsonl --batch [--batch-size 2000]
+
+Input has one JSON object per line with ``text`` and an optional ``id`` (the line
+number when missing); other fields are ignored. Each output line is
+``{"id": ..., "result": {...}}`` with exactly the /analyze response, or
+``{"id": ..., "error": "..."}``.
+
+The output file is the checkpoint. Rows that already have a result there are
+skipped, so rerunning the same command after a crash or Ctrl-C carries on
+without paying again for finished rows; rows that failed are retried and their
+new line appended (the last line for an id wins). A line torn by a crash is cut
+off before resuming.
+
+Rows are read lazily and handed to a fixed pool of workers through a bounded
+queue, so memory does not grow with the corpus. All upstream calls go through
+the shared gateway, which applies per-model concurrency (``LLM_CONCURRENCY``),
+request and token rate limits (``LLM_RATE_LIMITS``/``LLM_TOKEN_LIMITS``, or
+``--rpm``/``--tpm``) and backs off on 429s. Job calls are scheduled in the batch
+class, so when a job shares a process with the API they wait behind its requests.
+
+``--batch`` sends rows through the provider batch API (Groq) instead: one fused
+call per row, submitted in chunks of ``--batch-size`` and collected when the
+provider finishes them. Submitted batch ids are saved to ``<output>.batches.json``
+so a restarted job collects them rather than submitting the rows again.
+
+Texts must have at least 5 words and at most ``--max-words`` (``ANALYZE_MAX_WORDS``,
+as on /analyze); texts over 300 words are analyzed in chunks, as on /analyze. Batch
+mode sends each text as a single fused call, so there it is limited to 300 words.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Iterator, Optional, Set, Tuple
+
+from . import longtext, scheduler
+
+# fsync the output after this many rows, bounding what a power loss can cost.
+SYNC_EVERY = 50
+BATCH_MODEL = "llama-3.3-70b-versatile"
+
+
+def read_rows(path: str) -> Iterator[Tuple[str, dict]]:
+    """(checkpoint id, row) pairs; lines that are not JSON objects come back as rows with a ``parse_error``."""
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as e:
+                row = {"id": number, "parse_error": f"Line {number} is not a JSON object: {e}"}
+            row.setdefault("id", number)
+            yield str(row["id"]), row
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """Ids that already have a result in ``path``; a torn last line is truncated away."""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        kept = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            kept += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if "result" in entry:
+                done.add(str(entry["id"]))
+        f.truncate(kept)
+    return done
+
+
+class JobWriter:
+    def __init__(self, path: str):
+        self.file = open(path, "a", encoding="utf-8")
+        self.written = 0
+        self.failed = 0
+
+    def write(self, entry: dict):
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.written += 1
+        self.failed += "error" in entry
+        if self.written % SYNC_EVERY == 0:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+def check_text(row: dict, max_words: int) -> Tuple[str, Optional[str]]:
+    """The row's text and, if it can't be analyzed, why."""
+    if "parse_error" in row:
+        return "", row["parse_error"]
+    text = str(row.get("text") or "").strip()
+    words = len(text.split())
+    if words < 5:
+        return text, "Text must contain at least 5 words"
+    if words > max_words:
+        return text, f"Text must not exceed {max_words} words"
+    return text, None
+
+
+class Progress:
+    def __init__(self, total: int, every: float = 10.0):
+        self.total = total
+        self.every = every
+        self.started = self.last = time.monotonic()
+
+    def update(self, writer: JobWriter, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last < self.every:
+            return
+        self.last = now
+        rate = writer.written / max(now - self.started, 1e-9)
+        print(f"{writer.written}/{self.total} rows, {writer.failed} failed, {rate:.1f} rows/s")
+
+
+async def analyze_row(row: dict, mode: str, max_words: int) -> dict:
+    from . import main
+
+    text, problem = check_text(row, max_words)
+    if problem:
+        return {"id": row["id"], "error": problem}
+    try:
+        analysis = await main.run_analysis(text, mode)
+        return {"id": row["id"], "result": main.build_analysis_response(analysis, len(text.split()))}
+    except Exception as e:
+        return {"id": row["id"], "error": f"{type(e).__name__}: {e}"}
+
+
+async def run_online(rows: Iterator[Tuple[str, dict]], writer: JobWriter, progress: Progress,
+                     concurrency: int, mode: str, max_words: int):
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            row = await queue.get()
+            if row is None:
+                return
+            writer.write(await analyze_row(row, mode, max_words))
+            progress.update(writer)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        for _, row in rows:
+            await queue.put(row)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+
+
+class BatchState:
+    """Submitted provider batches and which rows they hold, saved beside the output file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.batches = []
+        if os.path.exists(path):
+            with open(path) as f:
+                self.batches = json.load(f)["batches"]
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"batches": self.batches}, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def pending(self) -> list:
+        return [batch for batch in self.batches if not batch["collected"]]
+
+
+async def collect_batch(entry: dict, writer: JobWriter, poll: float):
+    """Wait for one submitted batch and write a line for each of its rows."""
+    from . import main
+    from .jsonparse import parse_output
+    from .schemas import FusedAnalysis
+
+    while True:
+        batch = await main.gateway.get_batch(BATCH_MODEL, entry["id"])
+        if batch["status"] in ("completed", "failed", "expired", "cancelled"):
+            break
+        await asyncio.sleep(poll)
+
+    remaining = dict(entry["rows"])
+    for custom_id, outcome in await main.gateway.batch_results(BATCH_MODEL, batch):
+        if custom_id not in remaining:
+            continue
+        row_id, words = remaining.pop(custom_id)
+        if isinstance(outcome, Exception):
+            writer.write({"id": row_id, "error": str(outcome)})
+            continue
+        try:
+            fused = await parse_output(outcome.content, FusedAnalysis, "analyze.fused.batch")
+            writer.write({"id": row_id, "result": main.build_analysis_response(main.fused_result(fused), words)})
+        except ValueError as e:
+            writer.write({"id": row_id, "error": f"{type(e).__name__}: {e}"})
+    for row_id, _ in remaining.values():
+        writer.write({"id": row_id, "error": f"Missing from batch {entry['id']} ({batch['status']})"})
+    print(f"Collected batch {entry['id']} ({batch['status']}, {len(entry['rows'])} rows)")
+
+
+async def run_batches(rows: Iterator[Tuple[str, dict]], writer: JobWriter, progress: Progress, state: BatchState,
+                      batch_size: int, max_words: int, poll: float):
+    from . import main
+
+    async def submit(chunk: dict, requests: list):
+        batch_id = await main.gateway.create_batch(BATCH_MODEL, requests)
+        state.batches.append({"id": batch_id, "rows": chunk, "collected": False})
+        state.save()
+        print(f"Submitted batch {batch_id} ({len(chunk)} rows)")
+
+    chunk, requests = {}, []
+    for _, row in rows:
+        text, problem = check_text(row, max_words)
+        if problem:
+            writer.write({"id": row["id"], "error": problem})
+            continue
+        custom_id = f"row-{len(state.batches)}-{len(chunk)}"
+        chunk[custom_id] = [row["id"], len(text.split())]
+        requests.append((custom_id, main.fused_request(text)))
+        if len(chunk) >= batch_size:
+            await submit(chunk, requests)
+            chunk, requests = {}, []
+    if chunk:
+        await submit(chunk, requests)
+
+    for entry in state.pending():
+        await collect_batch(entry, writer, poll)
+        entry["collected"] = True
+        state.save()
+        progress.update(writer)
+
+
+def count_rows(path: str) -> int:
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+async def run_job(input_path: str, output_path: str, concurrency: int = 8, mode: str = "split",
+                  max_words: int = longtext.SINGLE_PASS_WORDS, batch: bool = False, batch_size: int = 2000,
+                  poll: float = 30.0, limit: Optional[int] = None) -> JobWriter:
+    from . import main
+
+    done = load_checkpoint(output_path)
+    state = BatchState(output_path + ".batches.json") if batch else None
+    # Rows sitting in a submitted but uncollected batch are paid for already; collect them instead.
+    submitted = {row_id for entry in state.pending() for row_id, _ in entry["rows"].values()} if state else set()
+    submitted = {str(row_id) for row_id in submitted}
+    rows = ((row_id, row) for row_id, row in read_rows(input_path) if row_id not in done and row_id not in submitted)
+    if limit is not None:
+        rows = (item for _, item in zip(range(limit), rows))
+
+    total = count_rows(input_path) - len(done)
+    print(f"{len(done)} rows already done, up to {total} to go")
+    writer = JobWriter(output_path)
+    progress = Progress(total)
+    try:
+        if batch:
+            await run_batches(rows, writer, progress, state, batch_size, max_words, poll)
+        else:
+            with scheduler.request_class("batch"):
+                await run_online(rows, writer, progress, concurrency, mode, max_words)
+    finally:
+        writer.close()
+        progress.update(writer, force=True)
+        await main.gateway.aclose()
+    return writer
+
+
+def _limits(specs: list) -> dict:
+    limits = {}
+    for spec in specs or []:
+        model, _, value = spec.partition("=")
+        limits[model] = int(value)
+    return limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the /analyze pipeline over a JSONL corpus")
+    parser.add_argument("input", help="JSONL with a 'text' (and optional 'id') per line")
+    parser.add_argument("output", help="JSONL results; also the checkpoint a rerun resumes from")
+    parser.add_argument("--concurrency", type=int, default=8, help="rows analyzed at once")
+    parser.add_argument("--mode", choices=("split", "fused"), default=os.getenv("ANALYZE_MODE", "split"))
+    parser.add_argument("--max-words", type=int, default=longtext.max_words())
+    parser.add_argument("--rpm", action="append", metavar="MODEL=N", help="requests per minute for a model")
+    parser.add_argument("--tpm", action="append", metavar="MODEL=N", help="tokens per minute for a model")
+    parser.add_argument("--batch", action="store_true", help="use the provider batch API (fused prompt)")
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--poll", type=float, default=30.0, help="seconds between batch status checks")
+    parser.add_argument("--limit", type=int, help="stop after this many new rows")
+    args = parser.parse_args()
+    if args.batch:
+        args.max_words = min(args.max_words, longtext.SINGLE_PASS_WORDS)
+
+    os.environ.setdefault("LLM_LOG_TOKENS", "0")
+    from .llm import gateway
+
+    for model, rpm in _limits(args.rpm).items():
+        gateway.set_rate_limit(model, requests_per_minute=rpm)
+    for model, tpm in _limits(args.tpm).items():
+        gateway.set_rate_limit(model, tokens_per_minute=tpm)
+
+    asyncio.run(run_job(args.input, args.output, args.concurrency, args.mode, args.max_words,
+                        args.batch, args.batch_size, args.poll, args.limit))
+
+
+if __name__ == "__main__":
+    main()
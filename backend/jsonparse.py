@@ -0,0 +1,189 @@
+"""Shared extractor for the JSON objects embedded in model output.
+
+Chain-of-thought responses put free text before (and sometimes after) the JSON
+answer, and that JSON is often nested or slightly malformed. ``JSONScanner``
+finds the last balanced object in a single linear pass and can be fed a
+streamed response chunk by chunk. ``parse_output`` validates the object against
+a pydantic schema, repairs common LLM defects (code fences, trailing commas,
+single quotes, Python literals, truncation) and, as a last resort, asks a small
+model to re-emit just the JSON instead of repeating the whole expensive call.
+Outcomes are counted per endpoint so parse-failure rates can be monitored.
+"""
+import json
+import re
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+from . import telemetry
+
+T = TypeVar("T", bound=BaseModel)
+
+OUTCOMES = ("ok", "repaired", "reasked", "failed")
+_stats = defaultdict(lambda: dict.fromkeys(OUTCOMES, 0))
+
+
+class ModelOutputError(ValueError):
+    """Model output did not contain a valid object for the expected schema."""
+
+
+class JSONScanner:
+    """Incrementally tracks brace-balanced objects; ``feed`` may be called once per streamed chunk."""
+
+    def __init__(self):
+        self._parts = []
+        self._length = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self.last_span: Optional[Tuple[int, int]] = None
+
+    def feed(self, chunk: str) -> "JSONScanner":
+        offset = self._length
+        self._parts.append(chunk)
+        self._length += len(chunk)
+        for i, char in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self._stack:
+                self._in_string = True
+            elif char == "{":
+                self._stack.append(offset + i)
+            elif char == "}" and self._stack:
+                # Objects close innermost-first, so the latest closed span is either a later
+                # object or one that encloses the previous last span; either way it wins.
+                self.last_span = (self._stack.pop(), offset + i + 1)
+        return self
+
+    @property
+    def text(self) -> str:
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    @property
+    def last(self) -> Optional[str]:
+        if self.last_span is None:
+            return None
+        start, end = self.last_span
+        return self.text[start:end]
+
+    @property
+    def unclosed(self) -> Optional[str]:
+        """The outermost object still open at the end of the input (a truncated answer), if any."""
+        if not self._stack:
+            return None
+        return self.text[self._stack[0]:]
+
+    def completed_truncated(self) -> Optional[str]:
+        tail = self.unclosed
+        if tail is None:
+            return None
+        tail = tail.rstrip().rstrip(",")
+        if self._in_string:
+            tail += '"'
+        return tail + "}" * len(self._stack)
+
+
+def find_last_json(text: str) -> Optional[str]:
+    return JSONScanner().feed(text).last
+
+
+def text_before_json(text: str) -> str:
+    """Free text preceding the last JSON object (the model's reasoning), without code fences."""
+    scanner = JSONScanner().feed(text)
+    if scanner.last_span is None:
+        return ""
+    thinking = text[:scanner.last_span[0]].strip()
+    return re.sub(r"```(?:json)?\s*$", "", thinking).strip()
+
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_SINGLE_QUOTED = re.compile(r"(?<=[{\[,:])(\s*)'((?:[^'\\]|\\.)*)'(?=\s*[:,}\]])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def repair(candidate: str) -> str:
+    fenced = _FENCE.search(candidate)
+    if fenced:
+        candidate = fenced.group(1)
+    candidate = _SINGLE_QUOTED.sub(lambda m: m.group(1) + json.dumps(m.group(2).replace("\\'", "'")), candidate)
+    candidate = re.sub(r"(?<=[:\[,\s])(True|False|None)(?=\s*[,}\]])", lambda m: _PY_LITERALS[m.group(1)], candidate)
+    return _TRAILING_COMMA.sub(r"\1", candidate)
+
+
+def _load(candidate: Optional[str], schema: Type[T]) -> Optional[T]:
+    if not candidate:
+        return None
+    try:
+        return schema.model_validate(json.loads(candidate, strict=False))
+    except (ValueError, ValidationError):
+        return None
+
+
+def parse_local(text: str, schema: Type[T]) -> Tuple[Optional[T], bool]:
+    """Parse without any model call. Returns (result, repaired)."""
+    scanner = JSONScanner().feed(text)
+    result = _load(scanner.last, schema)
+    if result is not None:
+        return result, False
+    for candidate in (scanner.last, find_last_json(repair(text)), scanner.completed_truncated()):
+        if candidate:
+            result = _load(candidate, schema) or _load(repair(candidate), schema)
+            if result is not None:
+                return result, True
+    return None, False
+
+
+async def parse_output(text: str, schema: Type[T], endpoint: str,
+                       reask: Optional[Callable[[str, Type[BaseModel]], Awaitable[str]]] = None) -> T:
+    """Extract, validate and if needed repair or re-ask for the ``schema`` object in ``text``."""
+    started = time.perf_counter()
+    with telemetry.span("parse", endpoint=endpoint, chars=len(text)) as trace:
+        try:
+            outcome = "failed"
+            result, repaired = parse_local(text, schema)
+            if result is not None:
+                outcome = "repaired" if repaired else "ok"
+                return result
+            if reask is not None:
+                try:
+                    result, _ = parse_local(await reask(text, schema), schema)
+                except Exception as e:
+                    print(f"Re-ask failed for {endpoint}: {e}")
+                if result is not None:
+                    outcome = "reasked"
+                    return result
+            telemetry.ERRORS.inc(source="parse", kind=endpoint)
+            raise ModelOutputError(f"No valid {schema.__name__} found in response: {text[:200]}")
+        finally:
+            _stats[endpoint][outcome] += 1
+            trace.set(outcome=outcome)
+            telemetry.PARSE_DURATION.observe(time.perf_counter() - started, endpoint=endpoint)
+
+
+@telemetry.registry.collector
+def parse_metrics():
+    outcomes = telemetry.Counter("psy_parse_total", "Model outputs parsed per endpoint and outcome",
+                                 ("endpoint", "outcome"))
+    for endpoint, counts in _stats.items():
+        for outcome, count in counts.items():
+            outcomes.inc(count, endpoint=endpoint, outcome=outcome)
+    return [outcomes]
+
+
+def parse_stats() -> dict:
+    report = {}
+    for endpoint, counts in _stats.items():
+        total = sum(counts.values())
+        report[endpoint] = dict(counts, total=total,
+                                failure_rate=round(counts["failed"] / total, 4) if total else 0.0)
+    return report
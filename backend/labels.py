@@ -0,0 +1,305 @@
+"""Personality labels for /analyze, from a table keyed on the scores they are made of.
+
+The label ("Free Thinker", "Curious, restless idea explorer") comes from the
+``analyze.classify`` prompt, which sees only discrete inputs: the five 1-5 OCEAN
+scores, the MBTI type and the 1-5 formality and complexity. That is 5^5 x 16 x
+5 x 5 = 1,250,000 possible inputs. Each label is stored under its input tuple,
+packed into one integer, and later requests find it with a dict lookup instead of
+another 70B round trip after the trait calls.
+
+A lookup never waits for the model. On a miss the request gets a label built
+from the same scores (``local_label``: the most pronounced OCEAN traits, the MBTI
+temperament and the writing style). The model is asked in the background, in the
+batch scheduling class, so the next text with those scores gets the model's
+label. ``PERSONALITY_LABELS_MISS=wait`` awaits the model on a miss instead.
+
+With ``PERSONALITY_LABELS_PATH`` set, the table is loaded from that file on first
+use and saved back every ``PERSONALITY_LABELS_SAVE_EVERY`` new labels; labels
+written by another version of the prompt are ignored. The file is JSON holding
+each distinct string once, and per key the indices of its type and description.
+It can be filled offline:
+
+    python -m backend.labels labels.json [--from results.jsonl ...] [--limit 2000] [--concurrency 8]
+
+``--from`` takes /analyze results, one per line (``backend.jobs`` output or plain
+responses), and labels their tuples, most frequent first. Without it the tuples
+closest to the middle of every scale come first.
+
+Configuration (environment variables):
+    PERSONALITY_LABELS             "0" asks the model for every label on the request path (default "1")
+    PERSONALITY_LABELS_MISS        "local" (default) or "wait": what a request gets for unseen scores
+    PERSONALITY_LABELS_PATH        JSON file the table is loaded from and saved to (disabled if unset)
+    PERSONALITY_LABELS_SAVE_EVERY  new labels between saves (default 20)
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import nullcontext
+from typing import Awaitable, Callable, Dict, Iterator, Optional, Tuple
+
+from . import prompts, scheduler, telemetry
+
+OCEAN = ("openness", "conscientiousness", "extraversion", "agreeableness", "neuroticism")
+LEXICAL = ("formality", "complexity")
+MBTI_TYPES = tuple(a + b + c + d for a in "EI" for b in "SN" for c in "TF" for d in "JP")
+KEYS = 5 ** 7 * len(MBTI_TYPES)
+
+# Words for a trait scored high and low; the traits furthest from 3 describe the person.
+TRAIT_WORDS = {
+    "openness": ("Curious", "Practical"),
+    "conscientiousness": ("Disciplined", "Spontaneous"),
+    "extraversion": ("Outgoing", "Reserved"),
+    "agreeableness": ("Warm", "Candid"),
+    "neuroticism": ("Sensitive", "Composed"),
+}
+TEMPERAMENTS = {"NT": "Strategist", "NF": "Idealist", "SJ": "Guardian", "SP": "Explorer"}
+
+
+def _level(value) -> int:
+    return min(5, max(1, int(float(value) + 0.5)))
+
+
+def label_key(ocean: dict, mbti: dict, lexical: dict) -> int:
+    """The label inputs packed into one integer below ``KEYS``; ValueError if the MBTI type is not one of the 16."""
+    key = MBTI_TYPES.index(str(mbti["type"]).upper())
+    for value in [ocean[trait] for trait in OCEAN] + [lexical[trait] for trait in LEXICAL]:
+        key = key * 5 + _level(value) - 1
+    return key
+
+
+def decode(key: int) -> Tuple[dict, dict, dict]:
+    """Scores for a key, in the shape ``label_key`` and the classify prompt take."""
+    levels = []
+    for _ in OCEAN + LEXICAL:
+        key, level = divmod(key, 5)
+        levels.append(level + 1)
+    levels.reverse()
+    return dict(zip(OCEAN, levels[:5])), {"type": MBTI_TYPES[key]}, dict(zip(LEXICAL, levels[5:]))
+
+
+def local_label(ocean: dict, mbti: dict, lexical: dict) -> dict:
+    """A label composed from the scores without a model call, used until the model's is in the table."""
+    pronounced = sorted((trait for trait in OCEAN if _level(ocean[trait]) != 3),
+                        key=lambda trait: -abs(_level(ocean[trait]) - 3))
+    words = [TRAIT_WORDS[trait][0 if _level(ocean[trait]) > 3 else 1] for trait in pronounced[:2]]
+    letters = str(mbti["type"]).upper()
+    noun = TEMPERAMENTS.get(letters[1:3] if letters[1:2] == "N" else letters[1:2] + letters[3:4], "Individual")
+    formality, complexity = _level(lexical["formality"]), _level(lexical["complexity"])
+    style = ["formal" if formality >= 4 else "casual" if formality <= 2 else "measured",
+             "nuanced" if complexity >= 4 else "plain-spoken" if complexity <= 2 else "clear"]
+    if len(words) > 1:
+        description = f"{words[1]}, {style[0]} and {style[1]}"
+    else:
+        description = f"{style[0].capitalize()} and {style[1]} communicator"
+    return {"type": f"{words[0] if words else 'Balanced'} {noun}", "description": description}
+
+
+class LabelTable:
+    def __init__(self, classify: Optional[Callable[[dict, dict, dict], Awaitable[Optional[dict]]]] = None):
+        self.enabled = os.getenv("PERSONALITY_LABELS", "1") != "0"
+        self.wait = os.getenv("PERSONALITY_LABELS_MISS", "local") == "wait"
+        self.path = os.getenv("PERSONALITY_LABELS_PATH") or None
+        self.save_every = int(os.getenv("PERSONALITY_LABELS_SAVE_EVERY", "20"))
+        # async (ocean, mbti, lexical) -> label dict, or None when the output did not parse; set by the API module.
+        self.classify = classify
+        self.labels: Dict[int, Tuple[str, str]] = {}
+        self.counters = {"hits": 0, "misses": 0, "stored": 0, "failed": 0}
+        self._filling: Dict[int, asyncio.Future] = {}
+        self._loaded = False
+        self._unsaved = 0
+
+    async def label(self, ocean: dict, mbti: dict, lexical: dict) -> dict:
+        if not self.enabled:
+            return await self.classify(ocean, mbti, lexical) or local_label(ocean, mbti, lexical)
+        self._load()
+        try:
+            key = label_key(ocean, mbti, lexical)
+        except ValueError:
+            return await self.classify(ocean, mbti, lexical) or local_label(ocean, mbti, lexical)
+        found = self.labels.get(key)
+        if found is not None:
+            self.counters["hits"] += 1
+            return {"type": found[0], "description": found[1]}
+        self.counters["misses"] += 1
+        filling = self._fill(key, ocean, mbti, lexical)
+        if self.wait:
+            return await asyncio.shield(filling) or local_label(ocean, mbti, lexical)
+        return local_label(ocean, mbti, lexical)
+
+    def _fill(self, key: int, ocean: dict, mbti: dict, lexical: dict) -> asyncio.Future:
+        """Ask the model for a key once, however many requests miss it meanwhile."""
+        filling = self._filling.get(key)
+        if filling is None:
+            # A background fill queues behind requests that are waiting for their own calls.
+            with nullcontext() if self.wait else scheduler.request_class("batch"):
+                filling = asyncio.ensure_future(self._ask(key, ocean, mbti, lexical))
+            self._filling[key] = filling
+            filling.add_done_callback(lambda _: self._filling.pop(key, None))
+        return filling
+
+    async def _ask(self, key: int, ocean: dict, mbti: dict, lexical: dict) -> Optional[dict]:
+        try:
+            label = await self.classify(ocean, mbti, lexical)
+        except Exception as e:
+            print(f"Personality label error: {e}")
+            label = None
+        if label is None:
+            self.counters["failed"] += 1
+            return None
+        self.add(key, label)
+        return label
+
+    def add(self, key: int, label: dict):
+        self.labels[key] = (sys.intern(label["type"]), sys.intern(label["description"]))
+        self.counters["stored"] += 1
+        self._unsaved += 1
+        if self.path and self._unsaved >= self.save_every:
+            self.save()
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("prompt") != prompts.CLASSIFY.id:
+                print(f"Personality labels in {self.path} are from {saved.get('prompt')}, starting empty")
+                return
+            strings = [sys.intern(text) for text in saved["strings"]]
+            for key, kind, description in saved["labels"]:
+                self.labels.setdefault(key, (strings[kind], strings[description]))
+            print(f"Personality labels: loaded {len(self.labels)} from {self.path}")
+        except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+            print(f"Personality labels load error: {e}")
+
+    def save(self):
+        """Write the table to ``PERSONALITY_LABELS_PATH``, replacing the file only once the new one is complete."""
+        if not self.path:
+            return
+        index: Dict[str, int] = {}
+        rows = [[key, index.setdefault(kind, len(index)), index.setdefault(description, len(index))]
+                for key, (kind, description) in sorted(self.labels.items())]
+        partial = self.path + ".tmp"
+        try:
+            with open(partial, "w", encoding="utf-8") as f:
+                json.dump({"prompt": prompts.CLASSIFY.id, "strings": list(index), "labels": rows}, f,
+                          ensure_ascii=False, separators=(",", ":"))
+            os.replace(partial, self.path)
+            self._unsaved = 0
+        except OSError as e:
+            print(f"Personality labels save error: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return dict(
+            self.counters,
+            enabled=self.enabled,
+            miss=("wait" if self.wait else "local"),
+            hit_rate=round(self.counters["hits"] / lookups, 3) if lookups else None,
+            labels=len(self.labels),
+            coverage=round(len(self.labels) / KEYS, 6),
+            filling=len(self._filling),
+        )
+
+
+personality_labels = LabelTable()
+
+
+@telemetry.registry.collector
+def label_metrics():
+    counters = personality_labels.counters
+    lookups = telemetry.Counter("psy_personality_labels_lookups_total", "Personality label table lookups by outcome",
+                                ("outcome",))
+    lookups.inc(counters["hits"], outcome="hit")
+    lookups.inc(counters["misses"], outcome="miss")
+    fills = telemetry.Counter("psy_personality_labels_fills_total",
+                              "Model calls filling the personality label table, by outcome", ("outcome",))
+    fills.inc(counters["stored"], outcome="stored")
+    fills.inc(counters["failed"], outcome="failed")
+    size = telemetry.Gauge("psy_personality_labels", "Labels held by the personality label table")
+    size.set(len(personality_labels.labels))
+    return [lookups, fills, size]
+
+
+def keys_from_results(paths) -> Iterator[int]:
+    """Keys found in /analyze results, most frequent first."""
+    counts = Counter()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    result = row.get("result", row)
+                    counts[label_key(result["ocean"], result["mbti"], result["lexical"])] += 1
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    continue
+    return (key for key, _ in counts.most_common())
+
+
+def central_keys(limit: int) -> Iterator[int]:
+    """The ``limit`` keys whose scores are closest to the middle of their scales."""
+    def distance(key):
+        ocean, _, lexical = decode(key)
+        return sum(abs(level - 3) for level in list(ocean.values()) + list(lexical.values()))
+    return iter(heapq.nsmallest(limit, range(KEYS), key=distance))
+
+
+async def warm(table: LabelTable, keys: Iterator[int], limit: int, concurrency: int) -> int:
+    """Ask the model for up to ``limit`` keys not in the table yet; returns how many were stored."""
+    todo = list(itertools.islice((key for key in keys if key not in table.labels), limit))
+    stored_before = table.counters["stored"]
+    started = time.monotonic()
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def fill(key):
+        async with limiter:
+            await table._ask(key, *decode(key))
+            done = table.counters["stored"] + table.counters["failed"]
+            if done % 100 == 0:
+                print(f"{done} labels asked, {time.monotonic() - started:.0f}s")
+
+    with scheduler.request_class("batch"):
+        await asyncio.gather(*(fill(key) for key in todo))
+    return table.counters["stored"] - stored_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the personality label table ahead of traffic")
+    parser.add_argument("path", help="label file; read first if it exists, then written back")
+    parser.add_argument("--from", dest="sources", nargs="*", default=[], help="/analyze results (.jsonl)")
+    parser.add_argument("--limit", type=int, default=2000, help="labels to ask the model for")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    os.environ["PERSONALITY_LABELS_PATH"] = args.path
+    # The API module wires the classify call into its own table; imported after the path is set.
+    from . import main as api
+    from .llm import gateway
+
+    table = api.personality_labels
+    table._load()
+    keys = keys_from_results(args.sources) if args.sources else central_keys(len(table.labels) + args.limit)
+
+    async def run():
+        try:
+            return await warm(table, keys, args.limit, args.concurrency)
+        finally:
+            await gateway.aclose()
+
+    stored = asyncio.run(run())
+    table.save()
+    print(f"Stored {stored} labels ({table.counters['failed']} failed); {len(table.labels)} in {args.path}, "
+          f"{os.path.getsize(args.path) / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Local lexical feature scorer, a fast path for the ``analyze_lexical`` LLM call.
+
+Formality, emotional intensity, complexity, certainty and social orientation are
+mostly visible in the surface of the text: contraction and slang rates, sentence
+and word length, vocabulary variety, hedges and boosters, exclamation density and
+pronoun mix. ``score`` turns those features into the same 1-5 fields the LLM
+returns through a linear mapping per trait, in well under a millisecond.
+
+The built-in mapping is hand-tuned. ``backend/benchmarks/calibrate_lexical.py``
+fits a replacement against recorded LLM outputs and writes it as JSON, which is
+picked up from ``LEXICAL_CALIBRATION`` (default ``backend/lexical_calibration.json``).
+"""
+import json
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+TRAITS = ("formality", "emotional_intensity", "complexity", "certainty", "social_orientation")
+
+_WORD = re.compile(r"[A-Za-z]+(?:['’][A-Za-z]+)*")
+_SENTENCE_END = re.compile(r"[.!?]+(?:\s|$)")
+_EMPHASIS = re.compile(r"[!?]{2,}|([A-Za-z])\1{2,}")
+_EMOJI = re.compile("[\U0001F300-\U0001FAFF☀-➿]")
+
+CONTRACTION_SUFFIXES = ("n't", "'re", "'m", "'ll", "'ve", "'d", "n’t", "’re", "’m", "’ll", "’ve", "’d")
+INFORMAL = {
+    "lol", "lmao", "omg", "haha", "hahaha", "gonna", "wanna", "gotta", "kinda", "sorta", "ya", "yeah", "yep",
+    "nope", "u", "ur", "idk", "btw", "tbh", "imo", "cant", "dont", "wont", "im", "ive", "thats", "stuff",
+    "cool", "awesome", "hey", "dude", "guys", "okay", "ok", "pls", "thx", "cuz", "bc", "nah", "yo", "wow",
+}
+INTENSIFIERS = {
+    "so", "really", "very", "totally", "absolutely", "extremely", "incredibly", "super", "completely",
+    "utterly", "deeply", "truly", "such", "too",
+}
+EMOTION = {
+    "love", "hate", "happy", "sad", "angry", "afraid", "scared", "excited", "amazing", "awful", "terrible",
+    "wonderful", "horrible", "joy", "fear", "hurt", "lonely", "anxious", "worried", "thrilled", "miss",
+    "upset", "grateful", "furious", "heartbroken", "beautiful", "passionate", "cry", "crying", "proud",
+    "frustrated", "stressed", "depressed", "glad", "delighted", "ashamed", "jealous", "adore", "enjoy",
+}
+HEDGES = {
+    "maybe", "perhaps", "might", "possibly", "probably", "guess", "seems", "seem", "somewhat", "unsure",
+    "apparently", "suppose", "likely", "could", "unclear", "wonder", "sometimes", "think", "believe",
+}
+BOOSTERS = {
+    "definitely", "certainly", "always", "never", "clearly", "obviously", "must", "know", "sure", "surely",
+    "undoubtedly", "absolutely", "will", "every", "everything", "nothing", "without", "fact", "indeed",
+}
+FIRST_SINGULAR = {"i", "me", "my", "mine", "myself", "i'm", "i've", "i'll", "i'd", "im", "ive"}
+FIRST_PLURAL = {"we", "us", "our", "ours", "ourselves", "we're", "we've", "we'll", "let's"}
+OTHERS = {"you", "your", "yours", "he", "she", "him", "her", "they", "them", "their", "everyone", "people",
+          "someone", "others", "anyone", "you're", "they're"}
+SOCIAL = {"friend", "friends", "family", "together", "people", "community", "team", "help", "share",
+          "party", "parties", "group", "relationship", "relationships", "talk", "meet", "partner", "kids",
+          "parents", "colleagues", "neighbors", "conversation", "conversations", "crowd", "crowds"}
+
+# Per trait: score = intercept + sum(weight * feature), rounded and clamped to 1-5.
+DEFAULT_MAPPING: Dict[str, dict] = {
+    "formality": {"intercept": 0.15, "weights": {
+        "long_word_rate": 4.0, "avg_word_length": 0.5, "informal_rate": -12.0, "contraction_rate": -8.0,
+        "exclamation_rate": -1.5, "emphasis_rate": -4.0, "lowercase_start_rate": -1.0}},
+    "emotional_intensity": {"intercept": 1.8, "weights": {
+        "emotion_rate": 10.0, "intensifier_rate": 8.0, "exclamation_rate": 2.0, "emphasis_rate": 6.0,
+        "caps_rate": 6.0}},
+    "complexity": {"intercept": -0.05, "weights": {
+        "avg_sentence_length": 0.07, "long_word_rate": 3.0, "type_token_ratio": 1.5, "informal_rate": -5.0}},
+    "certainty": {"intercept": 3.0, "weights": {
+        "booster_rate": 15.0, "hedge_rate": -15.0, "question_rate": -1.5, "exclamation_rate": 0.5}},
+    "social_orientation": {"intercept": 2.5, "weights": {
+        "other_rate": 12.0, "first_plural_rate": 15.0, "social_rate": 12.0, "first_singular_rate": -6.0}},
+}
+
+def load_mapping(path: Optional[str] = None) -> Dict[str, dict]:
+    path = path or os.getenv("LEXICAL_CALIBRATION") or os.path.join(os.path.dirname(__file__), "lexical_calibration.json")
+    if not os.path.exists(path):
+        return DEFAULT_MAPPING
+    with open(path) as f:
+        return json.load(f)["mapping"]
+
+
+def _moving_ttr(words: List[str], window: int = 25) -> float:
+    """Type-token ratio averaged over sliding windows, so it does not fall just because a text is longer."""
+    if len(words) <= window:
+        return len(set(words)) / len(words)
+    ratios = [len(set(words[i:i + window])) / window for i in range(0, len(words) - window + 1, 5)]
+    return sum(ratios) / len(ratios)
+
+
+def extract_features(text: str) -> Dict[str, float]:
+    raw_words = _WORD.findall(text)
+    words = [word.lower().replace("’", "'") for word in raw_words]
+    count = max(len(words), 1)
+    counts = Counter(words)
+    sentences = [s for s in _SENTENCE_END.split(text) if s.strip()] or [text]
+    starts = [s.strip()[0] for s in sentences if s.strip()]
+
+    def rate(vocabulary) -> float:
+        return sum(n for word, n in counts.items() if word in vocabulary) / count
+
+    return {
+        "word_count": len(words),
+        "sentence_count": len(sentences),
+        "avg_sentence_length": min(len(words) / len(sentences), 40.0),
+        "avg_word_length": sum(len(word) for word in words) / count,
+        "long_word_rate": sum(len(word) >= 7 for word in words) / count,
+        "type_token_ratio": _moving_ttr(words) if words else 0.0,
+        "contraction_rate": sum(n for word, n in counts.items() if word.endswith(CONTRACTION_SUFFIXES)) / count,
+        "informal_rate": rate(INFORMAL) + sum(word == "i" for word in raw_words) / count,
+        "lowercase_start_rate": sum(c.islower() for c in starts) / max(len(starts), 1),
+        "exclamation_rate": min(text.count("!") / len(sentences), 2.0),
+        "question_rate": min(text.count("?") / len(sentences), 2.0),
+        "emphasis_rate": (len(_EMPHASIS.findall(text)) + len(_EMOJI.findall(text))) / count,
+        "caps_rate": sum(len(word) > 1 and word.isupper() and word != "I" for word in raw_words) / count,
+        "intensifier_rate": rate(INTENSIFIERS),
+        "emotion_rate": rate(EMOTION),
+        "hedge_rate": rate(HEDGES),
+        "booster_rate": rate(BOOSTERS),
+        "first_singular_rate": rate(FIRST_SINGULAR),
+        "first_plural_rate": rate(FIRST_PLURAL),
+        "other_rate": rate(OTHERS),
+        "social_rate": rate(SOCIAL),
+    }
+
+
+def raw_scores(features: Dict[str, float], mapping: Dict[str, dict]) -> Dict[str, float]:
+    """Unrounded trait values, before clamping to the 1-5 scale."""
+    return {
+        trait: mapping[trait]["intercept"]
+        + sum(weight * features.get(name, 0.0) for name, weight in mapping[trait]["weights"].items())
+        for trait in TRAITS
+    }
+
+
+def confidence(features: Dict[str, float]) -> float:
+    """Surface features are noisy on a handful of words; trust grows with length up to 120 words."""
+    return round(0.3 + 0.5 * min(features["word_count"], 120) / 120, 2)
+
+
+def score(text: str, features: Optional[Dict[str, float]] = None,
+          mapping: Optional[Dict[str, dict]] = None) -> Dict[str, float]:
+    features = features or extract_features(text)
+    scores = {trait: int(min(5, max(1, round(value))))
+              for trait, value in raw_scores(features, mapping or _mapping).items()}
+    scores["confidence"] = confidence(features)
+    return scores
+
+
+def _level(value: int, low: str, mid: str, high: str) -> str:
+    return low if value <= 2 else high if value >= 4 else mid
+
+
+def explain(features: Dict[str, float], scores: Dict[str, float]) -> str:
+    """Short plain-language reasoning for the scores, in the register of the refined LLM thinking."""
+    parts = [
+        f"The writing reads as {_level(scores['formality'], 'casual and conversational', 'fairly neutral in tone', 'formal and polished')}, "
+        f"with about {features['avg_sentence_length']:.0f} words per sentence and "
+        f"{_level(scores['complexity'], 'simple, everyday vocabulary', 'a mix of plain and more varied vocabulary', 'varied and sophisticated vocabulary')}."
+    ]
+    if features["contraction_rate"] + features["informal_rate"] > 0.05:
+        parts.append("Contractions and informal words give it a relaxed, spoken feel.")
+    parts.append(
+        f"Emotionally it comes across as {_level(scores['emotional_intensity'], 'calm and matter-of-fact', 'moderately expressive', 'vivid and expressive')}"
+        + (", with exclamations adding energy." if features["exclamation_rate"] > 0.3 else ".")
+    )
+    if features["hedge_rate"] > features["booster_rate"]:
+        parts.append("Softening words like 'maybe' or 'I think' suggest some tentativeness.")
+    elif scores["certainty"] >= 4:
+        parts.append("Statements are made with confidence and little hedging.")
+    focus = ("other people and relationships" if scores["social_orientation"] >= 4
+             else "the writer's own experience" if scores["social_orientation"] <= 2
+             else "a balance of self and others")
+    parts.append(f"The focus is mostly on {focus}.")
+    return " ".join(parts)
+
+
+_mapping = load_mapping()
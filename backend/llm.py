@@ -0,0 +1,597 @@
+"""Shared async gateway for upstream chat-completion calls (Groq and Mistral).
+
+Both providers speak the OpenAI-compatible ``/chat/completions`` protocol, so a
+single pooled ``httpx.AsyncClient`` per provider is enough. Requests never block
+the event loop, each model gets its own concurrency limit and every call has a
+timeout, so one slow upstream response cannot stall the rest of the worker.
+
+Configuration (environment variables):
+    GROQ_BASE_URL / MISTRAL_BASE_URL   override the provider endpoints
+    LLM_TIMEOUT                        per-call timeout in seconds (default 60)
+    LLM_CONCURRENCY                    per-model limits, e.g. "llama-3.3-70b-versatile=8,llama-3.1-8b-instant=16"
+    LLM_DEFAULT_CONCURRENCY            limit for models not listed above (default 16)
+    LLM_MAX_CONNECTIONS                connection pool size per provider (default 100)
+    LLM_RATE_LIMITS                    requests per minute per model, e.g. "llama-3.3-70b-versatile=30" (unlimited if unset)
+    LLM_TOKEN_LIMITS                   tokens per minute per model, charged prompt estimate + max_tokens (unlimited if unset)
+    LLM_RECORD                         append every completed call (request key, call site, content, usage,
+                                       latency) to this JSONL file, for replay by the benchmarks' fake provider
+
+Calls wait for their model's slots and buckets in ``scheduler.py``, most urgent
+request class first, and are refused with ``Overloaded`` when they could not start
+before their request's deadline. With ``SHARED_STATE`` set (``shared.py``) the
+buckets live in the store the workers share, so the limits hold for all of them
+together. Retries, hedging and circuit breakers are configured in
+``resilience.py``; token usage is recorded per call site (``site``) in
+``tokens.py``. Each call is a span and a latency observation in ``telemetry.py``.
+"""
+import asyncio
+import email.utils
+import hashlib
+import json
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import timezone
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import httpx
+
+from . import telemetry
+from .scheduler import ModelQueue, Overloaded
+from .shared import SharedStateError, Take, shared_state
+from .resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, RetryPolicy, TokenBucket, hedged, is_retryable
+from .tokens import estimate_message_tokens, estimate_tokens, token_ledger
+
+PROVIDERS = {
+    "groq": {
+        "base_url_env": "GROQ_BASE_URL",
+        "base_url": "https://api.groq.com/openai/v1",
+        "api_key_env": "GROQ_API_KEY",
+    },
+    "mistral": {
+        "base_url_env": "MISTRAL_BASE_URL",
+        "base_url": "https://api.mistral.ai/v1",
+        "api_key_env": "MISTRAL_API_KEY",
+    },
+}
+
+
+def provider_for(model: str) -> str:
+    if model.startswith(("pixtral", "mistral", "open-mistral")):
+        return "mistral"
+    return "groq"
+
+
+def _parse_limits(spec: str) -> Dict[str, int]:
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            model, value = item.split("=", 1)
+            limits[model.strip()] = int(value)
+    return limits
+
+
+def request_key(model: str, messages: List[dict]) -> str:
+    """Identifies a request by model and exact messages; recordings are looked up by it on replay."""
+    payload = json.dumps({"model": model, "messages": messages}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _error_kind(error: Exception) -> str:
+    """A low-cardinality label for a failed call: the HTTP status, or the exception class."""
+    return str(getattr(error, "status_code", None) or type(error).__name__)
+
+
+class UpstreamError(Exception):
+    """Raised when a provider answers with a non-2xx status."""
+
+    def __init__(self, provider: str, status_code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"{provider} returned {status_code}: {message}")
+        self.provider = provider
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header, given as seconds or as an HTTP-date; None if absent or unreadable."""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+        return max(0.0, seconds) if math.isfinite(seconds) else None
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)  # HTTP-dates are always GMT
+    return max(0.0, when.timestamp() - time.time())
+
+
+def _raise_for_status(provider: str, response: httpx.Response):
+    if response.status_code >= 400:
+        raise UpstreamError(provider, response.status_code, response.text[:200],
+                            parse_retry_after(response.headers.get("retry-after")))
+
+
+@dataclass
+class Completion:
+    content: str
+    model: str
+    usage: Dict[str, int] = field(default_factory=dict)
+    latency: float = 0.0
+    finish_reason: Optional[str] = None
+
+
+class LLMGateway:
+    def __init__(self, timeout: Optional[float] = None, concurrency: Optional[Dict[str, int]] = None,
+                 default_concurrency: Optional[int] = None, max_connections: Optional[int] = None,
+                 retry: Optional[RetryPolicy] = None, hedge: Optional[bool] = None):
+        self.timeout = timeout if timeout is not None else float(os.getenv("LLM_TIMEOUT", "60"))
+        self.concurrency = concurrency if concurrency is not None else _parse_limits(os.getenv("LLM_CONCURRENCY", ""))
+        self.default_concurrency = default_concurrency or int(os.getenv("LLM_DEFAULT_CONCURRENCY", "16"))
+        self.max_connections = max_connections or int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+        self.retry = retry or RetryPolicy()
+        self.hedge = hedge if hedge is not None else os.getenv("LLM_HEDGE", "0") == "1"
+        self.hedge_min_samples = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        self.rate_limits = _parse_limits(os.getenv("LLM_RATE_LIMITS", ""))
+        self.token_limits = _parse_limits(os.getenv("LLM_TOKEN_LIMITS", ""))
+        self.record_path = os.getenv("LLM_RECORD") or None
+        self.shared = shared_state
+        self.counters = {"retries": 0, "hedges": 0, "fallbacks": 0, "breaker_rejections": 0}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._queues: Dict[str, ModelQueue] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latency: Dict[str, LatencyTracker] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _bind_loop(self):
+        """Connection pools and scheduler queues belong to one event loop. They are kept across requests, and across
+        warm serverless invocations when the runtime reuses its loop; a runtime that starts a new loop gets
+        new ones instead of failing on the closed loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._clients.clear()
+            self._queues.clear()
+            self._loop = loop
+
+    def _client(self, provider: str) -> httpx.AsyncClient:
+        self._bind_loop()
+        client = self._clients.get(provider)
+        if client is None or client.is_closed:
+            config = PROVIDERS[provider]
+            api_key = os.getenv(config["api_key_env"])
+            client = httpx.AsyncClient(
+                base_url=os.getenv(config["base_url_env"], config["base_url"]),
+                headers={"Authorization": f"Bearer {api_key}"} if api_key else {},
+                timeout=self._timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections,
+                                    keepalive_expiry=30.0),
+            )
+            self._clients[provider] = client
+        return client
+
+    @staticmethod
+    def _timeout(seconds: float) -> httpx.Timeout:
+        return httpx.Timeout(seconds, connect=min(seconds, 5.0))
+
+    def _queue(self, model: str) -> ModelQueue:
+        self._bind_loop()
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = ModelQueue(model, self.concurrency.get(model, self.default_concurrency))
+            self._queues[model] = queue
+        return queue
+
+    def set_rate_limit(self, model: str, requests_per_minute: Optional[int] = None,
+                       tokens_per_minute: Optional[int] = None):
+        if requests_per_minute:
+            self.rate_limits[model] = requests_per_minute
+            self._buckets.pop(f"requests/{model}", None)
+        if tokens_per_minute:
+            self.token_limits[model] = tokens_per_minute
+            self._buckets.pop(f"tokens/{model}", None)
+
+    def _charges(self, model: str, payload: dict) -> List[Tuple[str, TokenBucket, float]]:
+        """What a call takes from the model's request and token buckets, when limits are configured."""
+        charges = []
+        for kind, limits, cost in (("requests", self.rate_limits, 1),
+                                   ("tokens", self.token_limits, None)):
+            if model not in limits:
+                continue
+            key = f"{kind}/{model}"
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(limits[model])
+            if cost is None:
+                cost = estimate_message_tokens(payload["messages"]) + payload.get("max_tokens", 0)
+            charges.append((key, self._buckets[key], cost))
+        return charges
+
+    @asynccontextmanager
+    async def _slot(self, model: str, payload: dict):
+        """The model's slot with the call's rate-limit charges paid; yields the seconds waited for both."""
+        queue = self._queue(model)
+        charges = self._charges(model, payload)
+        shared = bool(charges) and self.shared is not None and self.shared.available
+        async with queue.slot([] if shared else [(bucket, cost) for _, bucket, cost in charges]) as waited:
+            if shared:
+                waited += await self._reserve(queue, charges)
+            yield waited
+
+    async def _reserve(self, queue: ModelQueue, charges: List[Tuple[str, TokenBucket, float]]) -> float:
+        """Take the charges from the buckets in the shared store, then wait until they are out of debt."""
+        takes = [(key, bucket.rate, bucket.capacity, cost, None) for key, bucket, cost in charges]
+        started = time.monotonic()
+        try:
+            levels = await self.shared.take(takes)
+        except SharedStateError:
+            # The store is unreachable: this worker's own buckets limit it instead.
+            for _, bucket, cost in charges:
+                await bucket.acquire(cost)
+            return time.monotonic() - started
+        delay = max(-level / bucket.rate for level, (_, bucket, _) in zip(levels, charges))
+        if delay > 0:
+            for level, (_, bucket, _) in zip(levels, charges):
+                if level < 0:
+                    bucket.waits += 1
+                    bucket.waited += -level / bucket.rate
+            try:
+                await queue.wait_in_slot(delay)
+            except BaseException:
+                # Refused or cancelled before it was sent: give the quota back.
+                asyncio.ensure_future(self._adjust([(key, rate, capacity, -cost, None)
+                                                    for key, rate, capacity, cost, _ in takes]))
+                raise
+        return time.monotonic() - started
+
+    async def _adjust(self, takes: List[Take]):
+        """Bucket updates nobody waits for; lost if the store is unreachable."""
+        try:
+            await self.shared.take(takes)
+        except SharedStateError:
+            pass
+
+    def _hold_off(self, model: str, payload: dict, error: Exception):
+        """A 429 with Retry-After: no worker sends the model another request until it has passed."""
+        seconds = getattr(error, "retry_after", None)
+        if getattr(error, "status_code", None) != 429 or not seconds:
+            return
+        for key, bucket, _ in self._charges(model, payload):
+            if key.startswith("requests/"):
+                bucket.hold_off(seconds)
+                if self.shared is not None and self.shared.available:
+                    ceiling = -bucket.rate * seconds
+                    asyncio.ensure_future(self._adjust([(key, bucket.rate, bucket.capacity, 0, ceiling)]))
+
+    def _record(self, site: str, model: str, messages: List[dict], content: str, usage: dict,
+                finish_reason: Optional[str], latency: float, prompt: Optional[str] = None, stream: bool = False):
+        entry = {"key": request_key(model, messages), "site": site, "prompt": prompt, "model": model,
+                 "content": content, "usage": usage, "finish_reason": finish_reason, "latency": round(latency, 4),
+                 "stream": stream}
+        try:
+            with open(self.record_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Recording error: {e}")
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        """Breakers are kept per provider and model, so an overloaded 70B does not also block its 8B fallback."""
+        key = f"{provider_for(model)}/{model}"
+        if key not in self._breakers:
+            self._breakers[key] = CircuitBreaker(key)
+        return self._breakers[key]
+
+    def _tracker(self, model: str) -> LatencyTracker:
+        if model not in self._latency:
+            self._latency[model] = LatencyTracker()
+        return self._latency[model]
+
+    def _hedge_delay(self, model: str) -> Optional[float]:
+        tracker = self._tracker(model)
+        if not self.hedge or len(tracker.samples) < self.hedge_min_samples:
+            return None
+        return tracker.percentile(0.95)
+
+    def _count_hedge(self):
+        self.counters["hedges"] += 1
+
+    @staticmethod
+    def _payload(model: str, messages: List[dict], temperature: Optional[float], max_tokens: int, extra: dict) -> dict:
+        payload = {"model": model, "messages": messages, "max_tokens": max_tokens}
+        if temperature is not None:
+            payload["temperature"] = temperature
+        payload.update(extra)
+        return payload
+
+    async def chat(self, model: str, messages: List[dict], temperature: Optional[float] = None,
+                   max_tokens: int = 1000, timeout: Optional[float] = None,
+                   fallbacks: Sequence[str] = (), site: Optional[str] = None, prompt: Optional[str] = None,
+                   **extra) -> Completion:
+        """One completion with retries; on exhaustion or an open breaker, try each of ``fallbacks`` in turn.
+
+        ``prompt`` is the id of the template the messages were built from (see ``prompts.py``).
+        """
+        models = [model, *fallbacks]
+        with telemetry.span("llm.chat", model=model, site=site or model, prompt=prompt) as trace:
+            for index, current in enumerate(models):
+                started = time.perf_counter()
+                try:
+                    completion = await self._chat_with_retries(
+                        current, self._payload(current, messages, temperature, max_tokens, extra), timeout
+                    )
+                    token_ledger.record(site or current, current, max_tokens, estimate_message_tokens(messages),
+                                        completion.usage, completion.finish_reason)
+                    telemetry.LLM_DURATION.observe(time.perf_counter() - started, model=current,
+                                                   site=site or current, outcome="ok")
+                    cached = (completion.usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+                    if cached:
+                        telemetry.LLM_TOKENS.inc(cached, model=current, site=site or current, kind="cached")
+                    trace.set(model=current, prompt_tokens=completion.usage.get("prompt_tokens"),
+                              cached_tokens=cached, completion_tokens=completion.usage.get("completion_tokens"),
+                              finish_reason=completion.finish_reason)
+                    if self.record_path:
+                        self._record(site or current, current, messages, completion.content, completion.usage,
+                                     completion.finish_reason, completion.latency, prompt)
+                    return completion
+                except Exception as e:
+                    telemetry.LLM_DURATION.observe(time.perf_counter() - started, model=current,
+                                                   site=site or current, outcome="error")
+                    telemetry.ERRORS.inc(source="llm", kind=_error_kind(e))
+                    # A saturated or broken model sheds to the next one, which has its own queue.
+                    if index == len(models) - 1 or not (is_retryable(e) or
+                                                        isinstance(e, (CircuitOpenError, Overloaded))):
+                        raise
+                    self.counters["fallbacks"] += 1
+                    trace.add("fallbacks")
+                    print(f"{current} failed ({e}), falling back to {models[index + 1]}")
+
+    async def _chat_with_retries(self, model: str, payload: dict, timeout: Optional[float]) -> Completion:
+        breaker = self.breaker(model)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                breaker.check()
+            except CircuitOpenError:
+                self.counters["breaker_rejections"] += 1
+                raise
+            try:
+                completion = await hedged(lambda: self._send(model, payload, timeout),
+                                          self._hedge_delay(model), self._count_hedge)
+            except Exception as e:
+                if isinstance(e, Overloaded):
+                    # Never sent; retrying would only queue it again.
+                    breaker.release_probe()
+                    raise
+                if not is_retryable(e):
+                    # The provider answered, it just rejected this request.
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                self._hold_off(model, payload, e)
+                if attempt >= self.retry.max_attempts:
+                    raise
+                self.counters["retries"] += 1
+                telemetry.LLM_RETRIES.inc(model=model)
+                telemetry.current_span().add("retries")
+                await asyncio.sleep(self.retry.delay(attempt, e))
+                continue
+            breaker.record_success()
+            self._tracker(model).record(completion.latency)
+            return completion
+
+    async def _send(self, model: str, payload: dict, timeout: Optional[float]) -> Completion:
+        provider = provider_for(model)
+        async with self._slot(model, payload) as waited:
+            started = time.perf_counter()
+            telemetry.current_span().add("queued", round(waited, 4))
+            response = await self._client(provider).post(
+                "/chat/completions", json=payload, timeout=self._timeout(timeout or self.timeout)
+            )
+            latency = time.perf_counter() - started
+        _raise_for_status(provider, response)
+        body = response.json()
+        choice = body["choices"][0]
+        return Completion(
+            content=choice["message"]["content"] or "",
+            model=body.get("model", model),
+            usage=body.get("usage") or {},
+            latency=latency,
+            finish_reason=choice.get("finish_reason"),
+        )
+
+    async def stream_chat(self, model: str, messages: List[dict], temperature: Optional[float] = None,
+                          max_tokens: int = 1000, timeout: Optional[float] = None, site: Optional[str] = None,
+                          prompt: Optional[str] = None, **extra) -> AsyncIterator[str]:
+        """Yield content deltas as the provider streams them (server-sent events).
+
+        Failures before the first delta are retried like ``chat``; once output has been
+        yielded an error is raised to the caller.
+        """
+        payload = self._payload(model, messages, temperature, max_tokens, dict(extra, stream=True))
+        breaker = self.breaker(model)
+        # Not made current: the generator may be closed from another task than the one iterating it.
+        trace = telemetry.start_span("llm.stream", model=model, site=site or model, prompt=prompt)
+        began = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                try:
+                    breaker.check()
+                except CircuitOpenError:
+                    self.counters["breaker_rejections"] += 1
+                    raise
+                started = False
+                parts = []
+                try:
+                    async for delta in self._stream(model, payload, timeout):
+                        if not started:
+                            started = True
+                            telemetry.LLM_TTFT.observe(time.perf_counter() - began, model=model, site=site or model)
+                            trace.set(ttft=round(time.perf_counter() - began, 4))
+                        parts.append(delta)
+                        yield delta
+                except Exception as e:
+                    if isinstance(e, Overloaded):
+                        breaker.release_probe()
+                        raise
+                    if started or not is_retryable(e):
+                        if not is_retryable(e):
+                            breaker.record_success()
+                        raise
+                    breaker.record_failure()
+                    self._hold_off(model, payload, e)
+                    if attempt >= self.retry.max_attempts:
+                        raise
+                    self.counters["retries"] += 1
+                    telemetry.LLM_RETRIES.inc(model=model)
+                    trace.add("retries")
+                    await asyncio.sleep(self.retry.delay(attempt, e))
+                    continue
+                breaker.record_success()
+                completion_estimate = estimate_tokens("".join(parts))
+                token_ledger.record(site or model, model, max_tokens, estimate_message_tokens(messages), {},
+                                    completion_estimate=completion_estimate)
+                telemetry.LLM_DURATION.observe(time.perf_counter() - began, model=model, site=site or model,
+                                               outcome="ok")
+                trace.set(prompt_tokens=estimate_message_tokens(messages), completion_tokens=completion_estimate)
+                trace.finish()
+                if self.record_path:
+                    self._record(site or model, model, messages, "".join(parts), {}, "stop",
+                                 time.perf_counter() - began, prompt, stream=True)
+                return
+        except BaseException as e:
+            if not isinstance(e, (GeneratorExit, asyncio.CancelledError)):
+                telemetry.LLM_DURATION.observe(time.perf_counter() - began, model=model, site=site or model,
+                                               outcome="error")
+                telemetry.ERRORS.inc(source="llm", kind=_error_kind(e))
+            trace.finish(e)
+            raise
+
+    async def _stream(self, model: str, payload: dict, timeout: Optional[float]) -> AsyncIterator[str]:
+        provider = provider_for(model)
+        async with self._slot(model, payload):
+            async with self._client(provider).stream(
+                "POST", "/chat/completions", json=payload, timeout=self._timeout(timeout or self.timeout)
+            ) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    _raise_for_status(provider, response)
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or []
+                    delta = choices[0].get("delta", {}).get("content") if choices else None
+                    if delta:
+                        yield delta
+
+    # Provider batch API (OpenAI-compatible /files + /batches, offered by Groq): cheaper, asynchronous,
+    # no rate limits, results within the completion window.
+    async def create_batch(self, model: str, requests: List[Tuple[str, dict]], window: str = "24h") -> str:
+        """Submit ``(custom_id, payload)`` chat completion requests as one batch job and return its id."""
+        provider = provider_for(model)
+        client = self._client(provider)
+        lines = "\n".join(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+                                      "body": payload}) for custom_id, payload in requests)
+        upload = await client.post("/files", data={"purpose": "batch"},
+                                   files={"file": ("batch.jsonl", lines.encode(), "application/jsonl")})
+        _raise_for_status(provider, upload)
+        response = await client.post("/batches", json={"input_file_id": upload.json()["id"],
+                                                       "endpoint": "/v1/chat/completions",
+                                                       "completion_window": window})
+        _raise_for_status(provider, response)
+        return response.json()["id"]
+
+    async def get_batch(self, model: str, batch_id: str) -> dict:
+        provider = provider_for(model)
+        response = await self._client(provider).get(f"/batches/{batch_id}")
+        _raise_for_status(provider, response)
+        return response.json()
+
+    async def batch_results(self, model: str, batch: dict) -> Iterator[Tuple[str, Union[Completion, UpstreamError]]]:
+        """Per-request outcomes of a finished batch: a ``Completion``, or the ``UpstreamError`` it failed with."""
+        provider = provider_for(model)
+        client = self._client(provider)
+        results = []
+        for key in ("output_file_id", "error_file_id"):
+            if not batch.get(key):
+                continue
+            response = await client.get(f"/files/{batch[key]}/content")
+            _raise_for_status(provider, response)
+            for line in filter(str.strip, response.text.splitlines()):
+                entry = json.loads(line)
+                reply = entry.get("response") or {}
+                if reply.get("status_code") == 200:
+                    body = reply["body"]
+                    choice = body["choices"][0]
+                    completion = Completion(content=choice["message"]["content"] or "", model=body.get("model", model),
+                                            usage=body.get("usage") or {}, finish_reason=choice.get("finish_reason"))
+                    results.append((entry["custom_id"], completion))
+                else:
+                    error = entry.get("error") or reply.get("body") or {}
+                    results.append((entry["custom_id"], UpstreamError(provider, reply.get("status_code") or 500,
+                                                                      json.dumps(error)[:200])))
+        return iter(results)
+
+    def stats(self) -> dict:
+        return dict(
+            self.counters,
+            breakers={key: {"state": b.state, "failures": b.failures, "opens": b.opens}
+                      for key, b in self._breakers.items()},
+            p95_latency={model: t.percentile(0.95) for model, t in self._latency.items()},
+            rate_limits={key: {"waits": b.waits, "waited": round(b.waited, 2)} for key, b in self._buckets.items()},
+            queues={model: queue.stats() for model, queue in self._queues.items()},
+            tokens=token_ledger.stats(),
+        )
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+@telemetry.registry.collector
+def gateway_metrics():
+    counters = telemetry.Counter("psy_llm_gateway_events_total", "Gateway hedges, fallbacks and breaker rejections",
+                                 ("event",))
+    for event in ("hedges", "fallbacks", "breaker_rejections"):
+        counters.inc(gateway.counters[event], event=event)
+    breakers = telemetry.Gauge("psy_llm_breaker_open", "1 while a model's circuit breaker is open", ("breaker",))
+    for key, breaker in gateway._breakers.items():
+        breakers.set(1 if breaker.state == "open" else 0, breaker=key)
+    waited = telemetry.Counter("psy_llm_rate_limit_wait_seconds_total", "Time spent waiting for rate-limit buckets",
+                               ("bucket",))
+    for key, bucket in gateway._buckets.items():
+        waited.inc(bucket.waited, bucket=key)
+    queued = telemetry.Gauge("psy_llm_queue_depth", "Calls waiting for a model slot per request class",
+                             ("model", "priority"))
+    active = telemetry.Gauge("psy_llm_in_flight", "Calls holding a model slot", ("model",))
+    for model, queue in gateway._queues.items():
+        for name, depth in queue.queued.items():
+            queued.set(depth, model=model, priority=name)
+        active.set(queue.active, model=model)
+    return [counters, breakers, waited, queued, active]
+
+
+async def gather_or_cancel(*aws):
+    """Like ``asyncio.gather`` but cancels the remaining calls as soon as one fails."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+gateway = LLMGateway()
@@ -0,0 +1,157 @@
+"""Long-text analysis: sentence-aware chunking and score aggregation.
+
+/analyze scores up to ``SINGLE_PASS_WORDS`` words in one pass. Longer texts are
+split into chunks of whole sentences, no larger than that, and each chunk is
+scored by the usual OCEAN, MBTI and lexical analyzers. This module combines the
+per-chunk scores. Each trait becomes a mean weighted by chunk confidence times
+chunk length. The weighted standard deviation across chunks is reported as that
+trait's dispersion. A high dispersion means the text reads differently from part
+to part, and it lowers the aggregate confidence.
+
+Configuration (environment variables):
+    ANALYZE_MAX_WORDS          longest text /analyze accepts (default 50000)
+    ANALYZE_CHUNK_WORDS        target chunk size in words, at most 300 (default 250)
+    ANALYZE_CHUNK_CONCURRENCY  chunks of one text analyzed at once (default 4)
+"""
+import math
+import os
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .lexical import TRAITS as LEXICAL_TRAITS
+
+# Texts up to this many words are analyzed whole; it is also the largest chunk.
+SINGLE_PASS_WORDS = 300
+# A trailing chunk smaller than this is folded into the one before it.
+MIN_CHUNK_WORDS = 20
+# Raw reasoning from this many of the highest-weighted chunks feeds the summary.
+REASONING_CHUNKS = 3
+
+TRAITS = {
+    "ocean": ("openness", "conscientiousness", "extraversion", "agreeableness", "neuroticism"),
+    "mbti": ("ei", "sn", "tf", "jp"),
+    "lexical": LEXICAL_TRAITS,
+}
+# (low, high) of each family's scale.
+SCALES = {"ocean": (1, 5), "mbti": (-5, 5), "lexical": (1, 5)}
+MBTI_LETTERS = ("EI", "SN", "TF", "JP")
+
+# Sentence ends (with any closing quotes or brackets) and line breaks.
+_BOUNDARY = re.compile(r"[.!?…]+[\"'”’)\]]*\s+|\s*\n\s*")
+
+
+def max_words() -> int:
+    return int(os.getenv("ANALYZE_MAX_WORDS", "50000"))
+
+
+def chunk_words() -> int:
+    return max(MIN_CHUNK_WORDS, min(SINGLE_PASS_WORDS, int(os.getenv("ANALYZE_CHUNK_WORDS", "250"))))
+
+
+def chunk_concurrency() -> int:
+    return max(1, int(os.getenv("ANALYZE_CHUNK_CONCURRENCY", "4")))
+
+
+def sentences(text: str) -> List[List[str]]:
+    """The text as sentences, each a list of words."""
+    found, start = [], 0
+    for match in _BOUNDARY.finditer(text):
+        words = text[start:match.end()].split()
+        if words:
+            found.append(words)
+        start = match.end()
+    if text[start:].split():
+        found.append(text[start:].split())
+    return found
+
+
+def _pieces(text: str, size: int, target: int) -> Iterator[List[str]]:
+    """Sentences, with any longer than ``size`` cut into ``target``-word pieces."""
+    for sentence in sentences(text):
+        if len(sentence) <= size:
+            yield sentence
+            continue
+        for start in range(0, len(sentence), target):
+            yield sentence[start:start + target]
+
+
+def chunk_text(text: str, size: Optional[int] = None) -> List[str]:
+    """Split ``text`` into chunks of whole sentences of about ``size`` words.
+
+    Chunks are balanced: a 600-word text with size 250 becomes three chunks of
+    about 200 words, not 250 + 250 + 100. A sentence longer than ``size`` is cut
+    at word boundaries.
+    """
+    size = size or chunk_words()
+    total = len(text.split())
+    target = math.ceil(total / math.ceil(total / size)) if total else size
+
+    chunks: List[List[str]] = []
+    current: List[str] = []
+    for sentence in _pieces(text, size, target):
+        if current and len(current) + len(sentence) > size:
+            chunks.append(current)
+            current = []
+        current = current + sentence
+        if len(current) >= target:
+            chunks.append(current)
+            current = []
+    if current:
+        if chunks and len(current) < MIN_CHUNK_WORDS:
+            chunks[-1] = chunks[-1] + current
+        else:
+            chunks.append(current)
+    return [" ".join(words) for words in chunks]
+
+
+def weighted_stats(values: List[float], weights: List[float]) -> Tuple[float, float]:
+    """Weighted mean and weighted (population) standard deviation."""
+    total = sum(weights)
+    if not total:
+        weights, total = [1.0] * len(values), float(len(values))
+    mean = sum(v * w for v, w in zip(values, weights)) / total
+    variance = sum(w * (v - mean) ** 2 for v, w in zip(values, weights)) / total
+    return mean, math.sqrt(variance)
+
+
+def mbti_type(chunk_scores: List[dict], weights: List[float], means: Dict[str, float]) -> str:
+    """Letters from the sign of each aggregated axis. An axis at zero takes the weighted vote of chunk types."""
+    letters = []
+    for axis, (negative, positive) in zip(TRAITS["mbti"], MBTI_LETTERS):
+        mean = means[axis]
+        if math.floor(mean + 0.5) == 0:
+            votes = {negative: 0.0, positive: 0.0}
+            for scores, weight in zip(chunk_scores, weights):
+                votes[scores["type"][MBTI_LETTERS.index(negative + positive)]] += weight
+            letters.append(negative if votes[negative] >= votes[positive] else positive)
+        else:
+            letters.append(negative if mean < 0 else positive)
+    return "".join(letters)
+
+
+def aggregate(family: str, chunk_scores: List[dict], words: List[int]) -> Tuple[dict, Dict[str, float]]:
+    """Combined scores for one trait family and the per-trait dispersion across chunks.
+
+    Chunks weigh in by confidence times length. The combined confidence is the
+    weighted mean chunk confidence, scaled down by the average dispersion
+    relative to half the scale's range.
+    """
+    weights = [scores.get("confidence", 0.5) * count for scores, count in zip(chunk_scores, words)]
+    means, dispersion = {}, {}
+    for trait in TRAITS[family]:
+        means[trait], dispersion[trait] = weighted_stats([s[trait] for s in chunk_scores], weights)
+
+    low, high = SCALES[family]
+    combined = {trait: int(min(high, max(low, math.floor(mean + 0.5)))) for trait, mean in means.items()}
+    if family == "mbti":
+        combined["type"] = mbti_type(chunk_scores, weights, means)
+    confidence, _ = weighted_stats([s.get("confidence", 0.5) for s in chunk_scores], words)
+    agreement = 1 - min(1.0, sum(dispersion.values()) / len(dispersion) / ((high - low) / 2))
+    combined["confidence"] = round(confidence * agreement, 2)
+    return combined, {trait: round(value, 2) for trait, value in dispersion.items()}
+
+
+def top_chunks(chunk_scores: List[dict], words: List[int], count: int = REASONING_CHUNKS) -> List[int]:
+    """Indexes of the ``count`` chunks with the most weight, strongest first."""
+    weights = [scores.get("confidence", 0.5) * n for scores, n in zip(chunk_scores, words)]
+    return sorted(range(len(weights)), key=lambda i: -weights[i])[:count]
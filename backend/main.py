@@ -1,15 +1,28 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
-from pydantic import BaseModel
-from groq import Groq
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional
+from contextlib import nullcontext
 import asyncio
 import os
 import json
-import re
-import base64
-import httpx
+import hashlib
+import tempfile
+from datetime import timedelta
+
+from . import (images, lexical as local_lexical, longtext, prompts, scheduler, sessions, social_metrics, startup,
+               telemetry, whatsapp)
+from .answer_index import answer_index
+from .labels import personality_labels
+from .cache import Uncached, cache_key, normalize_text, result_cache
+from .llm import gateway, gather_or_cancel
+from .jsonparse import ModelOutputError, parse_output, parse_stats, text_before_json
+from .tokens import budget_for
+from .schemas import (ChatExtraction, DepressionSummary, FusedAnalysis, LexicalScores, MbtiScores, OceanScores,
+                      PackedScores, PersonalityLabel, ScoreResult, SemanticBehavior, SocialBehavior)
+from .sessions import session_store
+from .shared import shared_state
 
 app = FastAPI()
 
@@ -20,166 +33,205 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Upstream calls of the questionnaire routes queue ahead of /analyze and the WhatsApp routes
+app.add_middleware(scheduler.PriorityMiddleware, routes={
+    "/score-response": "interactive",
+    "/score-responses": "interactive",
+    "/analyze-depression": "interactive",
+    "/sessions/": "interactive",
+})
+app.add_middleware(telemetry.TracingMiddleware)
+
+
+@app.exception_handler(scheduler.Overloaded)
+async def overloaded(request: Request, exc: scheduler.Overloaded):
+    """Model calls that could not start before the request's deadline: fail fast, say when to retry"""
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": exc.retry_after_header})
+
+
+@app.exception_handler(sessions.SessionError)
+async def session_error(request: Request, exc: sessions.SessionError):
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)})
 
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-mistral_api_key = os.getenv("MISTRAL_API_KEY")
 
 class TextInput(BaseModel):
     text: str
+    mode: Optional[str] = None
 
 class ImageInput(BaseModel):
     image: str
 
+class ImagesInput(BaseModel):
+    images: List[str]
+
 class ResponseScore(BaseModel):
     response: str
     question: str
     category: str
+    session_id: Optional[str] = None
+    index: Optional[int] = None
+
+class ResponseScoreBatch(BaseModel):
+    items: List[ResponseScore]
+    batch_size: Optional[int] = None
+    include_summary: bool = False
 
 class DepressionAnalysis(BaseModel):
     total_score: int
     responses: list
 
-thinking_data = {"ocean": "", "mbti": "", "lexical": ""}
+class SessionStart(BaseModel):
+    questions: int = 10
 
-async def refine_thinking(raw_thinking: str) -> str:
-    response = client.chat.completions.create(
+class TraitAnalysis(BaseModel):
+    scores: dict
+    thinking: str = ""
+    refined: bool = False
+
+async def reask_json(content: str, schema) -> str:
+    """Cheap repair call: ask the small model to re-emit only the JSON answer from a malformed response"""
+    response = await gateway.chat(
         model="llama-3.1-8b-instant",
-        messages=[
-            {"role": "system", "content": "You are a writing assistant. Convert technical analysis into natural explanations. Remove all references to JSON, code, formatting, or technical terms. Output ONLY the refined thinking content directly, without any introductory phrases like 'Here is' or 'The rewritten analysis'. Start immediately with the actual analysis."},
-            {"role": "user", "content": f"Convert this to natural language, removing technical terms. Output only the analysis content:\n\n{raw_thinking}"}
-        ],
-        temperature=0.5,
-        max_tokens=5000
+        messages=prompts.REASK.messages(schema=json.dumps(schema.model_json_schema()), output=content[-3000:]),
+        temperature=0,
+        max_tokens=1500,
+        response_format={"type": "json_object"},
+        site="reask",
+        prompt=prompts.REASK.id
     )
-    return response.choices[0].message.content.strip()
+    return response.content
 
-async def analyze_ocean(text: str):
-    prompt = f"""Analyze the following text for OCEAN personality traits. Use Chain of Thought reasoning.
-
-First, think step-by-step about each trait:
-- Openness (1=conventional, routine-focused | 5=creative, abstract, curious, imaginative)
-- Conscientiousness (1=spontaneous, disorganized | 5=organized, disciplined, goal-oriented, reliable)
-- Extraversion (1=reserved, solitary | 5=outgoing, energetic, social, talkative)
-- Agreeableness (1=competitive, critical | 5=cooperative, empathetic, trusting, warm)
-- Neuroticism (1=calm, stable | 5=anxious, emotional, stressed, worried)
+async def parse_trait_response(content: str, schema, endpoint: str) -> TraitAnalysis:
+    """Split a chain-of-thought response into its reasoning and trailing JSON scores"""
+    content = content.strip()
+    if not content:
+        raise ValueError("Empty response from model")
+    
+    scores = await parse_output(content, schema, endpoint, reask=reask_json)
+    return TraitAnalysis(scores=scores.model_dump(), thinking=text_before_json(content))
 
-Text: "{text}"
+async def refine_thinking(raw_thinking: str) -> str:
+    if not raw_thinking:
+        return ""
+    response = await gateway.chat(
+        model="llama-3.1-8b-instant",
+        messages=prompts.REFINE.messages(thinking=raw_thinking),
+        temperature=0.5,
+        max_tokens=budget_for("refine", raw_thinking),
+        site="refine",
+        prompt=prompts.REFINE.id
+    )
+    return response.content.strip()
 
-Think through your reasoning, then provide your final answer as JSON:
-{{"openness": 3, "conscientiousness": 4, "extraversion": 2, "agreeableness": 5, "neuroticism": 1, "confidence": 0.8}}"""
-    
-    response = client.chat.completions.create(
+async def stream_refine_thinking(raw_thinking: str):
+    if not raw_thinking:
+        return
+    async for delta in gateway.stream_chat(
+        model="llama-3.1-8b-instant",
+        messages=prompts.REFINE.messages(thinking=raw_thinking),
+        temperature=0.5,
+        max_tokens=budget_for("refine", raw_thinking),
+        site="refine",
+        prompt=prompts.REFINE.id
+    ):
+        yield delta
+
+async def analyze_ocean(text: str) -> TraitAnalysis:
+    response = await gateway.chat(
         model="llama-3.3-70b-versatile",
-        messages=[
-            {"role": "system", "content": "You are a personality analysis expert. Think step-by-step, then provide JSON at the end."},
-            {"role": "user", "content": "Text: 'I love exploring new ideas and thinking outside the box. Routine bores me.'"},
-            {"role": "assistant", "content": '{"openness": 5, "conscientiousness": 2, "extraversion": 3, "agreeableness": 3, "neuroticism": 2, "confidence": 0.85}'},
-            {"role": "user", "content": "Text: 'I always plan everything in advance and stick to my schedule. Organization is key.'"},
-            {"role": "assistant", "content": '{"openness": 2, "conscientiousness": 5, "extraversion": 3, "agreeableness": 3, "neuroticism": 1, "confidence": 0.9}'},
-            {"role": "user", "content": prompt}
-        ],
+        messages=prompts.ANALYZE_OCEAN.messages(text=text),
         temperature=0.3,
-        max_tokens=10000
+        max_tokens=budget_for("analyze.trait", text),
+        site="analyze.ocean",
+        prompt=prompts.ANALYZE_OCEAN.id
     )
     
-    content = response.choices[0].message.content.strip()
-    if not content:
-        raise ValueError("Empty response from model")
-    
-    json_start = content.rfind('{')
-    if json_start > 0:
-        raw_thinking = content[:json_start].strip()
-        thinking_data["ocean"] = raw_thinking
-    
-    match = re.search(r'\{[^{}]*\}', content, re.DOTALL)
-    if match:
-        return json.loads(match.group())
-    raise ValueError(f"No valid JSON found in response: {content[:200]}")
-
-async def analyze_mbti(text: str):
-    prompt = f"""Analyze the following text for MBTI dimensions. Use Chain of Thought reasoning.
+    return await parse_trait_response(response.content, OceanScores, "analyze.ocean")
 
-Think step-by-step about each dimension:
-- E/I: Extraversion(-5: very outgoing, social) to Introversion(+5: very reserved, reflective)
-- S/N: Sensing(-5: concrete, practical, detail-focused) to Intuition(+5: abstract, theoretical, big-picture)
-- T/F: Thinking(-5: logical, objective, analytical) to Feeling(+5: empathetic, values-driven, personal)
-- J/P: Judging(-5: structured, planned, decisive) to Perceiving(+5: flexible, spontaneous, adaptable)
-
-Text: "{text}"
-
-Think through your reasoning, determine the 4-letter type, then provide JSON:
-{{"ei": 2, "sn": -3, "tf": 1, "jp": -2, "type": "INFP", "confidence": 0.7}}"""
-    
-    response = client.chat.completions.create(
+async def analyze_mbti(text: str) -> TraitAnalysis:
+    response = await gateway.chat(
         model="llama-3.3-70b-versatile",
-        messages=[
-            {"role": "system", "content": "You are a personality analysis expert. Think step-by-step, then provide JSON at the end."},
-            {"role": "user", "content": "Text: 'I prefer deep conversations over small talk. Abstract concepts fascinate me.'"},
-            {"role": "assistant", "content": '{"ei": 3, "sn": 4, "tf": 1, "jp": 0, "type": "INFJ", "confidence": 0.8}'},
-            {"role": "user", "content": "Text: 'I love parties and meeting new people! Life is about having fun and being spontaneous.'"},
-            {"role": "assistant", "content": '{"ei": -4, "sn": -1, "tf": 2, "jp": 3, "type": "ENFP", "confidence": 0.85}'},
-            {"role": "user", "content": prompt}
-        ],
+        messages=prompts.ANALYZE_MBTI.messages(text=text),
         temperature=0.3,
-        max_tokens=10000
+        max_tokens=budget_for("analyze.trait", text),
+        site="analyze.mbti",
+        prompt=prompts.ANALYZE_MBTI.id
     )
     
-    content = response.choices[0].message.content.strip()
-    if not content:
-        raise ValueError("Empty response from model")
-    
-    json_start = content.rfind('{')
-    if json_start > 0:
-        raw_thinking = content[:json_start].strip()
-        thinking_data["mbti"] = raw_thinking
-    
-    match = re.search(r'\{[^{}]*\}', content, re.DOTALL)
-    if match:
-        return json.loads(match.group())
-    raise ValueError(f"No valid JSON found in response: {content[:200]}")
-
-async def analyze_lexical(text: str):
-    prompt = f"""Analyze the following text for lexical features. Use Chain of Thought reasoning.
-
-Think step-by-step about each feature:
-- Formality (1=casual, slang, contractions | 5=formal, professional, proper grammar)
-- Emotional Intensity (1=neutral, detached, factual | 5=passionate, expressive, emotional)
-- Complexity (1=simple vocabulary, short sentences | 5=sophisticated vocabulary, complex sentences)
-- Certainty (1=hesitant, uncertain, questioning | 5=confident, assertive, definitive)
-- Social Orientation (1=self-focused, individual | 5=other-focused, community, relationships)
-
-Text: "{text}"
+    return await parse_trait_response(response.content, MbtiScores, "analyze.mbti")
 
-Think through your reasoning, then provide JSON:
-{{"formality": 3, "emotional_intensity": 2, "complexity": 4, "certainty": 3, "social_orientation": 5, "confidence": 0.8}}"""
-    
-    response = client.chat.completions.create(
+async def analyze_lexical(text: str) -> TraitAnalysis:
+    response = await gateway.chat(
         model="llama-3.3-70b-versatile",
-        messages=[
-            {"role": "system", "content": "You are a linguistic analysis expert. Think step-by-step, then provide JSON at the end."},
-            {"role": "user", "content": "Text: 'gonna meet up with friends later lol cant wait!!'"},
-            {"role": "assistant", "content": '{"formality": 1, "emotional_intensity": 4, "complexity": 1, "certainty": 4, "social_orientation": 5, "confidence": 0.95}'},
-            {"role": "user", "content": "Text: 'The implementation of this methodology requires careful consideration of various parameters.'"},
-            {"role": "assistant", "content": '{"formality": 5, "emotional_intensity": 1, "complexity": 5, "certainty": 3, "social_orientation": 1, "confidence": 0.9}'},
-            {"role": "user", "content": prompt}
-        ],
+        messages=prompts.ANALYZE_LEXICAL.messages(text=text),
         temperature=0.3,
-        max_tokens=10000
+        max_tokens=budget_for("analyze.trait", text),
+        site="analyze.lexical",
+        prompt=prompts.ANALYZE_LEXICAL.id
     )
     
-    content = response.choices[0].message.content.strip()
-    if not content:
-        raise ValueError("Empty response from model")
-    
-    json_start = content.rfind('{')
-    if json_start > 0:
-        raw_thinking = content[:json_start].strip()
-        thinking_data["lexical"] = raw_thinking
+    return await parse_trait_response(response.content, LexicalScores, "analyze.lexical")
+
+def analyze_lexical_local(text: str) -> TraitAnalysis:
+    """Lexical scores from surface features of the text, without a model call"""
+    features = local_lexical.extract_features(text)
+    scores = local_lexical.score(text, features)
+    return TraitAnalysis(scores=scores, thinking=local_lexical.explain(features, scores), refined=True)
+
+def blend_lexical(local: dict, llm: dict) -> dict:
+    """Confidence-weighted average of the local and LLM lexical scores"""
+    total = local["confidence"] + llm["confidence"] or 1.0
+    blended = {
+        trait: int(round((local[trait] * local["confidence"] + llm[trait] * llm["confidence"]) / total))
+        for trait in local_lexical.TRAITS
+    }
+    blended["confidence"] = round(max(local["confidence"], llm["confidence"]), 2)
+    return blended
+
+def default_lexical_mode() -> str:
+    mode = os.getenv("LEXICAL_MODE", "llm")
+    if mode not in ("local", "llm", "blended"):
+        raise ValueError(f"LEXICAL_MODE must be 'local', 'llm' or 'blended', got {mode!r}")
+    return mode
+
+async def score_lexical(text: str, mode: str) -> TraitAnalysis:
+    """Lexical features in ``mode``: local (no model call), llm, or blended (both, confidence-weighted)"""
+    local = analyze_lexical_local(text) if mode != "llm" else None
+    if mode == "local":
+        return local
     
-    match = re.search(r'\{[^{}]*\}', content, re.DOTALL)
-    if match:
-        return json.loads(match.group())
-    raise ValueError(f"No valid JSON found in response: {content[:200]}")
+    try:
+        analysis = await analyze_lexical(text)
+    except ValueError as e:
+        if local is None:
+            raise
+        print(f"LLM lexical analysis failed, using local scores: {e}")
+        return local
+    if mode == "blended":
+        analysis.scores = blend_lexical(local.scores, analysis.scores)
+    return analysis
+
+async def refine_trait(analysis: TraitAnalysis) -> str:
+    """Locally generated reasoning is already plain language and skips the rewrite call"""
+    if analysis.refined:
+        return analysis.thinking
+    return await refine_thinking(analysis.thinking)
+
+def fused_request(text: str) -> dict:
+    """gateway.chat arguments for the fused call; also the body of a provider batch line"""
+    return dict(
+        model="llama-3.3-70b-versatile",
+        messages=prompts.ANALYZE_FUSED.messages(text=text),
+        temperature=0.3,
+        max_tokens=budget_for("analyze.fused", text),
+        response_format={"type": "json_object"}
+    )
+
+async def analyze_fused(text: str) -> FusedAnalysis:
+    """OCEAN, MBTI, lexical scores, personality label and reasoning from a single structured call"""
+    response = await gateway.chat(**fused_request(text), site="analyze.fused", prompt=prompts.ANALYZE_FUSED.id)
+    return await parse_output(response.content, FusedAnalysis, "analyze.fused")
 
 def calculate_hybrid_score(ocean, mbti, lexical):
     ocean_avg = sum([ocean["openness"], ocean["conscientiousness"], ocean["extraversion"], 
@@ -194,364 +246,300 @@ def calculate_hybrid_score(ocean, mbti, lexical):
     return (ocean_avg * 2 + mbti_normalized * 2 + lexical_avg * 1) / 5
 
 async def classify_personality(ocean, mbti, lexical):
-    prompt = f"""Based on the following personality analysis, create a concise personality type label (1-2 words) and a brief description (3-5 words).
-
-OCEAN Scores:
-- Openness: {ocean['openness']}/5
-- Conscientiousness: {ocean['conscientiousness']}/5
-- Extraversion: {ocean['extraversion']}/5
-- Agreeableness: {ocean['agreeableness']}/5
-- Neuroticism: {ocean['neuroticism']}/5
-
-MBTI Type: {mbti['type']}
-
-Lexical Features:
-- Formality: {lexical['formality']}/5
-- Complexity: {lexical['complexity']}/5
+    """Personality label from the label table; the model is asked in the background for scores not seen before"""
+    return await personality_labels.label(ocean, mbti, lexical)
 
-Provide only JSON:
-{{"type": "Creative Thinker", "description": "Imaginative and analytical"}}"""
-    
-    response = client.chat.completions.create(
+async def ask_personality_label(ocean, mbti, lexical) -> Optional[dict]:
+    """The analyze.classify call behind the label table; None when its output does not parse"""
+    response = await gateway.chat(
         model="llama-3.3-70b-versatile",
-        messages=[
-            {"role": "system", "content": "You are a personality expert. Create concise, meaningful personality labels. Return only JSON."},
-            {"role": "user", "content": prompt}
-        ],
+        messages=prompts.CLASSIFY.messages(
+            openness=ocean['openness'], conscientiousness=ocean['conscientiousness'],
+            extraversion=ocean['extraversion'], agreeableness=ocean['agreeableness'],
+            neuroticism=ocean['neuroticism'], mbti_type=mbti['type'],
+            formality=lexical['formality'], complexity=lexical['complexity']
+        ),
         temperature=0.7,
-        max_tokens=100
+        max_tokens=100,
+        fallbacks=("llama-3.1-8b-instant",),
+        site="analyze.classify",
+        prompt=prompts.CLASSIFY.id
     )
     
-    content = response.choices[0].message.content.strip()
-    match = re.search(r'\{[^{}]*\}', content, re.DOTALL)
-    if match:
-        return json.loads(match.group())
-    return {"type": "Unique Individual", "description": "Complex personality profile"}
-
-async def extract_chat_with_mistral(base64_image: str):
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.post(
-            "https://api.mistral.ai/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {mistral_api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "pixtral-12b-2409",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": "Extract all messages from this WhatsApp chat screenshot. Identify messages by bubble color: GREEN bubbles are from the USER, WHITE/GRAY/BLACK bubbles are from OTHER person. Return ONLY valid JSON with this exact format: {\"user_content\": [\"message1\", \"message2\"], \"other_content\": [\"message1\", \"message2\"]}. Include only the message text, no timestamps or names."},
-                            {"type": "image_url", "image_url": f"data:image/jpeg;base64,{base64_image}"}
-                        ]
-                    }
-                ],
-                "max_tokens": 2000
-            }
-        )
-        content = response.json()["choices"][0]["message"]["content"].strip()
-        match = re.search(r'\{[^{}]*"user_content"[^{}]*"other_content"[^{}]*\}', content, re.DOTALL)
-        if match:
-            return json.loads(match.group())
-        raise ValueError("Failed to extract chat data")
+    try:
+        label = await parse_output(response.content, PersonalityLabel, "analyze.classify")
+        return label.model_dump()
+    except ModelOutputError:
+        return None
+
+personality_labels.classify = ask_personality_label
+
+async def extract_chat_with_mistral(image_url: str):
+    response = await gateway.chat(
+        model="pixtral-12b-2409",
+        messages=prompts.EXTRACT_CHAT.messages(images=[image_url]),
+        max_tokens=2000,
+        site="analyze_whatsapp.extract",
+        prompt=prompts.EXTRACT_CHAT.id
+    )
+    chat = await parse_output(response.content, ChatExtraction, "analyze_whatsapp.extract", reask=reask_json)
+    if chat.messages:
+        chat.user_content = [m.text for m in chat.messages if m.side == "user"]
+        chat.other_content = [m.text for m in chat.messages if m.side == "other"]
+    return chat.model_dump()
+
+async def analyze_social_behavior(user_messages: list, other_messages: list, measured: Optional[str] = None):
+    """All eight metrics from the model, for transcripts whose turn order is unknown"""
+    key = cache_key(
+        "social_behavior",
+        user=user_messages,
+        other=other_messages,
+        measured=measured,
+        model="llama-3.3-70b-versatile",
+        prompt_version=prompts.SOCIAL_BEHAVIOR.id,
+        temperature=0.3
+    )
+    return await result_cache.get_or_compute(key, lambda: social_behavior_call(user_messages, other_messages, measured))
 
-async def analyze_social_behavior(user_messages: list, other_messages: list):
+async def social_behavior_call(user_messages: list, other_messages: list, measured: Optional[str] = None):
     user_text = " ".join(user_messages)
     other_text = " ".join(other_messages)
+    measured_section = f"""
+Measured over the whole chat (exact counts, not estimates; base Conversation Initiation, Response Engagement and Social Reciprocity on these):
+{measured}
+""" if measured else ""
     
-    prompt = f"""Analyze this person's social media behavior based on their WhatsApp messages. Use clinical psychological metrics.
-
-User's Messages: {user_text}
-Other Person's Messages: {other_text}
-
-Analyze these clinical metrics (1-5 scale):
-- Response Engagement (1=dismissive, brief | 5=engaged, detailed responses)
-- Emotional Expressiveness (1=flat, minimal emotion | 5=highly expressive, emotive)
-- Conversation Initiation (1=passive, reactive | 5=proactive, initiates topics)
-- Social Reciprocity (1=self-focused, ignores cues | 5=balanced, reciprocal)
-- Attachment Style (1=avoidant, distant | 5=secure, warm)
-- Communication Clarity (1=vague, ambiguous | 5=clear, direct)
-- Empathy Display (1=low empathy, dismissive | 5=high empathy, validating)
-- Boundary Management (1=poor boundaries | 5=healthy boundaries)
-
-Return JSON:
-{{"response_engagement": 3, "emotional_expressiveness": 4, "conversation_initiation": 2, "social_reciprocity": 4, "attachment_style": 3, "communication_clarity": 4, "empathy_display": 5, "boundary_management": 3, "confidence": 0.8, "behavioral_summary": "Brief description"}}"""
-    
-    response = client.chat.completions.create(
+    response = await gateway.chat(
         model="llama-3.3-70b-versatile",
-        messages=[
-            {"role": "system", "content": "You are a clinical psychologist analyzing social media behavior patterns. Return only JSON."},
-            {"role": "user", "content": prompt}
-        ],
+        messages=prompts.SOCIAL_BEHAVIOR.messages(user_text=user_text, other_text=other_text, measured=measured_section),
         temperature=0.3,
-        max_tokens=1000
+        max_tokens=1000,
+        site="analyze_whatsapp.behavior",
+        prompt=prompts.SOCIAL_BEHAVIOR.id
+    )
+    
+    behavior = await parse_output(response.content, SocialBehavior, "analyze_whatsapp.behavior", reask=reask_json)
+    return behavior.model_dump(exclude_none=True)
+
+async def analyze_semantic_behavior(transcript: list) -> dict:
+    """The five metrics that need reading the messages; the structural ones are counted in social_metrics"""
+    conversation = social_metrics.render(transcript)
+    key = cache_key(
+        "social_semantic",
+        conversation=conversation,
+        model="llama-3.3-70b-versatile",
+        prompt_version=prompts.SOCIAL_SEMANTIC.id,
+        temperature=0.3
     )
     
-    content = response.choices[0].message.content.strip()
-    match = re.search(r'\{[^{}]*\}', content, re.DOTALL)
-    if match:
-        return json.loads(match.group())
-    raise ValueError("Failed to analyze behavior")
+    async def compute():
+        response = await gateway.chat(
+            model="llama-3.3-70b-versatile",
+            messages=prompts.SOCIAL_SEMANTIC.messages(conversation=conversation),
+            temperature=0.3,
+            max_tokens=budget_for("analyze_whatsapp.semantic"),
+            site="analyze_whatsapp.semantic",
+            prompt=prompts.SOCIAL_SEMANTIC.id
+        )
+        behavior = await parse_output(response.content, SemanticBehavior, "analyze_whatsapp.semantic", reask=reask_json)
+        return behavior.model_dump(exclude_none=True)
+    
+    return await result_cache.get_or_compute(key, compute)
+
+def scoring_tier(items: List[ResponseScore]) -> str:
+    """Pick the few-shot tier for the longest of ``items``"""
+    if any(item.category == "suicidal_ideation" for item in items):
+        return "full"
+    longest = max(len(item.response.split()) for item in items)
+    if longest <= 6:
+        return "brief"
+    return "standard" if longest <= 40 else "full"
+
+async def score_single_response(input_data: ResponseScore) -> dict:
+    """Score a single response on 0-3 scale using LLM with Chain-of-Thought reasoning
+    
+    Other than suicidal_ideation items, an answer close enough to earlier answers to the same
+    question, which the model all scored alike, reuses that score (see answer_index.py).
+    """
+    crisis_item = input_data.category == "suicidal_ideation"
+    match = None
+    if not crisis_item:
+        group = answer_index.group_key(input_data.question, input_data.category, prompts.SCORE_RESPONSE.id)
+        match = answer_index.lookup(group, input_data.response)
+        if match is not None:
+            telemetry.current_span().set(answer_index="audit" if match.audit else "hit",
+                                         similarity=round(match.similarity, 3))
+            if not match.audit:
+                return {"score": match.score, "reasoning": match.reasoning, "crisis": False}
+    
+    with scheduler.request_class("crisis") if crisis_item else nullcontext():
+        response = await gateway.chat(
+            model="llama-3.3-70b-versatile",
+            messages=prompts.SCORE_RESPONSE.messages(
+                scoring_tier([input_data]), question=input_data.question, category=input_data.category,
+                response=input_data.response
+            ),
+            temperature=0.2,
+            max_tokens=budget_for("score_response", input_data.response),
+            site="score_response",
+            prompt=prompts.SCORE_RESPONSE.id
+        )
+    
+    result = await parse_output(response.content, ScoreResult, "score_response", reask=reask_json)
+    if not crisis_item:
+        answer_index.add(group, input_data.response, result.score, result.reasoning, audited=match)
+    crisis = crisis_item and result.score >= 2
+    return {"score": result.score, "reasoning": result.reasoning, "crisis": crisis}
 
 @app.post("/api/score-response")
 @app.post("/score-response")
 async def score_response(input_data: ResponseScore):
-    """Score a single response on 0-3 scale using LLM with Chain-of-Thought reasoning"""
-    prompt = f"""You are an expert clinical psychologist with 20+ years of experience in depression assessment and mental health evaluation. Use comprehensive Chain-of-Thought reasoning to analyze this response.
-
-Question: {input_data.question}
-Category: {input_data.category}
-User Response: "{input_data.response}"
-
-=== CHAIN-OF-THOUGHT ANALYSIS PROCESS ===
-
-Step 1: LINGUISTIC ANALYSIS
-- Identify key emotional words, phrases, and linguistic markers
-- Analyze tone (hopeful, neutral, distressed, desperate)
-- Note intensity indicators (always, never, sometimes, occasionally)
-- Detect temporal markers (lately, always, used to, now)
-
-Step 2: SYMPTOM SEVERITY MAPPING
-- Map response to clinical depression indicators
-- Consider frequency (how often symptoms occur)
-- Assess duration (how long symptoms persist)
-- Evaluate functional impairment (impact on daily life)
-
-Step 3: CONTEXTUAL INTERPRETATION
-- Distinguish between temporary mood vs persistent state
-- Identify coping mechanisms or lack thereof
-- Recognize minimization or exaggeration patterns
-- Consider cultural and linguistic variations in expression
-
-Step 4: EDGE CASE HANDLING
-- Ambiguous responses ("I'm okay I guess")
-- Contradictory statements ("I'm fine but everything feels pointless")
-- Deflection or avoidance ("I don't know", "whatever")
-- Extreme brevity ("bad", "terrible", "fine")
-- Metaphorical language ("drowning", "empty shell")
-- Sarcasm or dark humor masking distress
-
-Step 5: SCORE DETERMINATION
-0 = No symptoms / Positive state / Healthy functioning
-1 = Mild symptoms / Occasional distress / Minimal impairment
-2 = Moderate symptoms / Frequent distress / Notable impairment
-3 = Severe symptoms / Persistent distress / Significant impairment
-
-=== COMPREHENSIVE FEW-SHOT EXAMPLES ===
-
-Example 1 (Score 0):
-Response: "I've been feeling really good lately, energized and optimistic about the future"
-Analysis: Positive emotional state, energy present, future-oriented thinking, no distress indicators
-Score: 0
-
-Example 2 (Score 1):
-Response: "I'm okay, just a bit stressed with work but managing"
-Analysis: Mild stress acknowledged, coping mechanisms implied ("managing"), temporary situational factor
-Score: 1
-
-Example 3 (Score 1 - Ambiguous):
-Response: "I don't know, I guess I'm fine"
-Analysis: Uncertainty suggests mild disconnection, "I guess" indicates lack of conviction, but no severe distress
-Score: 1
-
-Example 4 (Score 2):
-Response: "I feel sad most days and it's hard to enjoy things I used to love"
-Analysis: Frequency indicator ("most days"), anhedonia present, past vs present comparison shows decline
-Score: 2
-
-Example 5 (Score 2 - Deflection):
-Response: "Whatever, does it even matter?"
-Analysis: Deflection masks distress, existential questioning, apathy indicator, suggests moderate hopelessness
-Score: 2
-
-Example 6 (Score 3):
-Response: "I feel completely hopeless, like there's no point in anything anymore"
-Analysis: Absolute language ("completely", "no point"), pervasive hopelessness, existential despair
-Score: 3
-
-Example 7 (Score 3 - Metaphorical):
-Response: "I'm drowning and nobody can see it, I'm just an empty shell going through motions"
-Analysis: Drowning metaphor indicates overwhelming distress, depersonalization ("empty shell"), severe disconnection
-Score: 3
-
-Example 8 (Score 1 - Brief positive):
-Response: "Good"
-Analysis: Brief but positive, no distress indicators, assume healthy state unless context suggests otherwise
-Score: 0
-
-Example 9 (Score 2 - Contradictory):
-Response: "I'm fine really, just that everything feels meaningless and I can't get out of bed"
-Analysis: Contradiction between "fine" and severe symptoms, minimization pattern, functional impairment evident
-Score: 2
-
-Example 10 (Score 3 - Suicidal ideation):
-Response: "I keep thinking everyone would be better off without me, I have a plan"
-Analysis: Active suicidal ideation, plan formation, severe risk indicator, immediate concern
-Score: 3, CRISIS
-
-Example 11 (Score 1 - Suicidal ideation):
-Response: "Sometimes I wonder what it would be like to not exist, but I'd never do anything"
-Analysis: Passive ideation, no intent or plan, philosophical wondering, low immediate risk
-Score: 1
-
-Example 12 (Score 2 - Sleep issues):
-Response: "I barely sleep anymore, maybe 2-3 hours a night, and I'm exhausted all the time"
-Analysis: Severe sleep disruption, chronic pattern, functional impairment (exhaustion), moderate severity
-Score: 2
-
-=== YOUR TASK ===
-
-Now analyze the user's response using the complete Chain-of-Thought process above. Think through ALL steps comprehensively, then provide your final answer as JSON.
-
-Return format:
-{{"score": 2, "reasoning": "Detailed multi-sentence explanation of your analysis", "crisis": false}}"""
+    """Score one answer; with a session_id it is also recorded in that questionnaire session
     
+    An unknown or expired session, or a bad index, does not stop the scoring: the result then
+    carries a ``session_warning`` and the client falls back to scoring the rest without the session.
+    """
+    key = cache_key(
+        "score_response",
+        question=input_data.question,
+        category=input_data.category,
+        response=normalize_text(input_data.response, casefold=True),
+        model="llama-3.3-70b-versatile",
+        prompt_version=prompts.SCORE_RESPONSE.id,
+        temperature=0.2
+    )
+    answer = None
+    session_warning = None
+    if input_data.session_id is not None:
+        try:
+            answer = await session_store.answer_started(input_data.session_id, input_data.index, input_data.response)
+        except sessions.SessionError as e:
+            # Recording is best-effort: the score (and its crisis flag) must reach the client regardless.
+            session_warning = str(e)
+    result = None
     try:
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": "You are an expert clinical psychologist. Use comprehensive Chain-of-Thought reasoning. Think deeply through all steps, then return JSON with detailed reasoning."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2,
-            max_tokens=2000
-        )
-        
-        content = response.choices[0].message.content.strip()
-        match = re.search(r'\{[^{}]*\}', content, re.DOTALL)
-        if match:
-            result = json.loads(match.group())
-            score = result.get("score", 1)
-            crisis = input_data.category == "suicidal_ideation" and score >= 2
-            return {"score": score, "reasoning": result.get("reasoning", ""), "crisis": crisis}
-        return {"score": 1, "reasoning": "Default score", "crisis": False}
+        result = await result_cache.get_or_compute(key, lambda: score_single_response(input_data))
+    except scheduler.Overloaded:
+        # A made-up score would be worse than asking the client to retry.
+        raise
     except Exception as e:
         print(f"Scoring error: {e}")
-        return {"score": 1, "reasoning": "Error in scoring", "crisis": False}
+        result = {"score": 1, "reasoning": "Error in scoring", "crisis": False}
+    finally:
+        if answer is not None:
+            await session_store.answer_scored(input_data.session_id, input_data.index, answer, result)
+    if session_warning is not None:
+        return dict(result, session_warning=session_warning)
+    return result
+
+async def score_packed_responses(items: List[ResponseScore]) -> List[dict]:
+    """Score several non-crisis responses with one shared copy of the scoring guide"""
+    listed = "\n\n".join(
+        f'Item {i}\nQuestion: {item.question}\nCategory: {item.category}\nUser Response: "{item.response}"'
+        for i, item in enumerate(items, 1)
+    )
+    response = await gateway.chat(
+        model="llama-3.3-70b-versatile",
+        messages=prompts.SCORE_PACKED.messages(scoring_tier(items), listed=listed),
+        temperature=0.2,
+        max_tokens=budget_for("score_responses.packed", listed, items=len(items)),
+        site="score_responses.packed",
+        prompt=prompts.SCORE_PACKED.id
+    )
+    
+    packed = await parse_output(response.content, PackedScores, "score_responses.packed")
+    scored = {entry.id: entry for entry in packed.results}
+    
+    results = []
+    for i, item in enumerate(items, 1):
+        entry = scored.get(i)
+        if entry is None:
+            results.append(await score_response(item))
+        else:
+            results.append({"score": entry.score, "reasoning": entry.reasoning, "crisis": False})
+    return results
+
+@app.post("/api/score-responses")
+@app.post("/score-responses")
+async def score_responses(input_data: ResponseScoreBatch):
+    """Score a whole questionnaire in one request, optionally with the final depression analysis.
+    
+    With batch_size 1 every item is scored concurrently with the single-item prompt; larger
+    values pack that many items into each prompt. suicidal_ideation items are always scored
+    on their own so crisis detection keeps the full single-item analysis.
+    """
+    batch_size = input_data.batch_size
+    if batch_size is None:
+        batch_size = int(os.getenv("SCORE_BATCH_SIZE", "1"))
+    if batch_size < 1:
+        raise HTTPException(status_code=400, detail="batch_size must be at least 1")
+    
+    items = input_data.items
+    single = [i for i, item in enumerate(items) if batch_size == 1 or item.category == "suicidal_ideation"]
+    packed = sorted(set(range(len(items))) - set(single))
+    chunks = [packed[n:n + batch_size] for n in range(0, len(packed), batch_size)]
+    
+    async def score_chunk(indices):
+        try:
+            return await score_packed_responses([items[i] for i in indices])
+        except scheduler.Overloaded:
+            raise
+        except Exception as e:
+            print(f"Packed scoring error, scoring items individually: {e}")
+            return await gather_or_cancel(*(score_response(items[i]) for i in indices))
+    
+    single_results, chunk_results = await gather_or_cancel(
+        gather_or_cancel(*(score_response(items[i]) for i in single)),
+        gather_or_cancel(*(score_chunk(chunk) for chunk in chunks))
+    )
+    
+    results = [None] * len(items)
+    for i, result in zip(single, single_results):
+        results[i] = result
+    for chunk, scored in zip(chunks, chunk_results):
+        for i, result in zip(chunk, scored):
+            results[i] = result
+    
+    total_score = sum(result["score"] for result in results)
+    response = {"results": results, "total_score": total_score, "crisis": any(r["crisis"] for r in results)}
+    if input_data.include_summary:
+        response["summary"] = await analyze_depression(
+            DepressionAnalysis(total_score=total_score, responses=[item.response for item in items])
+        )
+    return response
 
 @app.post("/api/analyze-depression")
 @app.post("/analyze-depression")
 async def analyze_depression(input_data: DepressionAnalysis):
     """Provide comprehensive personalized analysis with Chain-of-Thought reasoning and detailed recommendations"""
     score = input_data.total_score
-    responses_text = " ".join(input_data.responses)
-    
-    # Determine severity level
-    if score <= 5:
-        level = "Minimal"
-        severity = "minimal"
-    elif score <= 10:
-        level = "Mild"
-        severity = "mild"
-    elif score <= 15:
-        level = "Moderate"
-        severity = "moderate"
-    elif score <= 20:
-        level = "Moderately Severe"
-        severity = "moderately_severe"
-    else:
-        level = "Severe"
-        severity = "severe"
-    
-    prompt = f"""Analyze depression assessment. Score: {score}/30, Level: {level}, Responses: {responses_text}
-
-Return JSON with 4 fields:
-1. "reasoning": Brief analysis of symptom patterns and severity
-2. "detailed_analysis": 2-3 sentence clinical assessment
-3. "message": Empathetic 2-3 sentence personalized message
-4. "recommendations": Array of 5-7 actionable recommendations
-
-Example:
-{{
-    "reasoning": "Score indicates {severity} depression with symptoms of [key patterns]. Requires [intervention level].",
-    "detailed_analysis": "Your responses show [main symptoms]. This impacts [areas of life].",
-    "message": "Taking this assessment shows strength. These feelings can improve with support.",
-    "recommendations": [
-        "Try 4-7-8 breathing before bed for better sleep",
-        "Schedule consultation with mental health professional",
-        "Get 10-15 min morning sunlight daily",
-        "Do one enjoyable activity for 10 min, 3x this week",
-        "Reach out to one trusted person this week"
-    ]
-}}
-
-Be concise but helpful. Return only JSON."""
-    
+    return await depression_summary(str(score), sessions.severity_level(score), " ".join(input_data.responses))
+
+async def depression_summary(score: str, level: str, responses_text: str) -> dict:
+    """The analyze_depression summary; ``score`` may be a range while a session's last answers are being scored"""
     try:
-        response = client.chat.completions.create(
+        response = await gateway.chat(
             model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": "You are an expert mental health counselor. Provide COMPREHENSIVE, DETAILED, UNRESTRICTED analysis. Use complete Chain-of-Thought reasoning. Be thorough and specific. Return JSON with extensive content."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=prompts.DEPRESSION_SUMMARY.messages(score=score, level=level, responses=responses_text),
             temperature=0.7,
-            max_tokens=1000
+            max_tokens=1000,
+            site="analyze_depression",
+            prompt=prompts.DEPRESSION_SUMMARY.id
         )
         
-        content = response.choices[0].message.content.strip()
+        content = response.content.strip()
         print(f"\n=== RAW RESPONSE (first 1000 chars) ===\n{content[:1000]}\n")
         
-        # Extract JSON with proper brace matching
-        def extract_json(text):
-            start = text.find('{')
-            if start == -1:
-                return None
-            
-            brace_count = 0
-            in_string = False
-            escape = False
-            
-            for i in range(start, len(text)):
-                char = text[i]
-                
-                if escape:
-                    escape = False
-                    continue
-                    
-                if char == '\\':
-                    escape = True
-                    continue
-                    
-                if char == '"':
-                    in_string = not in_string
-                    continue
-                    
-                if not in_string:
-                    if char == '{':
-                        brace_count += 1
-                    elif char == '}':
-                        brace_count -= 1
-                        if brace_count == 0:
-                            return text[start:i+1]
-            return None
-        
-        json_str = extract_json(content)
-        if not json_str:
-            raise ValueError("No valid JSON found in response")
-        
-        # Sanitize control characters
-        json_str = json_str.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
+        result = await parse_output(content, DepressionSummary, "analyze_depression", reask=reask_json)
+        print(f"\n=== PARSED RESULT ===\nRecommendations count: {len(result.recommendations)}\n")
         
-        try:
-            result = json.loads(json_str)
-            print(f"\n=== PARSED RESULT ===\nKeys: {list(result.keys())}\nRecommendations count: {len(result.get('recommendations', []))}\n")
-            
-            return {
-                "level": level,
-                "reasoning": result.get("reasoning", ""),
-                "detailed_analysis": result.get("detailed_analysis", ""),
-                "message": result.get("message", "You're taking an important step by checking in with yourself."),
-                "recommendations": result.get("recommendations", [
-                    "Practice deep breathing for 5 minutes daily",
-                    "Reach out to a friend or family member",
-                    "Maintain a regular sleep schedule"
-                ])
-            }
-        except json.JSONDecodeError as je:
-            print(f"\n=== JSON DECODE ERROR ===\n{je}")
-            print(f"\n=== ATTEMPTED TO PARSE ===\n{json_str[:500]}\n")
-            raise
+        return {
+            "level": level,
+            "reasoning": result.reasoning,
+            "detailed_analysis": result.detailed_analysis,
+            "message": result.message,
+            "recommendations": result.recommendations
+        }
     except Exception as e:
         print(f"\n=== ANALYSIS ERROR ===\n{e}")
         import traceback
@@ -566,80 +554,683 @@ Be concise but helpful. Return only JSON."""
             "Spend 10-15 minutes outside in natural light each day",
             "Connect with someone you trust, even if just for a brief chat",
             "Engage in one activity you used to enjoy, even if you don't feel like it",
-            "Consider speaking with a mental health professional" if score > 15 else "Practice self-compassion - be kind to yourself"
+            "Consider speaking with a mental health professional" if level in ("Moderately Severe", "Severe")
+            else "Practice self-compassion - be kind to yourself"
         ]
     }
 
-@app.post("/api/analyze-whatsapp")
-@app.post("/analyze-whatsapp")
-async def analyze_whatsapp(input_data: ImageInput):
+session_store.summarize = depression_summary
+
+@app.post("/api/sessions")
+@app.post("/sessions")
+async def start_session(input_data: SessionStart):
+    """Open a questionnaire session; its answers are then scored with its session_id and their index"""
+    return (await session_store.create(input_data.questions)).view()
+
+@app.get("/api/sessions/{session_id}")
+@app.get("/sessions/{session_id}")
+async def session_state(session_id: str):
+    """Running total, severity band (once it can no longer change) and crisis flags of a session"""
+    return (await session_store.get(session_id)).view()
+
+@app.post("/api/sessions/{session_id}/finish")
+@app.post("/sessions/{session_id}/finish")
+async def finish_session(session_id: str):
+    """Scores, total and summary of a complete session, in the /score-responses shape
+    
+    The summary has usually been started while the last answer was scored (see sessions.py),
+    so this returns as soon as it is done.
+    """
+    return await session_store.finish(session_id)
+
+async def prepare_image(data: bytes) -> images.PreparedImage:
+    """Decode, crop, downscale and re-encode off the event loop"""
     try:
-        chat_data = await extract_chat_with_mistral(input_data.image)
-        analysis = await analyze_social_behavior(chat_data["user_content"], chat_data["other_content"])
-        
-        return {
-            "chat_data": chat_data,
-            "social_behavior": analysis,
-            "personality_type": {
-                "type": "Social Communicator",
-                "description": analysis.get("behavioral_summary", "Analyzed from chat patterns")
-            }
+        return await asyncio.get_running_loop().run_in_executor(None, images.prepare, data)
+    except images.ImageError as e:
+        raise HTTPException(status_code=413 if len(data) > images.max_upload_bytes() else 400, detail=str(e))
+
+async def extract_screenshot(data: bytes) -> dict:
+    """Preprocess one screenshot and extract its messages, cached per image"""
+    key = cache_key(
+        "extract_chat",
+        image=hashlib.sha256(data).hexdigest(),
+        preprocessing=images.settings(),
+        model="pixtral-12b-2409",
+        prompt_version=prompts.EXTRACT_CHAT.id
+    )
+    
+    async def compute():
+        image = await prepare_image(data)
+        print(f"Screenshot {image.original_bytes} -> {len(image.data)} bytes ({image.mime}, {image.width}x{image.height})")
+        return await extract_chat_with_mistral(image.data_url)
+    
+    return await result_cache.get_or_compute(key, compute)
+
+def whatsapp_response(chat_data: dict, analysis: dict) -> dict:
+    return {
+        "chat_data": chat_data,
+        "social_behavior": analysis,
+        "personality_type": {
+            "type": "Social Communicator",
+            "description": analysis.get("behavioral_summary", "Analyzed from chat patterns")
         }
+    }
+
+def default_social_mode() -> str:
+    mode = os.getenv("SOCIAL_METRICS_MODE", "local").lower()
+    return mode if mode in ("local", "llm") else "local"
+
+def chat_transcript(chat_data: dict) -> Optional[list]:
+    """Ordered (side, text) pairs, or None when the extraction only kept each side's messages"""
+    if not chat_data.get("messages"):
+        return None
+    return [(message["side"], message["text"]) for message in chat_data["messages"]]
+
+async def behavior_events(chat_data: dict, transcript: Optional[list] = None, summary: Optional[dict] = None,
+                          measured: Optional[str] = None, extra: Optional[dict] = None, report_chunks: bool = False):
+    """Yields ("structural", ...) as soon as the locally counted metrics are known, then ("done", response).
+    
+    Without an ordered transcript, or in SOCIAL_METRICS_MODE=llm, all eight metrics come from the model.
+    """
+    extra = extra or {}
+    chunk_tokens = int(os.getenv("WHATSAPP_CHUNK_TOKENS", "3000"))
+    
+    if transcript is not None and default_social_mode() == "local":
+        structural = social_metrics.score(summary or social_metrics.features(transcript))
+        yield "structural", dict(extra, chat_data=chat_data, structural=structural)
+        chunks = whatsapp.chunk_ordered(transcript, chunk_tokens)
+        results = await gather_or_cancel(*(analyze_semantic_behavior(chunk) for chunk in chunks))
+        semantic = results[0] if len(results) == 1 else whatsapp.combine_behavior(
+            results, [len(social_metrics.render(chunk)) for chunk in chunks]
+        )
+        analysis = social_metrics.combine(structural, semantic)
+    else:
+        chunks = whatsapp.chunk_transcript(chat_data["user_content"], chat_data["other_content"], chunk_tokens)
+        results = await gather_or_cancel(*(analyze_social_behavior(u, o, measured) for u, o in chunks))
+        analysis = results[0] if len(results) == 1 else whatsapp.combine_behavior(
+            results, [len(" ".join(u + o)) for u, o in chunks]
+        )
+    
+    response = whatsapp_response(chat_data, analysis)
+    response.update(extra)
+    if report_chunks:
+        response["chunks"] = len(chunks)
+    yield "done", response
+
+async def whatsapp_result(events, stream: bool = False):
+    """The final response of a behavior_events generator, or all of its events as server-sent events"""
+    if stream:
+        async def sse():
+            try:
+                async for event, data in events:
+                    yield sse_event(event, data)
+            except HTTPException as e:
+                yield sse_event("error", {"detail": e.detail})
+            except Exception as e:
+                print(f"Error: {e}")
+                import traceback
+                traceback.print_exc()
+                yield sse_event("error", {"detail": str(e)})
+        
+        return StreamingResponse(sse(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    try:
+        async for event, data in events:
+            if event == "done":
+                return data
+    except (HTTPException, scheduler.Overloaded):
+        raise
     except Exception as e:
         print(f"Error: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/analyze")
-@app.post("/analyze")
-async def analyze_text(input_data: TextInput):
+async def image_events(data: bytes):
+    chat_data = await extract_screenshot(data)
+    async for event in behavior_events(chat_data, chat_transcript(chat_data)):
+        yield event
+
+async def conversation_events(screenshots: List[bytes]):
+    """One social behavior analysis for a conversation spread over several screenshots, in scroll order"""
+    pool = asyncio.Semaphore(int(os.getenv("WHATSAPP_EXTRACT_CONCURRENCY", "4")))
+    
+    async def extract(data):
+        async with pool:
+            return await extract_screenshot(data)
+    
+    extracted = await gather_or_cancel(*(extract(data) for data in screenshots))
+    transcripts = [chat_transcript(chat) for chat in extracted]
+    if all(t is not None for t in transcripts):
+        transcript, repeats = whatsapp.merge_overlapping(transcripts)
+        user, other = social_metrics.split(transcript)
+        chat_data = {"messages": [{"side": side, "text": text} for side, text in transcript],
+                     "user_content": user, "other_content": other}
+    else:
+        transcript = None
+        user, user_repeats = whatsapp.merge_overlapping([chat["user_content"] for chat in extracted])
+        other, other_repeats = whatsapp.merge_overlapping([chat["other_content"] for chat in extracted])
+        repeats = user_repeats + other_repeats
+        chat_data = {"user_content": user, "other_content": other}
+    
+    extra = {"screenshots": len(screenshots), "duplicates_removed": repeats}
+    async for event in behavior_events(chat_data, transcript, extra=extra, report_chunks=True):
+        yield event
+
+@app.post("/api/analyze-whatsapp")
+@app.post("/analyze-whatsapp")
+async def analyze_whatsapp(input_data: ImageInput, stream: bool = False):
+    try:
+        data = images.decode_base64(input_data.image)
+    except images.ImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await whatsapp_result(image_events(data), stream)
+
+@app.post("/api/analyze-whatsapp/upload")
+@app.post("/analyze-whatsapp/upload")
+async def analyze_whatsapp_upload(request: Request, stream: bool = False):
+    """Binary variant of /analyze-whatsapp: a raw image body or a multipart form with an ``image`` file field"""
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("image") or form.get("file")
+        if upload is None or not hasattr(upload, "read"):
+            raise HTTPException(status_code=400, detail="Multipart upload needs an 'image' file field")
+        data = await upload.read()
+    else:
+        data = await request.body()
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    if len(data) > images.max_upload_bytes():
+        raise HTTPException(status_code=413, detail=f"Image is larger than {images.max_upload_bytes()} bytes")
+    return await whatsapp_result(image_events(data), stream)
+
+@app.post("/api/analyze-whatsapp/conversation")
+@app.post("/analyze-whatsapp/conversation")
+async def analyze_whatsapp_conversation(request: Request, stream: bool = False):
+    """Several screenshots of one chat, in scroll order: a JSON body ``{"images": [base64, ...]}``
+    or a multipart form with repeated ``image`` file fields"""
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        screenshots = [await upload.read() for upload in form.getlist("image") if hasattr(upload, "read")]
+    else:
+        try:
+            input_data = ImagesInput.model_validate(await request.json())
+            screenshots = [images.decode_base64(image) for image in input_data.images]
+        except (ValueError, ValidationError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    limit = int(os.getenv("WHATSAPP_MAX_SCREENSHOTS", "20"))
+    if not screenshots:
+        raise HTTPException(status_code=400, detail="At least one screenshot is required")
+    if len(screenshots) > limit:
+        raise HTTPException(status_code=400, detail=f"At most {limit} screenshots per conversation")
+    if any(len(data) > images.max_upload_bytes() for data in screenshots):
+        raise HTTPException(status_code=413, detail=f"Each image must be at most {images.max_upload_bytes()} bytes")
+    return await whatsapp_result(conversation_events(screenshots), stream)
+
+def export_max_bytes() -> int:
+    return int(os.getenv("WHATSAPP_EXPORT_MAX_BYTES", str(100 * 1024 * 1024)))
+
+async def spool_upload(chunks) -> tuple:
+    """Copy an upload to a temporary file, in memory while small"""
+    file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > export_max_bytes():
+            file.close()
+            raise HTTPException(status_code=413, detail=f"Export is larger than {export_max_bytes()} bytes")
+        file.write(chunk)
+    return file, size
+
+async def read_upload(upload):
+    while True:
+        chunk = await upload.read(64 * 1024)
+        if not chunk:
+            break
+        yield chunk
+
+async def export_events(file, user: Optional[str]):
+    """Social behavior of an exported chat: structure counted over the whole file, the LLM on the recent excerpt"""
+    from . import chat_export  # the export parser loads with the first export, not on every cold start
+    
+    try:
+        stats = await asyncio.get_running_loop().run_in_executor(
+            None, chat_export.read_stats, file, export_max_bytes(),
+            timedelta(hours=float(os.getenv("WHATSAPP_SESSION_GAP_HOURS", "6"))),
+            int(os.getenv("WHATSAPP_CHUNK_TOKENS", "3000"))
+        )
+    except chat_export.ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        file.close()
+    
+    if user is not None and user not in stats.participants:
+        raise HTTPException(status_code=400, detail=f"'{user}' is not in this chat; participants: {sorted(stats.participants)}")
+    user = user or stats.default_user()
+    summary = stats.summary(user)
+    transcript = stats.transcript(user)
+    print(f"Export: {stats.messages} messages, {summary['participants']} participants, {len(transcript)} in the excerpt")
+    
+    user_messages, other_messages = social_metrics.split(transcript)
+    chat_data = {"messages": [{"side": side, "text": text} for side, text in transcript],
+                 "user_content": user_messages, "other_content": other_messages}
+    extra = {"user": user, "participants": sorted(stats.participants), "messages": stats.messages,
+             "conversation_stats": summary}
+    async for event in behavior_events(chat_data, transcript, summary, chat_export.describe(summary), extra):
+        yield event
+
+@app.post("/api/analyze-whatsapp/export")
+@app.post("/analyze-whatsapp/export")
+async def analyze_whatsapp_export(request: Request, user: Optional[str] = None, stream: bool = False):
+    """An exported chat (.txt, or the .zip WhatsApp produces with media) as the raw body or a multipart
+    ``file`` field; ``user`` is the participant to analyze, the most active one if omitted"""
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file") or form.get("export")
+        if upload is None or not hasattr(upload, "read"):
+            raise HTTPException(status_code=400, detail="Multipart upload needs a 'file' field")
+        user = user or form.get("user") or None
+        file, size = await spool_upload(read_upload(upload))
+    else:
+        file, size = await spool_upload(request.stream())
+    if not size:
+        file.close()
+        raise HTTPException(status_code=400, detail="Empty upload")
+    return await whatsapp_result(export_events(file, user), stream)
+
+async def run_split_analysis(text: str, lexical_mode: Optional[str] = None) -> dict:
+    """Chain-of-thought trait calls, refine calls and the personality label (one call fewer per stage with local lexical)"""
+    ocean, mbti, lexical_analysis = await gather_or_cancel(
+        analyze_ocean(text),
+        analyze_mbti(text),
+        score_lexical(text, lexical_mode or default_lexical_mode())
+    )
+    
+    refined_ocean, refined_mbti, refined_lexical = await gather_or_cancel(
+        refine_trait(ocean),
+        refine_trait(mbti),
+        refine_trait(lexical_analysis)
+    )
+    
+    personality = await classify_personality(ocean.scores, mbti.scores, lexical_analysis.scores)
+    
+    return {
+        "ocean": ocean.scores,
+        "mbti": mbti.scores,
+        "lexical": lexical_analysis.scores,
+        "personality_type": personality,
+        "thinking": {
+            "ocean": refined_ocean,
+            "mbti": refined_mbti,
+            "lexical": refined_lexical
+        }
+    }
+
+async def run_fused_analysis(text: str) -> dict:
+    return fused_result(await analyze_fused(text))
+
+def fused_result(fused: FusedAnalysis) -> dict:
+    return {
+        "ocean": fused.ocean.model_dump(),
+        "mbti": fused.mbti.model_dump(),
+        "lexical": fused.lexical.model_dump(),
+        "personality_type": fused.personality_type.model_dump(),
+        "thinking": fused.reasoning.model_dump()
+    }
+
+async def analyze_chunk(chunk: str, mode: str, lexical_mode: str) -> dict:
+    """OCEAN, MBTI and lexical analyses of one chunk of a long text, without the refine and classify calls"""
+    if mode == "fused":
+        try:
+            fused = await analyze_fused(chunk)
+            return {
+                family: TraitAnalysis(scores=getattr(fused, family).model_dump(),
+                                      thinking=getattr(fused.reasoning, family), refined=True)
+                for family in longtext.TRAITS
+            }
+        except (ValueError, ValidationError) as e:
+            print(f"Fused chunk analysis failed, falling back to split mode: {e}")
+    ocean, mbti, lexical_analysis = await gather_or_cancel(
+        analyze_ocean(chunk),
+        analyze_mbti(chunk),
+        score_lexical(chunk, lexical_mode)
+    )
+    return {"ocean": ocean, "mbti": mbti, "lexical": lexical_analysis}
+
+async def summarize_reasoning(analyses: List[TraitAnalysis], chunk_count: int) -> str:
+    """One refined explanation from the reasoning of the highest-weighted chunks"""
+    if all(analysis.refined for analysis in analyses):
+        # Already plain language (fused or local lexical); the strongest chunk speaks for the text.
+        return analyses[0].thinking
+    raw = "\n\n".join(analysis.thinking for analysis in analyses if analysis.thinking)
+    try:
+        return await refine_thinking(f"Analysis of {len(analyses)} of {chunk_count} parts of a longer text:\n\n{raw}")
+    except scheduler.Overloaded as e:
+        # The chunks are already paid for; unrefined reasoning beats failing the text.
+        print(f"Reasoning refine shed, keeping the strongest chunk's reasoning: {e}")
+        return analyses[0].thinking
+
+async def run_long_analysis(text: str, mode: str, lexical_mode: Optional[str] = None) -> dict:
+    """Score sentence-aware chunks concurrently, then aggregate with confidence-weighted means.
+    
+    Chunks run a few at a time (ANALYZE_CHUNK_CONCURRENCY) on top of the gateway's per-model
+    limits. A chunk whose analysis fails, or that the scheduler sheds because the request's
+    deadline cannot cover it, is left out and counted; the text fails only if every chunk does
+    (503 when every chunk was shed). Reasoning is refined once per trait family from the
+    strongest chunks.
+    """
+    chunks = longtext.chunk_text(text)
+    lexical_mode = lexical_mode or default_lexical_mode()
+    limit = asyncio.Semaphore(longtext.chunk_concurrency())
+    shed: List[scheduler.Overloaded] = []
+    
+    async def scored(chunk: str):
+        async with limit:
+            try:
+                return await analyze_chunk(chunk, mode, lexical_mode)
+            except scheduler.Overloaded as e:
+                print(f"Chunk analysis shed ({len(chunk.split())} words): {e}")
+                shed.append(e)
+                return None
+            except Exception as e:
+                print(f"Chunk analysis failed ({len(chunk.split())} words): {e}")
+                return None
+    
+    results = await gather_or_cancel(*[scored(chunk) for chunk in chunks])
+    kept = [(chunk, result) for chunk, result in zip(chunks, results) if result is not None]
+    if not kept:
+        if len(shed) == len(chunks):
+            raise shed[-1]
+        raise ValueError(f"Analysis failed for all {len(chunks)} chunks of the text")
+    words = [len(chunk.split()) for chunk, _ in kept]
+    
+    aggregated, dispersion = {}, {}
+    for family in longtext.TRAITS:
+        family_scores = [result[family].scores for _, result in kept]
+        aggregated[family], dispersion[family] = longtext.aggregate(family, family_scores, words)
+    
+    reasoning = await gather_or_cancel(*[
+        summarize_reasoning(
+            [kept[i][1][family] for i in longtext.top_chunks([r[family].scores for _, r in kept], words)],
+            len(kept)
+        )
+        for family in longtext.TRAITS
+    ])
+    personality = await classify_personality(aggregated["ocean"], aggregated["mbti"], aggregated["lexical"])
+    
+    return {
+        **aggregated,
+        "personality_type": personality,
+        "thinking": {family: thinking.strip() for family, thinking in zip(longtext.TRAITS, reasoning)},
+        "chunks": {
+            "count": len(chunks),
+            "failed": len(chunks) - len(kept),
+            "shed": len(shed),
+            "words": words,
+            "dispersion": dispersion,
+            "scores": [{family: result[family].scores for family in longtext.TRAITS} for _, result in kept]
+        }
+    }
+
+def prepare_analysis(input_data: TextInput):
+    """Validate an /analyze request and return (text, word_count, mode, cache key)"""
     text = input_data.text.strip()
     word_count = len(text.split())
     
     if word_count < 5:
         raise HTTPException(status_code=400, detail="Text must contain at least 5 words")
-    if word_count > 300:
-        raise HTTPException(status_code=400, detail="Text must not exceed 300 words")
+    if word_count > longtext.max_words():
+        raise HTTPException(status_code=400, detail=f"Text must not exceed {longtext.max_words()} words")
     
+    mode = input_data.mode or os.getenv("ANALYZE_MODE", "split")
+    if mode not in ("split", "fused"):
+        raise HTTPException(status_code=400, detail="Mode must be 'split' or 'fused'")
+    
+    key = cache_key(
+        "analyze",
+        text=normalize_text(text),
+        mode=mode,
+        lexical_mode=default_lexical_mode() if mode == "split" else None,
+        models=["llama-3.3-70b-versatile", "llama-3.1-8b-instant"],
+        prompt_version=prompts.fingerprint("analyze.ocean", "analyze.mbti", "analyze.lexical", "analyze.fused",
+                                       "analyze.classify", "refine"),
+        temperature=0.3,
+        **({"chunk_words": longtext.chunk_words()} if word_count > longtext.SINGLE_PASS_WORDS else {})
+    )
+    return text, word_count, mode, key
+
+def build_analysis_response(analysis: dict, word_count: int) -> dict:
     confidence_level = "low" if word_count < 50 else "medium" if word_count < 100 else "high"
+    hybrid_score = calculate_hybrid_score(analysis["ocean"], analysis["mbti"], analysis["lexical"])
+    
+    response = {
+        "ocean": analysis["ocean"],
+        "mbti": analysis["mbti"],
+        "lexical": analysis["lexical"],
+        "hybrid_score": round(hybrid_score, 2),
+        "personality_type": analysis["personality_type"],
+        "confidence_level": confidence_level,
+        "word_count": word_count,
+        "thinking": analysis["thinking"]
+    }
+    if "chunks" in analysis:
+        response["chunks"] = analysis["chunks"]
+    return response
+
+def cacheable(response: dict) -> bool:
+    """False for a long text missing chunks the scheduler shed; under less load the whole text would be scored"""
+    return not response.get("chunks", {}).get("shed")
+
+async def run_analysis(text: str, mode: str) -> dict:
+    if len(text.split()) > longtext.SINGLE_PASS_WORDS:
+        return await run_long_analysis(text, mode)
+    if mode == "fused":
+        try:
+            return await run_fused_analysis(text)
+        except (ValueError, ValidationError) as e:
+            print(f"Fused analysis failed, falling back to split mode: {e}")
+    return await run_split_analysis(text)
+
+@app.post("/api/analyze")
+@app.post("/analyze")
+async def analyze_text(input_data: TextInput):
+    text, word_count, mode, key = prepare_analysis(input_data)
+    
+    async def compute():
+        response = build_analysis_response(await run_analysis(text, mode), word_count)
+        if not cacheable(response):
+            raise Uncached(response)
+        return response
     
     try:
-        ocean, mbti, lexical = await asyncio.gather(
-            analyze_ocean(text),
-            analyze_mbti(text),
-            analyze_lexical(text)
-        )
+        return await result_cache.get_or_compute(key, compute)
+    except scheduler.Overloaded:
+        raise
+    except Exception as e:
+        print(f"Error: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+def sse_event(event: str, data) -> str:
+    if event == "error":
+        telemetry.ERRORS.inc(source="stream", kind="sse")
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_split_analysis(text: str, word_count: int, lexical_mode: Optional[str] = None):
+    """Yield (event, data) pairs for the split pipeline as each stage resolves, ending with the full payload"""
+    traits = {
+        asyncio.ensure_future(analyze_ocean(text)): "ocean",
+        asyncio.ensure_future(analyze_mbti(text)): "mbti",
+        asyncio.ensure_future(score_lexical(text, lexical_mode or default_lexical_mode())): "lexical"
+    }
+    tasks = list(traits)
+    try:
+        results = {}
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                results[traits[task]] = task.result()
+                yield traits[task], results[traits[task]].scores
         
-        refined_ocean, refined_mbti, refined_lexical = await asyncio.gather(
-            refine_thinking(thinking_data["ocean"]),
-            refine_thinking(thinking_data["mbti"]),
-            refine_thinking(thinking_data["lexical"])
-        )
+        ocean, mbti, lexical = results["ocean"].scores, results["mbti"].scores, results["lexical"].scores
+        yield "hybrid_score", round(calculate_hybrid_score(ocean, mbti, lexical), 2)
         
-        hybrid_score = calculate_hybrid_score(ocean, mbti, lexical)
-        personality = await classify_personality(ocean, mbti, lexical)
+        # The label and the three refine streams run concurrently and share one event queue.
+        queue = asyncio.Queue()
+        refined = {"ocean": [], "mbti": [], "lexical": []}
         
-        return {
+        async def label():
+            try:
+                queue.put_nowait(("personality_type", await classify_personality(ocean, mbti, lexical)))
+            except Exception as e:
+                queue.put_nowait(("error", e))
+        
+        async def refine(trait):
+            try:
+                if results[trait].refined:
+                    queue.put_nowait(("thinking", (trait, results[trait].thinking)))
+                else:
+                    async for delta in stream_refine_thinking(results[trait].thinking):
+                        queue.put_nowait(("thinking", (trait, delta)))
+                queue.put_nowait(("thinking_done", trait))
+            except Exception as e:
+                queue.put_nowait(("error", e))
+        
+        tasks = [asyncio.ensure_future(label())] + [asyncio.ensure_future(refine(t)) for t in refined]
+        
+        personality = None
+        remaining = 4
+        while remaining:
+            event, data = await queue.get()
+            if event == "error":
+                raise data
+            if event == "personality_type":
+                personality = data
+                remaining -= 1
+                yield "personality_type", data
+            elif event == "thinking":
+                trait, delta = data
+                refined[trait].append(delta)
+                yield "thinking", {"trait": trait, "delta": delta}
+            else:
+                remaining -= 1
+        
+        analysis = {
             "ocean": ocean,
             "mbti": mbti,
             "lexical": lexical,
-            "hybrid_score": round(hybrid_score, 2),
             "personality_type": personality,
-            "confidence_level": confidence_level,
-            "word_count": word_count,
-            "thinking": {
-                "ocean": refined_ocean,
-                "mbti": refined_mbti,
-                "lexical": refined_lexical
-            }
+            "thinking": {trait: "".join(parts).strip() for trait, parts in refined.items()}
         }
-    except Exception as e:
-        print(f"Error: {e}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
-
+        yield "done", build_analysis_response(analysis, word_count)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@app.post("/api/analyze/stream")
+@app.post("/analyze/stream")
+async def analyze_text_stream(input_data: TextInput):
+    """Server-sent events variant of /analyze.
+    
+    Emits ocean, mbti and lexical as each resolves, then hybrid_score and personality_type,
+    thinking deltas as the refined reasoning streams in, and finally a done event whose data
+    is exactly the /analyze JSON response. Texts analyzed in chunks emit their events once the
+    chunks are aggregated.
+    """
+    text, word_count, mode, key = prepare_analysis(input_data)
+    
+    async def events():
+        try:
+            payload = result_cache.get(key)
+            cached = payload is not None
+            if not cached and mode == "split" and word_count <= longtext.SINGLE_PASS_WORDS:
+                async for event, data in stream_split_analysis(text, word_count):
+                    if event == "done":
+                        payload = data
+                    else:
+                        yield sse_event(event, data)
+            else:
+                if not cached:
+                    payload = build_analysis_response(await run_analysis(text, mode), word_count)
+                for event in ("ocean", "mbti", "lexical", "hybrid_score", "personality_type"):
+                    yield sse_event(event, payload[event])
+                for trait, thinking in payload["thinking"].items():
+                    yield sse_event("thinking", {"trait": trait, "delta": thinking})
+            if not cached and cacheable(payload):
+                result_cache.set(key, payload)
+            yield sse_event("done", payload)
+        except Exception as e:
+            print(f"Error: {e}")
+            import traceback
+            traceback.print_exc()
+            yield sse_event("error", {"detail": str(e)})
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/cache-stats")
+@app.get("/cache-stats")
+async def cache_stats():
+    return result_cache.stats()
+
+@app.get("/api/answer-index-stats")
+@app.get("/answer-index-stats")
+async def answer_index_stats():
+    """Near-duplicate answer reuse: hit rate, audited disagreement with the model, size"""
+    return answer_index.stats()
+
+@app.get("/api/label-stats")
+@app.get("/label-stats")
+async def label_stats():
+    """Personality label table: hit rate, labels held and model calls filling it"""
+    return personality_labels.stats()
+
+@app.get("/api/session-stats")
+@app.get("/session-stats")
+async def session_stats():
+    """Questionnaire sessions held, dropped, and where their summaries stood at finish"""
+    return session_store.stats()
+
+@app.get("/api/shared-state-stats")
+@app.get("/shared-state-stats")
+async def shared_state_stats():
+    """Store shared by the workers: operations, failures and mean round trip (null when nothing is shared)"""
+    return shared_state.stats() if shared_state is not None else None
+
+@app.get("/api/parse-stats")
+@app.get("/parse-stats")
+async def get_parse_stats():
+    return parse_stats()
+
+@app.get("/api/llm-stats")
+@app.get("/llm-stats")
+async def llm_stats():
+    return gateway.stats()
+
+@app.get("/api/metrics")
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of request, model, parse, cache and event-loop metrics"""
+    return PlainTextResponse(telemetry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/traces")
+@app.get("/traces")
+async def traces(limit: int = 20, name: Optional[str] = None):
+    """Recent request traces: span tree with start offsets, and total time per span name"""
+    return telemetry.recent_traces(limit, name)
+
+@app.get("/api/startup")
+@app.get("/startup")
+async def startup_profile():
+    """Import-time breakdown of this instance's cold start; empty unless STARTUP_PROFILE=1"""
+    return startup.report
+
+# Static pages are served by Vercel. To serve them from this app instead:
+# from fastapi.staticfiles import StaticFiles
 # app.mount("/", StaticFiles(directory="../", html=True), name="static")
 
 if __name__ == "__main__":
@@ -0,0 +1,390 @@
+"""Versioned prompt templates for every model call.
+
+Each prompt has two parts:
+
+- a static prefix, built once at import: the system instructions, scale
+  definitions, output format and any few-shot examples;
+- one final user message with the per-request content.
+
+The prefix is the same for every request, and the user's text always comes last.
+That lets providers that cache prompt prefixes reuse it instead of processing it
+again on every call. OpenAI-compatible APIs report the reused part as
+``usage.prompt_tokens_details.cached_tokens``, which the gateway puts on each
+``llm.chat`` span.
+
+Prompts are looked up by name. ``Prompt.id`` (``name@vN``) is part of the result
+cache keys and is set on each LLM span and recording. When the wording of a prompt
+changes, bump its version: cached results from the old wording stop matching, and
+traces show which wording produced an answer.
+
+Prefix messages are shared between calls and must never be modified.
+``Prompt.messages()`` returns a new list every time.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+SCORING_STEPS = """=== CHAIN-OF-THOUGHT ANALYSIS PROCESS ===
+
+Step 1: LINGUISTIC ANALYSIS
+- Identify key emotional words, phrases, and linguistic markers
+- Analyze tone (hopeful, neutral, distressed, desperate)
+- Note intensity indicators (always, never, sometimes, occasionally)
+- Detect temporal markers (lately, always, used to, now)
+
+Step 2: SYMPTOM SEVERITY MAPPING
+- Map response to clinical depression indicators
+- Consider frequency (how often symptoms occur)
+- Assess duration (how long symptoms persist)
+- Evaluate functional impairment (impact on daily life)
+
+Step 3: CONTEXTUAL INTERPRETATION
+- Distinguish between temporary mood vs persistent state
+- Identify coping mechanisms or lack thereof
+- Recognize minimization or exaggeration patterns
+- Consider cultural and linguistic variations in expression
+
+Step 4: EDGE CASE HANDLING
+- Ambiguous responses ("I'm okay I guess")
+- Contradictory statements ("I'm fine but everything feels pointless")
+- Deflection or avoidance ("I don't know", "whatever")
+- Extreme brevity ("bad", "terrible", "fine")
+- Metaphorical language ("drowning", "empty shell")
+- Sarcasm or dark humor masking distress
+
+Step 5: SCORE DETERMINATION
+0 = No symptoms / Positive state / Healthy functioning
+1 = Mild symptoms / Occasional distress / Minimal impairment
+2 = Moderate symptoms / Frequent distress / Notable impairment
+3 = Severe symptoms / Persistent distress / Significant impairment"""
+
+# (label, response, analysis, score) in the order they appear in the full guide.
+SCORING_EXAMPLES = [
+    ('Score 0', "I've been feeling really good lately, energized and optimistic about the future", 'Positive emotional state, energy present, future-oriented thinking, no distress indicators', '0'),
+    ('Score 1', "I'm okay, just a bit stressed with work but managing", 'Mild stress acknowledged, coping mechanisms implied ("managing"), temporary situational factor', '1'),
+    ('Score 1 - Ambiguous', "I don't know, I guess I'm fine", 'Uncertainty suggests mild disconnection, "I guess" indicates lack of conviction, but no severe distress', '1'),
+    ('Score 2', "I feel sad most days and it's hard to enjoy things I used to love", 'Frequency indicator ("most days"), anhedonia present, past vs present comparison shows decline', '2'),
+    ('Score 2 - Deflection', 'Whatever, does it even matter?', 'Deflection masks distress, existential questioning, apathy indicator, suggests moderate hopelessness', '2'),
+    ('Score 3', "I feel completely hopeless, like there's no point in anything anymore", 'Absolute language ("completely", "no point"), pervasive hopelessness, existential despair', '3'),
+    ('Score 3 - Metaphorical', "I'm drowning and nobody can see it, I'm just an empty shell going through motions", 'Drowning metaphor indicates overwhelming distress, depersonalization ("empty shell"), severe disconnection', '3'),
+    ('Score 1 - Brief positive', 'Good', 'Brief but positive, no distress indicators, assume healthy state unless context suggests otherwise', '0'),
+    ('Score 2 - Contradictory', "I'm fine really, just that everything feels meaningless and I can't get out of bed", 'Contradiction between "fine" and severe symptoms, minimization pattern, functional impairment evident', '2'),
+    ('Score 3 - Suicidal ideation', 'I keep thinking everyone would be better off without me, I have a plan', 'Active suicidal ideation, plan formation, severe risk indicator, immediate concern', '3, CRISIS'),
+    ('Score 1 - Suicidal ideation', "Sometimes I wonder what it would be like to not exist, but I'd never do anything", 'Passive ideation, no intent or plan, philosophical wondering, low immediate risk', '1'),
+    ('Score 2 - Sleep issues', "I barely sleep anymore, maybe 2-3 hours a night, and I'm exhausted all the time", 'Severe sleep disruption, chronic pattern, functional impairment (exhaustion), moderate severity', '2'),
+]
+
+# Few-shot tiers by example number. Short answers mostly need the brevity, ambiguity and
+# deflection cases; the suicidal-ideation examples only matter for that category, which always
+# gets the full guide so crisis detection never runs on a trimmed prompt.
+SCORING_TIERS = {
+    "brief": (1, 3, 5, 6, 8),
+    "standard": (1, 2, 3, 4, 5, 6, 7, 8, 9, 12),
+    "full": tuple(range(1, len(SCORING_EXAMPLES) + 1)),
+}
+
+
+def scoring_guide(tier: str = "full") -> str:
+    examples = "\n\n".join(
+        f'Example {n} ({label}):\nResponse: "{response}"\nAnalysis: {analysis}\nScore: {score}'
+        for n, (label, response, analysis, score) in enumerate(
+            (SCORING_EXAMPLES[i - 1] for i in SCORING_TIERS[tier]), 1
+        )
+    )
+    return f"{SCORING_STEPS}\n\n=== COMPREHENSIVE FEW-SHOT EXAMPLES ===\n\n{examples}"
+
+
+class Prompt:
+    """A prebuilt message prefix and a ``str.format`` template for the final user message.
+
+    ``system`` may map variant names to system texts when a prompt comes in a few
+    fixed forms, like the scoring guide's few-shot tiers. Each variant gets its own
+    prefix. ``system=None`` leaves the system message out.
+    """
+
+    def __init__(self, name: str, version: int, system: Union[None, str, Dict[str, str]], user: str,
+                 examples: Sequence[Tuple[str, str]] = ()):
+        self.name = name
+        self.version = version
+        self.id = f"{name}@v{version}"
+        self.user = user
+        variants = system if isinstance(system, dict) else {None: system}
+        self.prefixes = {variant: self._prefix(text, examples) for variant, text in variants.items()}
+
+    @staticmethod
+    def _prefix(system: Optional[str], examples: Sequence[Tuple[str, str]]) -> Tuple[dict, ...]:
+        messages = [{"role": "system", "content": system}] if system else []
+        for question, answer in examples:
+            messages += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        return tuple(messages)
+
+    def messages(self, variant: Optional[str] = None, images: Sequence[str] = (), **values) -> List[dict]:
+        """The prefix for ``variant`` followed by the user message filled in with ``values``.
+
+        ``images`` are attached to the user message as ``image_url`` parts after its text.
+        """
+        content = self.user.format(**values)
+        if images:
+            content = [{"type": "text", "text": content}, *({"type": "image_url", "image_url": url} for url in images)]
+        return [*self.prefixes[variant], {"role": "user", "content": content}]
+
+
+REGISTRY: Dict[str, Prompt] = {}
+
+
+def register(prompt: Prompt) -> Prompt:
+    if prompt.name in REGISTRY:
+        raise ValueError(f"Prompt {prompt.name!r} is already registered")
+    REGISTRY[prompt.name] = prompt
+    return prompt
+
+
+def get(name: str) -> Prompt:
+    return REGISTRY[name]
+
+
+def fingerprint(*names: str) -> str:
+    """The ids of ``names`` as one string, for cache keys of results built from several prompts."""
+    return ",".join(REGISTRY[name].id for name in names)
+
+
+TRAIT_SCALES = {
+    "ocean": """- Openness (1=conventional, routine-focused | 5=creative, abstract, curious, imaginative)
+- Conscientiousness (1=spontaneous, disorganized | 5=organized, disciplined, goal-oriented, reliable)
+- Extraversion (1=reserved, solitary | 5=outgoing, energetic, social, talkative)
+- Agreeableness (1=competitive, critical | 5=cooperative, empathetic, trusting, warm)
+- Neuroticism (1=calm, stable | 5=anxious, emotional, stressed, worried)""",
+    "mbti": """- E/I: Extraversion(-5: very outgoing, social) to Introversion(+5: very reserved, reflective)
+- S/N: Sensing(-5: concrete, practical, detail-focused) to Intuition(+5: abstract, theoretical, big-picture)
+- T/F: Thinking(-5: logical, objective, analytical) to Feeling(+5: empathetic, values-driven, personal)
+- J/P: Judging(-5: structured, planned, decisive) to Perceiving(+5: flexible, spontaneous, adaptable)""",
+    "lexical": """- Formality (1=casual, slang, contractions | 5=formal, professional, proper grammar)
+- Emotional Intensity (1=neutral, detached, factual | 5=passionate, expressive, emotional)
+- Complexity (1=simple vocabulary, short sentences | 5=sophisticated vocabulary, complex sentences)
+- Certainty (1=hesitant, uncertain, questioning | 5=confident, assertive, definitive)
+- Social Orientation (1=self-focused, individual | 5=other-focused, community, relationships)""",
+}
+
+ANALYZE_OCEAN = register(Prompt(
+    "analyze.ocean", 2,
+    system=f"""You are a personality analysis expert. Think step-by-step, then provide JSON at the end.
+
+Analyze each text you are given for OCEAN personality traits. Use Chain of Thought reasoning.
+
+First, think step-by-step about each trait:
+{TRAIT_SCALES["ocean"]}
+
+Think through your reasoning, then provide your final answer as JSON:
+{{"openness": 3, "conscientiousness": 4, "extraversion": 2, "agreeableness": 5, "neuroticism": 1, "confidence": 0.8}}""",
+    examples=[
+        ("Text: 'I love exploring new ideas and thinking outside the box. Routine bores me.'",
+         '{"openness": 5, "conscientiousness": 2, "extraversion": 3, "agreeableness": 3, "neuroticism": 2, "confidence": 0.85}'),
+        ("Text: 'I always plan everything in advance and stick to my schedule. Organization is key.'",
+         '{"openness": 2, "conscientiousness": 5, "extraversion": 3, "agreeableness": 3, "neuroticism": 1, "confidence": 0.9}'),
+    ],
+    user='Text: "{text}"\n\nThink through your reasoning, then provide your final answer as JSON.',
+))
+
+ANALYZE_MBTI = register(Prompt(
+    "analyze.mbti", 2,
+    system=f"""You are a personality analysis expert. Think step-by-step, then provide JSON at the end.
+
+Analyze each text you are given for MBTI dimensions. Use Chain of Thought reasoning.
+
+Think step-by-step about each dimension:
+{TRAIT_SCALES["mbti"]}
+
+Think through your reasoning, determine the 4-letter type, then provide JSON:
+{{"ei": 2, "sn": -3, "tf": 1, "jp": -2, "type": "INFP", "confidence": 0.7}}""",
+    examples=[
+        ("Text: 'I prefer deep conversations over small talk. Abstract concepts fascinate me.'",
+         '{"ei": 3, "sn": 4, "tf": 1, "jp": 0, "type": "INFJ", "confidence": 0.8}'),
+        ("Text: 'I love parties and meeting new people! Life is about having fun and being spontaneous.'",
+         '{"ei": -4, "sn": -1, "tf": 2, "jp": 3, "type": "ENFP", "confidence": 0.85}'),
+    ],
+    user='Text: "{text}"\n\nThink through your reasoning, determine the 4-letter type, then provide JSON.',
+))
+
+ANALYZE_LEXICAL = register(Prompt(
+    "analyze.lexical", 2,
+    system=f"""You are a linguistic analysis expert. Think step-by-step, then provide JSON at the end.
+
+Analyze each text you are given for lexical features. Use Chain of Thought reasoning.
+
+Think step-by-step about each feature:
+{TRAIT_SCALES["lexical"]}
+
+Think through your reasoning, then provide JSON:
+{{"formality": 3, "emotional_intensity": 2, "complexity": 4, "certainty": 3, "social_orientation": 5, "confidence": 0.8}}""",
+    examples=[
+        ("Text: 'gonna meet up with friends later lol cant wait!!'",
+         '{"formality": 1, "emotional_intensity": 4, "complexity": 1, "certainty": 4, "social_orientation": 5, "confidence": 0.95}'),
+        ("Text: 'The implementation of this methodology requires careful consideration of various parameters.'",
+         '{"formality": 5, "emotional_intensity": 1, "complexity": 5, "certainty": 3, "social_orientation": 1, "confidence": 0.9}'),
+    ],
+    user='Text: "{text}"\n\nThink through your reasoning, then provide JSON.',
+))
+
+ANALYZE_FUSED = register(Prompt(
+    "analyze.fused", 2,
+    system=f"""You are a personality and linguistic analysis expert. Reason carefully, then return only JSON.
+
+Analyze each text you are given for OCEAN traits, MBTI dimensions and lexical features, then label the personality.
+
+OCEAN (1-5):
+{TRAIT_SCALES["ocean"]}
+
+MBTI (-5 to +5):
+{TRAIT_SCALES["mbti"]}
+
+Lexical (1-5):
+{TRAIT_SCALES["lexical"]}
+
+Personality type: a 1-2 word label and a 3-5 word description.
+
+For each of ocean, mbti and lexical, write 2-4 sentences of reasoning in plain natural language for the user, without mentioning JSON, scores formats or code.
+
+Return only JSON with keys "reasoning", "ocean", "mbti", "lexical" and "personality_type".""",
+    examples=[
+        ("Text: 'I love exploring new ideas and thinking outside the box. Routine bores me.'",
+         '{"reasoning": {"ocean": "The writer seeks novelty and finds routine dull, which points to high openness and a looser relationship with structure.", "mbti": "A pull toward ideas and possibilities over the familiar suggests intuition and a flexible, exploratory approach.", "lexical": "The language is relaxed and enthusiastic, with short, confident sentences."}, "ocean": {"openness": 5, "conscientiousness": 2, "extraversion": 3, "agreeableness": 3, "neuroticism": 2, "confidence": 0.85}, "mbti": {"ei": 1, "sn": 4, "tf": 0, "jp": 3, "type": "INTP", "confidence": 0.7}, "lexical": {"formality": 2, "emotional_intensity": 3, "complexity": 2, "certainty": 4, "social_orientation": 2, "confidence": 0.85}, "personality_type": {"type": "Free Thinker", "description": "Curious, restless idea explorer"}}'),
+    ],
+    user='Text: "{text}"\n\nReturn only JSON with keys "reasoning", "ocean", "mbti", "lexical" and "personality_type".',
+))
+
+CLASSIFY = register(Prompt(
+    "analyze.classify", 2,
+    system="""You are a personality expert. Create concise, meaningful personality labels. Return only JSON.
+
+Based on the personality analysis you are given, create a concise personality type label (1-2 words) and a brief description (3-5 words).
+
+Provide only JSON:
+{"type": "Creative Thinker", "description": "Imaginative and analytical"}""",
+    user="""OCEAN Scores:
+- Openness: {openness}/5
+- Conscientiousness: {conscientiousness}/5
+- Extraversion: {extraversion}/5
+- Agreeableness: {agreeableness}/5
+- Neuroticism: {neuroticism}/5
+
+MBTI Type: {mbti_type}
+
+Lexical Features:
+- Formality: {formality}/5
+- Complexity: {complexity}/5""",
+))
+
+REFINE = register(Prompt(
+    "refine", 1,
+    system="You are a writing assistant. Convert technical analysis into natural explanations. Remove all references to JSON, code, formatting, or technical terms. Output ONLY the refined thinking content directly, without any introductory phrases like 'Here is' or 'The rewritten analysis'. Start immediately with the actual analysis.",
+    user="Convert this to natural language, removing technical terms. Output only the analysis content:\n\n{thinking}",
+))
+
+REASK = register(Prompt(
+    "reask", 1,
+    system="You repair malformed JSON. Return only one valid JSON object and nothing else.",
+    user="Extract the final answer from this model output as a JSON object matching this JSON schema:\n{schema}\n\nModel output:\n{output}",
+))
+
+EXTRACT_CHAT = register(Prompt(
+    "analyze_whatsapp.extract", 3,
+    system=None,
+    user='Extract all messages from this WhatsApp chat screenshot, top to bottom. Identify messages by bubble color: GREEN bubbles are from the USER, WHITE/GRAY/BLACK bubbles are from OTHER person. Return ONLY valid JSON with this exact format: {{"messages": [{{"side": "user", "text": "message1"}}, {{"side": "other", "text": "message2"}}]}}. Keep the on-screen order. Include only the message text, no timestamps or names.',
+))
+
+SOCIAL_METRICS = """- Response Engagement (1=dismissive, brief | 5=engaged, detailed responses)
+- Emotional Expressiveness (1=flat, minimal emotion | 5=highly expressive, emotive)
+- Conversation Initiation (1=passive, reactive | 5=proactive, initiates topics)
+- Social Reciprocity (1=self-focused, ignores cues | 5=balanced, reciprocal)
+- Attachment Style (1=avoidant, distant | 5=secure, warm)
+- Communication Clarity (1=vague, ambiguous | 5=clear, direct)
+- Empathy Display (1=low empathy, dismissive | 5=high empathy, validating)
+- Boundary Management (1=poor boundaries | 5=healthy boundaries)"""
+
+SOCIAL_BEHAVIOR = register(Prompt(
+    "analyze_whatsapp.behavior", 3,
+    system=f"""You are a clinical psychologist analyzing social media behavior patterns. Return only JSON.
+
+Analyze this person's social media behavior based on their WhatsApp messages. Use clinical psychological metrics.
+
+Analyze these clinical metrics (1-5 scale):
+{SOCIAL_METRICS}
+
+Return JSON:
+{{"response_engagement": 3, "emotional_expressiveness": 4, "conversation_initiation": 2, "social_reciprocity": 4, "attachment_style": 3, "communication_clarity": 4, "empathy_display": 5, "boundary_management": 3, "confidence": 0.8, "behavioral_summary": "Brief description"}}""",
+    user="User's Messages: {user_text}\nOther Person's Messages: {other_text}\n{measured}",
+))
+
+SOCIAL_SEMANTIC = register(Prompt(
+    "analyze_whatsapp.semantic", 2,
+    system="""You are a clinical psychologist analyzing social media behavior patterns. Return only JSON.
+
+Analyze this person's communication style based on their WhatsApp messages. Use clinical psychological metrics.
+
+Analyze these clinical metrics (1-5 scale):
+- Emotional Expressiveness (1=flat, minimal emotion | 5=highly expressive, emotive)
+- Attachment Style (1=avoidant, distant | 5=secure, warm)
+- Communication Clarity (1=vague, ambiguous | 5=clear, direct)
+- Empathy Display (1=low empathy, dismissive | 5=high empathy, validating)
+- Boundary Management (1=poor boundaries | 5=healthy boundaries)
+
+Return JSON:
+{"emotional_expressiveness": 4, "attachment_style": 3, "communication_clarity": 4, "empathy_display": 5, "boundary_management": 3, "confidence": 0.8, "behavioral_summary": "Brief description"}""",
+    user='Conversation in order ("User" is the person being analyzed):\n{conversation}',
+))
+
+SCORE_RESPONSE = register(Prompt(
+    "score_response", 3,
+    system={tier: f"""You are an expert clinical psychologist with 20+ years of experience in depression assessment and mental health evaluation. Use comprehensive Chain-of-Thought reasoning. Think deeply through all steps, then return JSON with detailed reasoning.
+
+{scoring_guide(tier)}
+
+=== YOUR TASK ===
+
+Analyze the user's response using the complete Chain-of-Thought process above. Think through ALL steps comprehensively, then provide your final answer as JSON.
+
+Return format:
+{{"score": 2, "reasoning": "Detailed multi-sentence explanation of your analysis", "crisis": false}}""" for tier in SCORING_TIERS},
+    user='Question: {question}\nCategory: {category}\nUser Response: "{response}"',
+))
+
+SCORE_PACKED = register(Prompt(
+    "score_responses.packed", 2,
+    system={tier: f"""You are an expert clinical psychologist with 20+ years of experience in depression assessment and mental health evaluation. Use comprehensive Chain-of-Thought reasoning. Think through all steps for every item, then return JSON.
+
+{scoring_guide(tier)}
+
+=== YOUR TASK ===
+
+Analyze every item using the complete Chain-of-Thought process above, judging each response on its own. Keep each reasoning to 1-3 sentences, then provide your final answer as JSON with one entry per item.
+
+Return format:
+{{"results": [{{"id": 1, "score": 2, "reasoning": "Brief explanation of your analysis"}}]}}""" for tier in SCORING_TIERS},
+    user="=== RESPONSES ===\n\n{listed}",
+))
+
+DEPRESSION_SUMMARY = register(Prompt(
+    "analyze_depression", 2,
+    system="""You are an expert mental health counselor. Provide COMPREHENSIVE, DETAILED, UNRESTRICTED analysis. Use complete Chain-of-Thought reasoning. Be thorough and specific. Return JSON with extensive content.
+
+Return JSON with 4 fields:
+1. "reasoning": Brief analysis of symptom patterns and severity
+2. "detailed_analysis": 2-3 sentence clinical assessment
+3. "message": Empathetic 2-3 sentence personalized message
+4. "recommendations": Array of 5-7 actionable recommendations
+
+Example:
+{
+    "reasoning": "Score indicates [severity] depression with symptoms of [key patterns]. Requires [intervention level].",
+    "detailed_analysis": "Your responses show [main symptoms]. This impacts [areas of life].",
+    "message": "Taking this assessment shows strength. These feelings can improve with support.",
+    "recommendations": [
+        "Try 4-7-8 breathing before bed for better sleep",
+        "Schedule consultation with mental health professional",
+        "Get 10-15 min morning sunlight daily",
+        "Do one enjoyable activity for 10 min, 3x this week",
+        "Reach out to one trusted person this week"
+    ]
+}
+
+Be concise but helpful. Return only JSON.""",
+    user="Analyze depression assessment. Score: {score}/30, Level: {level}, Responses: {responses}",
+))
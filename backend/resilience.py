@@ -0,0 +1,187 @@
+"""Retry, hedging and circuit-breaker primitives used by the LLM gateway.
+
+Configuration (environment variables):
+    LLM_MAX_ATTEMPTS         attempts per model including the first (default 3)
+    LLM_RETRY_BASE_DELAY     first backoff in seconds, doubled per attempt (default 0.5)
+    LLM_RETRY_MAX_DELAY      cap for a single backoff or Retry-After wait (default 8)
+    LLM_HEDGE                "1" sends a duplicate request once a call exceeds the model's p95 (default "0")
+    LLM_HEDGE_MIN_SAMPLES    latencies observed before hedging kicks in (default 20)
+    LLM_BREAKER_THRESHOLD    consecutive failures that open a provider's breaker (default 5)
+    LLM_BREAKER_RESET        seconds an open breaker waits before letting a probe through (default 30)
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while a provider's breaker is open."""
+
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(f"{provider} circuit open, retry in {retry_in:.1f}s")
+        self.provider = provider
+        self.retry_after = retry_in
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, httpx.TransportError):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: Optional[int] = None, base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None):
+        self.max_attempts = max_attempts or int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+
+    def delay(self, attempt: int, error: BaseException) -> float:
+        """Backoff before retry number ``attempt`` (1-based): Retry-After if given, else full jitter."""
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures; after ``reset_timeout`` one probe call is let through."""
+
+    def __init__(self, provider: str, threshold: Optional[int] = None, reset_timeout: Optional[float] = None):
+        self.provider = provider
+        self.threshold = threshold or int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+        self.reset_timeout = reset_timeout if reset_timeout is not None else float(os.getenv("LLM_BREAKER_RESET", "30"))
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.opens = 0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def check(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probing):
+            raise CircuitOpenError(self.provider, max(self.reset_timeout - (time.monotonic() - self.opened_at), 0))
+        if state == "half_open":
+            self._probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                self.opens += 1
+            self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """The call ``check`` let through was never sent (the scheduler shed it), so let the next one probe."""
+        self._probing = False
+
+
+class LatencyTracker:
+    """Rolling window of recent call latencies for one model."""
+
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+
+    def record(self, latency: float):
+        self.samples.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class TokenBucket:
+    """Client-side rate limit: ``per_minute`` units refill continuously, with up to ``burst`` seconds' worth saved up.
+
+    ``acquire`` waits until the bucket can cover the cost; the gateway's scheduler uses
+    ``wait_time`` and ``take`` instead, to order the waiting calls itself. A cost larger
+    than the whole bucket is let through once it is full and leaves it in debt, so big
+    requests are slowed down rather than blocked forever.
+    """
+
+    def __init__(self, per_minute: float, burst: float = 10.0):
+        self.rate = per_minute / 60
+        self.capacity = max(self.rate * burst, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waits = 0
+        self.waited = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float) -> float:
+        """Seconds until the bucket holds ``cost``, without taking it."""
+        self._refill()
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+    def take(self, cost: float):
+        self._refill()
+        self.tokens -= cost
+
+    def hold_off(self, seconds: float):
+        """Empty the bucket for ``seconds``: the provider answered 429 with that Retry-After."""
+        self._refill()
+        self.tokens = min(self.tokens, -self.rate * seconds)
+
+    async def acquire(self, cost: float = 1.0):
+        if self._lock is None or self._loop is not asyncio.get_running_loop():
+            self._lock, self._loop = asyncio.Lock(), asyncio.get_running_loop()
+        async with self._lock:
+            delay = self.wait_time(min(cost, self.capacity))
+            if delay > 0:
+                self.waits += 1
+                self.waited += delay
+                await asyncio.sleep(delay)
+            self.take(cost)
+
+
+async def hedged(call: Callable[[], Awaitable[T]], delay: Optional[float], on_hedge: Callable[[], None]) -> T:
+    """Run ``call``; if it has not finished after ``delay`` seconds, race a duplicate and keep the first result."""
+    first = asyncio.ensure_future(call())
+    if delay is None:
+        return await first
+    pending = {first}
+    try:
+        # Inside the try: a caller cancelled during the delay must not leave ``first`` running.
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return first.result()
+        on_hedge()
+        pending.add(asyncio.ensure_future(call()))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+            if not pending:
+                return done.pop().result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,292 @@
+"""Priority scheduling and admission control for upstream model calls.
+
+Each model has a fixed number of in-flight slots (``LLM_CONCURRENCY``) and, when
+configured, request and token buckets matched to the provider's limits
+(``LLM_RATE_LIMITS`` / ``LLM_TOKEN_LIMITS``). A call that cannot start at once
+waits in the model's queue, ordered by the class of the request it serves, then
+by arrival:
+
+    crisis        scoring a suicidal_ideation answer, where a late result delays a safety check
+    interactive   questionnaire scoring and its summary, with a user waiting between questions
+    analyze       /analyze and the WhatsApp endpoints
+    batch         offline jobs (``jobs.py``)
+
+The class comes from the route (``PriorityMiddleware``) or from ``request_class``,
+along with a deadline: how long the request may take before its client is better
+served by an error. Before queueing a call, the scheduler projects its wait from
+the calls ahead of it, the model's recent slot hold times and the buckets. If the
+call could not start before its deadline it fails at once with ``Overloaded``,
+which the API answers with 503 and Retry-After instead of holding the connection.
+A waiter whose deadline passes in the queue is dropped rather than sent. The
+length of the queue alone sheds nothing: a burst that can be served in time is
+queued. ``LLM_QUEUE_LIMIT`` adds a hard cap, for classes without a deadline; a
+full queue sheds its newest lowest-class waiter to make room for a more urgent call.
+
+Configuration (environment variables):
+    LLM_SCHEDULER      "priority" (default) or "fifo": arrival order, no deadlines or shedding
+    LLM_QUEUE_LIMIT    calls waiting per model before the queue sheds (default 0: no cap,
+                       only deadlines shed)
+    LLM_DEADLINES      seconds per class, e.g. "interactive=30,analyze=120" (the default; crisis
+                       and batch requests have no deadline unless listed)
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from . import telemetry
+
+CLASSES = ("crisis", "interactive", "analyze", "batch")
+DEFAULT_CLASS = "analyze"
+# Retry-After for a call shed with nothing to project from (no hold time measured yet, or a
+# deadline already past): clients would otherwise be told to retry at once.
+MIN_RETRY_AFTER = 1.0
+
+
+def _parse_deadlines(spec: str) -> Dict[str, float]:
+    deadlines = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            deadlines[name.strip()] = float(value)
+    return deadlines
+
+
+DEADLINES = _parse_deadlines(os.getenv("LLM_DEADLINES", "interactive=30,analyze=120"))
+
+# (class, deadline as a time.monotonic() value or None) of the request being served.
+_current = ContextVar("llm_request_class", default=(DEFAULT_CLASS, None))
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing a model call that would start too late, or when a queued call is shed."""
+
+    def __init__(self, model: str, priority: str, reason: str, retry_after: float):
+        super().__init__(f"{model} is overloaded for {priority} requests ({reason}), retry in {retry_after:.1f}s")
+        self.model = model
+        self.priority = priority
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+@contextmanager
+def request_class(name: str, deadline: Optional[float] = None):
+    """Schedule the model calls made inside the block as ``name``.
+
+    ``deadline`` overrides the class's seconds from ``LLM_DEADLINES``, counted from now.
+    """
+    if name not in CLASSES:
+        raise ValueError(f"unknown request class {name!r}, expected one of {', '.join(CLASSES)}")
+    seconds = deadline if deadline is not None else DEADLINES.get(name)
+    token = _current.set((name, time.monotonic() + seconds if seconds is not None else None))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def current() -> Tuple[str, Optional[float]]:
+    return _current.get()
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "deadline", "charges", "future", "timer")
+
+    def __init__(self, priority: int, seq: int, deadline: Optional[float], charges: Sequence, future: asyncio.Future):
+        self.priority, self.seq, self.deadline, self.charges, self.future = priority, seq, deadline, charges, future
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ModelQueue:
+    """Slots, queue and admission control for one model.
+
+    ``charges`` are ``(TokenBucket, cost)`` pairs a call must be able to pay before it
+    starts; the gateway builds them from the configured rate limits.
+    """
+
+    def __init__(self, model: str, slots: int, limit: Optional[int] = None, mode: Optional[str] = None):
+        self.model = model
+        self.slots = slots
+        self.limit = limit if limit is not None else int(os.getenv("LLM_QUEUE_LIMIT", "0"))
+        self.fifo = (mode or os.getenv("LLM_SCHEDULER", "priority")) == "fifo"
+        self.active = 0
+        self.hold: Optional[float] = None  # moving average of how long a call keeps its slot
+        self.queued = {name: 0 for name in CLASSES}
+        self.shed = {"deadline": 0, "full": 0, "expired": 0}
+        self._waiting: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._wake_at = 0.0
+
+    def _pending(self):
+        return (w for w in self._waiting if not w.future.done())
+
+    def projected_wait(self, priority: int, charges: Sequence = ()) -> float:
+        """Seconds until a call of ``priority`` would start, counting only the calls queued ahead of it."""
+        ahead = [w for w in self._pending() if w.priority <= priority]
+        wait = 0.0
+        backlog = len(ahead) + self.active + 1 - self.slots
+        if backlog > 0 and self.hold is not None:
+            wait = backlog * self.hold / self.slots
+        for bucket, cost in charges:
+            needed = cost + sum(c for w in ahead for b, c in w.charges if b is bucket)
+            wait = max(wait, bucket.wait_time(needed))
+        return wait
+
+    def _reject(self, name: str, reason: str, retry_after: float) -> Overloaded:
+        self.shed[reason] += 1
+        telemetry.LLM_SHED.inc(model=self.model, priority=name, reason=reason)
+        return Overloaded(self.model, name, reason, max(retry_after, self.hold or 0.0, MIN_RETRY_AFTER))
+
+    async def acquire(self, charges: Sequence = ()) -> float:
+        """Wait for a slot and for ``charges`` to be payable, in class order; returns the seconds waited."""
+        name, deadline = current()
+        if self.fifo:
+            priority, deadline = 0, None
+        else:
+            priority = CLASSES.index(name)
+        started = time.monotonic()
+        if deadline is not None:
+            wait = self.projected_wait(priority, charges)
+            if started + wait > deadline:
+                raise self._reject(name, "deadline", wait)
+        pending = list(self._pending())
+        if self.limit and not self.fifo and len(pending) >= self.limit:
+            victim = max(pending)
+            if victim.priority <= priority:
+                raise self._reject(name, "full", self.projected_wait(priority, charges))
+            victim.future.set_exception(self._reject(CLASSES[victim.priority], "full",
+                                                     self.projected_wait(victim.priority, victim.charges)))
+        if len(self._waiting) > 2 * len(pending) + 64:
+            # Drop settled waiters (shed, expired, cancelled) that have not reached the top of the heap.
+            self._waiting = list(self._pending())
+            heapq.heapify(self._waiting)
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, next(self._seq), deadline, charges, loop.create_future())
+        self.queued[name] += 1
+        waiter.future.add_done_callback(lambda _: self._settled(name))
+        if deadline is not None:
+            waiter.timer = loop.call_later(max(deadline - started, 0), self._expire, waiter, name)
+        heapq.heappush(self._waiting, waiter)
+        self._pump()
+        try:
+            await waiter.future
+        except BaseException:
+            future = waiter.future
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release(0.0)  # granted, but the caller went away before using the slot
+            self._pump()
+            raise
+        finally:
+            if waiter.timer is not None:
+                waiter.timer.cancel()
+        waited = time.monotonic() - started
+        telemetry.LLM_QUEUED.observe(waited, model=self.model, priority=name)
+        return waited
+
+    def release(self, held: float):
+        self.active -= 1
+        if held:
+            self.hold = held if self.hold is None else 0.8 * self.hold + 0.2 * held
+        self._pump()
+
+    @asynccontextmanager
+    async def slot(self, charges: Sequence = ()):
+        """``async with queue.slot(charges) as waited:`` holds one of the model's slots for the block."""
+        waited = await self.acquire(charges)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(time.monotonic() - started)
+
+    async def wait_in_slot(self, delay: float):
+        """Wait ``delay`` seconds in a slot already held (a shared bucket in debt), unless that passes the deadline."""
+        name, deadline = current()
+        if deadline is not None and not self.fifo and time.monotonic() + delay > deadline:
+            raise self._reject(name, "deadline", delay)
+        await asyncio.sleep(delay)
+
+    def _settled(self, name: str):
+        self.queued[name] -= 1
+
+    def _expire(self, waiter: _Waiter, name: str):
+        if not waiter.future.done():
+            waiter.future.set_exception(self._reject(name, "expired",
+                                                     self.projected_wait(waiter.priority, waiter.charges)))
+            self._pump()
+
+    def _pump(self):
+        """Start queued calls, most urgent first, while slots are free and the head call's buckets can pay."""
+        while self._waiting and self.active < self.slots:
+            waiter = self._waiting[0]
+            if waiter.future.done():
+                heapq.heappop(self._waiting)
+                continue
+            delay = max((bucket.wait_time(min(cost, bucket.capacity)) for bucket, cost in waiter.charges),
+                        default=0.0)
+            if delay > 0:
+                self._wake(delay, waiter.charges)
+                return
+            heapq.heappop(self._waiting)
+            for bucket, cost in waiter.charges:
+                bucket.take(cost)
+            self.active += 1
+            waiter.future.set_result(None)
+
+    def _wake(self, delay: float, charges: Sequence):
+        """Run ``_pump`` again once the buckets have refilled, keeping the earliest wake-up."""
+        loop = asyncio.get_running_loop()
+        at = loop.time() + delay
+        if self._timer is not None and not self._timer.cancelled() and self._wake_at > loop.time():
+            if self._wake_at <= at:
+                return
+            self._timer.cancel()
+        else:
+            for bucket, cost in charges:
+                bucket.waits += 1
+                bucket.waited += bucket.wait_time(min(cost, bucket.capacity))
+        self._wake_at = at
+        self._timer = loop.call_at(at, self._pump)
+
+    def stats(self) -> dict:
+        return {"slots": self.slots, "active": self.active, "queued": dict(self.queued),
+                "hold": round(self.hold, 3) if self.hold is not None else None, "shed": dict(self.shed)}
+
+
+class PriorityMiddleware:
+    """ASGI middleware: serves each request in the class its route maps to (``/api`` prefix ignored).
+
+    A route ending in "/" maps every path under it.
+    """
+
+    def __init__(self, app, routes: Dict[str, str], default: str = DEFAULT_CLASS):
+        self.app = app
+        self.routes = routes
+        self.default = default
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        if path.startswith("/api/"):
+            path = path[4:]
+        name = self.routes.get(path)
+        if name is None:
+            name = next((name for route, name in self.routes.items()
+                         if route.endswith("/") and path.startswith(route)), self.default)
+        with request_class(name):
+            await self.app(scope, receive, send)
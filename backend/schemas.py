@@ -0,0 +1,115 @@
+"""Pydantic schemas for structured model output."""
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, Field, confloat, conint
+
+Score = conint(ge=1, le=5)
+Axis = conint(ge=-5, le=5)
+Confidence = confloat(ge=0, le=1)
+
+
+class OceanScores(BaseModel):
+    openness: Score
+    conscientiousness: Score
+    extraversion: Score
+    agreeableness: Score
+    neuroticism: Score
+    confidence: Confidence = 0.5
+
+
+class MbtiScores(BaseModel):
+    ei: Axis
+    sn: Axis
+    tf: Axis
+    jp: Axis
+    type: str = Field(pattern=r"^[EI][SN][TF][JP]$")
+    confidence: Confidence = 0.5
+
+
+class LexicalScores(BaseModel):
+    formality: Score
+    emotional_intensity: Score
+    complexity: Score
+    certainty: Score
+    social_orientation: Score
+    confidence: Confidence = 0.5
+
+
+class PersonalityLabel(BaseModel):
+    type: str
+    description: str
+
+
+class TraitReasoning(BaseModel):
+    ocean: str
+    mbti: str
+    lexical: str
+
+
+class FusedAnalysis(BaseModel):
+    reasoning: TraitReasoning
+    ocean: OceanScores
+    mbti: MbtiScores
+    lexical: LexicalScores
+    personality_type: PersonalityLabel
+
+
+class ScoreResult(BaseModel):
+    score: conint(ge=0, le=3)
+    reasoning: str = ""
+    crisis: bool = False
+
+
+class PackedScore(BaseModel):
+    id: int
+    score: conint(ge=0, le=3)
+    reasoning: str = ""
+
+
+class PackedScores(BaseModel):
+    results: List[PackedScore]
+
+
+class DepressionSummary(BaseModel):
+    reasoning: str = ""
+    detailed_analysis: str = ""
+    message: str = "You're taking an important step by checking in with yourself."
+    recommendations: List[str] = [
+        "Practice deep breathing for 5 minutes daily",
+        "Reach out to a friend or family member",
+        "Maintain a regular sleep schedule"
+    ]
+
+
+class ChatMessage(BaseModel):
+    side: Literal["user", "other"]
+    text: str
+
+
+class ChatExtraction(BaseModel):
+    messages: List[ChatMessage] = []
+    user_content: List[str] = []
+    other_content: List[str] = []
+
+
+class SocialBehavior(BaseModel):
+    response_engagement: Score
+    emotional_expressiveness: Score
+    conversation_initiation: Score
+    social_reciprocity: Score
+    attachment_style: Score
+    communication_clarity: Score
+    empathy_display: Score
+    boundary_management: Score
+    confidence: Confidence = 0.5
+    behavioral_summary: Optional[str] = None
+
+
+class SemanticBehavior(BaseModel):
+    emotional_expressiveness: Score
+    attachment_style: Score
+    communication_clarity: Score
+    empathy_display: Score
+    boundary_management: Score
+    confidence: Confidence = 0.5
+    behavioral_summary: Optional[str] = None
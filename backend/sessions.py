@@ -0,0 +1,394 @@
+"""Server-side questionnaire sessions for the PsyGen chat.
+
+The chat opens a session (``POST /sessions``), scores each answer as it is given
+(``/score-response`` with the ``session_id`` and the question ``index``) and asks
+for the result once the last answer is in (``POST /sessions/{id}/finish``). The
+server keeps a compact record per session: the answers, their scores, and from
+those the running total, the severity band and the crisis flags.
+
+The final summary (the ``analyze_depression`` prompt) depends on the band and
+the answers, not on the exact total. It is therefore started speculatively as
+soon as every answer has arrived and the band can no longer change, whatever the
+answers still being scored turn out to be. Usually that is while the last answer
+is being scored, and the chat's closing messages add a few seconds more, so
+``finish`` finds the summary done or in flight instead of starting it. Before the
+last answer arrives the summary could not mention it, so a band that locks early
+only lets the speculation start with the last answer rather than after its score.
+A speculation whose inputs change (an answer replaced) is cancelled and started
+again; one whose band turns out wrong is never returned.
+
+Sessions live in this process's memory. Each holds at most ``MAX_QUESTIONS``
+answers of up to ``MAX_RESPONSE_CHARS`` characters; idle sessions expire after
+``SESSION_TTL`` and the least recently used are evicted beyond ``SESSION_MAX``.
+
+With ``SHARED_STATE`` set, every session is also recorded in the shared store
+(``shared.py``): its question count, and each answer with its score once it has
+one. Any worker or serverless instance can then continue a session another one
+opened. Before using a session, a worker merges the store's record into its own
+copy in one round trip. The work in flight stays where it started: an answer is
+scored by the worker that received it, and a speculative summary runs on the
+worker that saw the last answer. A worker finishing a session while another one
+is still scoring one of its answers polls the store for that score, for up to
+``SESSION_REMOTE_WAIT`` seconds. If the store fails, each worker carries on with
+the sessions it holds.
+
+Configuration (environment variables):
+    SESSION_TTL          seconds an idle session is kept (default 1800)
+    SESSION_MAX          sessions kept at once (default 1000)
+    SESSION_SPECULATE    "0" starts the summary only when the session is finished (default "1")
+    SESSION_REMOTE_WAIT  seconds finish waits for answers being scored by another worker (default 30)
+"""
+import asyncio
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from . import telemetry
+from .shared import SharedState, SharedStateError, shared_state
+
+MAX_ITEM_SCORE = 3
+MAX_QUESTIONS = 50
+MAX_RESPONSE_CHARS = 2000
+
+# Seconds between looks at the shared store for an answer another worker is scoring.
+REMOTE_POLL = 0.1
+
+# Upper bound of each severity band on the 0-30 questionnaire total; above the last is "Severe".
+SEVERITY_BANDS = ((5, "Minimal"), (10, "Mild"), (15, "Moderate"), (20, "Moderately Severe"))
+
+
+def severity_level(score: int) -> str:
+    for limit, level in SEVERITY_BANDS:
+        if score <= limit:
+            return level
+    return "Severe"
+
+
+class SessionError(Exception):
+    status_code = 400
+
+
+class SessionNotFound(SessionError):
+    status_code = 404
+
+    def __init__(self, session_id: str):
+        super().__init__(f"Session {session_id} not found or expired")
+
+
+class SessionIncomplete(SessionError):
+    status_code = 409
+
+    def __init__(self, missing: List[int]):
+        super().__init__(f"Questions {missing} have no score yet")
+        self.missing = missing
+
+
+class Answer:
+    __slots__ = ("response", "score", "crisis", "scored", "at", "elsewhere")
+
+    def __init__(self, response: str, at: Optional[float] = None):
+        self.response = response
+        self.score: Optional[int] = None
+        self.crisis = False
+        # Resolved when the request scoring this answer ends, whatever the outcome.
+        self.scored = asyncio.get_running_loop().create_future()
+        # Wall-clock time the answer was given: the latest answer to a question wins across workers.
+        self.at = at if at is not None else time.time()
+        # Read from the shared store while another worker scores it; ``scored`` is not resolved here.
+        self.elsewhere = False
+
+    def record(self, failed: bool = False) -> str:
+        return json.dumps({"response": self.response, "score": self.score, "crisis": self.crisis, "at": self.at,
+                           "failed": failed}, ensure_ascii=False)
+
+    @classmethod
+    def restore(cls, record: dict) -> "Answer":
+        answer = cls(record["response"], record["at"])
+        answer.crisis = bool(record["crisis"])
+        answer.settle(record["score"])
+        return answer
+
+    def settle(self, score: Optional[int]):
+        """Take the score another worker stored; None: it is still being scored there."""
+        self.score = score
+        self.elsewhere = score is None
+        if score is not None and not self.scored.done():
+            self.scored.set_result(None)
+
+
+class Session:
+    def __init__(self, session_id: str, questions: int):
+        self.id = session_id
+        self.questions = questions
+        self.answers: Dict[int, Answer] = {}
+        self.touched = time.monotonic()
+        self.summary: Optional[asyncio.Future] = None
+        # (level, responses) the summary was started with, and whether that was before finish.
+        self.summary_inputs: Optional[Tuple[str, Tuple[str, ...]]] = None
+        self.speculative = False
+
+    def bounds(self) -> Tuple[int, int]:
+        """Lowest and highest total still possible, counting answers without a score as 0 to 3."""
+        scores = [answer.score for answer in self.answers.values() if answer.score is not None]
+        low = sum(scores)
+        return low, low + MAX_ITEM_SCORE * (self.questions - len(scores))
+
+    def responses(self) -> Tuple[str, ...]:
+        return tuple(self.answers[i].response for i in sorted(self.answers))
+
+    def view(self) -> dict:
+        low, high = self.bounds()
+        summary = None
+        if self.summary is not None:
+            summary = "ready" if self.summary.done() else "running"
+        return {
+            "session_id": self.id,
+            "questions": self.questions,
+            "answered": len(self.answers),
+            "scored": sum(1 for answer in self.answers.values() if answer.score is not None),
+            "total_score": low,
+            "max_total_score": high,
+            "level": severity_level(low) if severity_level(low) == severity_level(high) else None,
+            "crisis": [i for i, answer in sorted(self.answers.items()) if answer.crisis],
+            "summary": summary,
+        }
+
+
+class SessionStore:
+    def __init__(self, summarize: Optional[Callable[[str, str, str], Awaitable[dict]]] = None,
+                 state: Optional[SharedState] = None):
+        self.ttl = float(os.getenv("SESSION_TTL", "1800"))
+        self.max_sessions = int(os.getenv("SESSION_MAX", "1000"))
+        self.speculate = os.getenv("SESSION_SPECULATE", "1") != "0"
+        self.remote_wait = float(os.getenv("SESSION_REMOTE_WAIT", "30"))
+        # async (score, level, responses) -> summary dict; set by the API module.
+        self.summarize = summarize
+        self.state = state
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.counters = {"created": 0, "expired": 0, "evicted": 0, "finished": 0, "speculated": 0,
+                         "speculation_ready": 0, "speculation_in_flight": 0, "discarded": 0,
+                         "summarized_at_finish": 0, "restored": 0}
+        self.finish_wait = 0.0
+
+    def _prune(self):
+        now = time.monotonic()
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if now - session.touched < self.ttl and len(self.sessions) <= self.max_sessions:
+                break
+            self._drop(session, "expired" if now - session.touched >= self.ttl else "evicted")
+
+    def _drop(self, session: Session, reason: str):
+        del self.sessions[session.id]
+        self.counters[reason] += 1
+        if session.summary is not None:
+            session.summary.cancel()
+
+    @staticmethod
+    def _key(session_id: str, index: Optional[int] = None) -> str:
+        return f"session:{session_id}" if index is None else f"session:{session_id}:{index}"
+
+    async def _publish(self, session: Session, index: Optional[int] = None, answer: Optional[Answer] = None,
+                       failed: bool = False):
+        """Write the session (and ``answer``, at ``index``) to the shared store, refreshing its expiry."""
+        if self.state is None:
+            return
+        values = {self._key(session.id): json.dumps({"questions": session.questions})}
+        if answer is not None:
+            values[self._key(session.id, index)] = answer.record(failed)
+        try:
+            await self.state.put_many(values, self.ttl)
+        except SharedStateError:
+            pass  # Carry on with this worker's copy.
+
+    async def _sync(self, session_id: str, session: Optional[Session]) -> Optional[Session]:
+        """Merge the shared store's record into this worker's copy, restoring a session opened elsewhere."""
+        questions = session.questions if session is not None else MAX_QUESTIONS
+        try:
+            meta, *records = await self.state.get_many(
+                [self._key(session_id)] + [self._key(session_id, i) for i in range(questions)])
+        except SharedStateError:
+            return session
+        if session is None:
+            if meta is None:
+                return None
+            session = Session(session_id, json.loads(meta)["questions"])
+            self.sessions[session_id] = session
+            self.counters["restored"] += 1
+        changed = False
+        for index, raw in enumerate(records[:session.questions]):
+            if raw is None:
+                continue
+            stored = json.loads(raw)
+            answer = session.answers.get(index)
+            if stored.get("failed"):
+                # Another worker could not score its answer: drop ours only if it was that one.
+                if answer is not None and answer.elsewhere and stored["at"] >= answer.at:
+                    del session.answers[index]
+                    changed = True
+            elif answer is None or stored["at"] > answer.at:
+                session.answers[index] = Answer.restore(stored)
+                changed = True
+            elif answer.elsewhere and stored["score"] is not None and stored["at"] == answer.at:
+                answer.crisis = bool(stored["crisis"])
+                answer.settle(stored["score"])
+                changed = True
+        if changed:
+            self._speculate(session)
+        return session
+
+    async def create(self, questions: int) -> Session:
+        if not 1 <= questions <= MAX_QUESTIONS:
+            raise SessionError(f"questions must be between 1 and {MAX_QUESTIONS}")
+        session = Session(secrets.token_urlsafe(16), questions)
+        self.sessions[session.id] = session
+        self.counters["created"] += 1
+        self._prune()
+        await self._publish(session)
+        return session
+
+    async def get(self, session_id: str) -> Session:
+        self._prune()
+        session = self.sessions.get(session_id)
+        if self.state is not None:
+            session = await self._sync(session_id, session)
+        if session is None:
+            raise SessionNotFound(session_id)
+        session.touched = time.monotonic()
+        self.sessions.move_to_end(session_id)
+        self._prune()
+        return session
+
+    async def answer_started(self, session_id: str, index: Optional[int], response: str) -> Answer:
+        """Record an answer as its scoring begins; the speculation may start on it already."""
+        session = await self.get(session_id)
+        if index is None or not 0 <= index < session.questions:
+            raise SessionError(f"index must be between 0 and {session.questions - 1}")
+        answer = Answer(response[:MAX_RESPONSE_CHARS])
+        session.answers[index] = answer
+        self._speculate(session)
+        await self._publish(session, index, answer)
+        return answer
+
+    async def answer_scored(self, session_id: str, index: int, answer: Answer, result: Optional[dict]):
+        """Record the score of an answer (``result`` None: it could not be scored)."""
+        if not answer.scored.done():
+            answer.scored.set_result(None)
+        session = self.sessions.get(session_id)
+        if session is None or session.answers.get(index) is not answer:
+            # Expired meanwhile, or replaced by a later answer to the same question.
+            return
+        if result is None:
+            del session.answers[index]
+            await self._publish(session, index, answer, failed=True)
+            return
+        answer.score = result["score"]
+        answer.crisis = bool(result.get("crisis"))
+        self._speculate(session)
+        await self._publish(session, index, answer)
+
+    def _speculate(self, session: Session):
+        if not self.speculate or len(session.answers) < session.questions:
+            return
+        low, high = session.bounds()
+        level = severity_level(low)
+        if level != severity_level(high):
+            return
+        self._summarize(session, str(low) if low == high else f"{low}-{high}", level, speculative=True)
+
+    def _summarize(self, session: Session, score: str, level: str, speculative: bool) -> asyncio.Future:
+        inputs = (level, session.responses())
+        if session.summary is not None:
+            if session.summary_inputs == inputs and not session.summary.cancelled():
+                return session.summary
+            session.summary.cancel()
+            self.counters["discarded"] += 1
+        session.summary_inputs = inputs
+        session.speculative = speculative
+        session.summary = asyncio.ensure_future(self.summarize(score, level, " ".join(inputs[1])))
+        session.summary.add_done_callback(_retrieve)
+        if speculative:
+            self.counters["speculated"] += 1
+        return session.summary
+
+    async def finish(self, session_id: str) -> dict:
+        """Scores, total and summary of a complete session, waiting for answers still being scored."""
+        session = await self.get(session_id)
+        pending = [answer.scored for answer in session.answers.values()
+                   if not answer.scored.done() and not answer.elsewhere]
+        if pending:
+            await asyncio.wait(pending)
+        give_up = time.monotonic() + self.remote_wait
+        while (self.state is not None and time.monotonic() < give_up
+               and any(answer.elsewhere for answer in session.answers.values())):
+            await asyncio.sleep(REMOTE_POLL)
+            await self._sync(session_id, session)
+        missing = [i for i in range(session.questions)
+                   if i not in session.answers or session.answers[i].score is None]
+        if missing:
+            raise SessionIncomplete(missing)
+
+        total = session.bounds()[0]
+        level = severity_level(total)
+        summary = self._summarize(session, str(total), level, speculative=False)
+        if not session.speculative:
+            outcome = "summarized_at_finish"
+        else:
+            outcome = "speculation_ready" if summary.done() else "speculation_in_flight"
+        telemetry.current_span().set(summary=outcome)
+        started = time.monotonic()
+        result = await asyncio.shield(summary)
+        self.finish_wait += time.monotonic() - started
+        self.counters["finished"] += 1
+        self.counters[outcome] += 1
+
+        answers = [session.answers[i] for i in range(session.questions)]
+        return {
+            "session_id": session.id,
+            "results": [{"score": answer.score, "crisis": answer.crisis} for answer in answers],
+            "total_score": total,
+            "crisis": any(answer.crisis for answer in answers),
+            "summary": result,
+        }
+
+    def stats(self) -> dict:
+        finished = self.counters["finished"]
+        return dict(
+            self.counters,
+            active=len(self.sessions),
+            shared=self.state is not None,
+            speculating=self.speculate,
+            mean_finish_wait_ms=round(self.finish_wait / finished * 1000, 1) if finished else None,
+        )
+
+
+def _retrieve(task: asyncio.Future):
+    # A discarded speculation's outcome is never awaited.
+    if not task.cancelled():
+        task.exception()
+
+
+session_store = SessionStore(state=shared_state)
+
+
+@telemetry.registry.collector
+def session_metrics():
+    counters = session_store.counters
+    active = telemetry.Gauge("psy_sessions_active", "Questionnaire sessions held in memory")
+    active.set(len(session_store.sessions))
+    closed = telemetry.Counter("psy_sessions_dropped_total", "Questionnaire sessions dropped from memory", 
+                               ("reason",))
+    for reason in ("expired", "evicted"):
+        closed.inc(counters[reason], reason=reason)
+    summaries = telemetry.Counter("psy_session_summaries_total",
+                                  "Finished sessions by where their summary stood at finish", ("outcome",))
+    for outcome, key in (("ready", "speculation_ready"), ("in_flight", "speculation_in_flight"),
+                         ("at_finish", "summarized_at_finish")):
+        summaries.inc(counters[key], outcome=outcome)
+    discarded = telemetry.Counter("psy_session_speculations_discarded_total",
+                                  "Speculative summaries cancelled because an answer changed")
+    discarded.inc(counters["discarded"])
+    return [active, closed, summaries, discarded]
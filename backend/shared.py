@@ -0,0 +1,458 @@
+"""State shared by every worker: rate-limit buckets, cached results, single-flight locks and sessions.
+
+Each uvicorn worker (or serverless instance) keeps its own buckets, cache and
+in-flight table. With N workers the provider therefore sees N times
+``LLM_RATE_LIMITS``. Each worker also finds out about a 429 on its own, and two
+workers given the same request both pay for it. With ``SHARED_STATE`` set, the
+workers coordinate through one store:
+
+- rate limits: every upstream call reserves its request and token cost from the
+  model's buckets in the store, in one round trip, and waits for the debt to be
+  refilled. The sum over all workers stays within the quota. A 429 with
+  Retry-After empties the request bucket for that long, for every worker
+  (``llm.py``).
+- results: ``cache.py`` looks up and stores results in the store behind its
+  in-process tiers.
+- single-flight: the first worker to miss a result takes a lock on its key and
+  computes it. The others poll the store for the result instead of calling the
+  model as well.
+- sessions: ``sessions.py`` records each questionnaire session and its scored
+  answers in the store, so any worker can continue a session another one opened.
+
+``MemoryState`` keeps all of this in the process itself, for a single worker and
+for tests. ``RespState`` speaks the Redis protocol (RESP2) to Redis 5+ or any
+server that implements the same commands; ``benchmarks/resp_server.py`` is a
+stand-in for tests and benchmarks. Every operation is a single round trip. A
+bucket update is one Lua script, and the operations of one call are pipelined on
+the worker's connection, so concurrent requests do not wait for each other's
+replies.
+
+When the store fails or takes longer than ``SHARED_STATE_TIMEOUT``, workers fall
+back to their own buckets, cache and sessions for ``SHARED_STATE_RETRY`` seconds
+and then try it again.
+
+Configuration (environment variables):
+    SHARED_STATE          "memory" or a redis://[:password@]host[:port][/db] URL (default: unset, nothing shared)
+    SHARED_STATE_PREFIX   prefix of every key in the store (default "psy:")
+    SHARED_STATE_TIMEOUT  seconds before an operation counts as failed (default 0.25)
+    SHARED_STATE_RETRY    seconds each worker uses its own state after a failure (default 5)
+"""
+import asyncio
+import hashlib
+import os
+import time
+import urllib.parse
+from collections import deque
+from typing import Awaitable, Dict, List, Optional, Sequence, Tuple
+
+from . import telemetry
+
+# (key, refill rate per second, capacity, cost, ceiling): one bucket update. A negative cost gives tokens back;
+# a ceiling caps the level after the update (a 429's Retry-After pushes it below zero).
+Take = Tuple[str, float, float, float, Optional[float]]
+
+SCRIPTS = {
+    # KEYS[1] bucket; ARGV rate, capacity, cost, ceiling (optional). Returns the level after the update.
+    "take": """
+local rate, capacity, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local ceiling = tonumber(ARGV[4])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens, updated = tonumber(state[1]), tonumber(state[2])
+if tokens == nil then tokens, updated = capacity, now end
+tokens = math.min(capacity, math.min(capacity, tokens + math.max(now - updated, 0) * rate) - cost)
+if ceiling ~= nil then tokens = math.min(tokens, ceiling) end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return tostring(tokens)
+""",
+    # KEYS[1] value, KEYS[2] lock; ARGV token, lock ttl in ms. Returns {1, value}, {2} (locked) or {0} (held).
+    "get_or_lock": """
+local value = redis.call('GET', KEYS[1])
+if value then return {1, value} end
+if redis.call('SET', KEYS[2], ARGV[1], 'NX', 'PX', ARGV[2]) then return {2} end
+return {0}
+""",
+    # KEYS[1] value, KEYS[2] lock; ARGV value ('' stores nothing), ttl in ms, token.
+    "release": """
+if ARGV[1] ~= '' then redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2]) end
+if redis.call('GET', KEYS[2]) == ARGV[3] then redis.call('DEL', KEYS[2]) end
+return 1
+""",
+}
+SHAS = {name: hashlib.sha1(source.encode()).hexdigest() for name, source in SCRIPTS.items()}
+
+
+def apply_take(buckets: Dict[str, Tuple[float, float]], key: str, rate: float, capacity: float, cost: float,
+               ceiling: Optional[float], now: float) -> float:
+    """The ``take`` script on a dict of ``key -> (tokens, updated)``; returns the level after the update."""
+    tokens, updated = buckets.get(key, (capacity, now))
+    tokens = min(capacity, min(capacity, tokens + max(now - updated, 0.0) * rate) - cost)
+    if ceiling is not None:
+        tokens = min(tokens, ceiling)
+    buckets[key] = (tokens, now)
+    return tokens
+
+
+class SharedStateError(Exception):
+    """The store failed, was too slow, or is being skipped after a recent failure."""
+
+
+class SharedState:
+    """Operations the workers share; subclasses implement the underscored ones on their store."""
+
+    kind = "none"
+
+    def __init__(self, prefix: Optional[str] = None, timeout: Optional[float] = None, retry: Optional[float] = None):
+        self.prefix = prefix if prefix is not None else os.getenv("SHARED_STATE_PREFIX", "psy:")
+        self.timeout = timeout if timeout is not None else float(os.getenv("SHARED_STATE_TIMEOUT", "0.25"))
+        self.retry = retry if retry is not None else float(os.getenv("SHARED_STATE_RETRY", "5"))
+        self.down_until = 0.0
+        self.counters = {"ops": 0, "errors": 0, "skipped": 0}
+        self.seconds = 0.0
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    async def _run(self, operation: Awaitable):
+        if not self.available:
+            self.counters["skipped"] += 1
+            operation.close()
+            raise SharedStateError(f"{self.kind} store skipped after a failure")
+        started = time.perf_counter()
+        try:
+            return await operation
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, RespError) as e:
+            self.counters["errors"] += 1
+            self.down_until = time.monotonic() + self.retry
+            print(f"Shared state error ({type(e).__name__}: {e}), using per-worker state for {self.retry:g}s")
+            raise SharedStateError(str(e) or type(e).__name__) from e
+        finally:
+            self.counters["ops"] += 1
+            self.seconds += time.perf_counter() - started
+
+    async def take(self, takes: Sequence[Take]) -> List[float]:
+        """Update several buckets in one round trip; returns each one's level after its update."""
+        return await self._run(self._take([(self.prefix + "bucket:" + key, *rest) for key, *rest in takes]))
+
+    async def get_or_lock(self, key: str, token: str, ttl: float) -> Tuple[Optional[str], bool]:
+        """The value stored at ``key``, or else whether the lock on it was taken with ``token`` for ``ttl`` seconds."""
+        return await self._run(self._get_or_lock(self.prefix + key, self.prefix + "lock:" + key, token, ttl))
+
+    async def put(self, key: str, value: Optional[str], ttl: float, token: Optional[str] = None):
+        """Store ``value`` (unless None) for ``ttl`` seconds and release the lock held with ``token``."""
+        await self._run(self._put(self.prefix + key, self.prefix + "lock:" + key, value, ttl, token))
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[str]]:
+        """The values stored at ``keys`` (None where there is none), in one round trip."""
+        return await self._run(self._get_many([self.prefix + key for key in keys]))
+
+    async def put_many(self, values: Dict[str, str], ttl: float):
+        """Store several values for ``ttl`` seconds, in one round trip."""
+        await self._run(self._put_many({self.prefix + key: value for key, value in values.items()}, ttl))
+
+    async def _take(self, takes: Sequence[Take]) -> List[float]:
+        raise NotImplementedError
+
+    async def _get_or_lock(self, key: str, lock: str, token: str, ttl: float) -> Tuple[Optional[str], bool]:
+        raise NotImplementedError
+
+    async def _put(self, key: str, lock: str, value: Optional[str], ttl: float, token: Optional[str]):
+        raise NotImplementedError
+
+    async def _get_many(self, keys: Sequence[str]) -> List[Optional[str]]:
+        raise NotImplementedError
+
+    async def _put_many(self, values: Dict[str, str], ttl: float):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def describe(self) -> str:
+        return self.kind
+
+    def stats(self) -> dict:
+        ops = self.counters["ops"]
+        return dict(
+            self.counters,
+            store=self.describe(),
+            available=self.available,
+            mean_ms=round(self.seconds / ops * 1000, 3) if ops else None,
+        )
+
+
+class MemoryState(SharedState):
+    """The shared operations on dicts in this process: one worker, or tests."""
+
+    kind = "memory"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        # key -> (value, monotonic expiry)
+        self.values: Dict[str, Tuple[str, float]] = {}
+        self._writes = 0
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self.values[key]
+            return None
+        return entry[0]
+
+    def _set(self, key: str, value: str, ttl: float):
+        self.values[key] = (value, time.monotonic() + ttl)
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            now = time.monotonic()
+            for stale in [k for k, (_, expires) in self.values.items() if expires <= now]:
+                del self.values[stale]
+
+    async def _take(self, takes: Sequence[Take]) -> List[float]:
+        now = time.monotonic()
+        return [apply_take(self.buckets, key, rate, capacity, cost, ceiling, now)
+                for key, rate, capacity, cost, ceiling in takes]
+
+    async def _get_or_lock(self, key: str, lock: str, token: str, ttl: float) -> Tuple[Optional[str], bool]:
+        value = self._get(key)
+        if value is not None:
+            return value, False
+        if self._get(lock) is not None:
+            return None, False
+        self._set(lock, token, ttl)
+        return None, True
+
+    async def _put(self, key: str, lock: str, value: Optional[str], ttl: float, token: Optional[str]):
+        if value is not None:
+            self._set(key, value, ttl)
+        if token is not None and self._get(lock) == token:
+            del self.values[lock]
+
+    async def _get_many(self, keys: Sequence[str]) -> List[Optional[str]]:
+        return [self._get(key) for key in keys]
+
+    async def _put_many(self, values: Dict[str, str], ttl: float):
+        for key, value in values.items():
+            self._set(key, value, ttl)
+
+
+class RespError(Exception):
+    """An error reply. Replies are matched to commands in order, so these are returned rather than raised."""
+
+
+def encode_command(args: Sequence) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """One RESP2 value: str for simple and bulk strings, int, list, None, or a RespError."""
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionResetError("connection closed by the store")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RespError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        if int(rest) < 0:
+            return None
+        return (await reader.readexactly(int(rest) + 2))[:-2].decode()
+    if kind == b"*":
+        if int(rest) < 0:
+            return None
+        return [await read_reply(reader) for _ in range(int(rest))]
+    raise ConnectionResetError(f"unexpected reply from the store: {line[:40]!r}")
+
+
+class RespConnection:
+    """One connection used by every coroutine of a worker: commands are written as they come (pipelined) and
+    replies, which arrive in the same order, are handed back by a reader task."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.closed = False
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: "deque[asyncio.Future]" = deque()
+        self._reading: Optional[asyncio.Task] = None
+
+    async def open(self, setup: Sequence[Sequence] = ()):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._reading = asyncio.ensure_future(self._read())
+        for reply in await self.execute(*setup):
+            if isinstance(reply, RespError):
+                self.close()
+                raise reply
+
+    async def execute(self, *commands: Sequence, timeout: Optional[float] = None) -> list:
+        """Send ``commands`` in one write and return their replies (error replies as ``RespError``)."""
+        if self.closed:
+            raise ConnectionResetError("connection to the store is closed")
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in commands]
+        self._pending.extend(futures)
+        self._writer.write(b"".join(encode_command(command) for command in commands))
+        await self._writer.drain()
+        return list(await asyncio.wait_for(asyncio.gather(*futures), timeout))
+
+    async def _read(self):
+        try:
+            while True:
+                reply = await read_reply(self._reader)
+                future = self._pending.popleft()
+                # Its caller may have timed out; the reply is consumed all the same, keeping the order.
+                if not future.done():
+                    future.set_result(reply)
+        except (OSError, asyncio.IncompleteReadError, IndexError, ValueError) as e:
+            self.closed = True
+            while self._pending:
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(ConnectionResetError(f"connection to the store lost: {e!r}"))
+
+    def close(self):
+        self.closed = True
+        if self._reading is not None:
+            self._reading.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class RespState(SharedState):
+    """The shared operations on a Redis-protocol server, one pipelined connection per event loop."""
+
+    kind = "resp"
+
+    def __init__(self, url: str, **kwargs):
+        super().__init__(**kwargs)
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = urllib.parse.unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip("/") or 0)
+        self._conn: Optional[RespConnection] = None
+        self._connecting: Optional[asyncio.Future] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def describe(self) -> str:
+        return f"redis://{self.host}:{self.port}/{self.db}"
+
+    async def _connection(self) -> RespConnection:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Like the gateway's pools: a connection belongs to the event loop that opened it.
+            self._conn, self._connecting, self._loop = None, None, loop
+        if self._conn is not None and not self._conn.closed:
+            return self._conn
+        if self._connecting is None or self._connecting.done():
+            self._connecting = asyncio.ensure_future(self._open())
+        # Shielded: a caller timing out must not abort the connection the others wait for.
+        return await asyncio.wait_for(asyncio.shield(self._connecting), self.timeout)
+
+    async def _open(self) -> RespConnection:
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        setup.extend(("SCRIPT", "LOAD", source) for source in SCRIPTS.values())
+        conn = RespConnection(self.host, self.port)
+        await conn.open(setup)
+        self._conn = conn
+        return conn
+
+    async def _eval(self, calls: Sequence[Tuple[str, Sequence, Sequence]]) -> list:
+        """Run ``(script, keys, args)`` calls in one round trip, reloading scripts the server lost (a restart)."""
+        conn = await self._connection()
+        replies = await conn.execute(*(("EVALSHA", SHAS[name], len(keys), *keys, *args) for name, keys, args in calls),
+                                     timeout=self.timeout)
+        missing = [i for i, reply in enumerate(replies)
+                   if isinstance(reply, RespError) and str(reply).startswith("NOSCRIPT")]
+        if missing:
+            retried = await conn.execute(*(("EVAL", SCRIPTS[calls[i][0]], len(calls[i][1]), *calls[i][1],
+                                            *calls[i][2]) for i in missing), timeout=self.timeout)
+            for i, reply in zip(missing, retried):
+                replies[i] = reply
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    async def _take(self, takes: Sequence[Take]) -> List[float]:
+        replies = await self._eval([("take", (key,), (rate, capacity, cost, "" if ceiling is None else ceiling))
+                                    for key, rate, capacity, cost, ceiling in takes])
+        return [float(reply) for reply in replies]
+
+    async def _get_or_lock(self, key: str, lock: str, token: str, ttl: float) -> Tuple[Optional[str], bool]:
+        (reply,) = await self._eval([("get_or_lock", (key, lock), (token, int(ttl * 1000)))])
+        return (reply[1] if reply[0] == 1 else None), reply[0] == 2
+
+    async def _put(self, key: str, lock: str, value: Optional[str], ttl: float, token: Optional[str]):
+        if token is None:
+            await self._execute(("SET", key, value, "PX", int(ttl * 1000)))
+            return
+        await self._eval([("release", (key, lock), ("" if value is None else value, int(ttl * 1000), token))])
+
+    async def _execute(self, *commands: Sequence) -> list:
+        conn = await self._connection()
+        replies = await conn.execute(*commands, timeout=self.timeout)
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    async def _get_many(self, keys: Sequence[str]) -> List[Optional[str]]:
+        if not keys:
+            return []
+        (reply,) = await self._execute(("MGET", *keys))
+        return reply
+
+    async def _put_many(self, values: Dict[str, str], ttl: float):
+        await self._execute(*(("SET", key, value, "PX", int(ttl * 1000)) for key, value in values.items()))
+
+    async def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def from_env() -> Optional[SharedState]:
+    spec = os.getenv("SHARED_STATE", "").strip()
+    if not spec:
+        return None
+    if spec == "memory":
+        return MemoryState()
+    if spec.startswith("redis://"):
+        return RespState(spec)
+    raise ValueError(f"SHARED_STATE must be 'memory' or a redis:// URL, got {spec!r}")
+
+
+shared_state = from_env()
+
+
+@telemetry.registry.collector
+def shared_state_metrics():
+    if shared_state is None:
+        return []
+    ops = telemetry.Counter("psy_shared_state_ops_total", "Shared-state operations by outcome", ("outcome",))
+    ops.inc(shared_state.counters["ops"] - shared_state.counters["errors"], outcome="ok")
+    ops.inc(shared_state.counters["errors"], outcome="error")
+    ops.inc(shared_state.counters["skipped"], outcome="skipped")
+    seconds = telemetry.Counter("psy_shared_state_seconds_total", "Time spent in shared-state operations")
+    seconds.inc(shared_state.seconds)
+    available = telemetry.Gauge("psy_shared_state_available", "0 while workers fall back to their own state")
+    available.set(1 if shared_state.available else 0)
+    return [ops, seconds, available]
@@ -0,0 +1,117 @@
+"""Structural conversation metrics for the WhatsApp analyzer, computed locally.
+
+Three of the eight social behavior metrics describe the shape of a conversation
+rather than what is said in it, so they are counted from the ordered transcript
+(a list of ``(side, text)`` pairs, side ``"user"`` or ``"other"``) instead of
+being guessed by the model:
+
+- response engagement: the user's words per turn, on its own and relative to the
+  other person's;
+- conversation initiation: who opens the conversation and asks the questions
+  that move it along (who starts each conversation, for exports with timestamps);
+- social reciprocity: how evenly turns and words are shared.
+
+The same input always gives the same scores, and they are available as soon as
+the transcript is, before the semantic LLM call returns.
+"""
+import math
+from typing import Dict, List, Optional, Tuple
+
+USER, OTHER = "user", "other"
+STRUCTURAL = ("response_engagement", "conversation_initiation", "social_reciprocity")
+SEMANTIC = ("emotional_expressiveness", "attachment_style", "communication_clarity", "empathy_display",
+            "boundary_management")
+# Field order of the full SocialBehavior result.
+METRICS = ("response_engagement", "emotional_expressiveness", "conversation_initiation", "social_reciprocity",
+           "attachment_style", "communication_clarity", "empathy_display", "boundary_management")
+
+# Average words per message at which engagement on its own reaches the top of the scale.
+ENGAGED_WORDS = 20
+# Turns needed before the structural scores are fully trusted.
+CONFIDENT_TURNS = 20
+
+
+def from_lists(user_messages: List[str], other_messages: List[str]) -> List[Tuple[str, str]]:
+    """A transcript from per-side lists whose interleaving is unknown (older extractions)."""
+    return [(USER, text) for text in user_messages] + [(OTHER, text) for text in other_messages]
+
+
+def split(transcript: List[Tuple[str, str]]) -> Tuple[List[str], List[str]]:
+    return [text for side, text in transcript if side == USER], [text for side, text in transcript if side == OTHER]
+
+
+def render(transcript: List[Tuple[str, str]]) -> str:
+    """One line per message, in order, for prompts."""
+    return "\n".join(f"{'User' if side == USER else 'Other'}: {' '.join(text.split())}" for side, text in transcript)
+
+
+def features(transcript: List[Tuple[str, str]]) -> dict:
+    """Per-side counts in the shape of ``chat_export.ConversationStats.summary``, so both feed ``score``."""
+    sides = {side: {"messages": 0, "turns": 0, "words": 0, "questions": 0} for side in (USER, OTHER)}
+    previous = None
+    for side, text in transcript:
+        counts = sides[side]
+        counts["messages"] += 1
+        counts["words"] += len(text.split())
+        counts["questions"] += "?" in text
+        counts["turns"] += side != previous
+        previous = side
+
+    summary = {}
+    for side, counts in sides.items():
+        summary[side] = {
+            "messages": counts["messages"],
+            "turns": counts["turns"],
+            "words_per_message": round(counts["words"] / counts["messages"], 1) if counts["messages"] else 0.0,
+            "messages_per_turn": round(counts["messages"] / counts["turns"], 2) if counts["turns"] else 0.0,
+            "questions": counts["questions"],
+        }
+    # Without timestamps, opening the transcript and asking questions are the visible forms of initiative.
+    opener = 1 if transcript and transcript[0][0] == USER else 0
+    prompts = sides[USER]["questions"] + sides[OTHER]["questions"] + (1 if transcript else 0)
+    summary["user_initiation_share"] = round((sides[USER]["questions"] + opener) / prompts, 3) if prompts else 0.5
+    return summary
+
+
+def _scale(value: float) -> int:
+    """0-1 onto the 1-5 metric scale."""
+    return int(min(5, max(1, round(1 + 4 * value))))
+
+
+def score(summary: dict) -> Dict[str, float]:
+    """The structural metrics, plus a confidence, from ``features`` or an export summary."""
+    user, other = summary[USER], summary[OTHER]
+    user_per_turn = user["words_per_message"] * user["messages_per_turn"]
+    other_per_turn = other["words_per_message"] * other["messages_per_turn"]
+
+    absolute = min(user["words_per_message"], ENGAGED_WORDS) / ENGAGED_WORDS
+    if user_per_turn and other_per_turn:
+        # Writing three times as much per turn as the other person saturates the relative part.
+        relative = 0.5 + 0.5 * max(-1.0, min(1.0, math.log(user_per_turn / other_per_turn, 3)))
+        engagement = (absolute + relative) / 2
+    else:
+        engagement = absolute
+
+    turns = user["turns"] + other["turns"]
+    words = user["words_per_message"] * user["messages"] + other["words_per_message"] * other["messages"]
+    turn_share = user["turns"] / turns if turns else 0.5
+    word_share = user["words_per_message"] * user["messages"] / words if words else 0.5
+    balance = 1 - abs(turn_share - 0.5) - abs(word_share - 0.5)
+
+    return {
+        "response_engagement": _scale(engagement),
+        "conversation_initiation": _scale(summary["user_initiation_share"]),
+        "social_reciprocity": _scale(balance),
+        "confidence": round(0.3 + 0.6 * min(turns, CONFIDENT_TURNS) / CONFIDENT_TURNS, 2),
+    }
+
+
+def combine(structural: Dict[str, float], semantic: Optional[dict]) -> dict:
+    """Full SocialBehavior fields: structural scores counted here, semantic ones from the model."""
+    semantic = semantic or {}
+    combined = {metric: structural.get(metric, semantic.get(metric)) for metric in METRICS}
+    confidences = [c for c in (structural.get("confidence"), semantic.get("confidence")) if c is not None]
+    combined["confidence"] = round(min(confidences), 2) if confidences else 0.5
+    if semantic.get("behavioral_summary"):
+        combined["behavioral_summary"] = semantic["behavioral_summary"]
+    return combined
@@ -0,0 +1,72 @@
+"""Cold-start profile of the serverless entry point.
+
+Every new serverless instance imports the whole backend before it answers its
+first request, so import time adds straight to that request's latency. With
+``STARTUP_PROFILE=1``, ``api/index.py`` imports the backend in ``STAGES`` and
+times each one. Each stage is charged only for what it adds on top of the earlier
+stages, so the libraries come first and the app modules last. The breakdown is
+printed to the function log and served at ``/startup``.
+
+``backend/benchmarks/bench_coldstart.py`` measures the same entry point from a
+fresh interpreter and compares it with a budget.
+
+Configuration (environment variables):
+    STARTUP_PROFILE    "1" profiles the imports of the next cold start (default "0")
+"""
+import importlib
+import os
+import sys
+import time
+from typing import Optional, Sequence
+
+STAGES = (
+    "pydantic",
+    "starlette",
+    "fastapi",
+    "httpx",
+    "backend.telemetry",
+    "backend.tokens",
+    "backend.resilience",
+    "backend.scheduler",
+    "backend.shared",
+    "backend.llm",
+    "backend.cache",
+    "backend.answer_index",
+    "backend.sessions",
+    "backend.schemas",
+    "backend.jsonparse",
+    "backend.prompts",
+    "backend.labels",
+    "backend.lexical",
+    "backend.longtext",
+    "backend.images",
+    "backend.social_metrics",
+    "backend.whatsapp",
+    "backend.main",
+)
+
+# Filled in by ``profile_imports``; empty when the profile is off.
+report: dict = {}
+
+
+def enabled() -> bool:
+    return os.getenv("STARTUP_PROFILE", "0") == "1"
+
+
+def profile_imports(stages: Sequence[str] = STAGES, started: Optional[float] = None) -> dict:
+    """Import ``stages`` in order, timing each; ``started`` is a ``perf_counter`` taken when the entry point began."""
+    began = time.perf_counter()
+    rows = []
+    for name in stages:
+        loaded = len(sys.modules)
+        before = time.perf_counter()
+        importlib.import_module(name)
+        rows.append({"stage": name, "ms": round((time.perf_counter() - before) * 1000, 1),
+                     "modules": len(sys.modules) - loaded})
+    total = time.perf_counter() - (started if started is not None else began)
+    report.update(total_ms=round(total * 1000, 1), stages=rows, modules=len(sys.modules))
+
+    print(f"Startup profile: {report['total_ms']:.0f}ms to import the backend, {len(sys.modules)} modules")
+    for row in sorted(rows, key=lambda row: -row["ms"]):
+        print(f"  {row['stage']:22}{row['ms']:>8.1f}ms {row['modules']:>5} modules")
+    return report
@@ -0,0 +1,434 @@
+"""Request tracing, Prometheus metrics and an event-loop lag monitor.
+
+Spans nest through a context variable, so a span opened inside a handler is a
+child of the request span. The same holds for spans opened in tasks that the
+handler starts, such as the gathered trait calls. The request span wraps each
+endpoint and covers the whole streamed body. The gateway opens a span per LLM
+call, recording:
+
+- model;
+- prompt and completion tokens;
+- retries;
+- time spent queued behind rate limits and concurrency limits;
+- time to first token, for streams.
+
+``parse_output`` adds a span per parse. Finished traces are kept in memory for
+/traces and can be appended to a JSONL file. When the ``opentelemetry`` package
+is installed and ``TRACE_OTEL=1``, every span is mirrored to an OpenTelemetry
+span, exported by whatever SDK and exporter the process configures (for
+example ``opentelemetry-instrument``).
+
+Metrics are kept in process and rendered in the Prometheus text format by
+``render`` for /metrics. They include:
+
+- latency histograms per endpoint and per model;
+- token, error and cache counters;
+- event-loop lag.
+
+A blocked loop delays every request in the worker, not just the one blocking it.
+The lag monitor sleeps for a fixed interval and measures how late it wakes. It
+logs the spans that were open when the lag went past ``LOOP_LAG_WARN``.
+
+Configuration (environment variables):
+    TRACING_ENABLED   "0" turns spans off; metrics are always collected (default "1")
+    TRACE_BUFFER      finished traces kept for /traces (default 100)
+    TRACE_FILE        append each finished trace to this JSONL file (default: off)
+    TRACE_OTEL        "1" mirrors spans to OpenTelemetry when it is installed (default "0")
+    LOOP_LAG_INTERVAL seconds between event-loop lag probes (default 0.25)
+    LOOP_LAG_WARN     lag in seconds that is logged with the open spans (default 0.1)
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# opentelemetry.trace, imported only when TRACE_OTEL=1 so it stays off the cold-start path.
+otel_trace = None
+
+# Seconds; covers cached responses (milliseconds) up to long-text analyses (minutes).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+# Scrapes and trace reads are timed but not traced, so they don't push real requests out of the buffer.
+UNTRACED = ("/metrics", "/api/metrics", "/traces", "/api/traces")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for key, value in self.values.items():
+            yield self.name, _labels(self.labels, key), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[tuple(str(labels.get(name, "")) for name in self.labels)] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # Per label set: counts per bucket (non-cumulative, last is +Inf), sum.
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket", _labels(self.labels + ("le",), key + (le,)), cumulative
+            yield f"{self.name}_sum", _labels(self.labels, key), total
+            yield f"{self.name}_count", _labels(self.labels, key), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List = []
+        self.collectors: List[Callable[[], Iterable]] = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, collect: Callable[[], Iterable]):
+        """``collect()`` returns metrics built at scrape time from state kept elsewhere (cache, parse stats)."""
+        self.collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        lines = []
+        metrics = list(self.metrics)
+        for collect in self.collectors:
+            try:
+                metrics.extend(collect())
+            except Exception as e:
+                print(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {int(value) if value == int(value) else repr(float(value))}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_DURATION = registry.add(Histogram("psy_http_request_duration_seconds",
+                                       "Request latency per route, including the streamed body",
+                                       ("method", "route", "status")))
+LLM_DURATION = registry.add(Histogram("psy_llm_call_duration_seconds",
+                                      "Upstream call latency per model and call site, retries included",
+                                      ("model", "site", "outcome")))
+LLM_TTFT = registry.add(Histogram("psy_llm_time_to_first_token_seconds",
+                                  "Time to the first streamed token per model and call site", ("model", "site")))
+LLM_QUEUED = registry.add(Histogram("psy_llm_queue_seconds",
+                                    "Time a call waited for rate limits and the model's concurrency slot",
+                                    ("model", "priority")))
+LLM_SHED = registry.add(Counter("psy_llm_shed_total",
+                                "Model calls the scheduler refused or dropped: deadline (projected wait too long), "
+                                "full (queue full) or expired (deadline passed while queued)",
+                                ("model", "priority", "reason")))
+LLM_TOKENS = registry.add(Counter("psy_llm_tokens_total", "Prompt, cached prompt and completion tokens per model and call site",
+                                  ("model", "site", "kind")))
+LLM_RETRIES = registry.add(Counter("psy_llm_retries_total", "Upstream attempts retried per model", ("model",)))
+PARSE_DURATION = registry.add(Histogram("psy_parse_duration_seconds",
+                                        "Time to extract and validate JSON from model output, re-asks included",
+                                        ("endpoint",)))
+ERRORS = registry.add(Counter("psy_errors_total",
+                              "Errors by source: http (5xx responses), stream (error events), llm (failed calls), "
+                              "parse (unusable model output)", ("source", "kind")))
+LOOP_LAG = registry.add(Histogram("psy_event_loop_lag_seconds", "How late the event loop ran a timer",
+                                  buckets=LAG_BUCKETS))
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.attributes = attributes
+        self.children: List["Span"] = []
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.ended: Optional[float] = None
+        self.error: Optional[str] = None
+        self._token = None
+        if parent is not None:
+            parent.children.append(self)
+        self._otel = tracer.start_otel(self)
+
+    @property
+    def duration(self) -> float:
+        return (self.ended or time.perf_counter()) - self.started
+
+    def set(self, **attributes) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    def add(self, key: str, amount: float = 1):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def finish(self, error: Optional[BaseException] = None):
+        if self.ended is not None:
+            return
+        self.ended = time.perf_counter()
+        if error is not None:
+            self.error = "cancelled" if isinstance(error, asyncio.CancelledError) else f"{type(error).__name__}: {error}"
+        tracer.finished(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Exited from another context (an async generator closed elsewhere); the context var is theirs.
+            pass
+        self.finish(exc)
+
+    def to_dict(self, origin: Optional[float] = None) -> dict:
+        origin = self.started if origin is None else origin
+        entry = {"name": self.name, "start": round(self.started - origin, 4), "duration": round(self.duration, 4)}
+        if self.attributes:
+            entry["attributes"] = self.attributes
+        if self.error:
+            entry["error"] = self.error
+        if self.children:
+            entry["children"] = [child.to_dict(origin) for child in self.children]
+        return entry
+
+
+class _NoSpan:
+    """Stands in for a span when tracing is off, so call sites need no checks."""
+    attributes: dict = {}
+
+    def set(self, **attributes):
+        return self
+
+    def add(self, key: str, amount: float = 1):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NO_SPAN = _NoSpan()
+_current: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+class Tracer:
+    def __init__(self, enabled: bool = True, buffer: int = 100, path: Optional[str] = None, otel: bool = False):
+        self.enabled = enabled
+        self.recent: deque = deque(maxlen=buffer)
+        self.path = path
+        self.otel = None
+        if otel:
+            global otel_trace
+            try:
+                from opentelemetry import trace as otel_trace
+            except ImportError:
+                print("TRACE_OTEL=1 but opentelemetry is not installed; spans stay local")
+            else:
+                self.otel = otel_trace.get_tracer("psy.backend")
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        return cls(
+            enabled=os.getenv("TRACING_ENABLED", "1") != "0",
+            buffer=int(os.getenv("TRACE_BUFFER", "100")),
+            path=os.getenv("TRACE_FILE") or None,
+            otel=os.getenv("TRACE_OTEL", "0") == "1",
+        )
+
+    def start_otel(self, span: Span):
+        if self.otel is None:
+            return None
+        parent = span.parent._otel if span.parent is not None else None
+        context = otel_trace.set_span_in_context(parent) if parent is not None else None
+        return self.otel.start_span(span.name, context=context, start_time=int(span.started_at * 1e9))
+
+    def finished(self, span: Span):
+        if span._otel is not None:
+            for key, value in span.attributes.items():
+                if value is not None:
+                    span._otel.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+            if span.error:
+                span._otel.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, span.error))
+            span._otel.end(end_time=int((span.started_at + span.duration) * 1e9))
+        if span.parent is not None:
+            return
+        self.recent.append(span)
+        if self.path:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(trace_summary(span), default=str) + "\n")
+            except OSError as e:
+                print(f"Trace write error: {e}")
+
+
+tracer = Tracer.from_env()
+
+
+def span(name: str, **attributes):
+    """A child of the current span (or a new trace); use as ``with span(...) as s:``."""
+    if not tracer.enabled:
+        return NO_SPAN
+    return Span(name, _current.get(), **attributes)
+
+
+def start_span(name: str, **attributes):
+    """A child of the current span that does not become current; call ``finish`` when done (streams)."""
+    if not tracer.enabled:
+        return NO_SPAN
+    return Span(name, _current.get(), **attributes)
+
+
+def current_span():
+    return _current.get() or NO_SPAN
+
+
+def _walk(span: Span) -> Iterable[Span]:
+    yield span
+    for child in span.children:
+        yield from _walk(child)
+
+
+def trace_summary(root: Span) -> dict:
+    """The span tree plus total time per span name, the latency breakdown at a glance."""
+    breakdown: Dict[str, float] = {}
+    for item in _walk(root):
+        if item is not root:
+            breakdown[item.name] = breakdown.get(item.name, 0.0) + item.duration
+    return {
+        "trace_id": root.trace_id,
+        "started_at": root.started_at,
+        "duration": round(root.duration, 4),
+        "breakdown": {name: round(total, 4) for name, total in sorted(breakdown.items(), key=lambda kv: -kv[1])},
+        "root": root.to_dict(),
+    }
+
+
+def recent_traces(limit: int = 20, name: Optional[str] = None) -> List[dict]:
+    traces = [root for root in reversed(tracer.recent) if name is None or name in root.name]
+    return [trace_summary(root) for root in traces[:limit]]
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: Optional[float] = None, warn: Optional[float] = None):
+        self.interval = interval if interval is not None else float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+        self.warn = warn if warn is not None else float(os.getenv("LOOP_LAG_WARN", "0.1"))
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Future] = None
+        self._active: Dict[int, Span] = {}
+
+    def ensure_started(self):
+        """Start probing on the running loop; called per request, so the monitor needs no startup hook."""
+        if self._task is None or self._task.done() or self._task.get_loop() is not asyncio.get_running_loop():
+            self._task = asyncio.ensure_future(self._run())
+
+    def track(self, request_span: Span):
+        if isinstance(request_span, Span):
+            self._active[id(request_span)] = request_span
+
+    def untrack(self, request_span: Span):
+        self._active.pop(id(request_span), None)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            LOOP_LAG.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.warn:
+                running = [item.name for root in list(self._active.values()) for item in _walk(root)
+                           if item.ended is None]
+                print(f"Event loop blocked for {lag * 1000:.0f}ms; open spans: {', '.join(running) or 'none'}")
+
+
+loop_monitor = LoopLagMonitor()
+
+
+class TracingMiddleware:
+    """ASGI middleware: one root span and one latency observation per HTTP request, streamed body included."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        loop_monitor.ensure_started()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        request_span = NO_SPAN if scope["path"] in UNTRACED else span("http", method=scope["method"],
+                                                                       path=scope["path"])
+        route = "unmatched"
+        loop_monitor.track(request_span)
+        try:
+            with request_span:
+                try:
+                    await self.app(scope, receive, send_wrapper)
+                finally:
+                    route = getattr(scope.get("route"), "path", None) or "unmatched"
+                    request_span.set(route=route, status=status["code"])
+                    if isinstance(request_span, Span):
+                        request_span.name = f"{scope['method']} {route}"
+        finally:
+            loop_monitor.untrack(request_span)
+            HTTP_DURATION.observe(time.perf_counter() - started, method=scope["method"], route=route,
+                                  status=status["code"])
+            if status["code"] >= 500:
+                ERRORS.inc(source="http", kind=str(status["code"]))
+
+
+def render() -> str:
+    return registry.render()
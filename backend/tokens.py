@@ -0,0 +1,137 @@
+"""Token accounting for upstream calls.
+
+Providers reserve rate-limit capacity by ``max_tokens``, so every call asks for a
+budget sized to its input instead of a flat ceiling. Prompt sizes are estimated
+locally (no tokenizer download), and every response is logged with its actual
+prompt and completion usage against the estimate and the reserved budget.
+``TokenLedger.stats`` aggregates those numbers per call site so budgets can be
+tuned from production data.
+
+Configuration (environment variables):
+    LLM_BUDGET_SCALE   multiplier applied to every budget (default 1.0)
+    LLM_LOG_TOKENS     "0" silences the per-response token log line (default "1")
+"""
+import math
+import os
+import re
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+from . import telemetry
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+# Fixed chat-template overhead per message, and a flat allowance for an attached image.
+MESSAGE_OVERHEAD = 4
+IMAGE_TOKENS = 1024
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough BPE-style count: one token per word or punctuation mark, plus one per 8 characters of long words."""
+    return sum(1 + (len(piece) - 1) // 8 for piece in _PIECES.findall(text))
+
+
+def estimate_message_tokens(messages: List[dict]) -> int:
+    total = 3
+    for message in messages:
+        total += MESSAGE_OVERHEAD
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+            continue
+        for part in content:
+            if part.get("type") == "text":
+                total += estimate_tokens(part.get("text", ""))
+            else:
+                total += IMAGE_TOKENS
+    return total
+
+
+class Budget:
+    """``max_tokens`` for one call site: ``base + per_token * input tokens + per_item * items``, capped."""
+
+    def __init__(self, base: int, per_token: float = 0.0, cap: int = 4096, per_item: int = 0):
+        self.base = base
+        self.per_token = per_token
+        self.cap = cap
+        self.per_item = per_item
+
+    def max_tokens(self, input_tokens: int = 0, items: int = 0, scale: float = 1.0) -> int:
+        return min(self.cap, math.ceil((self.base + self.per_token * input_tokens + self.per_item * items) * scale))
+
+
+# ``input_tokens`` is the user-supplied part of the prompt: the analyzed text (5-300 words on
+# /analyze; longer texts are analyzed in chunks of at most 300), the reasoning being rewritten,
+# or the questionnaire answer.
+BUDGETS: Dict[str, Budget] = {
+    "analyze.trait": Budget(base=800, per_token=2.0, cap=1600),
+    "analyze.fused": Budget(base=800, per_token=1.0, cap=1500),
+    "refine": Budget(base=120, per_token=1.3, cap=1200),
+    "score_response": Budget(base=700, per_token=2.0, cap=1200),
+    "score_responses.packed": Budget(base=200, per_token=1.0, cap=4096, per_item=250),
+    # Five scores and a one-line summary; the answer does not grow with the transcript.
+    "analyze_whatsapp.semantic": Budget(base=300, cap=600),
+}
+
+
+def budget_for(name: str, text: str = "", items: int = 0) -> int:
+    scale = float(os.getenv("LLM_BUDGET_SCALE", "1.0"))
+    return BUDGETS[name].max_tokens(estimate_tokens(text), items, scale)
+
+
+class TokenLedger:
+    """Per call-site totals of estimated, actual and reserved tokens."""
+
+    def __init__(self, window: int = 500):
+        self.log = os.getenv("LLM_LOG_TOKENS", "1") != "0"
+        self._window = window
+        self._sites = defaultdict(self._new_site)
+
+    def _new_site(self) -> dict:
+        return {"calls": 0, "truncated": 0, "prompt_tokens": 0, "prompt_estimate": 0,
+                "completion_tokens": 0, "reserved_tokens": 0, "recent": deque(maxlen=self._window)}
+
+    def record(self, site: str, model: str, reserved: int, prompt_estimate: int, usage: dict,
+               finish_reason: Optional[str] = None, completion_estimate: Optional[int] = None):
+        """``completion_estimate`` stands in for usage on streamed calls, which report none."""
+        prompt = usage.get("prompt_tokens") or prompt_estimate
+        completion = usage.get("completion_tokens")
+        if completion is None:
+            completion = completion_estimate or 0
+        truncated = finish_reason == "length"
+        entry = self._sites[site]
+        entry["calls"] += 1
+        entry["truncated"] += truncated
+        entry["prompt_tokens"] += prompt
+        entry["prompt_estimate"] += prompt_estimate
+        entry["completion_tokens"] += completion
+        entry["reserved_tokens"] += reserved
+        entry["recent"].append(completion)
+        telemetry.LLM_TOKENS.inc(prompt, model=model, site=site, kind="prompt")
+        telemetry.LLM_TOKENS.inc(completion, model=model, site=site, kind="completion")
+        if self.log:
+            print(f"Tokens {site} ({model}): prompt {prompt} (estimated {prompt_estimate}), "
+                  f"completion {completion} of {reserved} reserved{' TRUNCATED' if truncated else ''}")
+
+    def stats(self) -> dict:
+        report = {}
+        for site, entry in self._sites.items():
+            recent = sorted(entry["recent"])
+            calls = entry["calls"]
+            report[site] = {
+                "calls": calls,
+                "truncated": entry["truncated"],
+                "avg_prompt_tokens": round(entry["prompt_tokens"] / calls, 1),
+                "prompt_estimate_ratio": round(entry["prompt_estimate"] / entry["prompt_tokens"], 3)
+                if entry["prompt_tokens"] else None,
+                "avg_completion_tokens": round(entry["completion_tokens"] / calls, 1),
+                "p95_completion_tokens": recent[min(int(0.95 * len(recent)), len(recent) - 1)],
+                "max_completion_tokens": recent[-1],
+                "avg_reserved_tokens": round(entry["reserved_tokens"] / calls, 1),
+                "reserved_utilization": round(entry["completion_tokens"] / entry["reserved_tokens"], 3)
+                if entry["reserved_tokens"] else None,
+            }
+        return report
+
+
+token_ledger = TokenLedger()
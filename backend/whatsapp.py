@@ -0,0 +1,120 @@
+"""Helpers for WhatsApp conversations that span several screenshots.
+
+Consecutive screenshots of a scrolled chat overlap, so the messages at the end
+of one extraction reappear at the start of the next, sometimes with small OCR
+differences or cut off at the screen edge. ``merge_overlapping`` stitches the
+per-screenshot lists back into one transcript without those repeats, and
+``chunk_transcript`` splits long transcripts into pieces that fit a prompt
+budget. Messages are plain strings, or ``(side, text)`` pairs when the
+extraction kept the order of both sides.
+"""
+import re
+from difflib import SequenceMatcher
+from typing import List, Tuple, Union
+
+from .tokens import estimate_tokens
+
+# Messages at least this similar after normalization count as the same message.
+SIMILARITY = 0.9
+
+
+def _normalize(message: str) -> str:
+    return re.sub(r"[^\w]+", " ", message.casefold()).strip()
+
+
+def same_message(a: str, b: str) -> bool:
+    """Equal up to case, punctuation and OCR noise, or one is the other cut off at the screen edge."""
+    a, b = _normalize(a), _normalize(b)
+    if not a or not b:
+        return a == b
+    if a == b:
+        return True
+    shorter, longer = sorted((a, b), key=len)
+    if len(shorter) >= 8 and (longer.startswith(shorter) or longer.endswith(shorter)):
+        return True
+    return SequenceMatcher(None, a, b).ratio() >= SIMILARITY
+
+
+Message = Union[str, Tuple[str, str]]
+
+
+def _text(message: Message) -> str:
+    return message[1] if isinstance(message, tuple) else message
+
+
+def _same(a: Message, b: Message) -> bool:
+    if isinstance(a, tuple) and a[0] != b[0]:
+        return False
+    return same_message(_text(a), _text(b))
+
+
+def _overlap(merged: List[Message], following: List[Message]) -> int:
+    """Length of the longest suffix of ``merged`` that matches a prefix of ``following``."""
+    for size in range(min(len(merged), len(following)), 0, -1):
+        if all(_same(a, b) for a, b in zip(merged[-size:], following[:size])):
+            # A lone "ok" or emoji matching across screenshots is more likely a real repeat than overlap.
+            if sum(len(_normalize(_text(m))) for m in following[:size]) >= 8:
+                return size
+    return 0
+
+
+def merge_overlapping(sequences: List[List[Message]]) -> Tuple[List[Message], int]:
+    """Concatenate per-screenshot message lists in order, dropping scroll overlap. Returns (messages, removed)."""
+    merged: List[Message] = []
+    removed = 0
+    for messages in sequences:
+        size = _overlap(merged, messages)
+        for i in range(size):
+            # Keep the more complete copy of a message that was cut off on one of the screenshots.
+            index = len(merged) - size + i
+            if len(_text(messages[i])) > len(_text(merged[index])):
+                merged[index] = messages[i]
+        merged.extend(messages[size:])
+        removed += size
+    return merged, removed
+
+
+def chunk_transcript(user: List[str], other: List[str], max_tokens: int) -> List[Tuple[List[str], List[str]]]:
+    """Split both sides into consecutive chunks of roughly ``max_tokens`` each.
+
+    The extraction keeps each side's order but not how the two interleave, so both
+    lists are cut at the same relative positions.
+    """
+    total = estimate_tokens(" ".join(user)) + estimate_tokens(" ".join(other))
+    count = max(1, -(-total // max_tokens))
+    if count == 1:
+        return [(user, other)]
+
+    def cut(messages: List[str], index: int) -> List[str]:
+        return messages[len(messages) * index // count:len(messages) * (index + 1) // count]
+
+    chunks = [(cut(user, i), cut(other, i)) for i in range(count)]
+    return [chunk for chunk in chunks if chunk[0] or chunk[1]]
+
+
+def chunk_ordered(transcript: List[Tuple[str, str]], max_tokens: int) -> List[List[Tuple[str, str]]]:
+    """Consecutive slices of an ordered transcript of roughly ``max_tokens`` each."""
+    chunks: List[List[Tuple[str, str]]] = [[]]
+    size = 0
+    for message in transcript:
+        tokens = estimate_tokens(message[1]) + 2
+        if chunks[-1] and size + tokens > max_tokens:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(message)
+        size += tokens
+    return chunks
+
+
+def combine_behavior(results: List[dict], weights: List[int]) -> dict:
+    """Weighted mean of per-chunk social behavior scores; the summary comes from the heaviest chunk."""
+    total = sum(weights) or 1
+    combined = {}
+    for field, value in results[0].items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            mean = sum(result[field] * weight for result, weight in zip(results, weights)) / total
+            combined[field] = round(mean, 2) if field == "confidence" else int(round(mean))
+    heaviest = results[weights.index(max(weights))]
+    if heaviest.get("behavioral_summary"):
+        combined["behavioral_summary"] = heaviest["behavioral_summary"]
+    return combined
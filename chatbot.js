@@ -6,6 +6,8 @@ class PsyGenChat {
         this.isIntroComplete = false;
         this.awaitingResponse = false;
         this.conversationStarted = false;
+        this.sessionId = null;
+        this.pendingScores = [];
         
         this.questions = [
             { id: 1, text: "How have you been feeling emotionally lately?", category: "sadness", source: "BDI" },
@@ -173,8 +175,10 @@ class PsyGenChat {
                     this.addBotMessage("Here's a quick heads up: I'll be asking about your feelings, sleep, energy, and thoughts. Just respond naturally in your own words.");
                     setTimeout(() => {
                         this.addBotMessage("One more thing - I'll play some calming music in the background. Take your time with each question. 🎵");
-                        setTimeout(() => {
+                        setTimeout(async () => {
                             this.playBackgroundMusic();
+                            // Answers to the first questions carry the session id, so it must be known first.
+                            await this.startSession();
                             this.conversationStarted = true;
                             this.askNextQuestion();
                         }, 2500);
@@ -215,10 +219,22 @@ class PsyGenChat {
     async handleQuestionResponse(message) {
         this.responses.push(message);
         
-        const score = await this.scoreResponse(message, this.questions[this.currentQuestion]);
+        // The crisis question is scored right away. With a session the rest are scored in the
+        // background as they come in; without one they are scored in one batch at the end.
+        const question = this.questions[this.currentQuestion];
+        const index = this.currentQuestion;
+        let score = null;
+        let crisis = false;
+        if (question.category === 'suicidal_ideation') {
+            // Without a score there is no telling, so the crisis resources are shown anyway.
+            score = await this.scoreResponse(message, question, index, null);
+            crisis = score === null || score >= 2;
+        } else if (this.sessionId) {
+            this.pendingScores.push(this.scoreResponse(message, question, index));
+        }
         this.scores.push(score);
         
-        if (this.currentQuestion === 9 && score >= 2) {
+        if (crisis) {
             setTimeout(() => {
                 this.showCrisisResources();
                 setTimeout(() => {
@@ -247,7 +263,24 @@ class PsyGenChat {
         }, 1500);
     }
     
-    async scoreResponse(response, question) {
+    async startSession() {
+        // The server keeps the running total and starts the final analysis before the last answer is scored.
+        try {
+            const result = await fetch('/api/sessions', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ questions: this.questions.length })
+            });
+            if (!result.ok) throw new Error('Session start failed');
+            
+            const data = await result.json();
+            this.sessionId = data.session_id;
+        } catch (error) {
+            console.error('Session error:', error);
+        }
+    }
+    
+    async scoreResponse(response, question, index, fallback = 1) {
         try {
             const result = await fetch('/api/score-response', {
                 method: 'POST',
@@ -255,15 +288,24 @@ class PsyGenChat {
                 body: JSON.stringify({
                     response: response,
                     question: question.text,
-                    category: question.category
+                    category: question.category,
+                    ...(this.sessionId && index !== undefined ? { session_id: this.sessionId, index: index } : {})
                 })
             });
             
+            if (!result.ok) throw new Error(`Scoring failed with ${result.status}`);
+            
             const data = await result.json();
+            if (typeof data.score !== 'number') throw new Error('Scoring returned no score');
+            if (data.session_warning) {
+                // The session is gone (expired, or held by another server): score the rest in one batch at the end.
+                console.warn('Session lost:', data.session_warning);
+                this.sessionId = null;
+            }
             return data.score;
         } catch (error) {
             console.error('Scoring error:', error);
-            return 1;
+            return fallback;
         }
     }
     
@@ -273,8 +315,7 @@ class PsyGenChat {
             setTimeout(async () => {
                 this.addBotMessage("Give me a moment while I analyze your responses...");
                 
-                const totalScore = this.scores.reduce((a, b) => a + b, 0);
-                const analysis = await this.getAnalysis(totalScore, this.responses);
+                const { totalScore, analysis } = await this.scoreAll();
                 
                 setTimeout(() => {
                     this.bgMusic.pause();
@@ -290,6 +331,49 @@ class PsyGenChat {
         }, 1000);
     }
     
+    async scoreAll() {
+        if (this.sessionId) {
+            try {
+                await Promise.all(this.pendingScores);
+                const result = await fetch(`/api/sessions/${this.sessionId}/finish`, { method: 'POST' });
+                if (!result.ok) throw new Error('Session finish failed');
+                
+                const data = await result.json();
+                this.scores = data.results.map(r => r.score);
+                return { totalScore: data.total_score, analysis: data.summary };
+            } catch (error) {
+                console.error('Session finish error, scoring in one batch:', error);
+            }
+        }
+        
+        try {
+            const result = await fetch('/api/score-responses', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    items: this.questions.map((question, i) => ({
+                        response: this.responses[i],
+                        question: question.text,
+                        category: question.category
+                    })),
+                    include_summary: true
+                })
+            });
+            if (!result.ok) throw new Error('Batch scoring failed');
+            
+            const data = await result.json();
+            this.scores = data.results.map(r => r.score);
+            return { totalScore: data.total_score, analysis: data.summary };
+        } catch (error) {
+            console.error('Batch scoring error:', error);
+            this.scores = await Promise.all(this.scores.map((score, i) =>
+                score !== null ? score : this.scoreResponse(this.responses[i], this.questions[i])
+            ));
+            const totalScore = this.scores.reduce((a, b) => a + b, 0);
+            return { totalScore, analysis: await this.getAnalysis(totalScore, this.responses) };
+        }
+    }
+    
     async getAnalysis(score, responses) {
         try {
             const result = await fetch('/api/analyze-depression', {
@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from backend.answer_index import AnswerIndex, content_words, words_agree
+
+QUESTION = ("How have you been sleeping?", "sleep", "score_response@v1")
+STORED = ["I have been sleeping well most nights this week",
+          "Honestly I have been sleeping well most nights this week"]
+
+
+@pytest.fixture
+def index(monkeypatch):
+    monkeypatch.delenv("ANSWER_INDEX_PATH", raising=False)
+    monkeypatch.delenv("ANSWER_INDEX_SIMILARITY", raising=False)
+    index = AnswerIndex()
+    index.audit_rate = 0.0
+    key = index.group_key(*QUESTION)
+    for answer in STORED:
+        index.add(key, answer, 0, "Sleeping well, no sign of a sleep problem.")
+    return index, key
+
+
+@pytest.mark.parametrize("answer", [
+    "I have not been sleeping well most nights this week",
+    "I have been sleeping terribly most nights this week",
+    "I haven't been sleeping well most nights this week",
+])
+def test_opposite_answers_do_not_reuse_the_score(index, answer):
+    index, key = index
+    assert index.lookup(key, answer) is None
+    assert index.counters["hits"] == 0
+
+
+def test_the_same_answer_reuses_the_score(index):
+    index, key = index
+    match = index.lookup(key, "I have been sleeping well most nights this week!")
+    assert match is not None and match.score == 0
+
+
+@pytest.mark.parametrize("first, second, agree", [
+    ("honestly not really tbh", "not really", True),
+    ("kinda tired", "kinda tierd", True),
+    ("I'm happy", "I'm unhappy", False),
+    ("I don't feel down", "I feel down", False),
+    ("sleeping well", "sleeping badly", False),
+])
+def test_words_agree(first, second, agree):
+    assert words_agree(content_words(first), content_words(second)) is agree
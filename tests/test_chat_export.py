@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from backend import chat_export
+
+
+def test_system_notice_between_messages_is_skipped():
+    lines = [
+        "31/12/2020, 21:41 - Alice: hello there\n",
+        "31/12/2020, 21:42 - Alice added Bob\n",
+        "31/12/2020, 21:43 - Bob: <Media omitted>\n",
+    ]
+    messages = list(chat_export.parse(lines))
+    assert [(m.author, m.text, m.kind) for m in messages] == [
+        ("Alice", "hello there", "text"),
+        ("Bob", "", "media"),
+    ]
+    assert messages[0].timestamp == datetime(2020, 12, 31, 21, 41)
+
+
+def test_continuation_lines_still_join_their_message():
+    lines = [
+        "[12/31/20, 9:41:05 PM] Alice: first line\n",
+        "second line\n",
+        "[12/31/20, 9:42:00 PM] Bob: reply\n",
+    ]
+    messages = list(chat_export.parse(lines))
+    assert [m.text for m in messages] == ["first line\nsecond line", "reply"]
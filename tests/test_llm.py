@@ -0,0 +1,32 @@
+import time
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+from backend.llm import UpstreamError, _raise_for_status, parse_retry_after
+
+
+def test_retry_after_in_seconds():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after("1.5") == 1.5
+
+
+def test_retry_after_as_http_date():
+    seconds = parse_retry_after(formatdate(time.time() + 30, usegmt=True))
+    assert 28 <= seconds <= 31
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+@pytest.mark.parametrize("value", [None, "", "soon", "inf", "Wed, 99 Foo 2015"])
+def test_unreadable_retry_after_is_none(value):
+    assert parse_retry_after(value) is None
+
+
+def test_http_date_retry_after_still_raises_upstream_error():
+    response = httpx.Response(429, headers={"retry-after": formatdate(time.time() + 10, usegmt=True)},
+                              text="slow down")
+    with pytest.raises(UpstreamError) as error:
+        _raise_for_status("groq", response)
+    assert error.value.status_code == 429
+    assert 8 <= error.value.retry_after <= 11
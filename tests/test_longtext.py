@@ -0,0 +1,70 @@
+import asyncio
+
+import httpx
+import pytest
+
+from backend import longtext, main, scheduler
+from backend.cache import ResultCache
+
+TEXT = "".join(f"On day {n} I planned my week ahead and kept a tidy desk at work. " for n in range(100))
+
+
+@pytest.fixture
+def chunks_shed(monkeypatch):
+    """Stub the chunk analysis so the chunks listed in the returned set are shed by the scheduler."""
+    shed = set()
+    chunks = longtext.chunk_text(TEXT)
+
+    async def analyze_chunk(chunk, mode, lexical_mode):
+        if chunks.index(chunk) in shed:
+            raise scheduler.Overloaded("llama-3.3-70b-versatile", "analyze", "deadline", 2.0)
+        scores = {family: dict.fromkeys(traits, 3) for family, traits in longtext.TRAITS.items()}
+        scores["mbti"] = dict.fromkeys(longtext.TRAITS["mbti"], 1)
+        return {family: main.TraitAnalysis(scores=dict(scores[family], confidence=0.8), thinking="stub", refined=True)
+                for family in longtext.TRAITS}
+
+    async def classify_personality(ocean, mbti, lexical):
+        return {"type": "stub"}
+
+    monkeypatch.setattr(main, "analyze_chunk", analyze_chunk)
+    monkeypatch.setattr(main, "classify_personality", classify_personality)
+    return shed, len(chunks)
+
+
+def test_shed_chunks_are_dropped_and_counted(chunks_shed):
+    shed, count = chunks_shed
+    shed.update({1, 3})
+    result = asyncio.run(main.run_long_analysis(TEXT, "fused"))
+    assert result["chunks"]["count"] == count
+    assert result["chunks"]["failed"] == 2
+    assert result["chunks"]["shed"] == 2
+    assert len(result["chunks"]["scores"]) == count - 2
+
+
+def test_a_text_with_every_chunk_shed_is_overloaded(chunks_shed):
+    shed, count = chunks_shed
+    shed.update(range(count))
+    with pytest.raises(scheduler.Overloaded):
+        asyncio.run(main.run_long_analysis(TEXT, "fused"))
+
+
+def test_a_result_missing_shed_chunks_is_not_cached(chunks_shed, monkeypatch):
+    shed, count = chunks_shed
+    shed.add(0)
+    cache = ResultCache()
+    monkeypatch.setattr(main, "result_cache", cache)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = await client.post("/api/analyze", json={"text": TEXT})
+            shed.clear()
+            second = await client.post("/api/analyze", json={"text": TEXT})
+            third = await client.post("/api/analyze", json={"text": TEXT})
+            return first.json(), second.json(), third.json()
+
+    first, second, third = asyncio.run(scenario())
+    assert first["chunks"]["shed"] == 1
+    assert second["chunks"]["shed"] == 0 and second["chunks"]["failed"] == 0
+    assert (cache.misses, cache.hits) == (2, 1)
+    assert third == second
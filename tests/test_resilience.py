@@ -0,0 +1,52 @@
+import asyncio
+
+from backend.resilience import hedged
+
+
+def test_cancelling_during_the_hedge_delay_cancels_the_call():
+    async def scenario():
+        started, cancelled = [], []
+
+        async def call():
+            started.append(1)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        caller = asyncio.ensure_future(hedged(call, 1.0, lambda: None))
+        await asyncio.sleep(0.05)
+        caller.cancel()
+        try:
+            await caller
+        except asyncio.CancelledError:
+            pass
+        await asyncio.sleep(0)
+        # Copies: asyncio.run cancels whatever is still running once the scenario returns.
+        return list(started), list(cancelled)
+
+    started, cancelled = asyncio.run(scenario())
+    assert started == [1]
+    assert cancelled == [1]
+
+
+def test_hedge_keeps_the_first_result_and_cancels_the_other_call():
+    async def scenario():
+        delays = [10, 0.01]
+        cancelled, hedges = [], []
+
+        async def call():
+            delay = delays.pop(0)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(delay)
+                raise
+            return delay
+
+        result = await hedged(call, 0.02, lambda: hedges.append(1))
+        await asyncio.sleep(0)
+        return result, list(cancelled), hedges
+
+    assert asyncio.run(scenario()) == (0.01, [10], [1])
@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+import httpx
+
+from backend import main
+from backend.sessions import SessionNotFound, SessionStore, session_store
+from backend.shared import MemoryState
+
+ANSWER = {"question": "Have you had any thoughts of hurting yourself?", "category": "suicidal_ideation"}
+
+
+def post_answer(monkeypatch, session_id):
+    """Post the crisis answer with ``session_id`` (or an async callable giving it, awaited in the event loop), scored by a stub."""
+    async def fake_score(input_data):
+        return {"score": 3, "reasoning": "stub", "crisis": True}
+
+    monkeypatch.setattr(main, "score_single_response", fake_score)
+
+    async def scenario():
+        session = await session_id() if callable(session_id) else session_id
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/score-response", json=dict(
+                ANSWER, response=f"answer for {session} at {time.monotonic()}", session_id=session, index=9))
+
+    return asyncio.run(scenario())
+
+
+def test_unknown_session_still_scores_the_answer(monkeypatch):
+    reply = post_answer(monkeypatch, "no-such-session")
+    assert reply.status_code == 200
+    body = reply.json()
+    assert body["score"] == 3 and body["crisis"] is True
+    assert "no-such-session" in body["session_warning"]
+
+
+def test_expired_session_still_scores_the_answer(monkeypatch):
+    async def expired_session():
+        session = await session_store.create(10)
+        session.touched -= session_store.ttl + 1
+        return session.id
+
+    reply = post_answer(monkeypatch, expired_session)
+    assert reply.status_code == 200
+    body = reply.json()
+    assert body["score"] == 3 and body["crisis"] is True
+    assert "expired" in body["session_warning"]
+
+
+def test_open_session_records_the_answer(monkeypatch):
+    created = []
+
+    async def open_session():
+        created.append((await session_store.create(10)).id)
+        return created[0]
+
+    reply = post_answer(monkeypatch, open_session)
+    assert reply.status_code == 200
+    assert "session_warning" not in reply.json()
+    assert session_store.sessions[created[0]].answers[9].score == 3
+
+
+def two_workers(remote_wait=5.0):
+    """Two session stores sharing one store, as two workers would."""
+    state = MemoryState(prefix="test:")
+
+    async def summarize(score, level, responses):
+        return {"level": level, "score": score}
+
+    workers = [SessionStore(summarize=summarize, state=state) for _ in range(2)]
+    for worker in workers:
+        worker.remote_wait = remote_wait
+    return workers
+
+
+def test_a_session_continues_on_another_worker():
+    async def scenario():
+        first, second = two_workers()
+        session = await first.create(3)
+        for index in range(3):
+            answer = await second.answer_started(session.id, index, f"answer {index}")
+            await second.answer_scored(session.id, index, answer, {"score": index, "crisis": False})
+        return await first.finish(session.id)
+
+    result = asyncio.run(scenario())
+    assert [r["score"] for r in result["results"]] == [0, 1, 2]
+    assert result["total_score"] == 3
+    assert result["summary"] == {"level": "Minimal", "score": "3"}
+
+
+def test_finish_waits_for_an_answer_scored_on_another_worker():
+    async def scenario():
+        first, second = two_workers()
+        session = await first.create(2)
+        answer = await first.answer_started(session.id, 0, "fine")
+        await first.answer_scored(session.id, 0, answer, {"score": 0, "crisis": False})
+        slow = await second.answer_started(session.id, 1, "I have thought about it")
+
+        async def score_later():
+            await asyncio.sleep(0.3)
+            await second.answer_scored(session.id, 1, slow, {"score": 3, "crisis": True})
+
+        scoring = asyncio.ensure_future(score_later())
+        result = await first.finish(session.id)
+        await scoring
+        return result
+
+    result = asyncio.run(scenario())
+    assert [r["score"] for r in result["results"]] == [0, 3]
+    assert result["crisis"] is True
+
+
+def test_an_unknown_session_is_not_found_with_a_shared_store():
+    async def scenario():
+        first, _ = two_workers()
+        try:
+            await first.get("missing")
+        except SessionNotFound:
+            return True
+        return False
+
+    assert asyncio.run(scenario())
@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from backend.benchmarks.resp_server import RespServer
+from backend.shared import MemoryState, RespState
+
+
+@pytest.fixture(params=["memory", "resp"])
+def state(request):
+    if request.param == "memory":
+        yield MemoryState(prefix="test:")
+        return
+    with RespServer() as url:
+        yield RespState(url, prefix="test:", timeout=2.0)
+
+
+def test_put_many_then_get_many(state):
+    async def scenario():
+        await state.put_many({"a": "1", "b": "two"}, ttl=60)
+        values = await state.get_many(["a", "missing", "b"])
+        await state.close()
+        return values
+
+    assert asyncio.run(scenario()) == ["1", None, "two"]
+
+
+def test_values_expire(state):
+    async def scenario():
+        await state.put_many({"short": "x"}, ttl=0.05)
+        await asyncio.sleep(0.1)
+        values = await state.get_many(["short"])
+        await state.close()
+        return values
+
+    assert asyncio.run(scenario()) == [None]